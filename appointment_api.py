@@ -1,5 +1,4 @@
 from flask import Flask, request, jsonify
-from datetime import datetime # For parsing/validation if not handled by DB utils
 import sqlite3
 import os # For os.getenv
 
@@ -9,35 +8,34 @@ from db_utils_appointment import (
     add_provider_availability,
     get_provider_availability,
     delete_provider_availability,
+    get_bookable_slots,
+    find_first_available_slots,
+    is_provider_free,
     request_appointment as db_request_appointment, # Aliased
     get_appointment_by_id,
     get_appointments_for_user,
-    update_appointment_status
+    update_appointment_status,
+    place_hold,
+    release_hold,
+    AppointmentConflictError
+)
+from time_utils import (
+    is_valid_datetime_string,
+    is_valid_date_string,
+    date_range_to_epoch_bounds,
+    epoch_to_datetime_string,
+    now_datetime_string,
+    SECONDS_PER_DAY
 )
 
 app = Flask(__name__)
 # Configure DB_NAME using an environment variable with a default
 DB_NAME = os.getenv('APPOINTMENT_DB_NAME', 'appointment_app.db')
-
-# --- Helper Functions ---
-def validate_datetime_string_format(datetime_str: str, format_str: str ='%Y-%m-%d %H:%M:%S') -> bool:
-    """
-    Validates if a string matches the specified datetime format.
-
-    Args:
-        datetime_str (str): The string to validate.
-        format_str (str): The expected datetime format.
-
-    Returns:
-        bool: True if the string matches the format, False otherwise.
-    """
-    if not isinstance(datetime_str, str): # Ensure it's a string before trying strptime
-        return False
-    try:
-        datetime.strptime(datetime_str, format_str)
-        return True
-    except ValueError: # Handles incorrect format
-        return False
+# Longest date range GET /api/providers/<id>/slots computes in one request
+MAX_SLOT_WINDOW_DAYS = int(os.getenv('MAX_SLOT_WINDOW_DAYS', '90'))
+# Most providers and slots GET /api/providers/first-available handles in one request
+MAX_SEARCH_PROVIDERS = int(os.getenv('MAX_SEARCH_PROVIDERS', '500'))
+MAX_SEARCH_RESULTS = 100
 
 # --- Provider Availability Endpoints ---
 
@@ -69,7 +67,7 @@ def add_availability_api(provider_id: int):
           "availability_id": int,
           "provider_id": int
       }
-    - 400 Bad Request: Missing required fields, invalid datetime format,
+    - 400 Bad Request: Missing required fields, invalid datetime format, unsupported recurring_rule,
                        end time not after start time (DB check), or provider ID not found (FK error).
       JSON: { "status": "error", "message": "Error description" }
     - 500 Internal Server Error: Database error or other unexpected server issues.
@@ -91,8 +89,8 @@ def add_availability_api(provider_id: int):
     if not start_datetime_str or not end_datetime_str:
         return jsonify({"status": "error", "message": "Missing required fields: start_datetime, end_datetime"}), 400
 
-    if not validate_datetime_string_format(start_datetime_str) or \
-       not validate_datetime_string_format(end_datetime_str):
+    if not is_valid_datetime_string(start_datetime_str) or \
+       not is_valid_datetime_string(end_datetime_str):
         return jsonify({"status": "error", "message": "Invalid datetime format. Use YYYY-MM-DD HH:MM:SS"}), 400
 
     with get_db_connection(DB_NAME) as conn:
@@ -167,9 +165,9 @@ def get_availability_api(provider_id: int):
     # Validate filter parameters
     if (start_filter and not end_filter) or (not start_filter and end_filter):
         return jsonify({"status": "error", "message": "Both start_filter and end_filter must be provided if one is used."}), 400
-    if start_filter and not validate_datetime_string_format(start_filter):
+    if start_filter and not is_valid_datetime_string(start_filter):
         return jsonify({"status": "error", "message": "Invalid start_filter format. Use YYYY-MM-DD HH:MM:SS"}), 400
-    if end_filter and not validate_datetime_string_format(end_filter):
+    if end_filter and not is_valid_datetime_string(end_filter):
         return jsonify({"status": "error", "message": "Invalid end_filter format. Use YYYY-MM-DD HH:MM:SS"}), 400
 
     with get_db_connection(DB_NAME) as conn:
@@ -186,6 +184,194 @@ def get_availability_api(provider_id: int):
             print(f"Unexpected error in get_availability_api for provider {provider_id}: {e_gen}")
             return jsonify({"status": "error", "message": "An unexpected server error occurred."}), 500
 
+@app.route('/api/providers/<int:provider_id>/slots', methods=['GET'])
+def get_slots_api(provider_id: int):
+    """
+    Get bookable appointment slots for a provider.
+
+    Expands the provider's availability blocks (including recurring ones) over the
+    requested dates, removes time taken by pending or confirmed appointments or held by
+    live slot holds (see POST /api/appointments/holds), and returns the free slots of the
+    requested length. Slots in the past are omitted.
+
+    Path Parameters:
+        provider_id (int): The ID of the provider.
+
+    Query Parameters:
+        date_from (str): First day to search (YYYY-MM-DD).
+        date_to (str): Last day to search, inclusive (YYYY-MM-DD). At most MAX_SLOT_WINDOW_DAYS days after date_from.
+        duration_minutes (int): Length of each slot.
+        step_minutes (int, optional): Distance between slot starts. Defaults to duration_minutes.
+
+    Responses:
+    - 200 OK: Successfully computed slots.
+      JSON: {
+          "status": "success",
+          "provider_id": int,
+          "duration_minutes": int,
+          "slots": [
+              {"start_time": "YYYY-MM-DD HH:MM:SS", "end_time": "YYYY-MM-DD HH:MM:SS"}, ...
+          ]
+      }
+    - 400 Bad Request: Missing or invalid query parameters, or the date range is too long.
+      JSON: { "status": "error", "message": "Error description" }
+    - 500 Internal Server Error: Database error.
+      JSON: { "status": "error", "message": "A database error occurred." }
+    """
+    date_from = request.args.get('date_from')
+    date_to = request.args.get('date_to')
+    duration_minutes = request.args.get('duration_minutes', type=int)
+    step_minutes = request.args.get('step_minutes', type=int)
+
+    if not date_from or not date_to or duration_minutes is None:
+        return jsonify({"status": "error", "message": "date_from, date_to and duration_minutes are required."}), 400
+    if not is_valid_date_string(date_from) or not is_valid_date_string(date_to):
+        return jsonify({"status": "error", "message": "Invalid date format. Use YYYY-MM-DD"}), 400
+    if 'step_minutes' in request.args and step_minutes is None:
+        return jsonify({"status": "error", "message": "step_minutes must be an integer."}), 400
+
+    window_start, window_end = date_range_to_epoch_bounds(date_from, date_to)
+    if window_end <= window_start:
+        return jsonify({"status": "error", "message": "date_to must not be before date_from."}), 400
+    if window_end - window_start > MAX_SLOT_WINDOW_DAYS * SECONDS_PER_DAY:
+        return jsonify({"status": "error", "message": f"The date range cannot exceed {MAX_SLOT_WINDOW_DAYS} days."}), 400
+
+    with get_db_connection(DB_NAME) as conn:
+        try:
+            slots = get_bookable_slots(
+                conn, provider_id, epoch_to_datetime_string(window_start), epoch_to_datetime_string(window_end),
+                duration_minutes, step_minutes, not_before=now_datetime_string()
+            )
+            return jsonify({"status": "success", "provider_id": provider_id,
+                            "duration_minutes": duration_minutes, "slots": slots}), 200
+        except ValueError as ve:
+            return jsonify({"status": "error", "message": str(ve)}), 400
+        except sqlite3.Error as e:
+            print(f"DB Error in get_slots_api for provider {provider_id}: {e}")
+            return jsonify({"status": "error", "message": "A database error occurred while computing slots."}), 500
+        except Exception as e_gen:
+            print(f"Unexpected error in get_slots_api for provider {provider_id}: {e_gen}")
+            return jsonify({"status": "error", "message": "An unexpected server error occurred."}), 500
+
+@app.route('/api/providers/<int:provider_id>/free', methods=['GET'])
+def is_provider_free_api(provider_id: int):
+    """
+    Check whether a provider is free for a time range.
+
+    Free means the range lies within the provider's availability and overlaps no
+    pending or confirmed appointment. Answered from per-day 5-minute bitmaps, so a
+    range that splits a 5-minute cell is judged on the whole cell. Slot holds are
+    not considered.
+
+    Path Parameters:
+        provider_id (int): The ID of the provider.
+
+    Query Parameters:
+        start_time (str): Range start (YYYY-MM-DD HH:MM:SS).
+        end_time (str): Range end, exclusive (YYYY-MM-DD HH:MM:SS). At most 24 hours after start_time.
+
+    Responses:
+    - 200 OK: JSON: { "status": "success", "provider_id": int, "start_time": str, "end_time": str, "free": bool }
+    - 400 Bad Request: Missing or invalid times.
+      JSON: { "status": "error", "message": "Error description" }
+    - 500 Internal Server Error: Database error.
+      JSON: { "status": "error", "message": "A database error occurred." }
+    """
+    start_time = request.args.get('start_time')
+    end_time = request.args.get('end_time')
+    if not is_valid_datetime_string(start_time) or not is_valid_datetime_string(end_time):
+        return jsonify({"status": "error", "message": "start_time and end_time are required (YYYY-MM-DD HH:MM:SS)."}), 400
+
+    with get_db_connection(DB_NAME) as conn:
+        try:
+            free = is_provider_free(conn, provider_id, start_time, end_time)
+            return jsonify({"status": "success", "provider_id": provider_id, "start_time": start_time,
+                            "end_time": end_time, "free": free}), 200
+        except ValueError as ve:
+            return jsonify({"status": "error", "message": str(ve)}), 400
+        except sqlite3.Error as e:
+            print(f"DB Error in is_provider_free_api for provider {provider_id}: {e}")
+            return jsonify({"status": "error", "message": "A database error occurred."}), 500
+        except Exception as e_gen:
+            print(f"Unexpected error in is_provider_free_api for provider {provider_id}: {e_gen}")
+            return jsonify({"status": "error", "message": "An unexpected server error occurred."}), 500
+
+@app.route('/api/providers/first-available', methods=['GET'])
+def first_available_api():
+    """
+    Find the earliest bookable slots with any of several providers.
+
+    Answers "earliest appointment with any cardiologist this week" in one request: the
+    client passes the IDs of the providers it is interested in (e.g. from its specialty
+    search) and gets back the earliest free slots across all of them. Slots are computed
+    as in GET /api/providers/<id>/slots; slots in the past are omitted.
+
+    Query Parameters:
+        provider_ids (str): Comma-separated provider IDs (at most MAX_SEARCH_PROVIDERS).
+        date_from (str): First day to search (YYYY-MM-DD).
+        date_to (str): Last day to search, inclusive (YYYY-MM-DD). At most MAX_SLOT_WINDOW_DAYS days after date_from.
+        duration_minutes (int): Length of each slot.
+        step_minutes (int, optional): Distance between slot starts. Defaults to duration_minutes.
+        limit (int, optional): Number of slots to return (1 to MAX_SEARCH_RESULTS). Defaults to 10.
+
+    Responses:
+    - 200 OK: Successfully searched.
+      JSON: {
+          "status": "success",
+          "duration_minutes": int,
+          "slots": [
+              {"provider_id": int, "start_time": "YYYY-MM-DD HH:MM:SS", "end_time": "YYYY-MM-DD HH:MM:SS"}, ...
+          ]
+      }
+    - 400 Bad Request: Missing or invalid query parameters, too many providers, or the date range is too long.
+      JSON: { "status": "error", "message": "Error description" }
+    - 500 Internal Server Error: Database error.
+      JSON: { "status": "error", "message": "A database error occurred." }
+    """
+    provider_ids_param = request.args.get('provider_ids')
+    date_from = request.args.get('date_from')
+    date_to = request.args.get('date_to')
+    duration_minutes = request.args.get('duration_minutes', type=int)
+    step_minutes = request.args.get('step_minutes', type=int)
+    limit = request.args.get('limit', 10, type=int)
+
+    if not provider_ids_param or not date_from or not date_to or duration_minutes is None:
+        return jsonify({"status": "error", "message": "provider_ids, date_from, date_to and duration_minutes are required."}), 400
+    try:
+        provider_ids = [int(value) for value in provider_ids_param.split(',')]
+    except ValueError:
+        return jsonify({"status": "error", "message": "provider_ids must be comma-separated integers."}), 400
+    if len(provider_ids) > MAX_SEARCH_PROVIDERS:
+        return jsonify({"status": "error", "message": f"At most {MAX_SEARCH_PROVIDERS} providers can be searched at once."}), 400
+    if not is_valid_date_string(date_from) or not is_valid_date_string(date_to):
+        return jsonify({"status": "error", "message": "Invalid date format. Use YYYY-MM-DD"}), 400
+    if 'step_minutes' in request.args and step_minutes is None:
+        return jsonify({"status": "error", "message": "step_minutes must be an integer."}), 400
+    if limit is None or not 0 < limit <= MAX_SEARCH_RESULTS:
+        return jsonify({"status": "error", "message": f"limit must be an integer between 1 and {MAX_SEARCH_RESULTS}."}), 400
+
+    window_start, window_end = date_range_to_epoch_bounds(date_from, date_to)
+    if window_end <= window_start:
+        return jsonify({"status": "error", "message": "date_to must not be before date_from."}), 400
+    if window_end - window_start > MAX_SLOT_WINDOW_DAYS * SECONDS_PER_DAY:
+        return jsonify({"status": "error", "message": f"The date range cannot exceed {MAX_SLOT_WINDOW_DAYS} days."}), 400
+
+    with get_db_connection(DB_NAME) as conn:
+        try:
+            slots = find_first_available_slots(
+                conn, provider_ids, epoch_to_datetime_string(window_start), epoch_to_datetime_string(window_end),
+                duration_minutes, limit, step_minutes, not_before=now_datetime_string()
+            )
+            return jsonify({"status": "success", "duration_minutes": duration_minutes, "slots": slots}), 200
+        except ValueError as ve:
+            return jsonify({"status": "error", "message": str(ve)}), 400
+        except sqlite3.Error as e:
+            print(f"DB Error in first_available_api: {e}")
+            return jsonify({"status": "error", "message": "A database error occurred while searching for slots."}), 500
+        except Exception as e_gen:
+            print(f"Unexpected error in first_available_api: {e_gen}")
+            return jsonify({"status": "error", "message": "An unexpected server error occurred."}), 500
+
 @app.route('/api/providers/availability/<int:availability_id>', methods=['DELETE'])
 def delete_availability_api(availability_id: int):
     """
@@ -249,8 +435,11 @@ def request_appointment_api():
     Patient: Request a new appointment with a provider.
 
     The appointment is created with a status of 'pending_provider_confirmation'.
-    Validation of times against provider availability is not performed at this stage
-    but would be a critical addition in a full system.
+    The requested time must fall within the provider's availability (recurring blocks
+    included), must not be held by another patient (see POST /api/appointments/holds),
+    and must not overlap another pending or confirmed appointment with the provider;
+    all are checked in the same transaction as the insert. The patient's own holds with
+    the provider are released once the appointment is created.
 
     Request Body JSON:
     {
@@ -259,15 +448,19 @@ def request_appointment_api():
         "appointment_start_time": "YYYY-MM-DD HH:MM:SS", // Required
         "appointment_end_time": "YYYY-MM-DD HH:MM:SS",   // Required
         "reason_for_visit": "str",                       // Optional
-        "notes_by_patient": "str"                        // Optional
+        "notes_by_patient": "str",                       // Optional
+        "hold_id": "str"                                 // Optional. A live hold by this patient covering the time.
     }
 
     Responses:
     - 201 Created: Appointment requested successfully.
       JSON: { "status": "success", "message": "...", "appointment_id": int }
     - 400 Bad Request: Missing fields, invalid data types, invalid time range (DB check),
+                       time outside the provider's availability, unknown or expired hold_id,
                        or patient/provider ID not found (FK constraint).
       JSON: { "status": "error", "message": "Error description" }
+    - 409 Conflict: The time overlaps another appointment with the provider, or another patient holds it.
+      JSON: { "status": "error", "message": "Error description" }
     - 500 Internal Server Error: Database error.
       JSON: { "status": "error", "message": "A database error occurred." }
     """
@@ -281,6 +474,7 @@ def request_appointment_api():
     end_time = data.get('appointment_end_time')
     reason_for_visit = data.get('reason_for_visit')
     notes_by_patient = data.get('notes_by_patient')
+    hold_id = data.get('hold_id')
 
     # Auth Placeholder: In a real app, patient_id should ideally match the
     # authenticated user ID making the request.
@@ -293,20 +487,16 @@ def request_appointment_api():
 
     if not isinstance(patient_id, int) or not isinstance(provider_id, int):
         return jsonify({"status": "error", "message": "patient_id and provider_id must be integers"}), 400
-    if not validate_datetime_string_format(start_time) or not validate_datetime_string_format(end_time):
+    if not is_valid_datetime_string(start_time) or not is_valid_datetime_string(end_time):
         return jsonify({"status": "error", "message": "Invalid datetime format for appointment times. Use YYYY-MM-DD HH:MM:SS"}), 400
-
-    # Business Logic Placeholder: A crucial step in a real system would be to check
-    # if the requested slot [start_time, end_time] is actually available for the provider
-    # by checking against `provider_availability` and existing `appointments`.
-    # This logic is complex and would typically reside in a service layer or within this API.
-    # For now, we proceed directly to attempting to book.
+    if hold_id is not None and not isinstance(hold_id, str):
+        return jsonify({"status": "error", "message": "hold_id must be a string"}), 400
 
     with get_db_connection(DB_NAME) as conn:
         try:
             new_appointment_id = db_request_appointment(
                 conn, patient_id, provider_id, start_time, end_time,
-                reason_for_visit, notes_by_patient
+                reason_for_visit, notes_by_patient, hold_id
             )
             return jsonify({
                 "status": "success",
@@ -315,6 +505,8 @@ def request_appointment_api():
             }), 201
         except ValueError as ve:
             return jsonify({"status": "error", "message": str(ve)}), 400
+        except AppointmentConflictError as ce:
+            return jsonify({"status": "error", "message": str(ce)}), 409
         except sqlite3.IntegrityError as ie:
             print(f"DB IntegrityError in request_appointment_api: {ie}")
             if "FOREIGN KEY constraint failed" in str(ie):
@@ -330,6 +522,128 @@ def request_appointment_api():
             return jsonify({"status": "error", "message": "An unexpected server error occurred."}), 500
 
 
+@app.route('/api/appointments/holds', methods=['POST'])
+def place_hold_api():
+    """
+    Patient: Hold a slot for a few minutes while finishing a booking.
+
+    While the hold is live the time is left out of GET /api/providers/<id>/slots, and
+    other patients' holds and appointment requests for it get 409. A patient holds at
+    most one slot per provider; a new hold replaces the previous one. Pass the returned
+    hold_id to POST /api/appointments/request to book the held time.
+
+    Request Body JSON:
+    {
+        "patient_id": int,     // Required. In a real app, this might come from auth.
+        "provider_id": int,    // Required
+        "appointment_start_time": "YYYY-MM-DD HH:MM:SS", // Required
+        "appointment_end_time": "YYYY-MM-DD HH:MM:SS",   // Required
+        "ttl_seconds": int                               // Optional. Defaults to APPOINTMENT_HOLD_TTL_SECONDS.
+    }
+
+    Responses:
+    - 201 Created: Hold placed.
+      JSON: { "status": "success", "hold": { "hold_id": str, "provider_id": int, "patient_id": int,
+              "start_time": str, "end_time": str, "expires_at": str } }
+    - 400 Bad Request: Missing fields, invalid data types or ttl_seconds, invalid time range,
+                       time outside the provider's availability, or unknown patient/provider.
+      JSON: { "status": "error", "message": "Error description" }
+    - 409 Conflict: The time overlaps an appointment with the provider or another patient's hold.
+      JSON: { "status": "error", "message": "Error description" }
+    - 500 Internal Server Error: Database error.
+      JSON: { "status": "error", "message": "A database error occurred." }
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({"status": "error", "message": "Invalid JSON payload"}), 400
+
+    patient_id = data.get('patient_id')
+    provider_id = data.get('provider_id')
+    start_time = data.get('appointment_start_time')
+    end_time = data.get('appointment_end_time')
+
+    # Auth Placeholder: patient_id should match the authenticated user.
+
+    required_fields = ['patient_id', 'provider_id', 'appointment_start_time', 'appointment_end_time']
+    missing = [field for field in required_fields if data.get(field) is None]
+    if missing:
+        return jsonify({"status": "error", "message": f"Missing required fields: {', '.join(missing)}"}), 400
+
+    if not isinstance(patient_id, int) or not isinstance(provider_id, int):
+        return jsonify({"status": "error", "message": "patient_id and provider_id must be integers"}), 400
+    if not is_valid_datetime_string(start_time) or not is_valid_datetime_string(end_time):
+        return jsonify({"status": "error", "message": "Invalid datetime format for appointment times. Use YYYY-MM-DD HH:MM:SS"}), 400
+
+    # place_hold validates ttl_seconds; leave it out to get the configured default.
+    hold_args = {'ttl_seconds': data['ttl_seconds']} if data.get('ttl_seconds') is not None else {}
+
+    with get_db_connection(DB_NAME) as conn:
+        try:
+            hold = place_hold(conn, patient_id, provider_id, start_time, end_time, **hold_args)
+            return jsonify({"status": "success", "hold": hold}), 201
+        except ValueError as ve:
+            return jsonify({"status": "error", "message": str(ve)}), 400
+        except AppointmentConflictError as ce:
+            return jsonify({"status": "error", "message": str(ce)}), 409
+        except sqlite3.IntegrityError as ie:
+            print(f"DB IntegrityError in place_hold_api: {ie}")
+            if "FOREIGN KEY constraint failed" in str(ie):
+                return jsonify({"status": "error", "message": "Invalid patient_id or provider_id (user does not exist)."}), 400
+            return jsonify({"status": "error", "message": f"Database integrity error: {str(ie)}"}), 400
+        except sqlite3.Error as e:
+            print(f"DB Error in place_hold_api: {e}")
+            return jsonify({"status": "error", "message": "A database error occurred while placing the hold."}), 500
+        except Exception as e_gen:
+            print(f"Unexpected error in place_hold_api: {e_gen}")
+            return jsonify({"status": "error", "message": "An unexpected server error occurred."}), 500
+
+
+@app.route('/api/appointments/holds/<string:hold_id>', methods=['DELETE'])
+def release_hold_api(hold_id: str):
+    """
+    Patient: Release a hold before it expires.
+
+    Path Parameters:
+        hold_id (str): The hold to release.
+
+    Request Body JSON (for simulated auth context):
+    {
+        "patient_id": int  // ID of the patient who placed the hold
+    }
+
+    Responses:
+    - 200 OK: Hold released.
+      JSON: { "status": "success", "message": "Hold released." }
+    - 400 Bad Request: Missing or invalid patient_id.
+      JSON: { "status": "error", "message": "Error description" }
+    - 404 Not Found: Hold not found (or already expired) or placed by another patient.
+      JSON: { "status": "error", "message": "Hold not found or you are not authorized to release it." }
+    - 500 Internal Server Error: Database error.
+      JSON: { "status": "error", "message": "A database error occurred." }
+    """
+    data = request.get_json()
+    if not data or 'patient_id' not in data:
+        return jsonify({"status": "error", "message": "Missing patient_id in request body for authorization."}), 400
+
+    patient_id = data.get('patient_id') # In real app, from session/token
+    if not isinstance(patient_id, int):
+        return jsonify({"status": "error", "message": "patient_id in body must be an integer."}), 400
+
+    with get_db_connection(DB_NAME) as conn:
+        try:
+            if release_hold(conn, hold_id, patient_id):
+                return jsonify({"status": "success", "message": "Hold released."}), 200
+            return jsonify({"status": "error", "message": "Hold not found or you are not authorized to release it."}), 404
+        except ValueError as ve:
+            return jsonify({"status": "error", "message": str(ve)}), 400
+        except sqlite3.Error as e:
+            print(f"DB Error in release_hold_api for hold {hold_id}: {e}")
+            return jsonify({"status": "error", "message": "A database error occurred."}), 500
+        except Exception as e_gen:
+            print(f"Unexpected error in release_hold_api for hold {hold_id}: {e_gen}")
+            return jsonify({"status": "error", "message": "An unexpected server error occurred."}), 500
+
+
 @app.route('/api/providers/<int:provider_id>/appointments', methods=['GET'])
 def get_provider_appointments_api(provider_id: int):
     """
@@ -365,9 +679,9 @@ def get_provider_appointments_api(provider_id: int):
     date_from_filter = request.args.get('date_from')
     date_to_filter = request.args.get('date_to')
 
-    if date_from_filter and not validate_datetime_string_format(date_from_filter, '%Y-%m-%d'):
+    if date_from_filter and not is_valid_date_string(date_from_filter):
         return jsonify({"status": "error", "message": "Invalid date_from format. Use YYYY-MM-DD"}), 400
-    if date_to_filter and not validate_datetime_string_format(date_to_filter, '%Y-%m-%d'):
+    if date_to_filter and not is_valid_date_string(date_to_filter):
         return jsonify({"status": "error", "message": "Invalid date_to format. Use YYYY-MM-DD"}), 400
 
     with get_db_connection(DB_NAME) as conn:
@@ -422,9 +736,9 @@ def get_patient_appointments_api(patient_id: int):
     date_from_filter = request.args.get('date_from')
     date_to_filter = request.args.get('date_to')
 
-    if date_from_filter and not validate_datetime_string_format(date_from_filter, '%Y-%m-%d'):
+    if date_from_filter and not is_valid_date_string(date_from_filter):
         return jsonify({"status": "error", "message": "Invalid date_from format. Use YYYY-MM-DD"}), 400
-    if date_to_filter and not validate_datetime_string_format(date_to_filter, '%Y-%m-%d'):
+    if date_to_filter and not is_valid_date_string(date_to_filter):
         return jsonify({"status": "error", "message": "Invalid date_to format. Use YYYY-MM-DD"}), 400
 
     with get_db_connection(DB_NAME) as conn:
@@ -529,6 +843,8 @@ def confirm_appointment_api(appointment_id: int):
       JSON: { "status": "error", "message": "Error description" }
     - 404 Not Found: If the appointment to be confirmed does not exist.
       JSON: { "status": "error", "message": "Error description" }
+    - 409 Conflict: The appointment's time has since been taken by another appointment.
+      JSON: { "status": "error", "message": "Error description" }
     - 500 Internal Server Error: Database error.
       JSON: { "status": "error", "message": "A database error occurred." }
     """
@@ -568,6 +884,8 @@ def confirm_appointment_api(appointment_id: int):
                 return jsonify({"status": "error", "message": "Failed to confirm appointment. It may not exist, not be in a confirmable state, or you are not authorized."}), 403
         except ValueError as ve:
             return jsonify({"status": "error", "message": str(ve)}), 400
+        except AppointmentConflictError as ce:
+            return jsonify({"status": "error", "message": str(ce)}), 409
         except sqlite3.Error as e:
             print(f"DB Error in confirm_appointment_api for appointment {appointment_id}: {e}")
             return jsonify({"status": "error", "message": "A database error occurred while confirming the appointment."}), 500
@@ -1,27 +1,76 @@
 from datetime import datetime, timedelta
+import json
 import os
+import signal
+import smtplib
+import socket
 import sqlite3 # For specific error handling if needed by the job
+import threading
+import urllib.request
+from email.message import EmailMessage
+import db_utils_appointment
 from db_utils_appointment import (
     get_db_connection,
-    get_appointments_needing_reminders,
     mark_reminder_sent,
     initialize_appointment_schema,
     request_appointment,
-    update_appointment_status
+    update_appointment_status,
+    add_provider_availability
 )
+from notification_dispatch import CHANNEL_CONCURRENCY, CHANNEL_RATE_PER_SECOND, NotificationDispatcher
+from reminder_scheduler import ReminderSchedule, SystemClock
+from time_utils import format_datetime, epoch_to_datetime_string, now_epoch
 
 # Configure DB_NAME using an environment variable with a default
 DB_NAME = os.getenv('APPOINTMENT_DB_NAME', 'appointment_app.db')
+# Reminders are queued, and outbox notifications claimed for delivery (at most), in batches of this many, one transaction each
+REMINDER_MARK_BATCH_SIZE = int(os.getenv('REMINDER_MARK_BATCH_SIZE', '500'))
+
+# Notification transports. When a host/URL is not set, sends are only simulated (logged).
+# Concurrency and rate limits per channel are configured in notification_dispatch.
+REMINDER_SMTP_HOST = os.getenv('REMINDER_SMTP_HOST')
+REMINDER_SMTP_PORT = int(os.getenv('REMINDER_SMTP_PORT', '25'))
+REMINDER_EMAIL_FROM = os.getenv('REMINDER_EMAIL_FROM', 'reminders@healthcare.example')
+REMINDER_SMS_GATEWAY_URL = os.getenv('REMINDER_SMS_GATEWAY_URL') # Receives a JSON POST {"to": ..., "message": ...}
+NOTIFICATION_SEND_TIMEOUT_SECONDS = float(os.getenv('NOTIFICATION_SEND_TIMEOUT_SECONDS', '10'))
+
+# Worker mode (REMINDER_JOB_MODE=worker, see run_reminder_worker): each worker runs every
+# REMINDER_WORKER_INTERVAL_SECONDS for the provider shards it holds a lease on. All workers
+# sharing a database must use the same REMINDER_SHARD_COUNT.
+REMINDER_SHARD_COUNT = int(os.getenv('REMINDER_SHARD_COUNT', '16'))
+REMINDER_WORKER_INTERVAL_SECONDS = float(os.getenv('REMINDER_WORKER_INTERVAL_SECONDS', '60'))
+REMINDER_SHARD_LEASE_SECONDS = int(os.getenv('REMINDER_SHARD_LEASE_SECONDS',
+                                             str(db_utils_appointment.REMINDER_SHARD_LEASE_SECONDS)))
+
+# Daemon mode (REMINDER_JOB_MODE=daemon, see run_reminder_daemon). Reminder offsets and the
+# load-ahead are configured in reminder_scheduler. The change feed is read at least this
+# often, which bounds how long a new confirmation or cancellation takes to be noticed.
+REMINDER_DAEMON_POLL_SECONDS = float(os.getenv('REMINDER_DAEMON_POLL_SECONDS', '30'))
+# After a database error (e.g. 'database is locked' while workers or dispatchers hold the
+# file) the daemon waits this long before retrying, instead of spinning on the reminders
+# that are already due.
+REMINDER_DAEMON_RETRY_SECONDS = float(os.getenv('REMINDER_DAEMON_RETRY_SECONDS', '5'))
+APPOINTMENT_CHANGE_BATCH_SIZE = 1000 # Change feed rows read per query
+# The change feed is written whatever the job mode, so every mode trims it: cron runs on
+# each enqueue_reminders, the daemon and workers at most this often.
+APPOINTMENT_CHANGE_PRUNE_INTERVAL_SECONDS = 3600
 
 # --- Notification Service Placeholders ---
 
+def _format_appointment_time(appt_start_time_str, time_format: str) -> str:
+    # Fall back to the raw value if it is not a YYYY-MM-DD HH:MM:SS string
+    try:
+        return datetime.strptime(appt_start_time_str, '%Y-%m-%d %H:%M:%S').strftime(time_format)
+    except (ValueError, TypeError):
+        return appt_start_time_str
+
 def send_email_reminder(email_address: str, appointment_details: dict) -> bool:
     """
-    Simulates sending an email reminder for an appointment.
+    Sends an email reminder for an appointment.
 
-    In a real application, this function would integrate with an email service
-    (e.g., SMTP, SendGrid, AWS SES) to dispatch actual emails. It would format
-    a user-friendly message containing key appointment information.
+    The email goes to the SMTP server at REMINDER_SMTP_HOST:REMINDER_SMTP_PORT (e.g. a
+    relay, a provider's SMTP endpoint or a local stand-in for testing). If
+    REMINDER_SMTP_HOST is not set, sending is only simulated (logged).
 
     Args:
         email_address (str): The recipient's email address.
@@ -31,51 +80,52 @@ def send_email_reminder(email_address: str, appointment_details: dict) -> bool:
                                     'provider_username', 'reason_for_visit'.
 
     Returns:
-        bool: True if the email was "sent" successfully (simulated), False otherwise
-              (e.g., if no email address was provided).
+        bool: True if the email was sent (or simulated), False if no email address was provided.
+
+    Raises:
+        OSError: If the SMTP server cannot be reached or does not answer within
+                 NOTIFICATION_SEND_TIMEOUT_SECONDS (smtplib.SMTPException is a subclass).
     """
     if not email_address: # Basic check for an email address
         print(f"  - Skipping email: No email address provided for appointment ID {appointment_details.get('appointment_id')}.")
         return False
 
-    # Simulate sending: Log the action
-    print(f"  - SIMULATING: Sending EMAIL reminder to {email_address} for appointment ID {appointment_details.get('appointment_id')} "
-          f"at {appointment_details.get('appointment_start_time')} with {appointment_details.get('provider_username')}.")
-
-    # Example of how a real email might be constructed and sent:
-    # subject = f"Appointment Reminder: Your appointment for '{appointment_details.get('reason_for_visit', 'your visit')}'"
-    # patient_name = appointment_details.get('patient_username', 'Patient')
-    # provider_name = appointment_details.get('provider_username', 'your provider')
-    # appt_start_time_str = appointment_details.get('appointment_start_time')
-    # reason = appointment_details.get('reason_for_visit', 'your scheduled check-up')
-    #
-    # # Attempt to parse the datetime string to a datetime object for better formatting
-    # try:
-    #     appt_dt_obj = datetime.strptime(appt_start_time_str, '%Y-%m-%d %H:%M:%S')
-    #     formatted_time = appt_dt_obj.strftime('%B %d, %Y at %I:%M %p') # Example: March 15, 2024 at 02:30 PM
-    # except (ValueError, TypeError): # Fallback if parsing fails or appt_start_time_str is not a string
-    #     formatted_time = appt_start_time_str
-    #
-    # body = (f"Dear {patient_name},\n\n"
-    #         f"This is a reminder for your appointment for '{reason}' "
-    #         f"scheduled for {formatted_time} with {provider_name}.\n\n"
-    #         f"If you need to reschedule, please contact us as soon as possible.\n\n"
-    #         f"Thank you,\nYour Healthcare Team")
-    # print(f"    Subject: {subject}") # For logging/debugging
-    # print(f"    Body Preview: {body[:100]}...") # Log a preview
-    #
-    # # Placeholder for actual email sending call, e.g.:
-    # # email_send_success = send_email_via_external_service(email_address, subject, body)
-    # # return email_send_success
-    return True # Simulate successful sending
+    if not REMINDER_SMTP_HOST:
+        # Simulate sending: Log the action
+        print(f"  - SIMULATING: Sending EMAIL reminder to {email_address} for appointment ID {appointment_details.get('appointment_id')} "
+              f"at {appointment_details.get('appointment_start_time')} with {appointment_details.get('provider_username')}.")
+        return True # Simulate successful sending
+
+    reason = appointment_details.get('reason_for_visit') or 'your scheduled check-up'
+    patient_name = appointment_details.get('patient_username') or 'Patient'
+    provider_name = appointment_details.get('provider_username') or 'your provider'
+    formatted_time = _format_appointment_time(appointment_details.get('appointment_start_time'),
+                                              '%B %d, %Y at %I:%M %p') # Example: March 15, 2024 at 02:30 PM
+
+    message = EmailMessage()
+    message['Subject'] = f"Appointment Reminder: Your appointment for '{reason}'"
+    message['From'] = REMINDER_EMAIL_FROM
+    message['To'] = email_address
+    if appointment_details.get('idempotency_key'): # Set for outbox deliveries; lets a retried send be recognised
+        message['Message-ID'] = f"<{appointment_details['idempotency_key'].replace(':', '.')}@{REMINDER_EMAIL_FROM.split('@')[-1]}>"
+    message.set_content(f"Dear {patient_name},\n\n"
+                        f"This is a reminder for your appointment for '{reason}' "
+                        f"scheduled for {formatted_time} with {provider_name}.\n\n"
+                        f"If you need to reschedule, please contact us as soon as possible.\n\n"
+                        f"Thank you,\nYour Healthcare Team")
+    with smtplib.SMTP(REMINDER_SMTP_HOST, REMINDER_SMTP_PORT, timeout=NOTIFICATION_SEND_TIMEOUT_SECONDS) as smtp:
+        smtp.send_message(message)
+    print(f"  - Sent EMAIL reminder to {email_address} for appointment ID {appointment_details.get('appointment_id')}.")
+    return True
 
 def send_sms_reminder(phone_number: str, appointment_details: dict) -> bool:
     """
-    Simulates sending an SMS reminder for an appointment.
+    Sends an SMS reminder for an appointment.
 
-    In a real application, this function would integrate with an SMS gateway
-    (e.g., Twilio, Vonage) to dispatch actual text messages. It would format
-    a concise message with key appointment information.
+    The message is POSTed as JSON ({"to": ..., "message": ...}) to the SMS gateway at
+    REMINDER_SMS_GATEWAY_URL (e.g. an adapter in front of Twilio/Vonage, or a local
+    stand-in for testing). If REMINDER_SMS_GATEWAY_URL is not set, sending is only
+    simulated (logged).
 
     Args:
         phone_number (str): The recipient's phone number.
@@ -83,52 +133,114 @@ def send_sms_reminder(phone_number: str, appointment_details: dict) -> bool:
                                     Expected keys are similar to `send_email_reminder`.
 
     Returns:
-        bool: True if the SMS was "sent" successfully (simulated), False otherwise.
+        bool: True if the SMS was sent (or simulated), False if no phone number was provided
+              or the gateway did not accept the message.
+
+    Raises:
+        OSError: If the gateway cannot be reached or does not answer within
+                 NOTIFICATION_SEND_TIMEOUT_SECONDS.
     """
     if not phone_number: # Basic check for a phone number
         print(f"  - Skipping SMS: No phone number provided for appointment ID {appointment_details.get('appointment_id')}.")
         return False
 
-    # Simulate sending: Log the action
-    print(f"  - SIMULATING: Sending SMS reminder to {phone_number} for appointment ID {appointment_details.get('appointment_id')} "
-          f"at {appointment_details.get('appointment_start_time')}.")
-
-    # Example of how a real SMS might be constructed and sent:
-    # provider_name = appointment_details.get('provider_username', 'your provider')
-    # appt_start_time_str = appointment_details.get('appointment_start_time')
-    # reason_summary = appointment_details.get('reason_for_visit', 'check-up')
-    # if len(reason_summary) > 25: reason_summary = reason_summary[:22] + "..." # Keep SMS concise
-    #
-    # try:
-    #     appt_dt_obj = datetime.strptime(appt_start_time_str, '%Y-%m-%d %H:%M:%S')
-    #     formatted_time = appt_dt_obj.strftime('%b %d, %I:%M%p') # E.g., Mar 15, 02:30PM
-    # except (ValueError, TypeError): # Fallback
-    #     formatted_time = appt_start_time_str
-    #
-    # message = (f"Reminder: Your appt for '{reason_summary}' with {provider_name} is on {formatted_time}.")
-    # print(f"    SMS Message: {message}") # For logging/debugging
-    #
-    # # Placeholder for actual SMS sending call, e.g.:
-    # # sms_send_success = send_sms_via_gateway(phone_number, message)
-    # # return sms_send_success
-    return True # Simulate successful sending
+    if not REMINDER_SMS_GATEWAY_URL:
+        # Simulate sending: Log the action
+        print(f"  - SIMULATING: Sending SMS reminder to {phone_number} for appointment ID {appointment_details.get('appointment_id')} "
+              f"at {appointment_details.get('appointment_start_time')}.")
+        return True # Simulate successful sending
+
+    provider_name = appointment_details.get('provider_username') or 'your provider'
+    reason_summary = appointment_details.get('reason_for_visit') or 'check-up'
+    if len(reason_summary) > 25: reason_summary = reason_summary[:22] + "..." # Keep SMS concise
+    formatted_time = _format_appointment_time(appointment_details.get('appointment_start_time'),
+                                              '%b %d, %I:%M%p') # E.g., Mar 15, 02:30PM
+    payload = {
+        "to": phone_number,
+        "message": f"Reminder: Your appt for '{reason_summary}' with {provider_name} is on {formatted_time}."
+    }
+    headers = {'Content-Type': 'application/json'}
+    if appointment_details.get('idempotency_key'): # Set for outbox deliveries; lets the gateway drop a retried send
+        headers['Idempotency-Key'] = appointment_details['idempotency_key']
+    request = urllib.request.Request(REMINDER_SMS_GATEWAY_URL, data=json.dumps(payload).encode('utf-8'),
+                                     headers=headers, method='POST')
+    # urlopen raises HTTPError (an OSError) for 4xx/5xx answers
+    with urllib.request.urlopen(request, timeout=NOTIFICATION_SEND_TIMEOUT_SECONDS) as response:
+        accepted = 200 <= response.status < 300
+    if accepted:
+        print(f"  - Sent SMS reminder to {phone_number} for appointment ID {appointment_details.get('appointment_id')}.")
+    return accepted
 
 # --- Core Logic ---
 
-def send_reminders(time_window_start_hours_ahead: int = 23,
-                   time_window_end_hours_ahead: int = 24,
-                   reminder_grace_period_hours: int = 2
-                  ):
+def _enqueue_reminder_batch(conn, appointments: list, offset_minutes: int = None,
+                            raise_on_error: bool = False) -> dict:
     """
-    Fetches upcoming confirmed appointments that require reminders and processes them.
+    Queues the email and SMS reminders for a batch of appointments and marks them as reminded.
 
-    This function is designed to be run periodically (e.g., as a cron job).
-    It identifies appointments within a specified future time window for which
-    reminders haven't been sent recently (respecting a grace period).
+    Both happen in one transaction (see enqueue_reminder_notifications), so a crash leaves
+    either the whole batch queued and marked, or none of it. `offset_minutes` is set by the
+    daemon, which queues one reminder per offset. The window scan finds a failed batch
+    again on its next run; the daemon does not, so it passes `raise_on_error` and puts the
+    reminders back in its schedule.
 
-    For each eligible appointment, it attempts to send email and/or SMS reminders
-    (using placeholder functions for actual dispatch) to the patient. After attempting
-    notifications, it updates the appointment record to mark that a reminder has been sent.
+    Returns:
+        dict: appointments_marked and notifications_enqueued; both 0 if the batch failed.
+
+    Raises:
+        sqlite3.Error: If the batch failed and `raise_on_error` is set.
+    """
+    for appt_details in appointments:
+        appt_id = appt_details['appointment_id'] # For convenience
+        print(f"\nProcessing Appointment ID: {appt_id} "
+              f"(Patient: {appt_details['patient_username']}, Provider: {appt_details['provider_username']}) "
+              f"scheduled at {appt_details['appointment_start_time']}")
+        print(f"  Details: Last reminder sent at: {appt_details['last_reminder_sent_at'] or 'Never'}")
+        if not appt_details.get("patient_email") and not appt_details.get("patient_phone"):
+            print(f"  No contact information (email/phone) suitable for sending for appointment ID {appt_id}.")
+
+    try:
+        result = db_utils_appointment.enqueue_reminder_notifications( # Uses current time by default
+            conn, appointments, offset_minutes=offset_minutes)
+        print(f"  Queued {result['notifications_enqueued']} notifications; marked {result['appointments_marked']} "
+              f"of {len(appointments)} appointments as reminded.")
+        return result
+    except sqlite3.Error as e_enqueue:
+        print(f"  ERROR: Database error while queueing reminders for {len(appointments)} appointments "
+              f"(appointment IDs {appointments[0]['appointment_id']}..{appointments[-1]['appointment_id']}): {e_enqueue}")
+        if raise_on_error:
+            raise
+        return {"appointments_marked": 0, "notifications_enqueued": 0}
+
+def _prune_change_feed(conn):
+    """
+    Deletes appointment change feed rows past their retention (prune_appointment_changes).
+    A failure is only logged; the rows are pruned by a later run.
+    """
+    try:
+        pruned = db_utils_appointment.prune_appointment_changes(conn)
+        print(f"Pruned {pruned} expired appointment change feed rows.")
+    except sqlite3.Error as e_db:
+        print(f"A database error occurred while pruning the appointment change feed: {e_db}")
+
+def enqueue_reminders(time_window_start_hours_ahead: int = 23,
+                      time_window_end_hours_ahead: int = 24,
+                      reminder_grace_period_hours: int = 2,
+                      shard_ids: list[int] = None,
+                      shard_count: int = None,
+                      prune_changes: bool = True
+                     ) -> int:
+    """
+    Fetches upcoming confirmed appointments that require reminders and queues their notifications.
+
+    It identifies appointments within a specified future time window for which
+    reminders haven't been sent recently (respecting a grace period), streaming them in
+    chunks of REMINDER_MARK_BATCH_SIZE (see iter_appointments_needing_reminders) so memory
+    stays flat however wide the window is. For each chunk, one notification per patient contact
+    (email, SMS) is added to notification_outbox and the appointments are marked as
+    reminded, in one transaction. Delivery is left to dispatch_outbox, so this part is
+    cheap to rerun: notifications already queued are not queued again. Unless
+    `prune_changes` is False, the run ends by pruning the appointment change feed.
 
     Args:
         time_window_start_hours_ahead (int): Defines the start of the time window (in hours
@@ -143,106 +255,323 @@ def send_reminders(time_window_start_hours_ahead: int = 23,
                                            within this many hours from the current time,
                                            another reminder will not be sent. This prevents
                                            sending multiple reminders if the job runs frequently.
+        shard_ids (list[int]): If given, only appointments in these provider shards
+                               (provider_id % shard_count), as held by run_reminder_worker.
+        shard_count (int): The number of shards; required with shard_ids.
+        prune_changes (bool): Prune expired appointment change feed rows on the same connection.
+
+    Returns:
+        int: The number of appointments marked as reminded.
     """
     job_start_time = datetime.now()
-    print(f"\n--- Starting Appointment Reminder Job ({job_start_time.strftime('%Y-%m-%d %H:%M:%S')}) ---")
+    print(f"\n--- Starting Appointment Reminder Job ({format_datetime(job_start_time)}) ---")
     print(f"Searching for appointments starting between {time_window_start_hours_ahead} and "
           f"{time_window_end_hours_ahead} hours from now.")
     print(f"Reminder grace period: {reminder_grace_period_hours} hours (reminders sent more recently than this will be skipped).")
+    if shard_ids is not None:
+        print(f"Provider shards: {', '.join(map(str, shard_ids)) or 'none'} of {shard_count}.")
 
     # Calculate the absolute start and end datetime strings for the database query window
     # Example: If job runs at 10:00, start_hours=23, end_hours=24,
     # window will be from 09:00 tomorrow to 10:00 tomorrow.
     window_start_dt = job_start_time + timedelta(hours=time_window_start_hours_ahead)
     window_end_dt = job_start_time + timedelta(hours=time_window_end_hours_ahead)
-    window_start_iso = window_start_dt.strftime('%Y-%m-%d %H:%M:%S')
-    window_end_iso = window_end_dt.strftime('%Y-%m-%d %H:%M:%S')
+    window_start_iso = format_datetime(window_start_dt)
+    window_end_iso = format_datetime(window_end_dt)
 
     print(f"Calculated reminder query window: APPOINTMENT_START_TIME >= '{window_start_iso}' AND APPOINTMENT_START_TIME < '{window_end_iso}'")
 
+    successful_reminders_marked_count = 0
     # Establish database connection using a context manager to ensure it's closed
     with get_db_connection(DB_NAME) as conn:
         try:
-            # Fetch appointments that are confirmed and meet the criteria for needing a reminder
-            appointments_to_remind = get_appointments_needing_reminders(
-                conn, window_start_iso, window_end_iso, reminder_grace_period_hours
-            )
-
-            if not appointments_to_remind:
+            # Stream the confirmed appointments needing a reminder, one chunk at a time, so
+            # memory does not grow with the window; each chunk is queued as it arrives.
+            appointments_processed_count = 0
+            notifications_enqueued_count = 0
+            for chunk in db_utils_appointment.iter_appointments_needing_reminders(
+                    conn, window_start_iso, window_end_iso, reminder_grace_period_hours,
+                    chunk_size=REMINDER_MARK_BATCH_SIZE, shard_ids=shard_ids, shard_count=shard_count):
+                print(f"Read {len(chunk)} appointments needing reminders.")
+                appointments_processed_count += len(chunk)
+                result = _enqueue_reminder_batch(conn, chunk)
+                successful_reminders_marked_count += result['appointments_marked']
+                notifications_enqueued_count += result['notifications_enqueued']
+
+            if not appointments_processed_count:
                 print("No appointments found needing reminders in the specified window.")
-                return
-
-            print(f"Found {len(appointments_to_remind)} appointments needing reminders.")
-            successful_reminders_marked_count = 0
-            failed_reminders_marked_count = 0
-            notifications_attempted_for_appt_count = 0
-
-            for appt_details in appointments_to_remind:
-                appt_id = appt_details['appointment_id'] # For convenience
-                print(f"\nProcessing Appointment ID: {appt_id} "
-                      f"(Patient: {appt_details['patient_username']}, Provider: {appt_details['provider_username']}) "
-                      f"scheduled at {appt_details['appointment_start_time']}")
-                print(f"  Details: Last reminder sent at: {appt_details['last_reminder_sent_at'] or 'Never'}")
-
-                at_least_one_notification_sent_successfully = False # Tracks if any send attempt was "successful"
-
-                # Attempt to send email reminder to the patient
-                if appt_details.get("patient_email"):
-                    if send_email_reminder(appt_details["patient_email"], appt_details):
-                        at_least_one_notification_sent_successfully = True
-                else:
-                    print(f"  - No patient email found for appointment {appt_id}.")
-
-                # Attempt to send SMS reminder to the patient
-                if appt_details.get("patient_phone"):
-                    if send_sms_reminder(appt_details["patient_phone"], appt_details):
-                        at_least_one_notification_sent_successfully = True
-                else:
-                    print(f"  - No patient phone found for appointment {appt_id}.")
-
-                if at_least_one_notification_sent_successfully:
-                    notifications_attempted_for_appt_count +=1
-                    # Mark reminder as sent only if at least one notification was "successfully" processed/attempted.
-                    # In a real system with actual send status from providers, this logic might be more nuanced
-                    # (e.g., mark only if confirmed delivery, or mark per channel).
-                    try:
-                        if mark_reminder_sent(conn, appt_id): # Uses current time by default
-                            print(f"  Successfully marked reminder as sent for appointment ID {appt_id}.")
-                            successful_reminders_marked_count +=1
-                        else:
-                            # This case implies appointment_id was not found during UPDATE by mark_reminder_sent,
-                            # which should be unlikely if it was just fetched.
-                            print(f"  WARNING: Failed to mark reminder (rowcount 0) for appointment ID {appt_id}.")
-                            failed_reminders_marked_count += 1
-                    except sqlite3.Error as e_mark: # Catch specific error from mark_reminder_sent
-                        print(f"  ERROR: Database error while marking reminder for appointment ID {appt_id}: {e_mark}")
-                        failed_reminders_marked_count += 1 # Count as failed if marking in DB fails
-                else:
-                    print(f"  No contact information (email/phone) suitable for sending for appointment ID {appt_id}, "
-                          f"or both simulated sends failed.")
+                return 0
 
             # Summary logging
             print(f"\n--- Reminder Processing Summary ---")
-            print(f"  Appointments processed for potential reminders: {len(appointments_to_remind)}")
-            print(f"  Notifications attempted for (had contacts & at least one simulated send success): {notifications_attempted_for_appt_count} appointments")
+            print(f"  Appointments processed for potential reminders: {appointments_processed_count}")
+            print(f"  Notifications queued for delivery: {notifications_enqueued_count}")
             print(f"  Successfully marked as reminded in DB: {successful_reminders_marked_count}")
-            # This counts appointments where marking failed OR where no notification was even attempted due to missing contacts/send failures.
-            truly_failed_or_skipped_marking = len(appointments_to_remind) - successful_reminders_marked_count
-            print(f"  Failed to mark or skipped marking (no contacts/send fail): {truly_failed_or_skipped_marking}")
+            # This counts appointments where queueing failed OR that have no contact information.
+            truly_failed_or_skipped_marking = appointments_processed_count - successful_reminders_marked_count
+            print(f"  Failed to mark or skipped marking (no contacts/queueing failed): {truly_failed_or_skipped_marking}")
 
 
         except sqlite3.Error as e_db:
-            # Errors from get_appointments_needing_reminders or connection issues
+            # Errors from iter_appointments_needing_reminders or connection issues
             print(f"A database error occurred during the reminder job's main processing: {e_db}")
         except ValueError as ve:
-             # Catches ValueErrors from get_appointments_needing_reminders (e.g., bad date format in args)
+             # Catches ValueErrors from iter_appointments_needing_reminders (e.g., bad date format in args)
              print(f"Configuration or data error for reminder job: {ve}")
         except Exception as e_unexpected:
             # Catch any other unexpected errors to prevent the job from crashing silently
             print(f"An unexpected error occurred during the reminder job: {e_unexpected}")
         finally:
+            if prune_changes:
+                _prune_change_feed(conn)
             job_end_time = datetime.now()
-            print(f"--- Reminder Job Finished ({job_end_time.strftime('%Y-%m-%d %H:%M:%S')}, Duration: {job_end_time - job_start_time}) ---")
+            print(f"--- Reminder Job Finished ({format_datetime(job_end_time)}, Duration: {job_end_time - job_start_time}) ---")
+    return successful_reminders_marked_count
+
+def _outbox_claim_limit(lease_seconds: int = db_utils_appointment.OUTBOX_LEASE_SECONDS) -> int:
+    """
+    Returns how many notifications dispatch_outbox claims at a time: at most
+    REMINDER_MARK_BATCH_SIZE, and few enough that every channel can send them within half
+    the lease, even if every send runs into NOTIFICATION_SEND_TIMEOUT_SECONDS or the
+    channel's rate limit. A batch that outlived its lease would be claimed, and sent, again.
+    """
+    budget = lease_seconds / 2
+    limits = [REMINDER_MARK_BATCH_SIZE]
+    for channel, concurrency in CHANNEL_CONCURRENCY.items():
+        limits.append(max(1, concurrency) * int(budget // NOTIFICATION_SEND_TIMEOUT_SECONDS))
+        if CHANNEL_RATE_PER_SECOND.get(channel):
+            limits.append(int(budget * CHANNEL_RATE_PER_SECOND[channel]))
+    return max(1, min(limits))
+
+def dispatch_outbox(clock=None) -> dict:
+    """
+    Delivers the due notifications in notification_outbox.
+
+    Claims due notifications in batches small enough to send within the lease (see
+    _outbox_claim_limit), sends each batch concurrently through a NotificationDispatcher
+    (per-channel concurrency and rate limits, see notification_dispatch) and records the
+    outcomes in one transaction (see record_notification_results): failures are retried
+    with exponential backoff on a later run and dead-lettered after OUTBOX_MAX_ATTEMPTS.
+    Returns once nothing is due. Several dispatchers can run at once; each notification is
+    claimed by one of them.
+
+    Args:
+        clock: Decides what is due and when retries are; defaults to the real clock
+               (see reminder_scheduler.SystemClock).
+
+    Returns:
+        dict: Number of notifications sent, left for a retry, and dead-lettered by this run.
+    """
+    clock = clock if clock is not None else SystemClock()
+    totals = {"sent": 0, "retrying": 0, "dead": 0}
+    senders = {'email': send_email_reminder, 'sms': send_sms_reminder}
+    claim_limit = _outbox_claim_limit()
+    with get_db_connection(DB_NAME) as conn:
+        try:
+            with NotificationDispatcher(senders) as dispatcher:
+                while True:
+                    claimed = db_utils_appointment.claim_due_notifications(conn, claim_limit, now=clock.now())
+                    if not claimed:
+                        break
+                    outcomes = dispatcher.dispatch_with_errors(
+                        [(notification['channel'], notification['address'], notification['details'])
+                         for notification in claimed])
+                    counts = db_utils_appointment.record_notification_results(
+                        conn, [(notification['notification_id'], notification['attempts'], sent, error)
+                               for notification, (sent, error) in zip(claimed, outcomes)], now=clock.now())
+                    for outcome, count in counts.items():
+                        totals[outcome] += count
+        except sqlite3.Error as e_db:
+            # Claimed notifications not recorded are claimed again once their lease expires
+            print(f"A database error occurred while dispatching reminder notifications: {e_db}")
+    print(f"Notification outbox: {totals['sent']} sent, {totals['retrying']} to retry, {totals['dead']} dead-lettered.")
+    return totals
+
+def send_reminders(time_window_start_hours_ahead: int = 23,
+                   time_window_end_hours_ahead: int = 24,
+                   reminder_grace_period_hours: int = 2
+                  ):
+    """
+    Queues the reminders due in the window (enqueue_reminders), then delivers everything
+    due in the outbox (dispatch_outbox), including retries left by earlier runs.
+
+    Args:
+        See enqueue_reminders.
+    """
+    enqueue_reminders(time_window_start_hours_ahead, time_window_end_hours_ahead, reminder_grace_period_hours)
+    dispatch_outbox()
+
+def _enqueue_due_reminders(conn, schedule: ReminderSchedule, due_reminders: list) -> int:
+    """
+    Queues the reminders ReminderSchedule.pop_due returned, REMINDER_MARK_BATCH_SIZE
+    appointments per transaction. Appointments cancelled or rescheduled since they were
+    scheduled are skipped (see get_reminder_appointments).
+
+    If a batch fails, its reminders and those of every later batch are put back in
+    `schedule` (ReminderSchedule.requeue) before the error is raised, so the next cycle
+    queues them; batches already committed are not queued again.
+
+    Returns:
+        int: The number of notifications queued.
+
+    Raises:
+        sqlite3.Error: If a batch could not be read or queued.
+    """
+    by_offset = {}
+    for appointment_id, start, offset in due_reminders:
+        by_offset.setdefault(offset, []).append((appointment_id, start))
+    batches = [(offset, appointment_starts[index:index + REMINDER_MARK_BATCH_SIZE])
+               for offset, appointment_starts in by_offset.items()
+               for index in range(0, len(appointment_starts), REMINDER_MARK_BATCH_SIZE)]
+    enqueued = 0
+    for batch_index, (offset, appointment_starts) in enumerate(batches):
+        try:
+            appointments = db_utils_appointment.get_reminder_appointments(conn, appointment_starts)
+            if appointments:
+                print(f"\nQueueing {offset}-minute reminders for {len(appointments)} appointments.")
+                enqueued += _enqueue_reminder_batch(conn, appointments, offset_minutes=offset,
+                                                    raise_on_error=True)['notifications_enqueued']
+        except sqlite3.Error:
+            schedule.requeue([(appointment_id, start, pending_offset)
+                              for pending_offset, pending_starts in batches[batch_index:]
+                              for appointment_id, start in pending_starts])
+            raise
+    return enqueued
+
+def run_reminder_daemon(stop_event: threading.Event = None, schedule: ReminderSchedule = None, clock=None):
+    """
+    Sends reminders continuously, at every offset in the schedule (24 hours, 2 hours and
+    15 minutes before the start by default), instead of rescanning a window from cron.
+
+    Confirmed appointments are loaded into a ReminderSchedule a slice at a time as their
+    first reminder approaches; after that, confirmations, cancellations and reschedules
+    come from the appointment change feed (see get_appointment_changes), read from a
+    change_id cursor taken before the first load. The loop sleeps until the next reminder
+    is due, the next slice must be loaded, an outbox retry is due, or
+    REMINDER_DAEMON_POLL_SECONDS have passed, whichever comes first. Due reminders are
+    queued in the notification outbox with one idempotency key per offset, then delivered
+    with dispatch_outbox, so a restart does not send a reminder twice. Reminders whose
+    batch fails to commit go back into the schedule and are retried after
+    REMINDER_DAEMON_RETRY_SECONDS.
+
+    Args:
+        stop_event (threading.Event): Set to stop the daemon; it finishes the current cycle first.
+                                      Defaults to a new event, i.e. run until interrupted.
+        schedule (ReminderSchedule): Defaults to one configured from reminder_scheduler's settings.
+        clock: Source of the current time and of waits; defaults to the real clock
+               (reminder_scheduler.SystemClock). simulate_reminder_job.py replays a day with
+               an accelerated one.
+    """
+    stop_event = stop_event if stop_event is not None else threading.Event()
+    schedule = schedule if schedule is not None else ReminderSchedule()
+    clock = clock if clock is not None else SystemClock()
+    print(f"\n--- Starting Appointment Reminder Daemon ({format_datetime(datetime.now())}) ---")
+    print(f"Reminder offsets (minutes before start): {', '.join(map(str, schedule.offsets_minutes))}")
+    with get_db_connection(DB_NAME) as conn:
+        change_cursor = None
+        next_prune_epoch = 0
+        while not stop_event.is_set():
+            now = clock.now()
+            next_outbox_epoch = None
+            retry_epoch = None
+            try:
+                if change_cursor is None:
+                    # Taken before the first load: changes made during it are replayed, harmlessly
+                    change_cursor = db_utils_appointment.get_latest_appointment_change_id(conn)
+                load_range = schedule.next_load_range(now)
+                if load_range:
+                    for appointment_id, start in db_utils_appointment.get_confirmed_appointment_starts(conn, *load_range):
+                        schedule.schedule(appointment_id, start, now)
+                    schedule.loaded_until = load_range[1]
+                    print(f"Loaded appointments starting up to {epoch_to_datetime_string(load_range[1])}; "
+                          f"{len(schedule)} scheduled.")
+                while True:
+                    changes = db_utils_appointment.get_appointment_changes(conn, change_cursor, APPOINTMENT_CHANGE_BATCH_SIZE)
+                    for change in changes:
+                        schedule.apply_change(change['appointment_id'], change['status'],
+                                              change['appointment_start_epoch'], now)
+                    if changes:
+                        change_cursor = changes[-1]['change_id']
+                    if len(changes) < APPOINTMENT_CHANGE_BATCH_SIZE:
+                        break
+
+                due_reminders = schedule.pop_due(now)
+                if due_reminders:
+                    _enqueue_due_reminders(conn, schedule, due_reminders)
+                next_outbox_epoch = db_utils_appointment.get_next_notification_attempt_epoch(conn)
+                if next_outbox_epoch is not None and next_outbox_epoch <= now:
+                    dispatch_outbox(clock)
+                    next_outbox_epoch = db_utils_appointment.get_next_notification_attempt_epoch(conn)
+
+                if now >= next_prune_epoch:
+                    db_utils_appointment.prune_appointment_changes(conn)
+                    next_prune_epoch = now + APPOINTMENT_CHANGE_PRUNE_INTERVAL_SECONDS
+            except sqlite3.Error as e_db:
+                # Nothing is lost: the cursor and loaded range only advance past what was applied,
+                # and due reminders that were not queued were put back in the schedule
+                print(f"A database error occurred in the reminder daemon; retrying shortly: {e_db}")
+                retry_epoch = now + REMINDER_DAEMON_RETRY_SECONDS
+
+            wake_candidates = [now + REMINDER_DAEMON_POLL_SECONDS, schedule.next_wake_epoch(), next_outbox_epoch]
+            wake_epoch = min(candidate for candidate in wake_candidates if candidate is not None)
+            if retry_epoch is not None:
+                wake_epoch = max(wake_epoch, retry_epoch)
+            clock.wait(stop_event, max(0, wake_epoch - clock.now()))
+    print(f"--- Reminder Daemon Stopped ({format_datetime(datetime.now())}) ---")
+
+def run_reminder_worker(stop_event: threading.Event = None, worker_id: str = None,
+                        shard_count: int = None) -> int:
+    """
+    Runs the reminder job as one of several coordinated workers, on one host or many.
+
+    Every REMINDER_WORKER_INTERVAL_SECONDS the worker heartbeats and takes its share of
+    the provider shards (acquire_reminder_shards), queues the reminders for those shards
+    only (enqueue_reminders, which also prunes the appointment change feed every
+    APPOINTMENT_CHANGE_PRUNE_INTERVAL_SECONDS) and delivers due outbox notifications
+    (dispatch_outbox, whose claims are already safe to run concurrently). Workers therefore split the candidate
+    set instead of each reading all of it, and a worker that dies has its shards taken
+    over once its leases (REMINDER_SHARD_LEASE_SECONDS) expire. On stop the leases are
+    released at once.
+
+    Args:
+        stop_event (threading.Event): Set to stop the worker after the current cycle.
+                                      Defaults to a new event, i.e. run until interrupted.
+        worker_id (str): Unique worker name. Defaults to host:pid.
+        shard_count (int): Defaults to REMINDER_SHARD_COUNT.
+
+    Returns:
+        int: The number of appointments this worker marked as reminded.
+    """
+    stop_event = stop_event if stop_event is not None else threading.Event()
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    shard_count = shard_count or REMINDER_SHARD_COUNT
+    print(f"\n--- Starting Reminder Worker {worker_id} ({shard_count} shards) ---")
+    marked = 0
+    next_prune_epoch = 0
+    with get_db_connection(DB_NAME) as conn:
+        try:
+            while not stop_event.is_set():
+                try:
+                    shard_ids = db_utils_appointment.acquire_reminder_shards(
+                        conn, worker_id, shard_count, REMINDER_SHARD_LEASE_SECONDS)
+                except sqlite3.Error as e_db:
+                    print(f"Reminder worker {worker_id} could not renew its shard leases: {e_db}")
+                    shard_ids = []
+                if shard_ids:
+                    prune_changes = now_epoch() >= next_prune_epoch
+                    marked += enqueue_reminders(shard_ids=shard_ids, shard_count=shard_count,
+                                                prune_changes=prune_changes)
+                    if prune_changes:
+                        next_prune_epoch = now_epoch() + APPOINTMENT_CHANGE_PRUNE_INTERVAL_SECONDS
+                dispatch_outbox()
+                stop_event.wait(REMINDER_WORKER_INTERVAL_SECONDS)
+        finally:
+            try:
+                db_utils_appointment.release_reminder_shards(conn, worker_id)
+            except sqlite3.Error as e_db:
+                print(f"Reminder worker {worker_id} could not release its shards; they expire on their own: {e_db}")
+    print(f"--- Reminder Worker {worker_id} Stopped ---")
+    return marked
 
 if __name__ == '__main__':
     """
@@ -260,9 +589,11 @@ if __name__ == '__main__':
        Specifically, `users` should have `email` and `phone` fields populated for
        patients who should receive reminders. Appointments should be in 'confirmed' status
        and fall within the job's processing window.
-    4. Notification Service Integration: The placeholder functions `send_email_reminder`
-       and `send_sms_reminder` must be replaced with actual integrations with
-       email and SMS sending services (e.g., SMTP libraries, Twilio API, AWS SES/SNS).
+    4. Notification Service Integration: Set REMINDER_SMTP_HOST (and REMINDER_SMTP_PORT,
+       REMINDER_EMAIL_FROM) and REMINDER_SMS_GATEWAY_URL to actually send reminders;
+       without them `send_email_reminder` and `send_sms_reminder` only log. Concurrency and
+       rate limits per channel are set with REMINDER_{EMAIL,SMS}_CONCURRENCY and
+       REMINDER_{EMAIL,SMS}_RATE_PER_SECOND to match the providers' quotas.
 
     Example for setting up test data (run this once, or manage via an env var):
     If you set the environment variable SETUP_TEST_DATA_FOR_REMINDER_JOB=true,
@@ -309,33 +640,37 @@ if __name__ == '__main__':
                 print(f"  Test user IDs: Patient1={p1_id}, Provider1={pv1_id}, Patient2(no_email)={p2_id}, Patient3(no_phone)={p3_id}")
 
                 print("  Setting up test appointments...")
-                # Appt 1: Needs reminder (in 23.5 hours, never reminded) - Patient1 has email & phone
-                appt1_start = (datetime.now() + timedelta(hours=23.5)).strftime('%Y-%m-%d %H:%M:%S')
-                appt1_end = (datetime.now() + timedelta(hours=24)).strftime('%Y-%m-%d %H:%M:%S')
+                # Bookings must fall within availability and may not overlap (see request_appointment)
+                add_provider_availability(conn_setup, pv1_id,
+                                          (datetime.now() + timedelta(hours=23)).strftime('%Y-%m-%d %H:%M:%S'),
+                                          (datetime.now() + timedelta(hours=25)).strftime('%Y-%m-%d %H:%M:%S'))
+                # Appt 1: Needs reminder (in 23.1 hours, never reminded) - Patient1 has email & phone
+                appt1_start = (datetime.now() + timedelta(hours=23.1)).strftime('%Y-%m-%d %H:%M:%S')
+                appt1_end = (datetime.now() + timedelta(hours=23.3)).strftime('%Y-%m-%d %H:%M:%S')
                 appt1_id = request_appointment(conn_setup, p1_id, pv1_id, appt1_start, appt1_end, "Annual Physical Reminder")
                 if appt1_id: update_appointment_status(conn_setup, appt1_id, 'confirmed', pv1_id, 'provider')
 
-                # Appt 2: Needs reminder (in 23.7 hours, reminder sent long ago) - Patient2 has only phone
-                appt2_start = (datetime.now() + timedelta(hours=23.7)).strftime('%Y-%m-%d %H:%M:%S')
-                appt2_end = (datetime.now() + timedelta(hours=24.2)).strftime('%Y-%m-%d %H:%M:%S')
+                # Appt 2: Needs reminder (in 23.3 hours, reminder sent long ago) - Patient2 has only phone
+                appt2_start = (datetime.now() + timedelta(hours=23.3)).strftime('%Y-%m-%d %H:%M:%S')
+                appt2_end = (datetime.now() + timedelta(hours=23.5)).strftime('%Y-%m-%d %H:%M:%S')
                 appt2_id = request_appointment(conn_setup, p2_id, pv1_id, appt2_start, appt2_end, "Lab Follow-up Reminder")
                 if appt2_id:
                     update_appointment_status(conn_setup, appt2_id, 'confirmed', pv1_id, 'provider')
                     # Mark as reminded more than 'reminder_grace_period_hours' ago
                     mark_reminder_sent(conn_setup, appt2_id, (datetime.now() - timedelta(hours=5)).strftime('%Y-%m-%d %H:%M:%S'))
 
-                # Appt 3: Too recent reminder (in 23.6 hours, reminded 30 mins ago) - Patient3 has only email
-                appt3_start = (datetime.now() + timedelta(hours=23.6)).strftime('%Y-%m-%d %H:%M:%S')
-                appt3_end = (datetime.now() + timedelta(hours=24.1)).strftime('%Y-%m-%d %H:%M:%S')
+                # Appt 3: Too recent reminder (in 23.5 hours, reminded 30 mins ago) - Patient3 has only email
+                appt3_start = (datetime.now() + timedelta(hours=23.5)).strftime('%Y-%m-%d %H:%M:%S')
+                appt3_end = (datetime.now() + timedelta(hours=23.7)).strftime('%Y-%m-%d %H:%M:%S')
                 appt3_id = request_appointment(conn_setup, p3_id, pv1_id, appt3_start, appt3_end, "Prescription Check Reminder")
                 if appt3_id:
                     update_appointment_status(conn_setup, appt3_id, 'confirmed', pv1_id, 'provider')
                     # Mark as reminded very recently
                     mark_reminder_sent(conn_setup, appt3_id, (datetime.now() - timedelta(minutes=30)).strftime('%Y-%m-%d %H:%M:%S'))
 
-                # Appt 4: Not confirmed (in 23.8 hours) - Patient1
-                appt4_start = (datetime.now() + timedelta(hours=23.8)).strftime('%Y-%m-%d %H:%M:%S')
-                appt4_end = (datetime.now() + timedelta(hours=24.3)).strftime('%Y-%m-%d %H:%M:%S')
+                # Appt 4: Not confirmed (in 23.7 hours) - Patient1
+                appt4_start = (datetime.now() + timedelta(hours=23.7)).strftime('%Y-%m-%d %H:%M:%S')
+                appt4_end = (datetime.now() + timedelta(hours=23.9)).strftime('%Y-%m-%d %H:%M:%S')
                 request_appointment(conn_setup, p1_id, pv1_id, appt4_start, appt4_end, "Pending Consultation") # Remains pending
 
                 print(f"  Test appointments created/updated: Appt1_ID={appt1_id}, Appt2_ID={appt2_id}, Appt3_ID={appt3_id}, Appt4(pending)")
@@ -345,9 +680,24 @@ if __name__ == '__main__':
 
     # Default run: Send reminders for appointments that are approximately 24 hours away.
     # This means appointments starting between 23 and 24 hours (exclusive of 24) from the current time.
-    send_reminders(time_window_start_hours_ahead=23,
-                   time_window_end_hours_ahead=24,
-                   reminder_grace_period_hours=2) # Don't resend if reminded in last 2 hours.
+    # REMINDER_JOB_MODE=enqueue or =dispatch runs only one half, e.g. to schedule
+    # dispatchers separately from (and more often than) the enqueueing job.
+    # REMINDER_JOB_MODE=daemon runs run_reminder_daemon, and =worker one of several sharded
+    # run_reminder_worker processes, until SIGTERM or Ctrl+C, in place of cron.
+    job_mode = os.getenv('REMINDER_JOB_MODE', 'all')
+    if job_mode in ('daemon', 'worker'):
+        stop_requested = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop_requested.set())
+        try:
+            (run_reminder_daemon if job_mode == 'daemon' else run_reminder_worker)(stop_requested)
+        except KeyboardInterrupt:
+            print(f"Reminder {job_mode} interrupted.")
+    if job_mode in ('all', 'enqueue'):
+        enqueue_reminders(time_window_start_hours_ahead=23,
+                          time_window_end_hours_ahead=24,
+                          reminder_grace_period_hours=2) # Don't resend if reminded in last 2 hours.
+    if job_mode in ('all', 'dispatch'):
+        dispatch_outbox()
 
     # Example for a more immediate reminder window (e.g., for appointments starting in next hour)
     # print("\nRunning for 1-hour window (0-1 hours ahead), 0 grace period (send even if reminded recently):")
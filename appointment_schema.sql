@@ -21,7 +21,8 @@ CREATE TABLE provider_availability (
 );
 
 -- Indexes for provider_availability table
-CREATE INDEX idx_pa_provider_id ON provider_availability(provider_id);
+-- Provider lookups filter on provider_id and sort by start time (see index_advisor.py)
+CREATE INDEX idx_pa_provider_start ON provider_availability(provider_id, start_datetime);
 CREATE INDEX idx_pa_start_datetime ON provider_availability(start_datetime);
 CREATE INDEX idx_pa_end_datetime ON provider_availability(end_datetime);
 
@@ -58,21 +59,116 @@ CREATE TABLE appointments (
     CONSTRAINT fk_appointments_provider
         FOREIGN KEY (provider_id) REFERENCES users(user_id) ON DELETE CASCADE,
     CONSTRAINT chk_start_end_appointment CHECK (appointment_end_time > appointment_start_time)
-    -- Consider adding a UNIQUE constraint if a provider cannot have overlapping confirmed appointments:
-    -- CONSTRAINT uq_provider_time_confirmed UNIQUE (provider_id, appointment_start_time, status) WHERE status = 'confirmed'
-    -- The exact syntax for partial unique constraints can vary by SQL dialect.
-    -- For MySQL, you might need a more complex solution or handle this at the application layer or with triggers.
+    -- A provider's pending/confirmed/rescheduling appointments may not overlap. A UNIQUE constraint
+    -- cannot express interval overlap, so the SQLite build enforces it with BEFORE INSERT/UPDATE
+    -- triggers (APPOINTMENT_OVERLAP_TRIGGERS in db_utils_appointment.py). Appointments are capped
+    -- at 24 hours, so the trigger finds overlaps with one range seek on idx_appt_provider_start:
+    --   provider_id = NEW.provider_id
+    --   AND appointment_start_time >= NEW.appointment_start_time - INTERVAL 24 HOUR
+    --   AND appointment_start_time < NEW.appointment_end_time
+    --   AND appointment_end_time > NEW.appointment_start_time
+    -- A MySQL port would use the same predicate in a trigger that SIGNALs SQLSTATE '45000'.
 );
 
 -- Indexes for appointments table
-CREATE INDEX idx_appt_patient_id ON appointments(patient_id);
-CREATE INDEX idx_appt_provider_id ON appointments(provider_id);
+-- A user's appointment list filters on patient_id/provider_id and sorts by start time, so
+-- (owner, start) serves filter, date range and ORDER BY without a filesort (see index_advisor.py)
+CREATE INDEX idx_appt_patient_start ON appointments(patient_id, appointment_start_time);
+CREATE INDEX idx_appt_provider_start ON appointments(provider_id, appointment_start_time);
+-- Date filters are written as half-open ranges (appointment_start_time >= 'day 00:00:00' AND
+-- appointment_start_time < 'next day 00:00:00') rather than DATE(appointment_start_time), so this
+-- index is usable. (The SQLite build keys these filters on generated integer epoch columns instead.)
 CREATE INDEX idx_appt_start_time ON appointments(appointment_start_time);
-CREATE INDEX idx_appt_status ON appointments(status);
+-- Reminder scan: status = 'confirmed' AND appointment_start_time in a window
+CREATE INDEX idx_appt_status_start ON appointments(status, appointment_start_time);
 CREATE INDEX idx_appt_video_room_name ON appointments(video_room_name); -- If frequently queried
 CREATE INDEX idx_appt_created_at ON appointments(created_at);
 CREATE INDEX idx_appt_updated_at ON appointments(updated_at);
 
+-- Table definition for appointment_holds: short-lived reservations a patient places
+-- before requesting an appointment. Rows past expires_at are ignored and purged lazily.
+CREATE TABLE appointment_holds (
+    hold_id VARCHAR(64) PRIMARY KEY, -- Random token returned to the patient
+    provider_id INT NOT NULL,
+    patient_id INT NOT NULL,
+    hold_start_time DATETIME NOT NULL,
+    hold_end_time DATETIME NOT NULL,
+    expires_at DATETIME NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT fk_holds_provider
+        FOREIGN KEY (provider_id) REFERENCES users(user_id) ON DELETE CASCADE,
+    CONSTRAINT fk_holds_patient
+        FOREIGN KEY (patient_id) REFERENCES users(user_id) ON DELETE CASCADE,
+    CONSTRAINT chk_start_end_hold CHECK (hold_end_time > hold_start_time)
+);
+
+CREATE INDEX idx_holds_provider_start ON appointment_holds(provider_id, hold_start_time);
+CREATE INDEX idx_holds_patient_id ON appointment_holds(patient_id);
+CREATE INDEX idx_holds_expires_at ON appointment_holds(expires_at);
+
+-- Table definition for provider_day_bitmaps: derived free/busy bitmaps, one row per provider
+-- and day, 288 bits each (one per 5-minute cell). Maintained by the application on every
+-- availability and appointment change; rows can be deleted at any time and are rebuilt on use.
+CREATE TABLE provider_day_bitmaps (
+    provider_id INT NOT NULL,
+    day_start DATETIME NOT NULL, -- Midnight starting the day
+    available_bits BINARY(36) NOT NULL, -- Cells entirely inside availability
+    busy_bits BINARY(36) NOT NULL, -- Cells overlapping a blocking appointment
+    PRIMARY KEY (provider_id, day_start),
+    CONSTRAINT fk_day_bitmaps_provider
+        FOREIGN KEY (provider_id) REFERENCES users(user_id) ON DELETE CASCADE
+);
+
+-- Table definition for notification_outbox: reminder notifications waiting to be delivered.
+-- The reminder job inserts rows in the same transaction that marks the appointments as
+-- reminded; a dispatcher claims due rows, sends them and records the outcome, retrying
+-- failures with exponential backoff until they are sent or dead-lettered.
+CREATE TABLE notification_outbox (
+    notification_id INT PRIMARY KEY AUTO_INCREMENT,
+    idempotency_key VARCHAR(255) NOT NULL UNIQUE, -- One row per appointment, channel and start time (and reminder offset, for the daemon); also sent to the provider
+    appointment_id INT NOT NULL,
+    channel VARCHAR(10) NOT NULL, -- 'email' or 'sms'
+    address VARCHAR(255) NOT NULL, -- Email address or phone number
+    payload TEXT NOT NULL, -- JSON appointment details used to render the message
+    status VARCHAR(10) NOT NULL DEFAULT 'pending', -- 'pending', 'sending', 'sent' or 'dead'
+    attempts INT NOT NULL DEFAULT 0,
+    next_attempt_at DATETIME NOT NULL, -- When pending: next try. When sending: lease expiry.
+    last_error TEXT NULL,
+    sent_at DATETIME NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT fk_outbox_appointment
+        FOREIGN KEY (appointment_id) REFERENCES appointments(appointment_id) ON DELETE CASCADE
+);
+CREATE INDEX idx_outbox_due ON notification_outbox(status, next_attempt_at);
+CREATE INDEX idx_outbox_appointment_id ON notification_outbox(appointment_id);
+
+-- Table definition for appointment_changes: a change feed of appointment inserts, status
+-- changes, reschedules and deletes, written by AFTER INSERT/UPDATE/DELETE triggers on
+-- appointments (APPOINTMENT_CHANGE_FEED_TRIGGERS in db_utils_appointment.py). The reminder
+-- daemon reads the rows after the last change_id it applied instead of rescanning
+-- appointments. Rows older than the retention period are pruned.
+CREATE TABLE appointment_changes (
+    change_id BIGINT PRIMARY KEY AUTO_INCREMENT,
+    appointment_id INT NOT NULL, -- No foreign key: the change outlives a deleted appointment
+    status VARCHAR(50) NOT NULL, -- Status after the change; 'deleted' when the row was deleted
+    appointment_start_time DATETIME NOT NULL, -- Start after the change
+    changed_at DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL
+);
+CREATE INDEX idx_appt_changes_changed_at ON appointment_changes(changed_at);
+
+-- Table definitions for sharded reminder workers: each worker heartbeats in reminder_workers
+-- and holds leases on shards of the reminder candidates (appointments whose
+-- provider_id % shard count equals shard_id). Expired leases are taken over by live workers.
+CREATE TABLE reminder_workers (
+    worker_id VARCHAR(255) PRIMARY KEY, -- host:pid
+    last_heartbeat_at DATETIME NOT NULL
+);
+CREATE TABLE reminder_shard_leases (
+    shard_id INT PRIMARY KEY,
+    worker_id VARCHAR(255) NULL, -- NULL when released
+    lease_expires_at DATETIME NOT NULL
+);
+
 -- Possible statuses for appointments.status:
 -- 'pending_provider_confirmation': Patient requested, provider needs to confirm.
 -- 'confirmed': Provider confirmed.
@@ -0,0 +1,78 @@
+from time_utils import SECONDS_PER_DAY
+
+# --- Daily Free/Busy Bitmaps ---
+# A provider's day is split into 288 five-minute cells. Two bitmaps per (provider, day)
+# answer free/busy questions with a few bitwise operations instead of range scans:
+#   available: cell lies entirely inside the provider's availability (recurring blocks expanded)
+#   busy:      cell overlaps a blocking appointment
+# Bit i is cell i of the day (bit 0 = 00:00-00:05). A time range is free when every cell
+# it touches is available and not busy, which is exact for 5-minute aligned times and
+# conservative (may answer "busy") for times that split a cell. Bitmaps are stored as
+# 36-byte BLOBs in provider_day_bitmaps (see db_utils_appointment); all times are epoch
+# seconds (see time_utils).
+CELL_SECONDS = 300
+CELLS_PER_DAY = SECONDS_PER_DAY // CELL_SECONDS
+BITMAP_BYTES = CELLS_PER_DAY // 8
+FULL_DAY = (1 << CELLS_PER_DAY) - 1
+
+
+def day_start(epoch: int) -> int:
+    """Returns the midnight starting the day that contains `epoch`."""
+    return epoch - epoch % SECONDS_PER_DAY
+
+
+def days_spanned(start: int, end: int) -> range:
+    """Returns the midnights of the days that [start, end) overlaps."""
+    return range(day_start(start), end, SECONDS_PER_DAY) if end > start else range(0)
+
+
+def _cell_bits(first: int, last: int) -> int:
+    """Bits for cells first..last-1, clamped to the day."""
+    first, last = max(first, 0), min(last, CELLS_PER_DAY)
+    return ((1 << (last - first)) - 1) << first if last > first else 0
+
+
+def touched_cells(intervals, day: int) -> int:
+    """Bitmap of the day's cells that overlap any of the (start, end) intervals."""
+    bits = 0
+    for start, end in intervals:
+        bits |= _cell_bits((start - day) // CELL_SECONDS, -(-(end - day) // CELL_SECONDS))
+    return bits
+
+
+def covered_cells(merged_intervals, day: int) -> int:
+    """
+    Bitmap of the day's cells that lie entirely inside one of the intervals.
+
+    The intervals must be merged (see slot_engine.merge_intervals), so that a cell
+    covered by two adjoining intervals counts as covered.
+    """
+    bits = 0
+    for start, end in merged_intervals:
+        bits |= _cell_bits(-(-(start - day) // CELL_SECONDS), (end - day) // CELL_SECONDS)
+    return bits
+
+
+def to_blob(bits: int) -> bytes:
+    return bits.to_bytes(BITMAP_BYTES, 'little')
+
+
+def from_blob(blob: bytes) -> int:
+    return int.from_bytes(blob, 'little')
+
+
+def is_range_free(bitmaps: dict, start: int, end: int) -> bool:
+    """
+    Checks that every cell [start, end) touches is available and not busy.
+
+    Args:
+        bitmaps (dict): day midnight -> (available bits, busy bits) for every day the range spans.
+        start (int): Range start (epoch seconds).
+        end (int): Range end, exclusive (epoch seconds).
+    """
+    for day in days_spanned(start, end):
+        available, busy = bitmaps[day]
+        needed = touched_cells([(start, end)], day)
+        if available & ~busy & needed != needed:
+            return False
+    return True
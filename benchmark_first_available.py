@@ -0,0 +1,147 @@
+"""
+Benchmark for GET /api/providers/first-available.
+
+Every provider gets recurring weekday availability (09:00-17:00) and a random share
+of its 30-minute slots over the search window is booked. The earliest free slots
+across all providers are then found two ways:
+
+  * per provider: get_bookable_slots for each provider, then a sort of the combined
+    slots (what a client calling GET /api/providers/<id>/slots per provider does,
+    minus the HTTP round trips), and
+  * find_first_available_slots: one query per table for all providers and a lazy
+    heap merge that stops after `limit` slots.
+
+Usage:
+    python benchmark_first_available.py [--providers 500] [--days 30] [--booked 0.6] [--runs 20]
+
+Each run uses a fresh scratch database file which is removed afterwards.
+"""
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from db_connection_pool import close_pool
+from db_utils_appointment import (
+    get_db_connection,
+    initialize_appointment_schema,
+    get_bookable_slots,
+    find_first_available_slots
+)
+from time_utils import format_datetime
+
+BENCHMARK_DB_NAME = 'benchmark_first_available.db'
+PATIENT_COUNT = 1000
+SLOT_MINUTES = 30
+LIMIT = 10
+
+
+def _remove_database():
+    close_pool(BENCHMARK_DB_NAME)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(BENCHMARK_DB_NAME + suffix):
+            os.remove(BENCHMARK_DB_NAME + suffix)
+
+
+def _create_database(provider_count: int, days: int, booked_share: float, first_day: datetime,
+                     rng: random.Random) -> tuple[list[int], int]:
+    """
+    Creates providers with weekday availability and books a share of their slots.
+
+    Returns:
+        tuple: (provider IDs, number of appointments booked).
+    """
+    _remove_database()
+    conn = get_db_connection(BENCHMARK_DB_NAME)
+    try:
+        initialize_appointment_schema(conn)
+        conn.executemany("INSERT INTO users (username) VALUES (?)",
+                         [(f'bench_user_{i}',) for i in range(provider_count + PATIENT_COUNT)])
+        user_ids = [row[0] for row in conn.execute("SELECT user_id FROM users ORDER BY user_id")]
+        providers, patients = user_ids[:provider_count], user_ids[provider_count:]
+
+        first_block = first_day.replace(hour=9)
+        conn.executemany(
+            "INSERT INTO provider_availability (provider_id, start_datetime, end_datetime, recurring_rule) "
+            "VALUES (?, ?, ?, ?)",
+            [(provider, format_datetime(first_block), format_datetime(first_block + timedelta(hours=8)),
+              "FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR") for provider in providers])
+
+        appointments = []
+        for provider in providers:
+            for day in range(days):
+                date = first_block + timedelta(days=day)
+                if date.weekday() >= 5:
+                    continue
+                for slot in range(8 * 60 // SLOT_MINUTES):
+                    if rng.random() < booked_share:
+                        start = date + timedelta(minutes=SLOT_MINUTES * slot)
+                        appointments.append((rng.choice(patients), provider, format_datetime(start),
+                                             format_datetime(start + timedelta(minutes=SLOT_MINUTES)), 'confirmed'))
+        conn.executemany("""INSERT INTO appointments (patient_id, provider_id, appointment_start_time,
+                            appointment_end_time, status) VALUES (?, ?, ?, ?, ?)""", appointments)
+        conn.commit()
+        return providers, len(appointments)
+    finally:
+        conn.close()
+
+
+def _time(function, runs: int) -> dict:
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = function()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {"p50_ms": timings[len(timings) // 2], "max_ms": timings[-1], "result": result}
+
+
+def time_searches(providers: list[int], window: tuple[str, str], runs: int) -> dict:
+    """
+    Times both ways of finding the LIMIT earliest slots and checks that they agree.
+
+    Returns:
+        dict: {'per_provider': {...}, 'batched': {...}}, each with 'p50_ms' and 'max_ms'.
+    """
+    conn = get_db_connection(BENCHMARK_DB_NAME)
+    try:
+        def per_provider():
+            slots = []
+            for provider in providers:
+                slots.extend((slot['start_time'], provider, slot['end_time'])
+                             for slot in get_bookable_slots(conn, provider, *window, SLOT_MINUTES))
+            slots.sort()
+            return [(provider, start, end) for start, provider, end in slots[:LIMIT]]
+
+        def batched():
+            return [(slot['provider_id'], slot['start_time'], slot['end_time'])
+                    for slot in find_first_available_slots(conn, providers, *window, SLOT_MINUTES, LIMIT)]
+
+        results = {"per_provider": _time(per_provider, runs), "batched": _time(batched, runs)}
+    finally:
+        conn.close()
+    if results["per_provider"].pop("result") != results["batched"].pop("result"):
+        raise AssertionError("The two searches returned different slots.")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the multi-provider first-available search.")
+    parser.add_argument('--providers', type=int, default=500, help="Providers searched.")
+    parser.add_argument('--days', type=int, default=30, help="Length of the search window in days.")
+    parser.add_argument('--booked', type=float, default=0.6, help="Share of each provider's slots already booked.")
+    parser.add_argument('--runs', type=int, default=20, help="Timed searches per method.")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    first_day = (datetime.now() + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    window = (format_datetime(first_day), format_datetime(first_day + timedelta(days=args.days)))
+    try:
+        providers, booked = _create_database(args.providers, args.days, args.booked, first_day, rng)
+        print(f"{len(providers)} providers x {args.days} days, {booked} appointments booked")
+        results = time_searches(providers, window, args.runs)
+        for name, label in (("per_provider", "per-provider slots + sort"), ("batched", "find_first_available_slots")):
+            print(f"{label:>27}: p50 {results[name]['p50_ms']:8.2f} ms, max {results[name]['max_ms']:8.2f} ms")
+    finally:
+        _remove_database()
@@ -0,0 +1,146 @@
+"""
+Benchmark for GET /api/messages/search.
+
+A fixed cohort of users is given a fixed message history up front; the messages
+table is then grown in steps with traffic between other users, and at each size
+`search_messages` is timed for cohort users. Because the FTS5 index is scoped by
+a per-user token, a search only ranks postings that match both the user and the
+query words, so latency should stay roughly flat as the table grows.
+
+Usage:
+    python benchmark_message_search.py [--steps 10000,100000,1000000] [--queries 200]
+
+Each run uses a fresh scratch database file which is removed afterwards.
+"""
+import argparse
+import os
+import random
+import time
+
+from db_connection_pool import close_pool
+from db_utils_messaging import get_db_connection, initialize_schema, search_messages
+
+BENCHMARK_DB_NAME = 'benchmark_message_search.db'
+USER_COUNT = 1000
+COHORT_SIZE = 50               # Users 1..COHORT_SIZE are searched; their history does not grow
+COHORT_MESSAGES_PER_USER = 200
+WORDS = ('lab', 'result', 'appointment', 'prescription', 'refill', 'blood', 'pressure', 'follow', 'up',
+         'doctor', 'visit', 'dose', 'allergy', 'insurance', 'referral', 'scan', 'report', 'thanks', 'please',
+         'tomorrow', 'morning', 'clinic', 'symptoms', 'pain', 'fever', 'test', 'normal', 'schedule')
+QUERIES = ('lab result', 'refill', 'blood pressure', 'appoint*', 'fever symptoms', 'referral scan')
+
+
+def _remove_database():
+    close_pool(BENCHMARK_DB_NAME)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(BENCHMARK_DB_NAME + suffix):
+            os.remove(BENCHMARK_DB_NAME + suffix)
+
+
+def _random_content(rng: random.Random) -> str:
+    return ' '.join(rng.choices(WORDS, k=rng.randint(4, 16)))
+
+
+def _create_conversations(conn, user_range: range, per_user: int, rng: random.Random) -> dict:
+    """Creates about `per_user` conversations for each user in `user_range`. Returns {conversation_id: participants}."""
+    pairs = {tuple(sorted(rng.sample(user_range, 2))) for _ in range(len(user_range) * per_user // 2)}
+    cursor = conn.cursor()
+    conversations = {}
+    for pair in sorted(pairs):
+        cursor.execute("INSERT INTO conversations (participant1_id, participant2_id) VALUES (?, ?)", pair)
+        conversations[cursor.lastrowid] = pair
+    return conversations
+
+
+def _insert_messages(conn, conversations: dict, count: int, rng: random.Random):
+    conversation_ids = list(conversations)
+    remaining = count
+    while remaining > 0:
+        batch = min(10000, remaining)
+        rows = []
+        for _ in range(batch):
+            conversation_id = rng.choice(conversation_ids)
+            rows.append((conversation_id, rng.choice(conversations[conversation_id]), _random_content(rng)))
+        conn.executemany("INSERT INTO messages (conversation_id, sender_id, content) VALUES (?, ?, ?)", rows)
+        conn.commit()
+        remaining -= batch
+
+
+def _create_database(rng: random.Random) -> dict:
+    """
+    Creates the schema, USER_COUNT users and the cohort's fixed history.
+
+    Returns:
+        dict: {conversation_id: participants} for the background (non-cohort) conversations.
+    """
+    _remove_database()
+    conn = get_db_connection(BENCHMARK_DB_NAME)
+    try:
+        initialize_schema(conn)
+        conn.executemany("INSERT INTO users (username) VALUES (?)", [(f'bench_user_{i}',) for i in range(USER_COUNT)])
+        cohort = _create_conversations(conn, range(1, COHORT_SIZE + 1), 5, rng)
+        background = _create_conversations(conn, range(COHORT_SIZE + 1, USER_COUNT + 1), 10, rng)
+        conn.commit()
+        # Each cohort message lands in two cohort users' histories.
+        _insert_messages(conn, cohort, COHORT_SIZE * COHORT_MESSAGES_PER_USER // 2, rng)
+        return background
+    finally:
+        conn.close()
+
+
+def _grow_to(target_rows: int, background: dict, rng: random.Random) -> float:
+    """Inserts background messages until the table holds `target_rows`. Returns the seconds spent."""
+    conn = get_db_connection(BENCHMARK_DB_NAME)
+    try:
+        current = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        started = time.perf_counter()
+        if target_rows > current:
+            _insert_messages(conn, background, target_rows - current, rng)
+        return time.perf_counter() - started
+    finally:
+        conn.close()
+
+
+def time_searches(query_count: int, rng: random.Random) -> dict:
+    """
+    Runs `query_count` searches for random cohort users and queries.
+
+    Returns:
+        dict: {'p50_ms': float, 'p95_ms': float, 'max_ms': float}
+    """
+    conn = get_db_connection(BENCHMARK_DB_NAME)
+    try:
+        timings = []
+        for _ in range(query_count):
+            user_id = rng.randint(1, COHORT_SIZE)
+            started = time.perf_counter()
+            search_messages(conn, user_id, rng.choice(QUERIES))
+            timings.append((time.perf_counter() - started) * 1000)
+    finally:
+        conn.close()
+    timings.sort()
+    return {
+        "p50_ms": timings[len(timings) // 2],
+        "p95_ms": timings[int(len(timings) * 0.95)],
+        "max_ms": timings[-1],
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark message search latency as the table grows.")
+    parser.add_argument('--steps', default='10000,100000,1000000',
+                        help="Comma-separated table sizes at which to measure search latency.")
+    parser.add_argument('--queries', type=int, default=200, help="Searches timed at each step.")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    try:
+        background = _create_database(rng)
+        print(f"{USER_COUNT} users; searching {COHORT_SIZE} users with ~{COHORT_MESSAGES_PER_USER} messages each")
+        for step in (int(value) for value in args.steps.split(',')):
+            load_seconds = _grow_to(step, background, rng)
+            result = time_searches(args.queries, rng)
+            print(f"{step:>10d} messages (loaded in {load_seconds:6.1f}s): search p50 {result['p50_ms']:7.2f} ms, "
+                  f"p95 {result['p95_ms']:7.2f} ms, max {result['max_ms']:7.2f} ms")
+    finally:
+        _remove_database()
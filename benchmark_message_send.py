@@ -0,0 +1,174 @@
+"""
+Benchmark for the POST /api/messages write path.
+
+Compares the legacy multi-commit sequence (`find_or_create_conversation` followed by
+`create_message`) with the single-transaction `send_direct_message` and with the
+group-commit `MessageWriteQueue`, under a number of concurrent sender threads, and
+reports messages/sec for each.
+
+Usage:
+    python benchmark_message_send.py [--senders 8] [--messages 500] [--synchronous NORMAL|FULL]
+
+Each run uses a fresh scratch database file which is removed afterwards.
+"""
+import argparse
+import os
+import threading
+import time
+
+from db_connection_pool import close_pool, POOL_MAX_SIZE
+from db_utils_messaging import (
+    get_db_connection,
+    initialize_schema,
+    find_or_create_conversation,
+    create_message,
+    send_direct_message,
+    MessageWriteQueue
+)
+
+BENCHMARK_DB_NAME = 'benchmark_message_send.db'
+
+
+def _checked_out(send):
+    """
+    Wraps a connection-based send so each call checks a connection out of the pool
+    and returns it, like one API request does.
+    """
+    def send_with_connection(sender_id, receiver_id, content):
+        conn = get_db_connection(BENCHMARK_DB_NAME)
+        try:
+            return send(conn, sender_id, receiver_id, content)
+        finally:
+            conn.close()
+    return send_with_connection
+
+
+def _legacy_send(conn, sender_id, receiver_id, content):
+    """The pre-existing send sequence: up to three commits per message."""
+    conversation_id = find_or_create_conversation(conn, sender_id, receiver_id)
+    return conversation_id, create_message(conn, conversation_id, sender_id, content)
+
+
+class _QueuedSend:
+    """Sends through a MessageWriteQueue and blocks until the message is durable."""
+
+    def __init__(self):
+        self.write_queue = None
+
+    def start(self):
+        """Starts a fresh queue for the current benchmark database."""
+        self.write_queue = MessageWriteQueue(BENCHMARK_DB_NAME)
+
+    def __call__(self, sender_id, receiver_id, content):
+        return self.write_queue.submit(sender_id, receiver_id, content).result()
+
+
+def _apply_synchronous(mode: str):
+    """Opens every pooled connection up front and sets its synchronous mode."""
+    connections = [get_db_connection(BENCHMARK_DB_NAME) for _ in range(POOL_MAX_SIZE)]
+    for conn in connections:
+        conn.execute(f"PRAGMA synchronous = {mode}")
+        conn.close()
+
+
+def _reset_database(user_count: int):
+    """Creates a fresh benchmark database with `user_count` users."""
+    close_pool(BENCHMARK_DB_NAME)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(BENCHMARK_DB_NAME + suffix):
+            os.remove(BENCHMARK_DB_NAME + suffix)
+    conn = get_db_connection(BENCHMARK_DB_NAME)
+    try:
+        initialize_schema(conn)
+        conn.executemany("INSERT INTO users (username) VALUES (?)",
+                         [(f'bench_user_{i}',) for i in range(user_count)])
+        conn.commit()
+        return [row['user_id'] for row in conn.execute("SELECT user_id FROM users ORDER BY user_id")]
+    finally:
+        conn.close()
+
+
+def run_benchmark(send_function, senders: int, messages_per_sender: int, synchronous: str, on_reset=None) -> dict:
+    """
+    Runs one benchmark pass with `senders` threads each sending `messages_per_sender` messages.
+
+    `send_function(sender_id, receiver_id, content)` performs one send; `on_reset`,
+    if given, is called after the fresh database has been created.
+
+    Each sender alternates between a private recipient and one recipient shared by
+    all senders, so conversations are both created and reused during the run and
+    the shared recipient's inbox rows see concurrent updates.
+
+    Returns:
+        dict: {'messages': int, 'seconds': float, 'messages_per_second': float, 'errors': int}
+    """
+    user_ids = _reset_database(senders * 2 + 1)
+    _apply_synchronous(synchronous)
+    if on_reset:
+        on_reset()
+    errors = []
+    start_barrier = threading.Barrier(senders + 1)
+
+    def sender(index: int):
+        sender_id = user_ids[index]
+        recipients = (user_ids[senders + index], user_ids[-1])
+        start_barrier.wait()
+        for i in range(messages_per_sender):
+            try:
+                send_function(sender_id, recipients[i % 2], f'Benchmark message {i} from {sender_id}')
+            except Exception as e: # Count lock/pool timeouts etc. instead of aborting the run
+                errors.append(e)
+
+    threads = [threading.Thread(target=sender, args=(i,)) for i in range(senders)]
+    for thread in threads:
+        thread.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    sent = senders * messages_per_sender - len(errors)
+    close_pool(BENCHMARK_DB_NAME)
+    return {
+        "messages": sent,
+        "seconds": elapsed,
+        "messages_per_second": sent / elapsed if elapsed else 0.0,
+        "errors": len(errors),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the messaging send path.")
+    parser.add_argument('--senders', type=int, default=8, help="Number of concurrent sender threads.")
+    parser.add_argument('--messages', type=int, default=500, help="Messages sent by each sender.")
+    parser.add_argument('--synchronous', choices=['NORMAL', 'FULL'], default='NORMAL',
+                        help="SQLite synchronous mode; FULL makes every commit an fsync. "
+                             "The write queue always commits its batches with FULL.")
+    args = parser.parse_args()
+
+    print(f"Senders: {args.senders}, messages per sender: {args.messages}, synchronous={args.synchronous}")
+    try:
+        queued_send = _QueuedSend()
+        results = {}
+        for label, send_function, on_reset in (
+                ("legacy (find_or_create + create_message)", _checked_out(_legacy_send), None),
+                ("single transaction (send_direct_message)", _checked_out(send_direct_message), None),
+                ("group commit (MessageWriteQueue)", queued_send, queued_send.start)):
+            results[label] = result = run_benchmark(send_function, args.senders, args.messages,
+                                                    args.synchronous, on_reset)
+            print(f"{label:45s} {result['messages_per_second']:10.1f} msg/s "
+                  f"({result['messages']} messages in {result['seconds']:.2f}s, {result['errors']} errors)")
+        queued_send.write_queue.close()
+        queue_metrics = queued_send.write_queue.metrics()
+        print(f"Write queue: {queue_metrics['batches_committed']} batches, "
+              f"avg batch size {queue_metrics['avg_batch_size']:.1f}, max queue depth {queue_metrics['max_queue_depth']}")
+        legacy_rate = results["legacy (find_or_create + create_message)"]['messages_per_second']
+        if legacy_rate:
+            for label, result in list(results.items())[1:]:
+                print(f"Speedup vs legacy, {label}: {result['messages_per_second'] / legacy_rate:.2f}x")
+    finally:
+        close_pool(BENCHMARK_DB_NAME)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(BENCHMARK_DB_NAME + suffix):
+                os.remove(BENCHMARK_DB_NAME + suffix)
@@ -0,0 +1,129 @@
+"""
+Benchmark for bulk prescription creation.
+
+Creates the same renewal workload (`--prescriptions` prescriptions of `--medications`
+medications each, for one provider and many patients) through the API twice over:
+
+  * single: one POST /api/prescriptions per prescription (create_prescription: one
+    transaction per prescription, medications inserted row by row), and
+  * batch: POST /api/prescriptions/batch with each of the `--batch-sizes`
+    (create_prescriptions_batch: one transaction and two executemany calls per request).
+
+Requests go through the Flask test client, so the numbers include request parsing,
+validation and JSON responses but no network. The API's logging is discarded, and the
+prescription tables are emptied between runs. Throughput is reported in prescriptions/s.
+
+Usage:
+    python benchmark_prescription_batch.py [--prescriptions 2000] [--medications 3] [--batch-sizes 10,50,200]
+
+Each run uses a fresh scratch database file which is removed afterwards.
+"""
+import argparse
+import contextlib
+import io
+import os
+import time
+
+import prescription_api
+from db_connection_pool import close_pool
+from db_utils_prescription import get_db_connection, initialize_prescription_schema
+
+BENCHMARK_DB_NAME = 'benchmark_prescription_batch.db'
+PATIENT_COUNT = 500
+
+
+def _remove_database():
+    close_pool(BENCHMARK_DB_NAME)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(BENCHMARK_DB_NAME + suffix):
+            os.remove(BENCHMARK_DB_NAME + suffix)
+
+
+def _create_database() -> tuple[int, list[int]]:
+    """Creates the schema, one provider and PATIENT_COUNT patients; returns (provider_id, patient_ids)."""
+    _remove_database()
+    conn = get_db_connection(BENCHMARK_DB_NAME)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            initialize_prescription_schema(conn)
+        conn.executemany("INSERT INTO users (username) VALUES (?)",
+                         [(f'bench_user_{i}',) for i in range(PATIENT_COUNT + 1)])
+        conn.commit()
+        user_ids = [row[0] for row in conn.execute("SELECT user_id FROM users ORDER BY user_id")]
+    finally:
+        conn.close()
+    return user_ids[0], user_ids[1:]
+
+
+def _renewals(count: int, medication_count: int, patient_ids: list[int]) -> list[dict]:
+    return [{
+        "patient_id": patient_ids[i % len(patient_ids)],
+        "issue_date": "2024-07-01",
+        "notes_for_patient": "Chronic-care renewal.",
+        "medications": [{"medication_name": f"Renewal Med {m}", "dosage": "1 tablet", "frequency": "Once daily",
+                         "quantity": "30 tablets", "refills_available": 2} for m in range(medication_count)],
+    } for i in range(count)]
+
+
+def _reset_tables():
+    conn = get_db_connection(BENCHMARK_DB_NAME)
+    try:
+        conn.execute("DELETE FROM prescription_medications")
+        conn.execute("DELETE FROM prescriptions")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _count_created() -> tuple[int, int]:
+    conn = get_db_connection(BENCHMARK_DB_NAME)
+    try:
+        return tuple(conn.execute(
+            "SELECT (SELECT COUNT(*) FROM prescriptions), (SELECT COUNT(*) FROM prescription_medications)").fetchone())
+    finally:
+        conn.close()
+
+
+def _run(client, provider_id: int, renewals: list[dict], batch_size: int = None) -> float:
+    """Creates `renewals` one request each (batch_size None) or in batches; returns elapsed seconds."""
+    _reset_tables()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if batch_size is None:
+            for renewal in renewals:
+                response = client.post('/api/prescriptions', json={**renewal, "provider_id": provider_id})
+                if response.status_code != 201:
+                    raise AssertionError(f"Single create failed: {response.get_data(as_text=True)}")
+        else:
+            for start in range(0, len(renewals), batch_size):
+                response = client.post('/api/prescriptions/batch', json={
+                    "provider_id": provider_id, "prescriptions": renewals[start:start + batch_size]})
+                if response.status_code != 201:
+                    raise AssertionError(f"Batch create failed: {response.get_data(as_text=True)}")
+    return time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark single vs batch prescription creation.")
+    parser.add_argument('--prescriptions', type=int, default=2000, help="Prescriptions created per run.")
+    parser.add_argument('--medications', type=int, default=3, help="Medications per prescription.")
+    parser.add_argument('--batch-sizes', default='10,50,200', help="Comma-separated prescriptions per batch request.")
+    args = parser.parse_args()
+
+    batch_sizes = [int(size) for size in args.batch_sizes.split(',')]
+    prescription_api.DB_NAME = BENCHMARK_DB_NAME
+    prescription_api.MAX_PRESCRIPTION_BATCH_SIZE = max(batch_sizes + [prescription_api.MAX_PRESCRIPTION_BATCH_SIZE])
+    client = prescription_api.app.test_client()
+    try:
+        provider_id, patient_ids = _create_database()
+        renewals = _renewals(args.prescriptions, args.medications, patient_ids)
+        print(f"{args.prescriptions} prescriptions x {args.medications} medications")
+        for label, size in [("single", None)] + [(f"batches of {size}", size) for size in batch_sizes]:
+            elapsed = _run(client, provider_id, renewals, size)
+            created = _count_created()
+            expected = (args.prescriptions, args.prescriptions * args.medications)
+            if created != expected:
+                raise AssertionError(f"Expected {expected} prescriptions/medications, found {created}.")
+            print(f"  {label:>16}: {elapsed:8.2f} s, {args.prescriptions / elapsed:10.0f} prescriptions/s")
+    finally:
+        _remove_database()
@@ -0,0 +1,153 @@
+"""
+Benchmark for the appointment reminder job.
+
+At each size, that many confirmed appointments are placed inside the job's
+23-24 hour reminder window and `send_reminders` is run over all of them twice:
+
+  * per appointment: REMINDER_MARK_BATCH_SIZE = 1, i.e. one transaction per queued
+    appointment and per claimed outbox notification (as unbatched as the job gets), and
+  * batched: the configured REMINDER_MARK_BATCH_SIZE, one transaction per batch.
+
+The peak memory (tracemalloc) of reading the window's candidates is also reported, for
+get_appointments_needing_reminders (whole window as one list) and for
+iter_appointments_needing_reminders (chunks of REMINDER_MARK_BATCH_SIZE, which the job uses).
+
+Reminder dispatch is the simulated send_email_reminder / send_sms_reminder, and the
+job's per-appointment logging is discarded, so the numbers are dominated by the
+query, queueing and outbox bookkeeping. Reminders and the outbox are reset between
+the two runs.
+
+Usage:
+    python benchmark_reminder_job.py [--steps 1000,10000,100000]
+
+Each run uses a fresh scratch database file which is removed afterwards.
+"""
+import argparse
+import contextlib
+import io
+import os
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import appointment_reminder_job
+from db_connection_pool import close_pool
+from db_utils_appointment import (
+    get_db_connection,
+    initialize_appointment_schema,
+    get_appointments_needing_reminders,
+    iter_appointments_needing_reminders
+)
+from time_utils import format_datetime
+
+BENCHMARK_DB_NAME = 'benchmark_reminder_job.db'
+PATIENT_COUNT = 1000
+APPOINTMENTS_PER_PROVIDER = 20 # Back-to-back 2-minute appointments inside the 40-minute window below
+
+
+def _remove_database():
+    close_pool(BENCHMARK_DB_NAME)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(BENCHMARK_DB_NAME + suffix):
+            os.remove(BENCHMARK_DB_NAME + suffix)
+
+
+def _create_database(appointment_count: int):
+    """Creates `appointment_count` confirmed appointments starting 23h10m-23h50m from now."""
+    _remove_database()
+    provider_count = -(-appointment_count // APPOINTMENTS_PER_PROVIDER)
+    conn = get_db_connection(BENCHMARK_DB_NAME)
+    try:
+        initialize_appointment_schema(conn)
+        conn.executemany("INSERT INTO users (username, email, phone) VALUES (?, ?, ?)",
+                         [(f'bench_user_{i}', f'bench_user_{i}@example.com', f'555-{i:07d}')
+                          for i in range(provider_count + PATIENT_COUNT)])
+        user_ids = [row[0] for row in conn.execute("SELECT user_id FROM users ORDER BY user_id")]
+        providers, patients = user_ids[:provider_count], user_ids[provider_count:]
+
+        first_start = datetime.now().replace(microsecond=0) + timedelta(hours=23, minutes=10)
+        appointments = []
+        for i in range(appointment_count):
+            start = first_start + timedelta(minutes=2 * (i % APPOINTMENTS_PER_PROVIDER))
+            appointments.append((patients[i % PATIENT_COUNT], providers[i // APPOINTMENTS_PER_PROVIDER],
+                                 format_datetime(start), format_datetime(start + timedelta(minutes=2)), 'confirmed'))
+        conn.executemany("""INSERT INTO appointments (patient_id, provider_id, appointment_start_time,
+                            appointment_end_time, status) VALUES (?, ?, ?, ?, ?)""", appointments)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _run_job(batch_size: int) -> tuple[float, int, int]:
+    """
+    Runs send_reminders once with the given batch size.
+
+    Returns:
+        tuple: (elapsed seconds, appointments marked as reminded, notifications sent).
+    """
+    conn = get_db_connection(BENCHMARK_DB_NAME)
+    try:
+        conn.execute("UPDATE appointments SET last_reminder_sent_at = NULL")
+        conn.execute("DELETE FROM notification_outbox")
+        conn.commit()
+    finally:
+        conn.close()
+
+    appointment_reminder_job.DB_NAME = BENCHMARK_DB_NAME
+    appointment_reminder_job.REMINDER_MARK_BATCH_SIZE = batch_size
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        appointment_reminder_job.send_reminders()
+    elapsed = time.perf_counter() - started
+
+    conn = get_db_connection(BENCHMARK_DB_NAME)
+    try:
+        marked = conn.execute(
+            "SELECT COUNT(*) FROM appointments WHERE last_reminder_sent_at IS NOT NULL").fetchone()[0]
+        sent = conn.execute("SELECT COUNT(*) FROM notification_outbox WHERE status = 'sent'").fetchone()[0]
+    finally:
+        conn.close()
+    return elapsed, marked, sent
+
+
+def _read_peak_kib(chunk_size: int = None) -> float:
+    """Peak memory of reading every reminder candidate, whole (chunk_size None) or in chunks."""
+    now = datetime.now()
+    window = (format_datetime(now + timedelta(hours=23)), format_datetime(now + timedelta(hours=24)))
+    conn = get_db_connection(BENCHMARK_DB_NAME)
+    try:
+        tracemalloc.start()
+        if chunk_size is None:
+            read = len(get_appointments_needing_reminders(conn, *window))
+        else:
+            read = sum(len(chunk) for chunk in iter_appointments_needing_reminders(conn, *window, chunk_size=chunk_size))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    finally:
+        conn.close()
+    if not read:
+        raise AssertionError("No reminder candidates were read.")
+    return peak / 1024
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark reminder marking in the appointment reminder job.")
+    parser.add_argument('--steps', default='1000,10000,100000',
+                        help="Comma-separated numbers of appointments in the reminder window.")
+    args = parser.parse_args()
+
+    batch_size = appointment_reminder_job.REMINDER_MARK_BATCH_SIZE
+    try:
+        for count in (int(step) for step in args.steps.split(',')):
+            _create_database(count)
+            print(f"{count} appointments in the reminder window")
+            print(f"  {'candidate read peak':>18}: {_read_peak_kib():10.0f} KiB whole window, "
+                  f"{_read_peak_kib(batch_size):8.0f} KiB in chunks of {batch_size}")
+            for label, size in (("per appointment", 1), (f"batches of {batch_size}", batch_size)):
+                elapsed, marked, sent = _run_job(size)
+                if marked != count or sent != 2 * count: # Every patient has an email address and a phone
+                    raise AssertionError(f"Expected {count} reminders marked and {2 * count} notifications sent, "
+                                         f"found {marked} and {sent}.")
+                print(f"  {label:>18}: {elapsed:8.2f} s, {count / elapsed:10.0f} reminders/s")
+    finally:
+        _remove_database()
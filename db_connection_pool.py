@@ -0,0 +1,458 @@
+import sqlite3
+import threading
+import time
+import weakref
+import os
+import atexit
+
+# --- Pool Configuration ---
+# All values can be overridden through environment variables so deployments can
+# tune the pool without code changes (same convention as the *_DB_NAME variables).
+POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '8'))              # Max open connections per database file
+POOL_ACQUIRE_TIMEOUT_SECONDS = float(os.getenv('DB_POOL_ACQUIRE_TIMEOUT', '10'))
+POOL_HEALTH_CHECK_INTERVAL_SECONDS = float(os.getenv('DB_POOL_HEALTH_CHECK_INTERVAL', '30'))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', '5000'))
+SQLITE_CACHE_SIZE_KIB = int(os.getenv('DB_CACHE_SIZE_KIB', '16384'))  # 16 MiB page cache per connection
+SQLITE_MMAP_SIZE_BYTES = int(os.getenv('DB_MMAP_SIZE_BYTES', str(64 * 1024 * 1024)))
+
+# PRAGMAs applied once when a physical connection is opened. Reused connections
+# keep them, which is where most of the per-request savings come from.
+CONNECTION_PRAGMAS = (
+    "PRAGMA foreign_keys = ON;",
+    "PRAGMA journal_mode = WAL;",            # Readers do not block the writer (and vice versa)
+    "PRAGMA synchronous = NORMAL;",          # Safe with WAL; fsync on checkpoint instead of every commit
+    f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS};",
+    f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KIB};",  # Negative value = size in KiB
+    "PRAGMA temp_store = MEMORY;",
+    f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE_BYTES};",
+)
+
+
+class PoolTimeoutError(sqlite3.OperationalError):
+    """Raised when no connection becomes available within the acquire timeout."""
+
+
+class PooledConnection:
+    """
+    A checked-out connection handed to callers instead of a raw sqlite3.Connection.
+
+    It proxies every attribute to the underlying connection, so existing db_utils
+    code (cursor(), execute(), commit(), rollback(), lastrowid...) works unchanged.
+    The differences are:
+    - `close()` returns the connection to its pool instead of closing the file.
+    - Used as a context manager (`with get_db_connection(...) as conn:`) it commits
+      or rolls back like sqlite3.Connection does, and then returns itself to the pool.
+      This fixes the descriptor leak of the plain sqlite3 context manager, which
+      never closes.
+    - Cursors it created (cursor(), execute(), executemany()) are closed when it is
+      returned, so a half-read SELECT does not keep its read snapshot open while the
+      connection sits idle or serves the next caller.
+    """
+
+    def __init__(self, pool: 'ConnectionPool', raw_conn: sqlite3.Connection):
+        self._pool = pool
+        self._raw_conn = raw_conn
+        self._released = False
+        self._cursors = weakref.WeakSet()
+        # If the caller drops this object without closing it, hand the raw
+        # connection back to the pool and count it as a leak.
+        self._finalizer = weakref.finalize(self, ConnectionPool._reclaim_leaked, pool, raw_conn)
+
+    @property
+    def raw_connection(self) -> sqlite3.Connection:
+        """The underlying sqlite3.Connection (for code that needs the real type)."""
+        if self._released:
+            raise sqlite3.ProgrammingError("Cannot operate on a connection that was returned to the pool.")
+        return self._raw_conn
+
+    def __getattr__(self, name):
+        return getattr(self.raw_connection, name)
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.raw_connection, name, value)
+
+    def _track(self, cursor: sqlite3.Cursor) -> sqlite3.Cursor:
+        self._cursors.add(cursor)
+        return cursor
+
+    def cursor(self, *args, **kwargs) -> sqlite3.Cursor:
+        return self._track(self.raw_connection.cursor(*args, **kwargs))
+
+    def execute(self, sql: str, parameters=()) -> sqlite3.Cursor:
+        return self._track(self.raw_connection.execute(sql, parameters))
+
+    def executemany(self, sql: str, parameters) -> sqlite3.Cursor:
+        return self._track(self.raw_connection.executemany(sql, parameters))
+
+    def close(self):
+        """Closes the cursors it created and returns the connection to the pool. Safe to call more than once."""
+        if self._released:
+            return
+        self._released = True
+        self._finalizer.detach()
+        for cursor in list(self._cursors):
+            try:
+                cursor.close()
+            except sqlite3.Error:
+                pass
+        self._pool._release(self._raw_conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if not self._released:
+                if exc_type is None:
+                    self._raw_conn.commit()
+                else:
+                    self._raw_conn.rollback()
+        finally:
+            self.close()
+        return False  # Never swallow exceptions
+
+
+class ConnectionPool:
+    """
+    A bounded pool of SQLite connections for a single database file.
+
+    Connections are opened lazily up to `max_size`, configured once with
+    CONNECTION_PRAGMAS, and reused across requests and threads. A thread that
+    returns a connection gets the same one back on its next checkout when it is
+    still idle, which keeps the page cache warm for per-thread workers.
+
+    Args:
+        db_name (str): Path of the SQLite database file. In-memory databases (':memory:'
+                       or '') are refused: each connection would see a different one.
+        max_size (int): Maximum number of simultaneously open connections.
+        acquire_timeout (float): Seconds to wait for a free connection before
+                                 raising PoolTimeoutError.
+        health_check_interval (float): Idle connections older than this (seconds)
+                                       are validated with `SELECT 1` on checkout.
+    """
+
+    def __init__(self, db_name: str, max_size: int = POOL_MAX_SIZE,
+                 acquire_timeout: float = POOL_ACQUIRE_TIMEOUT_SECONDS,
+                 health_check_interval: float = POOL_HEALTH_CHECK_INTERVAL_SECONDS):
+        if not isinstance(max_size, int) or max_size < 1:
+            raise ValueError("max_size must be a positive integer.")
+        if db_name in ('', ':memory:'):
+            # Every connection would open its own private database
+            raise ValueError("In-memory databases cannot be pooled; use a database file.")
+        self.db_name = db_name
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+
+        # Re-entrant because the leak finalizer can run during GC while this thread holds the lock.
+        self._lock = threading.Condition(threading.RLock())
+        self._idle = []                  # Stack of (raw_conn, released_at_monotonic)
+        self._open_count = 0             # Physical connections currently open (idle + in use)
+        self._file_identity = {}         # id(raw_conn) -> (st_dev, st_ino) of the file it was opened on
+        self._thread_affinity = threading.local()
+        self._closed = False
+        self._metrics = {
+            "checkouts": 0,
+            "releases": 0,
+            "connections_created": 0,
+            "connections_discarded": 0,
+            "health_checks": 0,
+            "health_check_failures": 0,
+            "leaks_detected": 0,
+            "acquire_timeouts": 0,
+            "wait_time_total_seconds": 0.0,
+            "wait_time_max_seconds": 0.0,
+        }
+
+    # --- Physical connection management ---
+
+    def _current_file_identity(self):
+        try:
+            st = os.stat(self.db_name)
+            return (st.st_dev, st.st_ino)
+        except OSError:
+            return None
+
+    def _open_connection(self) -> sqlite3.Connection:
+        """Opens and configures a physical connection. Called without the lock held."""
+        # check_same_thread=False: a connection may be checked out by different
+        # threads over its lifetime, but never by two threads at the same time.
+        raw_conn = sqlite3.connect(self.db_name, check_same_thread=False)
+        try:
+            raw_conn.row_factory = sqlite3.Row
+            for pragma in CONNECTION_PRAGMAS:
+                raw_conn.execute(pragma)
+        except sqlite3.Error:
+            raw_conn.close()
+            raise
+        file_identity = self._current_file_identity()
+        with self._lock:
+            self._file_identity[id(raw_conn)] = file_identity
+            self._metrics["connections_created"] += 1
+        return raw_conn
+
+    def _discard(self, raw_conn: sqlite3.Connection):
+        """Closes a physical connection. Caller must hold the lock."""
+        self._file_identity.pop(id(raw_conn), None)
+        self._open_count -= 1
+        self._metrics["connections_discarded"] += 1
+        try:
+            raw_conn.close()
+        except sqlite3.Error:
+            pass
+        self._lock.notify()
+
+    def _is_healthy(self, raw_conn: sqlite3.Connection, idle_since: float) -> bool:
+        """
+        Validates an idle connection before handing it out. Called without the lock held.
+
+        The database file identity is always compared (cheap `os.stat`) so that a
+        connection to a file that has since been deleted or replaced is never
+        reused. A `SELECT 1` round trip is only issued for connections that have
+        been idle longer than `health_check_interval`.
+        """
+        with self._lock:
+            file_identity = self._file_identity.get(id(raw_conn))
+        if file_identity != self._current_file_identity():
+            return False
+        if time.monotonic() - idle_since < self.health_check_interval:
+            return True
+        with self._lock:
+            self._metrics["health_checks"] += 1
+        try:
+            raw_conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    # --- Checkout / release ---
+
+    def acquire(self, timeout: float = None) -> PooledConnection:
+        """
+        Checks out a connection, opening a new one if the pool is below `max_size`.
+
+        Only the bookkeeping runs under the pool lock: an idle connection is taken, or a
+        slot reserved, under the lock, and the health check or the new connection's
+        open and PRAGMAs happen after it is released, so a slow disk does not stall
+        every other checkout and release.
+
+        Args:
+            timeout (float, optional): Overrides the pool's acquire timeout (seconds).
+
+        Returns:
+            PooledConnection: A connection wrapper; call `close()` (or use it as a
+                              context manager) to return it to the pool.
+
+        Raises:
+            PoolTimeoutError: If the pool is exhausted for longer than the timeout.
+            sqlite3.Error: If a new connection cannot be opened.
+        """
+        timeout = self.acquire_timeout if timeout is None else timeout
+        wait_started = time.monotonic()
+        deadline = wait_started + timeout
+
+        while True:
+            idle = self._reserve(timeout, deadline)
+            if idle is None: # A slot was reserved for a new connection
+                try:
+                    raw_conn = self._open_connection()
+                except sqlite3.Error:
+                    with self._lock:
+                        self._open_count -= 1
+                        self._lock.notify()
+                    raise
+                break
+            raw_conn, idle_since = idle
+            if self._is_healthy(raw_conn, idle_since):
+                break
+            with self._lock:
+                self._metrics["health_check_failures"] += 1
+                self._discard(raw_conn)
+
+        with self._lock:
+            waited = time.monotonic() - wait_started
+            self._metrics["checkouts"] += 1
+            self._metrics["wait_time_total_seconds"] += waited
+            self._metrics["wait_time_max_seconds"] = max(self._metrics["wait_time_max_seconds"], waited)
+
+        self._thread_affinity.last_conn_id = id(raw_conn)
+        return PooledConnection(self, raw_conn)
+
+    def _reserve(self, timeout: float, deadline: float):
+        """
+        Waits until an idle connection or a free slot is available. Returns (raw_conn,
+        idle_since) for an idle connection, preferring this thread's previous one, or
+        None after reserving a slot (counted in _open_count) for a new connection.
+        """
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise sqlite3.ProgrammingError(f"Connection pool for '{self.db_name}' is closed.")
+                if self._idle:
+                    index = len(self._idle) - 1
+                    preferred_id = getattr(self._thread_affinity, 'last_conn_id', None)
+                    for i, (candidate, _) in enumerate(self._idle):
+                        if id(candidate) == preferred_id:
+                            index = i
+                            break
+                    return self._idle.pop(index)
+                if self._open_count < self.max_size:
+                    self._open_count += 1
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._metrics["acquire_timeouts"] += 1
+                    raise PoolTimeoutError(
+                        f"Timed out after {timeout:.2f}s waiting for a connection to '{self.db_name}' "
+                        f"(pool size {self.max_size})."
+                    )
+                self._lock.wait(remaining)
+
+    def _release(self, raw_conn: sqlite3.Connection):
+        # Never return a connection with an open transaction: uncommitted work is
+        # discarded, matching what closing a plain sqlite3 connection would do.
+        healthy = True
+        try:
+            if raw_conn.in_transaction:
+                raw_conn.rollback()
+            raw_conn.row_factory = sqlite3.Row
+        except sqlite3.Error:
+            healthy = False
+
+        with self._lock:
+            self._metrics["releases"] += 1
+            if self._closed or not healthy:
+                self._discard(raw_conn)
+                return
+            self._idle.append((raw_conn, time.monotonic()))
+            self._lock.notify()
+
+    @staticmethod
+    def _reclaim_leaked(pool: 'ConnectionPool', raw_conn: sqlite3.Connection):
+        """weakref finalizer: a PooledConnection was garbage collected without close()."""
+        with pool._lock:
+            pool._metrics["leaks_detected"] += 1
+        print(f"WARNING: Leaked connection to '{pool.db_name}' detected; returning it to the pool.")
+        pool._release(raw_conn)
+
+    def close(self):
+        """Closes all idle connections and marks the pool closed; in-use connections close on release."""
+        with self._lock:
+            self._closed = True
+            while self._idle:
+                raw_conn, _ = self._idle.pop()
+                self._discard(raw_conn)
+
+    def metrics(self) -> dict:
+        """
+        Returns a snapshot of the pool's counters.
+
+        Returns:
+            dict: Includes 'checkouts', 'releases', 'connections_created',
+                  'connections_discarded', 'health_checks', 'health_check_failures',
+                  'leaks_detected', 'acquire_timeouts', 'wait_time_total_seconds',
+                  'wait_time_max_seconds', 'wait_time_avg_seconds', plus the current
+                  'open', 'idle', 'in_use' and 'max_size' gauges.
+        """
+        with self._lock:
+            snapshot = dict(self._metrics)
+            snapshot["open"] = self._open_count
+            snapshot["idle"] = len(self._idle)
+            snapshot["in_use"] = self._open_count - len(self._idle)
+            snapshot["max_size"] = self.max_size
+        checkouts = snapshot["checkouts"]
+        snapshot["wait_time_avg_seconds"] = snapshot["wait_time_total_seconds"] / checkouts if checkouts else 0.0
+        return snapshot
+
+
+# --- Process-wide pool registry ---
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_name: str) -> ConnectionPool:
+    """
+    Returns the shared pool for `db_name`, creating it on first use.
+
+    The pool is keyed by the absolute path of the file so that the appointment,
+    messaging and prescription services share one pool when pointed at the same
+    database.
+    """
+    key = os.path.abspath(db_name)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool._closed:
+            pool = ConnectionPool(db_name)
+            _pools[key] = pool
+        return pool
+
+
+def get_pooled_connection(db_name: str) -> PooledConnection:
+    """
+    Checks out a connection to `db_name` from the shared pool.
+
+    Raises:
+        PoolTimeoutError: If the pool stays exhausted for the acquire timeout.
+        sqlite3.Error: If a new connection cannot be opened or configured.
+    """
+    return get_pool(db_name).acquire()
+
+
+def close_pool(db_name: str):
+    """
+    Closes and forgets the pool for `db_name`, if any.
+
+    Call this before deleting or replacing a database file (e.g. in test teardown)
+    so that SQLite can checkpoint and remove its -wal/-shm files cleanly.
+    """
+    key = os.path.abspath(db_name)
+    with _pools_lock:
+        pool = _pools.pop(key, None)
+    if pool:
+        pool.close()
+
+
+def close_all_pools():
+    """Closes every pool created in this process."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+def get_all_pool_metrics() -> dict:
+    """Returns `{db_name: metrics_dict}` for every live pool."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {pool.db_name: pool.metrics() for pool in pools}
+
+
+
+# --- Write transactions ---
+
+def begin_immediate(conn):
+    """
+    Starts a write transaction with BEGIN IMMEDIATE, so the write lock is held before
+    the checks that the following writes depend on.
+
+    Call it before the `try:` whose handler rolls back: the connection must not already
+    be in a transaction. Committing the caller's pending work here would make it
+    permanent as a side effect, and joining it would tie it to this transaction's outcome.
+
+    Raises:
+        sqlite3.ProgrammingError: If the connection already has a transaction open; the
+                                  caller has to commit or roll back first.
+        sqlite3.OperationalError: If the write lock is not obtained within the busy timeout.
+    """
+    if conn.in_transaction:
+        raise sqlite3.ProgrammingError(
+            "A transaction is already open on this connection; commit or roll it back before this write.")
+    conn.execute("BEGIN IMMEDIATE")
+
+
+atexit.register(close_all_pools)
@@ -1,5 +1,36 @@
 import sqlite3
+import json
+import secrets
 from datetime import datetime # For type hinting and potential future use, though SQLite handles text dates
+from db_connection_pool import begin_immediate, get_pooled_connection, close_pool
+from time_utils import (
+    parse_datetime,
+    datetime_to_epoch,
+    date_range_to_epoch_bounds,
+    now_datetime_string,
+    now_epoch,
+    add_epoch_columns,
+    epoch_to_datetime_string,
+    SECONDS_PER_DAY
+)
+from slot_engine import (
+    parse_rrule,
+    expand_occurrences,
+    merge_intervals,
+    subtract_intervals,
+    carve_slots,
+    earliest_slots
+)
+from availability_bitmaps import (
+    days_spanned,
+    day_start,
+    touched_cells,
+    covered_cells,
+    to_blob,
+    from_blob,
+    is_range_free
+)
+from slot_holds import get_hold_registry, HOLD_TTL_SECONDS, MAX_HOLD_TTL_SECONDS
 
 # --- Database Schema (SQLite Compatible) ---
 APPOINTMENT_SCHEMA = """
@@ -16,15 +47,11 @@ CREATE TABLE IF NOT EXISTS provider_availability (
     provider_id INTEGER NOT NULL,
     start_datetime DATETIME NOT NULL,
     end_datetime DATETIME NOT NULL,
-    recurring_rule TEXT NULL, -- Storing as TEXT, actual parsing/handling in app logic
+    recurring_rule TEXT NULL, -- iCalendar RRULE subset, validated and expanded by slot_engine.py
     FOREIGN KEY (provider_id) REFERENCES users(user_id) ON DELETE CASCADE,
     CONSTRAINT chk_start_end_availability CHECK (STRFTIME('%s', end_datetime) > STRFTIME('%s', start_datetime)) -- Compare as unix timestamps
 );
 
-CREATE INDEX IF NOT EXISTS idx_pa_provider_id ON provider_availability(provider_id);
-CREATE INDEX IF NOT EXISTS idx_pa_start_datetime ON provider_availability(start_datetime);
-CREATE INDEX IF NOT EXISTS idx_pa_end_datetime ON provider_availability(end_datetime);
-
 CREATE TABLE IF NOT EXISTS appointments (
     appointment_id INTEGER PRIMARY KEY AUTOINCREMENT,
     patient_id INTEGER NOT NULL,
@@ -44,10 +71,75 @@ CREATE TABLE IF NOT EXISTS appointments (
     CONSTRAINT chk_start_end_appointment CHECK (STRFTIME('%s', appointment_end_time) > STRFTIME('%s', appointment_start_time))
 );
 
-CREATE INDEX IF NOT EXISTS idx_appt_patient_id ON appointments(patient_id);
-CREATE INDEX IF NOT EXISTS idx_appt_provider_id ON appointments(provider_id);
-CREATE INDEX IF NOT EXISTS idx_appt_start_time ON appointments(appointment_start_time);
-CREATE INDEX IF NOT EXISTS idx_appt_status ON appointments(status);
+-- Short-lived reservations placed before booking (see slot_holds.py)
+CREATE TABLE IF NOT EXISTS appointment_holds (
+    hold_id TEXT PRIMARY KEY, -- Random token returned to the patient who placed the hold
+    provider_id INTEGER NOT NULL,
+    patient_id INTEGER NOT NULL,
+    hold_start_time DATETIME NOT NULL,
+    hold_end_time DATETIME NOT NULL,
+    expires_at DATETIME NOT NULL,
+    created_at DATETIME DEFAULT (STRFTIME('%Y-%m-%d %H:%M:%S', 'now')) NOT NULL,
+    FOREIGN KEY (provider_id) REFERENCES users(user_id) ON DELETE CASCADE,
+    FOREIGN KEY (patient_id) REFERENCES users(user_id) ON DELETE CASCADE,
+    CONSTRAINT chk_start_end_hold CHECK (STRFTIME('%s', hold_end_time) > STRFTIME('%s', hold_start_time))
+);
+
+-- Derived free/busy bitmaps per provider and day (see availability_bitmaps.py).
+-- Built on first use and kept current by the functions in this module that change
+-- availability or appointments; deleting rows is always safe, they are rebuilt.
+CREATE TABLE IF NOT EXISTS provider_day_bitmaps (
+    provider_id INTEGER NOT NULL,
+    day_epoch INTEGER NOT NULL, -- Midnight starting the day, epoch seconds
+    available_bits BLOB NOT NULL, -- 288 bits: 5-minute cells entirely inside availability
+    busy_bits BLOB NOT NULL, -- 288 bits: 5-minute cells overlapping a blocking appointment
+    PRIMARY KEY (provider_id, day_epoch),
+    FOREIGN KEY (provider_id) REFERENCES users(user_id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+-- Reminder notifications waiting to be delivered (see enqueue_reminder_notifications).
+-- next_attempt_epoch is the next try for 'pending' rows and the lease expiry for 'sending' rows.
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    notification_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT NOT NULL UNIQUE, -- One row per appointment, channel and start time; also sent to the provider
+    appointment_id INTEGER NOT NULL,
+    channel TEXT NOT NULL CHECK (channel IN ('email', 'sms')),
+    address TEXT NOT NULL,
+    payload TEXT NOT NULL, -- JSON appointment details used to render the message
+    status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'sending', 'sent', 'dead')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_epoch INTEGER NOT NULL,
+    last_error TEXT NULL,
+    sent_at DATETIME NULL,
+    created_at DATETIME DEFAULT (STRFTIME('%Y-%m-%d %H:%M:%S', 'now')) NOT NULL,
+    FOREIGN KEY (appointment_id) REFERENCES appointments(appointment_id) ON DELETE CASCADE
+);
+-- Dispatchers claim due rows in next_attempt_epoch order; sent and dead rows stay out of the index.
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON notification_outbox(next_attempt_epoch)
+    WHERE status IN ('pending', 'sending');
+CREATE INDEX IF NOT EXISTS idx_outbox_appointment_id ON notification_outbox(appointment_id);
+
+-- Change feed of appointment confirmations, cancellations and reschedules (see APPOINTMENT_CHANGE_FEED_TRIGGERS).
+-- Readers remember the last change_id they applied; old rows are pruned by age.
+CREATE TABLE IF NOT EXISTS appointment_changes (
+    change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    appointment_id INTEGER NOT NULL, -- No foreign key: the change outlives a deleted appointment
+    status TEXT NOT NULL, -- Status after the change; 'deleted' when the row was deleted
+    appointment_start_epoch INTEGER NOT NULL, -- Start after the change
+    changed_epoch INTEGER NOT NULL DEFAULT (CAST(STRFTIME('%s', 'now') AS INTEGER))
+);
+CREATE INDEX IF NOT EXISTS idx_appt_changes_changed_epoch ON appointment_changes(changed_epoch);
+
+-- Reminder workers and the provider shards they hold (see acquire_reminder_shards).
+CREATE TABLE IF NOT EXISTS reminder_workers (
+    worker_id TEXT PRIMARY KEY, -- host:pid
+    heartbeat_epoch INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS reminder_shard_leases (
+    shard_id INTEGER PRIMARY KEY, -- Appointments whose provider_id % shard count equals this
+    worker_id TEXT NULL, -- NULL when released
+    lease_expires_epoch INTEGER NOT NULL DEFAULT 0
+);
 
 -- Trigger for appointments.updated_at
 CREATE TRIGGER IF NOT EXISTS update_appointments_updated_at
@@ -59,20 +151,171 @@ BEGIN
     WHERE appointment_id = OLD.appointment_id;
 END;
 """
+
+# Integer epoch columns generated from the TEXT time columns (see time_utils).
+# Range filters and ORDER BY use these, so the predicates compare raw indexed
+# integers instead of wrapping the column in DATE(...) or STRFTIME(...).
+# initialize_appointment_schema adds them with ALTER TABLE, which also upgrades
+# databases created before they existed, then creates APPOINTMENT_EPOCH_INDEXES.
+APPOINTMENT_EPOCH_COLUMNS = {
+    "provider_availability": {
+        "start_epoch": "start_datetime",
+        "end_epoch": "end_datetime",
+    },
+    "appointments": {
+        "appointment_start_epoch": "appointment_start_time",
+        "appointment_end_epoch": "appointment_end_time",
+        "last_reminder_sent_epoch": "last_reminder_sent_at",
+    },
+    "appointment_holds": {
+        "hold_start_epoch": "hold_start_time",
+        "hold_end_epoch": "hold_end_time",
+        "expires_epoch": "expires_at",
+    },
+}
+
+APPOINTMENT_EPOCH_INDEXES = """
+-- The TEXT-column indexes are superseded by the epoch indexes below
+DROP INDEX IF EXISTS idx_pa_start_datetime;
+DROP INDEX IF EXISTS idx_pa_end_datetime;
+DROP INDEX IF EXISTS idx_appt_start_time;
+
+CREATE INDEX IF NOT EXISTS idx_pa_start_epoch ON provider_availability(start_epoch);
+CREATE INDEX IF NOT EXISTS idx_pa_end_epoch ON provider_availability(end_epoch);
+CREATE INDEX IF NOT EXISTS idx_appt_start_epoch ON appointments(appointment_start_epoch);
+
+-- Composite indexes proposed by index_advisor.py. Each list query filters on an owner
+-- column and sorts by start time, so (owner, start) serves the filter, the optional
+-- date range and the ORDER BY from one index instead of sorting in a temp B-tree.
+-- They also serve every lookup the single-column indexes they replace did.
+DROP INDEX IF EXISTS idx_pa_provider_id;
+DROP INDEX IF EXISTS idx_appt_patient_id;
+DROP INDEX IF EXISTS idx_appt_provider_id;
+DROP INDEX IF EXISTS idx_appt_status;
+CREATE INDEX IF NOT EXISTS idx_pa_provider_start_epoch ON provider_availability(provider_id, start_epoch);
+CREATE INDEX IF NOT EXISTS idx_appt_patient_start_epoch ON appointments(patient_id, appointment_start_epoch);
+CREATE INDEX IF NOT EXISTS idx_appt_provider_start_epoch ON appointments(provider_id, appointment_start_epoch);
+-- Reminder scan: status = 'confirmed' plus a start-time window becomes one range read.
+CREATE INDEX IF NOT EXISTS idx_appt_status_start_epoch ON appointments(status, appointment_start_epoch);
+
+-- Hold conflict checks seek (provider, start) like appointments; expiry purges range over expires_epoch.
+CREATE INDEX IF NOT EXISTS idx_holds_provider_start_epoch ON appointment_holds(provider_id, hold_start_epoch);
+CREATE INDEX IF NOT EXISTS idx_holds_patient_id ON appointment_holds(patient_id);
+CREATE INDEX IF NOT EXISTS idx_holds_expires_epoch ON appointment_holds(expires_epoch);
+"""
+
+# --- Scheduling Rules ---
+# Appointments in these statuses hold their time with the provider; cancelled,
+# completed and no-show appointments free it again.
+BLOCKING_APPOINTMENT_STATUSES = (
+    'pending_provider_confirmation',
+    'confirmed',
+    'rescheduled_by_provider',
+    'rescheduled_pending_patient',
+    'rescheduled_pending_provider',
+)
+# Upper bound on an appointment's length, enforced by request_appointment. Knowing it
+# lets overlap queries seek idx_appt_provider_start_epoch on start time alone: an
+# appointment overlapping [a, b) must start in [a - MAX_APPOINTMENT_HOURS, b).
+MAX_APPOINTMENT_HOURS = 24
+
+# --- Double-Booking Prevention ---
+# A provider's blocking appointments may not overlap. The check lives in triggers so it
+# runs inside whichever write transaction inserts or re-activates an appointment (there
+# is no gap between checking and writing, and no write path can skip it), and it is an
+# indexed range predicate: an overlapping appointment must start in
+# [start - MAX_APPOINTMENT_HOURS, end), one seek on idx_appt_provider_start_epoch, so
+# booking cost does not grow with the provider's history. BEFORE triggers see NEW before
+# generated columns are computed, hence STRFTIME on the TEXT columns.
+APPOINTMENT_OVERLAP_MESSAGE = "The requested time overlaps another appointment with this provider."
+_BLOCKING_STATUS_LIST = ', '.join(f"'{status}'" for status in BLOCKING_APPOINTMENT_STATUSES)
+_OVERLAP_CHECK = f"""
+    SELECT RAISE(ABORT, '{APPOINTMENT_OVERLAP_MESSAGE}')
+    WHERE EXISTS (
+        SELECT 1 FROM appointments a
+        WHERE a.provider_id = NEW.provider_id
+          AND a.appointment_start_epoch >= CAST(STRFTIME('%s', NEW.appointment_start_time) AS INTEGER) - {MAX_APPOINTMENT_HOURS * 3600}
+          AND a.appointment_start_epoch < CAST(STRFTIME('%s', NEW.appointment_end_time) AS INTEGER)
+          AND a.appointment_end_epoch > CAST(STRFTIME('%s', NEW.appointment_start_time) AS INTEGER)
+          AND a.status IN ({_BLOCKING_STATUS_LIST})
+          AND a.appointment_id IS NOT NEW.appointment_id
+    );"""
+# Dropped and recreated on every start so they always match the constants above.
+APPOINTMENT_OVERLAP_TRIGGERS = f"""
+DROP TRIGGER IF EXISTS trg_appointments_no_overlap_insert;
+CREATE TRIGGER trg_appointments_no_overlap_insert
+BEFORE INSERT ON appointments
+WHEN NEW.status IN ({_BLOCKING_STATUS_LIST})
+BEGIN{_OVERLAP_CHECK}
+END;
+
+DROP TRIGGER IF EXISTS trg_appointments_no_overlap_update;
+CREATE TRIGGER trg_appointments_no_overlap_update
+BEFORE UPDATE OF status, provider_id, appointment_start_time, appointment_end_time ON appointments
+WHEN NEW.status IN ({_BLOCKING_STATUS_LIST})
+BEGIN{_OVERLAP_CHECK}
+END;
+"""
+
+# --- Appointment Change Feed ---
+# Every insert, status change, reschedule or delete of an appointment appends a row to
+# appointment_changes, so a long-running reader (the reminder daemon) can follow
+# confirmations and cancellations by reading the rows after the last change_id it saw,
+# a rowid seek, instead of rescanning appointments. Written by triggers, like the overlap
+# check, so no write path can skip it. AFTER triggers see the generated epoch columns.
+APPOINTMENT_CHANGE_RETENTION_SECONDS = 7 * SECONDS_PER_DAY
+APPOINTMENT_CHANGE_FEED_TRIGGERS = """
+DROP TRIGGER IF EXISTS trg_appointments_change_feed_insert;
+CREATE TRIGGER trg_appointments_change_feed_insert
+AFTER INSERT ON appointments
+BEGIN
+    INSERT INTO appointment_changes (appointment_id, status, appointment_start_epoch)
+    VALUES (NEW.appointment_id, NEW.status, NEW.appointment_start_epoch);
+END;
+
+DROP TRIGGER IF EXISTS trg_appointments_change_feed_update;
+CREATE TRIGGER trg_appointments_change_feed_update
+AFTER UPDATE OF status, appointment_start_time ON appointments
+WHEN OLD.status IS NOT NEW.status OR OLD.appointment_start_time IS NOT NEW.appointment_start_time
+BEGIN
+    INSERT INTO appointment_changes (appointment_id, status, appointment_start_epoch)
+    VALUES (NEW.appointment_id, NEW.status, NEW.appointment_start_epoch);
+END;
+
+DROP TRIGGER IF EXISTS trg_appointments_change_feed_delete;
+CREATE TRIGGER trg_appointments_change_feed_delete
+AFTER DELETE ON appointments
+BEGIN
+    INSERT INTO appointment_changes (appointment_id, status, appointment_start_epoch)
+    VALUES (OLD.appointment_id, 'deleted', OLD.appointment_start_epoch);
+END;
+"""
+
+
+APPOINTMENT_HELD_MESSAGE = "The requested time is held by another patient."
+
+
+class AppointmentConflictError(sqlite3.IntegrityError):
+    """Raised when an appointment or hold would overlap another blocking appointment, or another patient's hold."""
+
+
+def _raise_if_overlap(error: sqlite3.IntegrityError):
+    """Re-raises an overlap trigger failure as AppointmentConflictError; other errors are left alone."""
+    if APPOINTMENT_OVERLAP_MESSAGE in str(error):
+        raise AppointmentConflictError(APPOINTMENT_OVERLAP_MESSAGE) from error
+
 # Note on recurring_rule: VARCHAR(255) becomes TEXT in SQLite.
 # Note on chk_start_end_availability and chk_start_end_appointment:
 # SQLite datetime comparisons are safer with unix timestamps (STRFTIME('%s', ...)) or ensuring ISO8601 format.
 
 def get_db_connection(db_name='appointment_app.db'):
     """
-    Establishes and returns an SQLite3 connection object.
-    Configured for row factory access and foreign key enforcement.
+    Checks out a pooled SQLite3 connection (see db_connection_pool).
+    Configured for row factory access, foreign key enforcement and WAL mode.
+    `close()` or leaving a `with` block returns it to the pool.
     """
     try:
-        conn = sqlite3.connect(db_name)
-        conn.row_factory = sqlite3.Row # Access columns by name
-        conn.execute("PRAGMA foreign_keys = ON;") # Enable foreign key constraint enforcement
-        return conn
+        return get_pooled_connection(db_name)
     except sqlite3.Error as e:
         print(f"Database connection error to '{db_name}': {e}")
         raise
@@ -80,11 +323,21 @@ def get_db_connection(db_name='appointment_app.db'):
 def initialize_appointment_schema(conn: sqlite3.Connection):
     """
     Initializes the appointment-related database schema.
-    Creates users, provider_availability, and appointments tables, and associated triggers.
+    Creates users, provider_availability, appointments, appointment_holds,
+    provider_day_bitmaps, notification_outbox, appointment_changes and reminder shard lease tables, and
+    associated triggers, then adds the generated epoch columns (APPOINTMENT_EPOCH_COLUMNS),
+    their indexes, the double-booking triggers (APPOINTMENT_OVERLAP_TRIGGERS) and the
+    change feed triggers (APPOINTMENT_CHANGE_FEED_TRIGGERS).
     """
     try:
         cursor = conn.cursor()
         cursor.executescript(APPOINTMENT_SCHEMA)
+        for table, epoch_columns in APPOINTMENT_EPOCH_COLUMNS.items():
+            add_epoch_columns(conn, table, epoch_columns)
+        conn.commit()
+        cursor.executescript(APPOINTMENT_EPOCH_INDEXES)
+        cursor.executescript(APPOINTMENT_OVERLAP_TRIGGERS)
+        cursor.executescript(APPOINTMENT_CHANGE_FEED_TRIGGERS)
         conn.commit()
         print("Appointment database schema initialized successfully.")
     except sqlite3.Error as e:
@@ -107,13 +360,18 @@ def add_provider_availability(conn: sqlite3.Connection, provider_id: int, start_
         The availability_id of the newly added record, or None on failure before insert.
 
     Raises:
-        ValueError: If input parameters are invalid.
+        ValueError: If input parameters are invalid, or recurring_rule is not a supported RRULE
+                    (see slot_engine.parse_rrule).
         sqlite3.Error: If a database error occurs (e.g., IntegrityError for FK or CHECK constraint).
     """
     if not all([isinstance(provider_id, int), isinstance(start_datetime, str), isinstance(end_datetime, str)]):
         raise ValueError("Invalid input types for provider availability.")
-    # Basic format validation could be added here for datetime strings.
+    # The generated epoch columns are only correct for the canonical format.
+    parse_datetime(start_datetime)
+    parse_datetime(end_datetime)
     # The CHECK constraint in DB handles start_datetime < end_datetime.
+    if recurring_rule is not None:
+        parse_rrule(recurring_rule) # The slot engine must be able to expand it
 
     cursor = conn.cursor()
     try:
@@ -124,6 +382,8 @@ def add_provider_availability(conn: sqlite3.Connection, provider_id: int, start_
             """,
             (provider_id, start_datetime, end_datetime, recurring_rule)
         )
+        _invalidate_day_bitmaps(conn, provider_id, datetime_to_epoch(start_datetime),
+                                None if recurring_rule else datetime_to_epoch(end_datetime))
         conn.commit()
         new_availability_id = cursor.lastrowid
         if new_availability_id is None:
@@ -148,6 +408,9 @@ def get_provider_availability(conn: sqlite3.Connection, provider_id: int, start_
     Returns:
         A list of dictionaries, each representing an availability block.
         Returns empty list if no availability or on error.
+
+    Raises:
+        ValueError: If provider_id is not an integer or a filter is not YYYY-MM-DD HH:MM:SS.
     """
     if not isinstance(provider_id, int):
         raise ValueError("provider_id must be an integer.")
@@ -160,11 +423,11 @@ def get_provider_availability(conn: sqlite3.Connection, provider_id: int, start_
 
     if start_filter and end_filter:
         # Find availability blocks that overlap with the filter window [start_filter, end_filter)
-        # Overlap condition: avail.start_datetime < end_filter AND avail.end_datetime > start_filter
-        query += " AND start_datetime < ? AND end_datetime > ?"
-        params.extend([end_filter, start_filter])
+        # Overlap condition: avail.start < end_filter AND avail.end > start_filter (on the epoch columns)
+        query += " AND start_epoch < ? AND end_epoch > ?"
+        params.extend([datetime_to_epoch(end_filter), datetime_to_epoch(start_filter)])
 
-    query += " ORDER BY start_datetime ASC"
+    query += " ORDER BY start_epoch ASC"
 
     try:
         cursor.execute(query, tuple(params))
@@ -197,17 +460,409 @@ def delete_provider_availability(conn: sqlite3.Connection, availability_id: int,
     cursor = conn.cursor()
     try:
         cursor.execute(
-            "DELETE FROM provider_availability WHERE availability_id = ? AND provider_id = ?",
+            """
+            DELETE FROM provider_availability WHERE availability_id = ? AND provider_id = ?
+            RETURNING start_epoch, end_epoch, recurring_rule
+            """,
             (availability_id, provider_id)
         )
+        deleted = cursor.fetchone()
+        if deleted:
+            _invalidate_day_bitmaps(conn, provider_id, deleted['start_epoch'],
+                                    None if deleted['recurring_rule'] else deleted['end_epoch'])
         conn.commit()
-        return cursor.rowcount > 0 # True if a row was deleted
+        return deleted is not None # True if a row was deleted
     except sqlite3.Error as e:
         print(f"Error in delete_provider_availability for ID {availability_id}, provider {provider_id}: {e}")
         conn.rollback()
         raise
 
 
+def _get_available_intervals(conn: sqlite3.Connection, provider_id: int, window_start: int, window_end: int) -> list[tuple[int, int]]:
+    """
+    Returns the merged (start, end) epoch intervals of the provider's availability,
+    with recurring blocks expanded, that overlap [window_start, window_end).
+    Intervals are not clipped to the window.
+    """
+    cursor = conn.cursor()
+    # One-off blocks must overlap the window; a recurring block only has to start before its end.
+    cursor.execute(
+        """
+        SELECT availability_id, start_epoch, end_epoch, recurring_rule FROM provider_availability
+        WHERE provider_id = ? AND start_epoch < ? AND (recurring_rule IS NOT NULL OR end_epoch > ?)
+        """,
+        (provider_id, window_end, window_start)
+    )
+    available = []
+    for row in cursor.fetchall():
+        try:
+            available.extend(expand_occurrences(row['start_epoch'], row['end_epoch'], row['recurring_rule'],
+                                                window_start, window_end))
+        except ValueError as e:
+            # Rules are validated on insert; this only affects rows stored before that.
+            print(f"Skipping availability {row['availability_id']} with unsupported recurring_rule: {e}")
+    return merge_intervals(available)
+
+def _get_busy_intervals(conn: sqlite3.Connection, provider_id: int, window_start: int, window_end: int) -> list[tuple[int, int]]:
+    """
+    Returns the merged (start, end) epoch intervals of the provider's blocking appointments
+    that overlap [window_start, window_end).
+
+    The start-time range is bounded on both sides (see MAX_APPOINTMENT_HOURS), so this is
+    one seek on idx_appt_provider_start_epoch however long the provider's history is.
+    """
+    placeholders = ', '.join('?' for _ in BLOCKING_APPOINTMENT_STATUSES)
+    cursor = conn.cursor()
+    cursor.execute(
+        f"""
+        SELECT appointment_start_epoch, appointment_end_epoch FROM appointments
+        WHERE provider_id = ?
+          AND appointment_start_epoch >= ? AND appointment_start_epoch < ?
+          AND appointment_end_epoch > ?
+          AND status IN ({placeholders})
+        """,
+        (provider_id, window_start - MAX_APPOINTMENT_HOURS * 3600, window_end, window_start,
+         *BLOCKING_APPOINTMENT_STATUSES)
+    )
+    return merge_intervals(tuple(row) for row in cursor.fetchall())
+
+def _get_held_intervals(conn: sqlite3.Connection, provider_id: int, window_start: int, window_end: int,
+                        now: int, patient_id: int = None) -> list[tuple[int, int]]:
+    """
+    Returns the merged (start, end) epoch intervals of unexpired holds on the provider's time
+    that overlap [window_start, window_end), leaving out holds placed by `patient_id`.
+    One seek on idx_holds_provider_start_epoch, bounded like _get_busy_intervals.
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT hold_start_epoch, hold_end_epoch FROM appointment_holds
+        WHERE provider_id = ?
+          AND hold_start_epoch >= ? AND hold_start_epoch < ?
+          AND hold_end_epoch > ?
+          AND expires_epoch > ?
+          AND patient_id IS NOT ?
+        """,
+        (provider_id, window_start - MAX_APPOINTMENT_HOURS * 3600, window_end, window_start, now, patient_id)
+    )
+    return merge_intervals(tuple(row) for row in cursor.fetchall())
+
+def _get_free_intervals_by_provider(conn: sqlite3.Connection, provider_ids: list[int], window_start: int,
+                                   window_end: int) -> dict[int, list[tuple[int, int]]]:
+    """
+    Returns {provider_id: merged free intervals} for several providers at once.
+
+    Free time is availability (recurring blocks expanded) minus blocking appointments and
+    unexpired holds. Each kind is loaded for every provider in a single query, seeking
+    the (provider_id, start) indexes once per provider. Intervals start no earlier than
+    `window_start` and may run past `window_end`; providers without free time are left out.
+    """
+    placeholders = ', '.join('?' for _ in provider_ids)
+    cursor = conn.cursor()
+    cursor.execute(
+        f"""
+        SELECT provider_id, availability_id, start_epoch, end_epoch, recurring_rule FROM provider_availability
+        WHERE provider_id IN ({placeholders}) AND start_epoch < ? AND (recurring_rule IS NOT NULL OR end_epoch > ?)
+        """,
+        (*provider_ids, window_end, window_start)
+    )
+    available = {}
+    for row in cursor.fetchall():
+        try:
+            available.setdefault(row['provider_id'], []).extend(expand_occurrences(
+                row['start_epoch'], row['end_epoch'], row['recurring_rule'], window_start, window_end))
+        except ValueError as e:
+            print(f"Skipping availability {row['availability_id']} with unsupported recurring_rule: {e}")
+    free = {}
+    for provider_id, intervals in available.items():
+        if intervals:
+            free[provider_id] = [(max(start, window_start), end) for start, end in merge_intervals(intervals)]
+    if not free:
+        return {}
+
+    # Busy time only matters up to the end of the last free interval.
+    horizon = max(intervals[-1][1] for intervals in free.values())
+    placeholders = ', '.join('?' for _ in free)
+    status_placeholders = ', '.join('?' for _ in BLOCKING_APPOINTMENT_STATUSES)
+    busy = {}
+    cursor.execute(
+        f"""
+        SELECT provider_id, appointment_start_epoch, appointment_end_epoch FROM appointments
+        WHERE provider_id IN ({placeholders})
+          AND appointment_start_epoch >= ? AND appointment_start_epoch < ?
+          AND appointment_end_epoch > ?
+          AND status IN ({status_placeholders})
+        """,
+        (*free, window_start - MAX_APPOINTMENT_HOURS * 3600, horizon, window_start, *BLOCKING_APPOINTMENT_STATUSES)
+    )
+    for row in cursor.fetchall():
+        busy.setdefault(row[0], []).append((row[1], row[2]))
+    cursor.execute(
+        f"""
+        SELECT provider_id, hold_start_epoch, hold_end_epoch FROM appointment_holds
+        WHERE provider_id IN ({placeholders})
+          AND hold_start_epoch >= ? AND hold_start_epoch < ?
+          AND hold_end_epoch > ?
+          AND expires_epoch > ?
+        """,
+        (*free, window_start - MAX_APPOINTMENT_HOURS * 3600, horizon, window_start, now_epoch())
+    )
+    for row in cursor.fetchall():
+        busy.setdefault(row[0], []).append((row[1], row[2]))
+
+    for provider_id, intervals in busy.items():
+        free[provider_id] = subtract_intervals(free[provider_id], merge_intervals(intervals))
+    return {provider_id: intervals for provider_id, intervals in free.items() if intervals}
+
+def get_bookable_slots(conn: sqlite3.Connection, provider_id: int, window_start: str, window_end: str,
+                       duration_minutes: int, step_minutes: int = None, not_before: str = None) -> list[dict]:
+    """
+    Computes the provider's bookable slots in a time window.
+
+    Availability blocks are expanded through their recurring_rule (see slot_engine),
+    merged, and the provider's blocking appointments (BLOCKING_APPOINTMENT_STATUSES) and
+    unexpired slot holds are subtracted. The remaining free time is cut into slots of
+    `duration_minutes` whose starts are aligned to `step_minutes` from midnight. Everything
+    works on sorted epoch intervals, so the cost grows with the number of occurrences and
+    appointments inside the window, not with the provider's history.
+
+    Args:
+        conn: Active SQLite3 connection.
+        provider_id: The ID of the provider.
+        window_start: Window start, inclusive (YYYY-MM-DD HH:MM:SS string).
+        window_end: Window end, exclusive (YYYY-MM-DD HH:MM:SS string).
+        duration_minutes: Length of each slot.
+        step_minutes: Distance between slot starts. Defaults to `duration_minutes`.
+        not_before: Optional earliest slot start (YYYY-MM-DD HH:MM:SS string), e.g. the current time.
+
+    Returns:
+        A list of {"start_time": str, "end_time": str} dictionaries in start order.
+        Slots may extend past `window_end` only if they start before it.
+
+    Raises:
+        ValueError: For invalid inputs.
+        sqlite3.Error: If a database error occurs.
+    """
+    if not isinstance(provider_id, int):
+        raise ValueError("provider_id must be an integer.")
+    if not isinstance(duration_minutes, int) or duration_minutes <= 0:
+        raise ValueError("duration_minutes must be a positive integer.")
+    if duration_minutes > MAX_APPOINTMENT_HOURS * 60:
+        raise ValueError(f"duration_minutes must not exceed {MAX_APPOINTMENT_HOURS * 60}.")
+    step_minutes = duration_minutes if step_minutes is None else step_minutes
+    if not isinstance(step_minutes, int) or step_minutes <= 0:
+        raise ValueError("step_minutes must be a positive integer.")
+    window_start_epoch = datetime_to_epoch(window_start)
+    window_end_epoch = datetime_to_epoch(window_end)
+    if window_end_epoch <= window_start_epoch:
+        raise ValueError("window_end must be after window_start.")
+    not_before_epoch = datetime_to_epoch(not_before) if not_before else None
+
+    try:
+        # Slots must start inside the window, but may run past its end into the same free interval.
+        free = _get_free_intervals_by_provider(conn, [provider_id], window_start_epoch, window_end_epoch)
+        slots = carve_slots(free.get(provider_id, []), duration_minutes * 60, step_minutes * 60, not_before_epoch)
+        return [
+            {"start_time": epoch_to_datetime_string(start), "end_time": epoch_to_datetime_string(end)}
+            for start, end in slots if start < window_end_epoch
+        ]
+    except sqlite3.Error as e:
+        print(f"Error in get_bookable_slots for provider {provider_id}: {e}")
+        raise
+
+
+def find_first_available_slots(conn: sqlite3.Connection, provider_ids: list[int], window_start: str, window_end: str,
+                               duration_minutes: int, limit: int = 10, step_minutes: int = None,
+                               not_before: str = None) -> list[dict]:
+    """
+    Finds the earliest bookable slots with any of several providers.
+
+    Free time is computed as in get_bookable_slots, but availability, appointments and
+    holds are each loaded for all providers in one query, and the providers' slots are
+    merged lazily so only the earliest `limit` are produced. The window is searched in
+    chunks of 1, 2, 4, ... days, so the cost follows how far ahead the first free slots
+    are rather than the length of the window.
+
+    Args:
+        conn: Active SQLite3 connection.
+        provider_ids: The providers to search (e.g. every cardiologist).
+        window_start: Window start, inclusive (YYYY-MM-DD HH:MM:SS string).
+        window_end: Window end, exclusive (YYYY-MM-DD HH:MM:SS string).
+        duration_minutes: Length of each slot.
+        limit: Maximum number of slots to return.
+        step_minutes: Distance between slot starts. Defaults to `duration_minutes`.
+        not_before: Optional earliest slot start (YYYY-MM-DD HH:MM:SS string), e.g. the current time.
+
+    Returns:
+        Up to `limit` {"provider_id": int, "start_time": str, "end_time": str} dictionaries,
+        earliest first; slots starting at the same time are ordered by provider_id.
+
+    Raises:
+        ValueError: For invalid inputs.
+        sqlite3.Error: If a database error occurs.
+    """
+    if not isinstance(provider_ids, (list, tuple)) or not provider_ids \
+            or not all(isinstance(provider_id, int) for provider_id in provider_ids):
+        raise ValueError("provider_ids must be a non-empty list of integers.")
+    if not isinstance(limit, int) or limit <= 0:
+        raise ValueError("limit must be a positive integer.")
+    if not isinstance(duration_minutes, int) or duration_minutes <= 0:
+        raise ValueError("duration_minutes must be a positive integer.")
+    if duration_minutes > MAX_APPOINTMENT_HOURS * 60:
+        raise ValueError(f"duration_minutes must not exceed {MAX_APPOINTMENT_HOURS * 60}.")
+    step_minutes = duration_minutes if step_minutes is None else step_minutes
+    if not isinstance(step_minutes, int) or step_minutes <= 0:
+        raise ValueError("step_minutes must be a positive integer.")
+    window_start_epoch = datetime_to_epoch(window_start)
+    window_end_epoch = datetime_to_epoch(window_end)
+    if window_end_epoch <= window_start_epoch:
+        raise ValueError("window_end must be after window_start.")
+    not_before_epoch = datetime_to_epoch(not_before) if not_before else None
+
+    provider_ids = sorted(set(provider_ids))
+    slots = []
+    chunk_start = max(window_start_epoch, not_before_epoch or window_start_epoch)
+    chunk_days = 1
+    try:
+        # Earliest slots are usually near the start of the window, so search it in chunks that
+        # double in length and stop once `limit` slots are found, instead of loading every
+        # appointment in the window up front.
+        while chunk_start < window_end_epoch and len(slots) < limit:
+            chunk_end = min(chunk_start + chunk_days * SECONDS_PER_DAY, window_end_epoch)
+            free = _get_free_intervals_by_provider(conn, provider_ids, chunk_start, chunk_end)
+            slots.extend(earliest_slots(free, duration_minutes * 60, step_minutes * 60, limit - len(slots),
+                                        not_before_epoch, starts_before=chunk_end))
+            chunk_start, chunk_days = chunk_end, chunk_days * 2
+        return [
+            {"provider_id": provider_id, "start_time": epoch_to_datetime_string(start),
+             "end_time": epoch_to_datetime_string(end)}
+            for start, end, provider_id in slots
+        ]
+    except sqlite3.Error as e:
+        print(f"Error in find_first_available_slots for {len(provider_ids)} providers: {e}")
+        raise
+
+
+# --- Free/Busy Bitmaps ---
+
+def _invalidate_day_bitmaps(conn: sqlite3.Connection, provider_id: int, start_epoch: int, end_epoch: int = None):
+    """
+    Drops the provider's built bitmaps for the days [start_epoch, end_epoch) touches (every
+    day from start_epoch on if end_epoch is None), inside the caller's transaction. They are
+    rebuilt on next use.
+    """
+    cursor = conn.cursor()
+    if end_epoch is None:
+        cursor.execute("DELETE FROM provider_day_bitmaps WHERE provider_id = ? AND day_epoch >= ?",
+                       (provider_id, day_start(start_epoch)))
+    else:
+        cursor.execute("DELETE FROM provider_day_bitmaps WHERE provider_id = ? AND day_epoch >= ? AND day_epoch < ?",
+                       (provider_id, day_start(start_epoch), end_epoch))
+
+def _mark_day_bitmaps_busy(conn: sqlite3.Connection, provider_id: int, start_epoch: int, end_epoch: int):
+    """Sets the busy cells of a blocking appointment in the provider's built bitmaps, inside the caller's transaction."""
+    cursor = conn.cursor()
+    for day in days_spanned(start_epoch, end_epoch):
+        cursor.execute("SELECT busy_bits FROM provider_day_bitmaps WHERE provider_id = ? AND day_epoch = ?",
+                       (provider_id, day))
+        row = cursor.fetchone()
+        if row:
+            busy = from_blob(row['busy_bits']) | touched_cells([(start_epoch, end_epoch)], day)
+            cursor.execute("UPDATE provider_day_bitmaps SET busy_bits = ? WHERE provider_id = ? AND day_epoch = ?",
+                           (to_blob(busy), provider_id, day))
+
+def _read_day_bitmaps(conn: sqlite3.Connection, provider_id: int, days: range) -> dict:
+    """Returns {day midnight: (available bits, busy bits)} for the provider's built bitmaps among `days`."""
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT day_epoch, available_bits, busy_bits FROM provider_day_bitmaps
+        WHERE provider_id = ? AND day_epoch >= ? AND day_epoch < ?
+        """,
+        (provider_id, days.start, days.stop)
+    )
+    return {row['day_epoch']: (from_blob(row['available_bits']), from_blob(row['busy_bits']))
+            for row in cursor.fetchall()}
+
+def _build_day_bitmap(conn: sqlite3.Connection, provider_id: int, day: int) -> tuple[int, int]:
+    """Builds (available bits, busy bits) for one provider day from the availability and appointment tables."""
+    day_end = day + SECONDS_PER_DAY
+    return (covered_cells(_get_available_intervals(conn, provider_id, day, day_end), day),
+            touched_cells(_get_busy_intervals(conn, provider_id, day, day_end), day))
+
+def _load_day_bitmaps(conn: sqlite3.Connection, provider_id: int, start_epoch: int, end_epoch: int) -> dict:
+    """
+    Returns {day midnight: (available bits, busy bits)} for the days [start_epoch, end_epoch) touches.
+
+    Missing days are built and stored under BEGIN IMMEDIATE, so no booking can commit between
+    reading the appointments and storing the bitmap. If the caller already has a transaction
+    open, missing days are built from what it sees but not stored, leaving its transaction alone.
+    """
+    days = days_spanned(start_epoch, end_epoch)
+    bitmaps = _read_day_bitmaps(conn, provider_id, days)
+    if len(bitmaps) == len(days):
+        return bitmaps
+    if conn.in_transaction:
+        for day in days:
+            if day not in bitmaps:
+                bitmaps[day] = _build_day_bitmap(conn, provider_id, day)
+        return bitmaps
+
+    begin_immediate(conn)
+    try:
+        bitmaps = _read_day_bitmaps(conn, provider_id, days) # Another writer may have built some meanwhile
+        for day in days:
+            if day not in bitmaps:
+                bitmaps[day] = _build_day_bitmap(conn, provider_id, day)
+                conn.execute(
+                    """
+                    INSERT INTO provider_day_bitmaps (provider_id, day_epoch, available_bits, busy_bits)
+                    VALUES (?, ?, ?, ?)
+                    """,
+                    (provider_id, day, to_blob(bitmaps[day][0]), to_blob(bitmaps[day][1]))
+                )
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return bitmaps
+
+def is_provider_free(conn: sqlite3.Connection, provider_id: int, start_time: str, end_time: str) -> bool:
+    """
+    Checks whether the provider is available and has no blocking appointment in a time range.
+
+    Answered from the provider's daily bitmaps (see availability_bitmaps), so a check is a
+    primary-key read and a few bitwise operations; days not yet built are built and stored
+    first, in their own write transaction (never inside one the caller has open). Exact for
+    5-minute aligned times; a range that splits a 5-minute cell counts the whole cell. Slot holds are not part of the bitmaps (see get_bookable_slots).
+
+    Args:
+        conn: Active SQLite3 connection.
+        provider_id: The ID of the provider.
+        start_time: Range start (YYYY-MM-DD HH:MM:SS string).
+        end_time: Range end, exclusive (YYYY-MM-DD HH:MM:SS string).
+
+    Returns:
+        True if the whole range is free.
+
+    Raises:
+        ValueError: For invalid inputs or a range longer than MAX_APPOINTMENT_HOURS.
+        sqlite3.Error: If a database error occurs.
+    """
+    if not isinstance(provider_id, int):
+        raise ValueError("provider_id must be an integer.")
+    start_epoch, end_epoch = datetime_to_epoch(start_time), datetime_to_epoch(end_time)
+    if end_epoch <= start_epoch:
+        raise ValueError("end_time must be after start_time.")
+    if end_epoch - start_epoch > MAX_APPOINTMENT_HOURS * 3600:
+        raise ValueError(f"The range cannot be longer than {MAX_APPOINTMENT_HOURS} hours.")
+
+    try:
+        return is_range_free(_load_day_bitmaps(conn, provider_id, start_epoch, end_epoch), start_epoch, end_epoch)
+    except sqlite3.Error as e:
+        print(f"Error in is_provider_free for provider {provider_id}: {e}")
+        raise
+
 if __name__ == '__main__':
     import os
     db_file = 'test_appointment_utils.db'
@@ -304,12 +959,60 @@ if __name__ == '__main__':
     finally:
         if conn:
             conn.close()
+            close_pool(db_file) # Release pooled file handles so the WAL is checkpointed before removal
             print(f"\nClosed connection to {db_file}.")
         if os.path.exists(db_file):
             os.remove(db_file)
             print(f"Removed test database {db_file}.")
 
 
+# Rows per chunk read by iter_appointments_needing_reminders.
+REMINDER_CANDIDATE_CHUNK_SIZE = 500
+
+_REMINDER_APPOINTMENTS_SELECT = """
+    SELECT
+        a.appointment_id,
+        a.patient_id,
+        a.provider_id,
+        a.appointment_start_time,
+        a.reason_for_visit,
+        a.last_reminder_sent_at,
+        pat.username AS patient_username,
+        pat.email AS patient_email,
+        pat.phone AS patient_phone,
+        pro.username AS provider_username,
+        pro.email AS provider_email,
+        pro.phone AS provider_phone
+    FROM appointments a
+    JOIN users pat ON a.patient_id = pat.user_id
+    JOIN users pro ON a.provider_id = pro.user_id"""
+
+_REMINDER_CANDIDATES_SELECT = _REMINDER_APPOINTMENTS_SELECT + """
+    WHERE
+        a.status = 'confirmed'
+        AND a.appointment_start_epoch >= ?
+        AND a.appointment_start_epoch < ?
+        AND (
+            a.last_reminder_sent_epoch IS NULL
+            OR a.last_reminder_sent_epoch < ?
+        )"""
+
+def _reminder_query_params(window_start_iso: str, window_end_iso: str, reminder_grace_period_hours: int) -> list:
+    """Validates the reminder window arguments and returns the parameters for _REMINDER_CANDIDATES_SELECT."""
+    if not all(isinstance(arg, str) for arg in [window_start_iso, window_end_iso]):
+        raise ValueError("window_start_iso and window_end_iso must be string representations of datetime.")
+    try:
+        window_start_epoch = datetime_to_epoch(window_start_iso)
+        window_end_epoch = datetime_to_epoch(window_end_iso)
+    except ValueError:
+        raise ValueError("Invalid ISO datetime format for window_start_iso or window_end_iso. Use YYYY-MM-DD HH:MM:SS.")
+    if not isinstance(reminder_grace_period_hours, int) or reminder_grace_period_hours < 0:
+        raise ValueError("reminder_grace_period_hours must be a non-negative integer.")
+
+    # Calculate the cutoff time for "recent enough" reminders
+    grace_period_cutoff_epoch = now_epoch() - reminder_grace_period_hours * 3600
+    return [window_start_epoch, window_end_epoch, grace_period_cutoff_epoch]
+
 def get_appointments_needing_reminders(conn: sqlite3.Connection, window_start_iso: str,
                                        window_end_iso: str, reminder_grace_period_hours: int = 1) -> list[dict]:
     """
@@ -321,6 +1024,9 @@ def get_appointments_needing_reminders(conn: sqlite3.Connection, window_start_is
     - Its `last_reminder_sent_at` is NULL OR it was sent earlier than
       (now - reminder_grace_period_hours).
 
+    The whole window is read into memory; for wide windows prefer
+    iter_appointments_needing_reminders.
+
     Args:
         conn: Active SQLite3 connection.
         window_start_iso: ISO format datetime string for the start of the reminder window.
@@ -337,61 +1043,83 @@ def get_appointments_needing_reminders(conn: sqlite3.Connection, window_start_is
         ValueError: For invalid input datetime formats or grace period.
         sqlite3.Error: For database errors.
     """
-    if not all(isinstance(arg, str) for arg in [window_start_iso, window_end_iso]):
-        raise ValueError("window_start_iso and window_end_iso must be string representations of datetime.")
-    try:
-        datetime.strptime(window_start_iso, '%Y-%m-%d %H:%M:%S')
-        datetime.strptime(window_end_iso, '%Y-%m-%d %H:%M:%S')
-    except ValueError:
-        raise ValueError("Invalid ISO datetime format for window_start_iso or window_end_iso. Use YYYY-MM-DD HH:MM:SS.")
-    if not isinstance(reminder_grace_period_hours, int) or reminder_grace_period_hours < 0:
-        raise ValueError("reminder_grace_period_hours must be a non-negative integer.")
-
-    appointments_to_remind = []
+    params = _reminder_query_params(window_start_iso, window_end_iso, reminder_grace_period_hours)
     cursor = conn.cursor()
-
-    # Calculate the cutoff time for "recent enough" reminders
-    grace_period_cutoff_dt = datetime.now() - datetime.timedelta(hours=reminder_grace_period_hours)
-    grace_period_cutoff_iso = grace_period_cutoff_dt.strftime('%Y-%m-%d %H:%M:%S')
-
-    query = """
-    SELECT
-        a.appointment_id,
-        a.patient_id,
-        a.provider_id,
-        a.appointment_start_time,
-        a.reason_for_visit,
-        a.last_reminder_sent_at,
-        pat.username AS patient_username,
-        pat.email AS patient_email,
-        pat.phone AS patient_phone,
-        pro.username AS provider_username,
-        pro.email AS provider_email,
-        pro.phone AS provider_phone
-    FROM appointments a
-    JOIN users pat ON a.patient_id = pat.user_id
-    JOIN users pro ON a.provider_id = pro.user_id
-    WHERE
-        a.status = 'confirmed'
-        AND a.appointment_start_time >= ?
-        AND a.appointment_start_time < ?
-        AND (
-            a.last_reminder_sent_at IS NULL
-            OR a.last_reminder_sent_at < ?
-        );
-    """
-    # Parameters for the query
-    params = (window_start_iso, window_end_iso, grace_period_cutoff_iso)
-
     try:
-        cursor.execute(query, params)
-        for row in cursor.fetchall():
-            appointments_to_remind.append(dict(row))
-        return appointments_to_remind
+        cursor.execute(_REMINDER_CANDIDATES_SELECT, params)
+        return [dict(row) for row in cursor.fetchall()]
     except sqlite3.Error as e:
         print(f"Error in get_appointments_needing_reminders: {e}")
         raise # Re-raise to be handled by the job scheduler or caller
 
+def iter_appointments_needing_reminders(conn: sqlite3.Connection, window_start_iso: str, window_end_iso: str,
+                                        reminder_grace_period_hours: int = 1,
+                                        chunk_size: int = REMINDER_CANDIDATE_CHUNK_SIZE,
+                                        shard_ids: list[int] = None, shard_count: int = None):
+    """
+    Streams the appointments get_appointments_needing_reminders would return, in chunks.
+
+    Each chunk is one query reading at most `chunk_size` rows in (appointment_start_time,
+    appointment_id) order; the next chunk continues after the last key seen (keyset
+    continuation), a range read on idx_appt_status_start_epoch starting at the last key's
+    start time (only appointments tied on that start time are re-read). Memory therefore depends
+    on `chunk_size`, not on the width of the window. No statement is left open between
+    chunks, so the caller may write in between: marking streamed appointments as
+    reminded does not make later chunks skip or repeat rows.
+
+    Args:
+        conn: Active SQLite3 connection.
+        window_start_iso, window_end_iso, reminder_grace_period_hours: See get_appointments_needing_reminders.
+        chunk_size: Maximum number of appointments per chunk.
+        shard_ids, shard_count: If given, only appointments whose provider_id % shard_count is
+                                one of shard_ids (see acquire_reminder_shards).
+
+    Yields:
+        list[dict]: Non-empty chunks of appointment dictionaries (same fields as get_appointments_needing_reminders).
+
+    Raises:
+        ValueError: For invalid input datetime formats, grace period, chunk_size or shards (when iteration starts).
+        sqlite3.Error: For database errors.
+    """
+    if not isinstance(chunk_size, int) or chunk_size < 1:
+        raise ValueError("chunk_size must be a positive integer.")
+    params = _reminder_query_params(window_start_iso, window_end_iso, reminder_grace_period_hours)
+    candidates_select = _REMINDER_CANDIDATES_SELECT
+    if shard_ids is not None:
+        if not isinstance(shard_count, int) or shard_count < 1:
+            raise ValueError("shard_count must be a positive integer when shard_ids are given.")
+        if not shard_ids:
+            return
+        # Filters the rows the status/start range read finds; the range itself is unchanged
+        candidates_select += f"""
+        AND a.provider_id % {shard_count} IN ({', '.join(str(int(shard_id)) for shard_id in shard_ids)})"""
+    first_chunk_query = candidates_select + """
+    ORDER BY a.appointment_start_epoch, a.appointment_id
+    LIMIT ?"""
+    next_chunk_query = candidates_select + """
+        AND (a.appointment_start_epoch, a.appointment_id) > (?, ?)
+    ORDER BY a.appointment_start_epoch, a.appointment_id
+    LIMIT ?"""
+
+    last_key = None
+    while True:
+        try:
+            if last_key is None:
+                rows = conn.execute(first_chunk_query, params + [chunk_size]).fetchall()
+            else:
+                # The window's lower bound moves up to the last key, so the index range starts there
+                rows = conn.execute(next_chunk_query,
+                                    [last_key[0]] + params[1:] + list(last_key) + [chunk_size]).fetchall()
+        except sqlite3.Error as e:
+            print(f"Error in iter_appointments_needing_reminders: {e}")
+            raise
+        if not rows:
+            return
+        chunk = [dict(row) for row in rows]
+        last_key = (datetime_to_epoch(chunk[-1]['appointment_start_time']), chunk[-1]['appointment_id'])
+        yield chunk
+        if len(rows) < chunk_size:
+            return
 
 if __name__ == '__main__':
     import os
@@ -418,16 +1146,14 @@ def mark_reminder_sent(conn: sqlite3.Connection, appointment_id: int, reminder_t
         raise ValueError("appointment_id must be an integer.")
 
     if reminder_time:
-        # Optional: Validate reminder_time format if strictness is needed here,
-        # though SQLite will often accept various formats if they are unambiguous.
-        # For consistency, ensure YYYY-MM-DD HH:MM:SS
+        # Must be YYYY-MM-DD HH:MM:SS so last_reminder_sent_epoch is derived correctly
         try:
-            datetime.strptime(reminder_time, '%Y-%m-%d %H:%M:%S')
+            parse_datetime(reminder_time)
         except ValueError:
             raise ValueError("Invalid reminder_time format. Use YYYY-MM-DD HH:MM:SS.")
         timestamp_to_set = reminder_time
     else:
-        timestamp_to_set = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        timestamp_to_set = now_datetime_string()
 
     cursor = conn.cursor()
     try:
@@ -442,15 +1168,542 @@ def mark_reminder_sent(conn: sqlite3.Connection, appointment_id: int, reminder_t
         conn.rollback()
         raise
 
+def mark_reminders_sent(conn: sqlite3.Connection, appointment_ids: list[int], reminder_time: str = None) -> int:
+    """
+    Marks many appointments as reminded in a single transaction.
+
+    Same effect as calling mark_reminder_sent for each ID, but with one commit (and so
+    one WAL sync) for the whole batch instead of one per appointment.
+
+    Args:
+        conn: Active SQLite3 connection.
+        appointment_ids: IDs of the appointments to update.
+        reminder_time: Optional datetime string (YYYY-MM-DD HH:MM:SS) for when the reminders
+                       were sent. If None, the current timestamp is used for all of them.
+
+    Returns:
+        The number of appointments updated (IDs that do not exist are skipped).
+
+    Raises:
+        ValueError: If an appointment_id is not an integer or reminder_time format is invalid (if provided).
+        sqlite3.Error: If a database error occurs; no appointment in the batch is marked.
+    """
+    if not all(isinstance(appointment_id, int) for appointment_id in appointment_ids):
+        raise ValueError("appointment_ids must be integers.")
+    if not appointment_ids:
+        return 0
+
+    if reminder_time:
+        try:
+            parse_datetime(reminder_time)
+        except ValueError:
+            raise ValueError("Invalid reminder_time format. Use YYYY-MM-DD HH:MM:SS.")
+        timestamp_to_set = reminder_time
+    else:
+        timestamp_to_set = now_datetime_string()
+
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(
+            "UPDATE appointments SET last_reminder_sent_at = ? WHERE appointment_id = ?",
+            [(timestamp_to_set, appointment_id) for appointment_id in appointment_ids]
+        )
+        conn.commit()
+        return cursor.rowcount
+    except sqlite3.Error as e:
+        print(f"Error in mark_reminders_sent for {len(appointment_ids)} appointments: {e}")
+        conn.rollback()
+        raise
+
+# --- Notification Outbox ---
+# Reminders go through notification_outbox instead of being sent inline: the job enqueues
+# one row per notification in the same transaction that marks the appointments as
+# reminded, so a crash can neither lose a reminder nor send it twice from a rerun. A
+# dispatcher then claims due rows under a lease, sends them and records the outcome.
+# Failed sends are retried with exponential backoff; after OUTBOX_MAX_ATTEMPTS the row is
+# dead-lettered ('dead') for someone to look at. A dispatcher that dies mid-send leaves
+# its rows 'sending'; they are claimed again when the lease runs out, and the
+# idempotency key lets the provider drop the duplicate. Each claim counts one attempt, so
+# (notification_id, attempts) identifies a claim: a dispatcher that outlived its lease
+# cannot record an outcome over the new owner's claim. Reminders for appointments that are
+# no longer confirmed are dead-lettered when they come due instead of being sent.
+OUTBOX_MAX_ATTEMPTS = 6
+OUTBOX_BASE_BACKOFF_SECONDS = 60     # Wait after the first failure; doubles after each further one
+OUTBOX_MAX_BACKOFF_SECONDS = 3600
+OUTBOX_LEASE_SECONDS = 300           # How long a claimed row is left to its dispatcher
+_REMINDER_CONTACT_COLUMNS = (('email', 'patient_email'), ('sms', 'patient_phone'))
+
+def enqueue_reminder_notifications(conn: sqlite3.Connection, appointments: list[dict], reminder_time: str = None,
+                                   offset_minutes: int = None) -> dict:
+    """
+    Queues email/SMS reminders for appointments and marks the appointments as reminded, atomically.
+
+    One notification is queued per contact the patient has (patient_email, patient_phone),
+    keyed by appointment, channel and start time: enqueueing the same appointment again
+    (e.g. a rerun after a crash) adds nothing, while a rescheduled appointment gets new
+    reminders. Appointments without any contact are left unmarked. last_reminder_sent_at
+    therefore records when the reminder was queued; delivery is tracked in the outbox.
+
+    Args:
+        conn: Active SQLite3 connection.
+        appointments: Rows as returned by get_appointments_needing_reminders.
+        reminder_time: Optional datetime string (YYYY-MM-DD HH:MM:SS) to record as the reminder
+                       time. If None, the current timestamp is used.
+        offset_minutes: For the reminder daemon, which sends several reminders per appointment:
+                        how long before the start this reminder is, made part of the key so
+                        each offset is queued once.
+
+    Returns:
+        A dictionary with appointments_marked and notifications_enqueued (new outbox rows).
+
+    Raises:
+        ValueError: If reminder_time format is invalid (if provided).
+        sqlite3.Error: If a database error occurs; nothing is queued or marked.
+    """
+    if reminder_time:
+        try:
+            parse_datetime(reminder_time)
+        except ValueError:
+            raise ValueError("Invalid reminder_time format. Use YYYY-MM-DD HH:MM:SS.")
+        timestamp_to_set = reminder_time
+    else:
+        timestamp_to_set = now_datetime_string()
+
+    now = now_epoch()
+    notifications, marked_ids = [], []
+    for appt in appointments:
+        contacts = [(channel, appt[column]) for channel, column in _REMINDER_CONTACT_COLUMNS if appt.get(column)]
+        if not contacts:
+            continue
+        payload = json.dumps(appt)
+        for channel, address in contacts:
+            key = f"reminder:{appt['appointment_id']}:{channel}:{datetime_to_epoch(appt['appointment_start_time'])}"
+            if offset_minutes is not None:
+                key += f":{offset_minutes}m"
+            notifications.append((key, appt['appointment_id'], channel, address, payload, now))
+        marked_ids.append((timestamp_to_set, appt['appointment_id']))
+    if not notifications:
+        return {"appointments_marked": 0, "notifications_enqueued": 0}
+
+    cursor = conn.cursor()
+    begin_immediate(conn)
+    try:
+        cursor.executemany(
+            """
+            INSERT OR IGNORE INTO notification_outbox
+                (idempotency_key, appointment_id, channel, address, payload, next_attempt_epoch)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            notifications
+        )
+        enqueued = cursor.rowcount # INSERT OR IGNORE: rows already queued are not counted
+        cursor.executemany("UPDATE appointments SET last_reminder_sent_at = ? WHERE appointment_id = ?", marked_ids)
+        marked = cursor.rowcount
+        conn.commit()
+        return {"appointments_marked": marked, "notifications_enqueued": enqueued}
+    except sqlite3.Error as e:
+        print(f"Error in enqueue_reminder_notifications for {len(appointments)} appointments: {e}")
+        conn.rollback()
+        raise
+
+def claim_due_notifications(conn: sqlite3.Connection, limit: int = 100,
+                            lease_seconds: int = OUTBOX_LEASE_SECONDS, now: int = None) -> list[dict]:
+    """
+    Claims up to `limit` due outbox notifications for delivery.
+
+    Due means pending with next_attempt_epoch reached, or sending with an expired lease
+    (its dispatcher died). Claimed rows become 'sending' for `lease_seconds` and count
+    one attempt. The claim is a single UPDATE, so concurrent dispatchers never claim
+    the same row. Due rows whose appointment is no longer confirmed are dead-lettered in
+    the same transaction instead of being claimed.
+
+    Args:
+        conn: Active SQLite3 connection.
+        limit: Maximum number of notifications to claim.
+        lease_seconds: How long the caller has to record the outcome (see record_notification_results).
+        now: Current time in epoch seconds; defaults to now_epoch().
+
+    Returns:
+        Claimed notifications, oldest due first, each a dictionary with notification_id,
+        channel, address, attempts (which identifies this claim, see record_notification_results)
+        and details (the appointment details, plus idempotency_key).
+
+    Raises:
+        sqlite3.Error: If a database error occurs.
+    """
+    now = now_epoch() if now is None else now
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            UPDATE notification_outbox
+            SET status = 'dead', last_error = 'Appointment is no longer confirmed'
+            WHERE notification_id IN (
+                SELECT o.notification_id FROM notification_outbox o
+                JOIN appointments a ON a.appointment_id = o.appointment_id
+                WHERE o.status IN ('pending', 'sending') AND o.next_attempt_epoch <= ?
+                  AND a.status != 'confirmed'
+            )
+            """,
+            (now,)
+        )
+        cursor.execute(
+            """
+            UPDATE notification_outbox
+            SET status = 'sending', attempts = attempts + 1, next_attempt_epoch = ?
+            WHERE notification_id IN (
+                SELECT notification_id FROM notification_outbox
+                WHERE status IN ('pending', 'sending') AND next_attempt_epoch <= ?
+                ORDER BY next_attempt_epoch
+                LIMIT ?
+            )
+            RETURNING notification_id, idempotency_key, channel, address, payload, attempts
+            """,
+            (now + lease_seconds, now, limit)
+        )
+        rows = cursor.fetchall()
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Error in claim_due_notifications: {e}")
+        conn.rollback()
+        raise
+
+    claimed = []
+    for row in sorted(rows, key=lambda row: row['notification_id']):
+        details = json.loads(row['payload'])
+        details['idempotency_key'] = row['idempotency_key']
+        claimed.append({
+            "notification_id": row['notification_id'],
+            "channel": row['channel'],
+            "address": row['address'],
+            "attempts": row['attempts'],
+            "details": details,
+        })
+    return claimed
+
+def record_notification_results(conn: sqlite3.Connection, results: list[tuple], now: int = None,
+                                max_attempts: int = OUTBOX_MAX_ATTEMPTS) -> dict:
+    """
+    Records the outcome of claimed notifications in one transaction.
+
+    Sent notifications become 'sent'. Failed ones go back to 'pending' with a backoff of
+    OUTBOX_BASE_BACKOFF_SECONDS * 2^(attempts - 1), capped at OUTBOX_MAX_BACKOFF_SECONDS,
+    or become 'dead' once they have had `max_attempts` attempts. Rows whose claim was
+    lost (no longer 'sending', or claimed again since) are left alone.
+
+    Args:
+        conn: Active SQLite3 connection.
+        results: (notification_id, attempts, sent, error message or None) tuples, attempts
+                 being the value claim_due_notifications returned with the notification.
+        now: Current time in epoch seconds; defaults to now_epoch().
+        max_attempts: Attempts after which a failing notification is dead-lettered.
+
+    Returns:
+        A dictionary with the number of notifications now sent, retrying and dead.
+
+    Raises:
+        sqlite3.Error: If a database error occurs.
+    """
+    counts = {"sent": 0, "retrying": 0, "dead": 0}
+    if not results:
+        return counts
+    now = now_epoch() if now is None else now
+    sent_at = epoch_to_datetime_string(now)
+    sent = [(sent_at, notification_id, attempts) for notification_id, attempts, was_sent, _ in results if was_sent]
+    failed = [(max_attempts, now, OUTBOX_BASE_BACKOFF_SECONDS, OUTBOX_MAX_BACKOFF_SECONDS, error or "Send failed",
+               notification_id, attempts) for notification_id, attempts, was_sent, error in results if not was_sent]
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(
+            """
+            UPDATE notification_outbox SET status = 'sent', sent_at = ?, last_error = NULL
+            WHERE notification_id = ? AND attempts = ? AND status = 'sending'
+            """,
+            sent
+        )
+        cursor.executemany(
+            """
+            UPDATE notification_outbox
+            SET status = CASE WHEN attempts >= ? THEN 'dead' ELSE 'pending' END,
+                next_attempt_epoch = ? + MIN(? << (attempts - 1), ?),
+                last_error = ?
+            WHERE notification_id = ? AND attempts = ? AND status = 'sending'
+            """,
+            failed
+        )
+        claims = {(notification_id, attempts) for notification_id, attempts, _, _ in results}
+        ids = [notification_id for notification_id, _ in claims]
+        for notification_id, attempts, status in cursor.execute(
+                f"SELECT notification_id, attempts, status FROM notification_outbox "
+                f"WHERE notification_id IN ({', '.join('?' * len(ids))})", ids):
+            outcome = {"pending": "retrying"}.get(status, status)
+            if (notification_id, attempts) in claims and outcome in counts: # Otherwise claimed again since
+                counts[outcome] += 1
+        conn.commit()
+        return counts
+    except sqlite3.Error as e:
+        print(f"Error in record_notification_results for {len(results)} notifications: {e}")
+        conn.rollback()
+        raise
+
+def get_next_notification_attempt_epoch(conn: sqlite3.Connection) -> int | None:
+    """
+    Returns when the next outbox notification becomes due (a pending retry or an expiring
+    lease), in epoch seconds, or None if nothing is waiting. Lets a long-running
+    dispatcher sleep until then instead of polling.
+    """
+    try:
+        row = conn.execute("""
+            SELECT MIN(next_attempt_epoch) FROM notification_outbox
+            WHERE status IN ('pending', 'sending')
+        """).fetchone()
+        return row[0]
+    except sqlite3.Error as e:
+        print(f"Error in get_next_notification_attempt_epoch: {e}")
+        raise
+
+# --- Reminder Daemon Queries ---
+# The reminder daemon (appointment_reminder_job.run_reminder_daemon) loads upcoming
+# confirmed appointments once, follows appointment_changes from then on, and fetches an
+# appointment's details only when one of its reminders is due.
+
+def get_confirmed_appointment_starts(conn: sqlite3.Connection, from_epoch: int, to_epoch: int) -> list[tuple[int, int]]:
+    """
+    Returns (appointment_id, appointment_start_epoch) for confirmed appointments starting in
+    [from_epoch, to_epoch), in start order. A range read on idx_appt_status_start_epoch that
+    never touches the table rows.
+
+    Raises:
+        sqlite3.Error: For database errors.
+    """
+    try:
+        cursor = conn.execute("""
+            SELECT appointment_id, appointment_start_epoch FROM appointments
+            WHERE status = 'confirmed' AND appointment_start_epoch >= ? AND appointment_start_epoch < ?
+            ORDER BY appointment_start_epoch
+        """, (from_epoch, to_epoch))
+        return [(row[0], row[1]) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        print(f"Error in get_confirmed_appointment_starts: {e}")
+        raise
+
+def get_reminder_appointments(conn: sqlite3.Connection, appointment_starts: list[tuple[int, int]]) -> list[dict]:
+    """
+    Fetches reminder details for the given appointments, if each is still confirmed and
+    still starts at the given time.
+
+    Args:
+        conn: Active SQLite3 connection.
+        appointment_starts: (appointment_id, appointment_start_epoch) pairs.
+
+    Returns:
+        Appointment dictionaries with the fields of get_appointments_needing_reminders, in appointment_id order.
+        Appointments cancelled or rescheduled since are left out.
+
+    Raises:
+        sqlite3.Error: For database errors.
+    """
+    if not appointment_starts:
+        return []
+    expected_starts = dict(appointment_starts)
+    ids = list(expected_starts)
+    try:
+        cursor = conn.execute(_REMINDER_APPOINTMENTS_SELECT + f"""
+            WHERE a.appointment_id IN ({', '.join('?' * len(ids))})
+              AND +a.status = 'confirmed' -- Unary +: seek the IDs, not every confirmed appointment
+            ORDER BY a.appointment_id
+        """, ids)
+        rows = cursor.fetchall()
+    except sqlite3.Error as e:
+        print(f"Error in get_reminder_appointments: {e}")
+        raise
+    return [dict(row) for row in rows
+            if datetime_to_epoch(row['appointment_start_time']) == expected_starts[row['appointment_id']]]
+
+def get_latest_appointment_change_id(conn: sqlite3.Connection) -> int:
+    """Returns the change_id of the newest row in appointment_changes, or 0 if there is none."""
+    try:
+        return conn.execute("SELECT COALESCE(MAX(change_id), 0) FROM appointment_changes").fetchone()[0]
+    except sqlite3.Error as e:
+        print(f"Error in get_latest_appointment_change_id: {e}")
+        raise
+
+def get_appointment_changes(conn: sqlite3.Connection, after_change_id: int, limit: int = 1000) -> list[dict]:
+    """
+    Reads the appointment change feed.
+
+    Args:
+        conn: Active SQLite3 connection.
+        after_change_id: The last change_id already applied (0 for the start of the feed).
+        limit: Maximum number of changes to return.
+
+    Returns:
+        Up to `limit` changes after `after_change_id`, oldest first, each a dictionary with
+        change_id, appointment_id, status and appointment_start_epoch.
+
+    Raises:
+        sqlite3.Error: For database errors.
+    """
+    try:
+        cursor = conn.execute("""
+            SELECT change_id, appointment_id, status, appointment_start_epoch FROM appointment_changes
+            WHERE change_id > ?
+            ORDER BY change_id
+            LIMIT ?
+        """, (after_change_id, limit))
+        return [dict(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        print(f"Error in get_appointment_changes: {e}")
+        raise
+
+def prune_appointment_changes(conn: sqlite3.Connection,
+                              retention_seconds: int = APPOINTMENT_CHANGE_RETENTION_SECONDS) -> int:
+    """
+    Deletes change feed rows older than `retention_seconds`. A reader that falls further
+    behind than that must reload instead of following the feed.
+
+    Returns:
+        The number of rows deleted.
+
+    Raises:
+        sqlite3.Error: For database errors.
+    """
+    try:
+        cursor = conn.execute("DELETE FROM appointment_changes WHERE changed_epoch < ?",
+                              (now_epoch() - retention_seconds,))
+        conn.commit()
+        return cursor.rowcount
+    except sqlite3.Error as e:
+        print(f"Error in prune_appointment_changes: {e}")
+        conn.rollback()
+        raise
+
+# --- Reminder Shard Leases ---
+# Reminder workers on several hosts split the candidate appointments by provider:
+# shard k is every appointment with provider_id % shard_count == k. A worker queues
+# reminders only for the shards it holds a lease on. Each call to acquire_reminder_shards
+# is the worker's heartbeat: it renews the worker's leases and rebalances, so every live
+# worker ends up with an equal share and a dead worker's shards are taken over once its
+# leases expire. Leases are an efficiency measure, not a correctness one: a worker that
+# keeps going past its lease at worst queues a reminder another worker also queues, and
+# the outbox idempotency key drops the duplicate.
+REMINDER_SHARD_LEASE_SECONDS = 120
+
+def acquire_reminder_shards(conn: sqlite3.Connection, worker_id: str, shard_count: int,
+                            lease_seconds: int = REMINDER_SHARD_LEASE_SECONDS, now: int = None) -> list[int]:
+    """
+    Records a worker heartbeat, renews its shard leases and rebalances, in one transaction.
+
+    Live workers are those with a heartbeat in the last `lease_seconds`. Sorted by
+    worker_id, the first shard_count % live of them get shard_count // live + 1 shards
+    and the rest shard_count // live. A worker over its share releases its highest
+    shards; one under it claims free or expired shards, lowest first. A worker that just
+    joined therefore gets its share once the others have run their next heartbeat.
+
+    Args:
+        conn: Active SQLite3 connection.
+        worker_id: Unique name of the worker (e.g. host:pid).
+        shard_count: Number of shards the candidate set is split into; the same for all workers.
+        lease_seconds: How long the leases (and the heartbeat) last without renewal.
+        now: Current time in epoch seconds; defaults to now_epoch().
+
+    Returns:
+        The shard IDs the worker holds, ascending.
+
+    Raises:
+        ValueError: If shard_count is not a positive integer.
+        sqlite3.Error: If a database error occurs.
+    """
+    if not isinstance(shard_count, int) or shard_count < 1:
+        raise ValueError("shard_count must be a positive integer.")
+    now = now_epoch() if now is None else now
+    cursor = conn.cursor()
+    begin_immediate(conn)
+    try:
+        cursor.execute("INSERT OR REPLACE INTO reminder_workers (worker_id, heartbeat_epoch) VALUES (?, ?)",
+                       (worker_id, now))
+        cursor.execute("DELETE FROM reminder_workers WHERE heartbeat_epoch <= ?", (now - lease_seconds,))
+        live_workers = [row[0] for row in cursor.execute("SELECT worker_id FROM reminder_workers ORDER BY worker_id")]
+        rank = live_workers.index(worker_id)
+        share = shard_count // len(live_workers) + (1 if rank < shard_count % len(live_workers) else 0)
+
+        cursor.executemany("INSERT OR IGNORE INTO reminder_shard_leases (shard_id) VALUES (?)",
+                           [(shard_id,) for shard_id in range(shard_count)])
+        cursor.execute("""
+            UPDATE reminder_shard_leases SET lease_expires_epoch = ?
+            WHERE worker_id = ? AND lease_expires_epoch > ? AND shard_id < ?
+        """, (now + lease_seconds, worker_id, now, shard_count))
+        held = [row[0] for row in cursor.execute("""
+            SELECT shard_id FROM reminder_shard_leases
+            WHERE worker_id = ? AND lease_expires_epoch > ? AND shard_id < ?
+            ORDER BY shard_id
+        """, (worker_id, now, shard_count))]
+        if len(held) > share:
+            cursor.executemany(
+                "UPDATE reminder_shard_leases SET worker_id = NULL, lease_expires_epoch = 0 WHERE shard_id = ?",
+                [(shard_id,) for shard_id in held[share:]])
+            held = held[:share]
+        elif len(held) < share:
+            cursor.execute("""
+                UPDATE reminder_shard_leases SET worker_id = ?, lease_expires_epoch = ?
+                WHERE shard_id IN (
+                    SELECT shard_id FROM reminder_shard_leases
+                    WHERE lease_expires_epoch <= ? AND shard_id < ?
+                    ORDER BY shard_id
+                    LIMIT ?
+                )
+                RETURNING shard_id
+            """, (worker_id, now + lease_seconds, now, shard_count, share - len(held)))
+            held = sorted(held + [row[0] for row in cursor.fetchall()])
+        conn.commit()
+        return held
+    except sqlite3.Error as e:
+        print(f"Error in acquire_reminder_shards for worker {worker_id}: {e}")
+        conn.rollback()
+        raise
+
+def release_reminder_shards(conn: sqlite3.Connection, worker_id: str) -> int:
+    """
+    Releases a stopping worker's shard leases and removes its heartbeat, so that the other
+    workers take its shards over at their next heartbeat instead of after the lease expires.
+
+    Returns:
+        The number of shards released.
+
+    Raises:
+        sqlite3.Error: If a database error occurs.
+    """
+    begin_immediate(conn)
+    try:
+        released = conn.execute(
+            "UPDATE reminder_shard_leases SET worker_id = NULL, lease_expires_epoch = 0 WHERE worker_id = ?",
+            (worker_id,)).rowcount
+        conn.execute("DELETE FROM reminder_workers WHERE worker_id = ?", (worker_id,))
+        conn.commit()
+        return released
+    except sqlite3.Error as e:
+        print(f"Error in release_reminder_shards for worker {worker_id}: {e}")
+        conn.rollback()
+        raise
+
 # --- Appointment Management Functions ---
 
 def request_appointment(conn: sqlite3.Connection, patient_id: int, provider_id: int,
                         start_time: str, end_time: str, reason_for_visit: str = None,
-                        notes_by_patient: str = None) -> int | None:
+                        notes_by_patient: str = None, hold_id: str = None) -> int | None:
     """
     Inserts a new appointment request into the appointments table.
     The initial status is set to 'pending_provider_confirmation'.
 
+    The request is checked and written in one `BEGIN IMMEDIATE` transaction: the
+    requested time must lie within one stretch of the provider's availability
+    (recurring blocks included), must not be held by another patient (see place_hold),
+    and the overlap trigger rejects it if another blocking appointment with the
+    provider already holds any of that time. Time held by another patient is refused
+    before the transaction starts when the in-memory hold registry flags it and
+    appointment_holds confirms it, so contended requests fail without taking the write
+    lock. On success the patient's holds with this provider are released.
+
     Args:
         conn: Active SQLite3 connection.
         patient_id: ID of the patient requesting the appointment.
@@ -459,25 +1712,56 @@ def request_appointment(conn: sqlite3.Connection, patient_id: int, provider_id:
         end_time: Scheduled end time (YYYY-MM-DD HH:MM:SS string).
         reason_for_visit: Optional reason for the visit.
         notes_by_patient: Optional notes from the patient.
+        hold_id: Optional hold placed by this patient with place_hold. If given, it must be
+                 unexpired and cover the requested time.
 
     Returns:
         The appointment_id of the newly created appointment, or None on failure before insert.
 
     Raises:
-        ValueError: If input parameters are invalid (e.g., non-integer IDs).
+        ValueError: If input parameters are invalid (e.g., non-integer IDs, times not YYYY-MM-DD HH:MM:SS,
+                    longer than MAX_APPOINTMENT_HOURS), the time is outside the provider's availability,
+                    or `hold_id` is unknown, expired or does not cover the time.
+        AppointmentConflictError: If the time overlaps another blocking appointment with the provider,
+                                  or is held by another patient.
         sqlite3.Error: If a database error occurs (e.g., FK constraint, CHECK constraint).
     """
     if not all(isinstance(id_val, int) for id_val in [patient_id, provider_id]):
         raise ValueError("patient_id and provider_id must be integers.")
     if not all(isinstance(time_str, str) for time_str in [start_time, end_time]):
         raise ValueError("start_time and end_time must be string representations of datetime.")
+    start_epoch, end_epoch = datetime_to_epoch(start_time), datetime_to_epoch(end_time)
+    if end_epoch - start_epoch > MAX_APPOINTMENT_HOURS * 3600:
+        raise ValueError(f"Appointments cannot be longer than {MAX_APPOINTMENT_HOURS} hours.")
     # DB CHECK constraint handles end_time > start_time
 
+    if hold_id is not None and not isinstance(hold_id, str):
+        raise ValueError("hold_id must be a string.")
+
     cursor = conn.cursor()
     initial_status = 'pending_provider_confirmation'
     # created_at and updated_at have defaults in schema. updated_at will be handled by trigger on UPDATE.
 
+    now = now_epoch()
+    registry = _hold_registry(conn)
+    if _held_by_another_patient(conn, registry, provider_id, start_epoch, end_epoch, now, patient_id):
+        raise AppointmentConflictError(APPOINTMENT_HELD_MESSAGE)
+
+    # Take the write lock before reading availability so nothing can change between check and insert.
+    begin_immediate(conn)
     try:
+        _check_bookable(conn, patient_id, provider_id, start_epoch, end_epoch, now)
+        if hold_id is not None:
+            cursor.execute(
+                """
+                SELECT 1 FROM appointment_holds
+                WHERE hold_id = ? AND patient_id = ? AND provider_id = ? AND expires_epoch > ?
+                  AND hold_start_epoch <= ? AND hold_end_epoch >= ?
+                """,
+                (hold_id, patient_id, provider_id, now, start_epoch, end_epoch)
+            )
+            if cursor.fetchone() is None:
+                raise ValueError("The hold has expired, does not exist, or does not cover the requested time.")
         cursor.execute(
             """
             INSERT INTO appointments (patient_id, provider_id, appointment_start_time, appointment_end_time,
@@ -486,16 +1770,212 @@ def request_appointment(conn: sqlite3.Connection, patient_id: int, provider_id:
             """,
             (patient_id, provider_id, start_time, end_time, reason_for_visit, initial_status, notes_by_patient)
         )
-        conn.commit()
         new_appointment_id = cursor.lastrowid
+        _mark_day_bitmaps_busy(conn, provider_id, start_epoch, end_epoch)
+        released = _delete_patient_holds(conn, patient_id, provider_id)
+        conn.commit()
         if new_appointment_id is None:
             raise sqlite3.Error("Failed to retrieve lastrowid for new appointment.")
+        if registry is not None:
+            for released_id in released:
+                registry.remove(released_id)
         return new_appointment_id
+    except (ValueError, AppointmentConflictError):
+        conn.rollback()
+        raise
+    except sqlite3.IntegrityError as e:
+        print(f"Error in request_appointment: {e}")
+        conn.rollback()
+        _raise_if_overlap(e)
+        raise
     except sqlite3.Error as e:
         print(f"Error in request_appointment: {e}")
         conn.rollback()
         raise
 
+# --- Slot Holds ---
+
+def _load_holds(conn: sqlite3.Connection, registry):
+    """Fills a new hold registry with the unexpired holds persisted in appointment_holds."""
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT hold_id, provider_id, patient_id, hold_start_epoch, hold_end_epoch, expires_epoch
+        FROM appointment_holds WHERE expires_epoch > ?
+        """,
+        (now_epoch(),)
+    )
+    for row in cursor.fetchall():
+        registry.add(row['provider_id'], row['hold_id'], row['patient_id'],
+                     row['hold_start_epoch'], row['hold_end_epoch'], row['expires_epoch'])
+
+def _held_by_another_patient(conn: sqlite3.Connection, registry, provider_id: int, start_epoch: int, end_epoch: int,
+                             now: int, patient_id: int) -> bool:
+    """
+    Fast check, before any write lock, for time held by another patient. A registry hit is
+    only a hint, since the registry misses holds released or booked through other processes:
+    it is confirmed with a read of appointment_holds, and stale registry entries are dropped.
+    The write transaction checks the table again either way.
+    """
+    if registry is None or not registry.find_conflict(provider_id, start_epoch, end_epoch, now, patient_id):
+        return False
+    if _get_held_intervals(conn, provider_id, start_epoch, end_epoch, now, patient_id):
+        return True
+    while (stale := registry.find_conflict(provider_id, start_epoch, end_epoch, now, patient_id)) is not None:
+        registry.remove(stale[3])
+    return False
+
+def _hold_registry(conn: sqlite3.Connection):
+    """Returns the in-memory hold registry for this connection's database file (None for in-memory databases)."""
+    db_path = conn.execute("PRAGMA database_list").fetchone()[2]
+    return get_hold_registry(db_path, MAX_APPOINTMENT_HOURS * 3600, lambda registry: _load_holds(conn, registry))
+
+def _delete_patient_holds(conn: sqlite3.Connection, patient_id: int, provider_id: int) -> list[str]:
+    """Deletes the patient's holds with the provider inside the caller's transaction. Returns their IDs."""
+    cursor = conn.cursor()
+    cursor.execute(
+        "DELETE FROM appointment_holds WHERE patient_id = ? AND provider_id = ? RETURNING hold_id",
+        (patient_id, provider_id)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+def _check_bookable(conn: sqlite3.Connection, patient_id: int, provider_id: int,
+                    start_epoch: int, end_epoch: int, now: int):
+    """
+    Checks, inside the caller's write transaction, that [start_epoch, end_epoch) can be
+    booked or held by the patient: it lies within the provider's availability and is not
+    held by another patient. Appointment overlaps are left to the overlap triggers.
+
+    Raises:
+        ValueError: If the time is outside the provider's availability.
+        AppointmentConflictError: If another patient holds part of the time.
+    """
+    if end_epoch > start_epoch and not any(
+            start <= start_epoch and end_epoch <= end
+            for start, end in _get_available_intervals(conn, provider_id, start_epoch, end_epoch)):
+        raise ValueError("The requested time is outside the provider's availability.")
+    if _get_held_intervals(conn, provider_id, start_epoch, end_epoch, now, patient_id):
+        raise AppointmentConflictError(APPOINTMENT_HELD_MESSAGE)
+
+def place_hold(conn: sqlite3.Connection, patient_id: int, provider_id: int, start_time: str, end_time: str,
+               ttl_seconds: int = HOLD_TTL_SECONDS) -> dict:
+    """
+    Reserves a provider's time for a patient for `ttl_seconds`, ahead of request_appointment.
+
+    While the hold is live, the time is missing from get_bookable_slots and other patients'
+    holds and appointment requests for it are refused. A patient holds at most one slot
+    per provider: placing a new hold releases their previous one. Requests for time
+    already held by someone else are refused without a write when the in-memory registry
+    flags it and appointment_holds confirms it; otherwise the checks and the insert share
+    one `BEGIN IMMEDIATE` transaction, which also purges expired holds.
+
+    Args:
+        conn: Active SQLite3 connection.
+        patient_id: ID of the patient placing the hold.
+        provider_id: ID of the provider.
+        start_time: Start of the held time (YYYY-MM-DD HH:MM:SS string).
+        end_time: End of the held time (YYYY-MM-DD HH:MM:SS string).
+        ttl_seconds: How long the hold lasts (1 to MAX_HOLD_TTL_SECONDS).
+
+    Returns:
+        A dictionary with hold_id, provider_id, patient_id, start_time, end_time and expires_at.
+
+    Raises:
+        ValueError: For invalid inputs or time outside the provider's availability.
+        AppointmentConflictError: If the time overlaps a blocking appointment or another patient's hold.
+        sqlite3.Error: If a database error occurs (e.g., FK constraint for unknown users).
+    """
+    if not all(isinstance(id_val, int) for id_val in [patient_id, provider_id]):
+        raise ValueError("patient_id and provider_id must be integers.")
+    if not isinstance(ttl_seconds, int) or not 0 < ttl_seconds <= MAX_HOLD_TTL_SECONDS:
+        raise ValueError(f"ttl_seconds must be an integer between 1 and {MAX_HOLD_TTL_SECONDS}.")
+    if not all(isinstance(time_str, str) for time_str in [start_time, end_time]):
+        raise ValueError("start_time and end_time must be string representations of datetime.")
+    start_epoch, end_epoch = datetime_to_epoch(start_time), datetime_to_epoch(end_time)
+    if end_epoch <= start_epoch:
+        raise ValueError("end_time must be after start_time.")
+    if end_epoch - start_epoch > MAX_APPOINTMENT_HOURS * 3600:
+        raise ValueError(f"Holds cannot be longer than {MAX_APPOINTMENT_HOURS} hours.")
+
+    now = now_epoch()
+    registry = _hold_registry(conn)
+    if _held_by_another_patient(conn, registry, provider_id, start_epoch, end_epoch, now, patient_id):
+        raise AppointmentConflictError(APPOINTMENT_HELD_MESSAGE)
+
+    hold_id = secrets.token_urlsafe(16)
+    expires_at = epoch_to_datetime_string(now + ttl_seconds)
+    cursor = conn.cursor()
+    begin_immediate(conn)
+    try:
+        cursor.execute("DELETE FROM appointment_holds WHERE expires_epoch <= ?", (now,))
+        _check_bookable(conn, patient_id, provider_id, start_epoch, end_epoch, now)
+        if _get_busy_intervals(conn, provider_id, start_epoch, end_epoch):
+            raise AppointmentConflictError(APPOINTMENT_OVERLAP_MESSAGE)
+        released = _delete_patient_holds(conn, patient_id, provider_id)
+        cursor.execute(
+            """
+            INSERT INTO appointment_holds (hold_id, provider_id, patient_id, hold_start_time, hold_end_time, expires_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (hold_id, provider_id, patient_id, start_time, end_time, expires_at)
+        )
+        conn.commit()
+    except (ValueError, AppointmentConflictError):
+        conn.rollback()
+        raise
+    except sqlite3.Error as e:
+        print(f"Error in place_hold for provider {provider_id}, patient {patient_id}: {e}")
+        conn.rollback()
+        raise
+
+    if registry is not None:
+        for released_id in released:
+            registry.remove(released_id)
+        registry.add(provider_id, hold_id, patient_id, start_epoch, end_epoch, now + ttl_seconds)
+    return {
+        "hold_id": hold_id,
+        "provider_id": provider_id,
+        "patient_id": patient_id,
+        "start_time": start_time,
+        "end_time": end_time,
+        "expires_at": expires_at,
+    }
+
+def release_hold(conn: sqlite3.Connection, hold_id: str, patient_id: int) -> bool:
+    """
+    Releases a hold before it expires.
+
+    Args:
+        conn: Active SQLite3 connection.
+        hold_id: The hold to release.
+        patient_id: The patient releasing it (must be the one who placed it).
+
+    Returns:
+        True if the hold was released, False if it does not exist (or expired and was
+        purged) or belongs to another patient.
+
+    Raises:
+        ValueError: For invalid inputs.
+        sqlite3.Error: If a database error occurs.
+    """
+    if not isinstance(hold_id, str) or not isinstance(patient_id, int):
+        raise ValueError("hold_id must be a string and patient_id an integer.")
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM appointment_holds WHERE hold_id = ? AND patient_id = ?", (hold_id, patient_id))
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Error in release_hold for hold {hold_id}: {e}")
+        conn.rollback()
+        raise
+    if cursor.rowcount > 0:
+        registry = _hold_registry(conn)
+        if registry is not None:
+            registry.remove(hold_id)
+        return True
+    return False
+
 def get_appointment_by_id(conn: sqlite3.Connection, appointment_id: int) -> dict | None:
     """
     Fetches a specific appointment by its appointment_id, including patient and provider usernames.
@@ -553,12 +2033,15 @@ def get_appointments_for_user(conn: sqlite3.Connection, user_id: int, user_role:
         A list of dictionaries, each representing an appointment. Empty list if none found or on error.
 
     Raises:
-        ValueError: If user_id is not int, or user_role is invalid.
+        ValueError: If user_id is not int, user_role is invalid, or a date filter is not YYYY-MM-DD.
     """
     if not isinstance(user_id, int):
         raise ValueError("user_id must be an integer.")
     if user_role not in ['patient', 'provider']:
         raise ValueError("user_role must be 'patient' or 'provider'.")
+    # Inclusive dates become a half-open range on the indexed epoch column:
+    # [start of start_date, start of the day after end_date)
+    start_epoch, end_epoch = date_range_to_epoch_bounds(start_date_filter, end_date_filter)
 
     appointments_list = []
     cursor = conn.cursor()
@@ -585,15 +2068,15 @@ def get_appointments_for_user(conn: sqlite3.Connection, user_id: int, user_role:
         base_query += " AND a.status = ?"
         params.append(status_filter)
 
-    if start_date_filter: # Assumes YYYY-MM-DD, so compare date part of datetime column
-        base_query += " AND DATE(a.appointment_start_time) >= DATE(?)"
-        params.append(start_date_filter)
+    if start_epoch is not None:
+        base_query += " AND a.appointment_start_epoch >= ?"
+        params.append(start_epoch)
 
-    if end_date_filter:
-        base_query += " AND DATE(a.appointment_start_time) <= DATE(?)"
-        params.append(end_date_filter)
+    if end_epoch is not None:
+        base_query += " AND a.appointment_start_epoch < ?"
+        params.append(end_epoch)
 
-    base_query += " ORDER BY a.appointment_start_time ASC"
+    base_query += " ORDER BY a.appointment_start_epoch ASC"
 
     try:
         cursor.execute(base_query, tuple(params))
@@ -623,6 +2106,8 @@ def update_appointment_status(conn: sqlite3.Connection, appointment_id: int, new
 
     Raises:
         ValueError: For invalid inputs.
+        AppointmentConflictError: If the new status makes the appointment overlap another blocking one
+                                  (e.g., confirming an appointment whose time was rebooked after it was cancelled).
         sqlite3.Error: For database errors during fetch or update.
     """
     if not all(isinstance(val, int) for val in [appointment_id, current_user_id]):
@@ -636,7 +2121,13 @@ def update_appointment_status(conn: sqlite3.Connection, appointment_id: int, new
 
     try:
         # 1. Fetch current appointment details for authorization
-        cursor.execute("SELECT patient_id, provider_id, status FROM appointments WHERE appointment_id = ?", (appointment_id,))
+        cursor.execute(
+            """
+            SELECT patient_id, provider_id, status, appointment_start_epoch, appointment_end_epoch
+            FROM appointments WHERE appointment_id = ?
+            """,
+            (appointment_id,)
+        )
         appointment = cursor.fetchone()
 
         if not appointment:
@@ -683,13 +2174,22 @@ def update_appointment_status(conn: sqlite3.Connection, appointment_id: int, new
         update_query = f"UPDATE appointments SET {', '.join(set_clauses)} WHERE appointment_id = ?"
 
         cursor.execute(update_query, tuple(sql_params))
+        updated = cursor.rowcount > 0
+        if updated:
+            times = (appointment['provider_id'], appointment['appointment_start_epoch'], appointment['appointment_end_epoch'])
+            if new_status in BLOCKING_APPOINTMENT_STATUSES:
+                _mark_day_bitmaps_busy(conn, *times)
+            elif appointment['status'] in BLOCKING_APPOINTMENT_STATUSES:
+                _invalidate_day_bitmaps(conn, *times) # Freed time; rebuilt from the remaining appointments
         conn.commit()
 
-        return cursor.rowcount > 0 # True if a row was updated
+        return updated # True if a row was updated
 
     except sqlite3.Error as e:
         print(f"Error in update_appointment_status for appointment {appointment_id}: {e}")
         conn.rollback()
+        if isinstance(e, sqlite3.IntegrityError):
+            _raise_if_overlap(e)
         raise # Re-raise to be handled by API layer or caller
 
 
@@ -910,6 +2410,7 @@ if __name__ == '__main__':
     finally:
         if conn:
             conn.close()
+            close_pool(db_file) # Release pooled file handles so the WAL is checkpointed before removal
             print(f"\nClosed connection to {db_file}.")
         if os.path.exists(db_file):
             os.remove(db_file)
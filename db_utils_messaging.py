@@ -1,6 +1,15 @@
 import sqlite3
-import datetime
 import os # For potential future use, like managing DB file paths
+import re
+import sys
+import time
+import queue
+import atexit
+import threading
+from concurrent.futures import Future
+from db_connection_pool import begin_immediate, get_pooled_connection, close_pool
+from time_utils import now_datetime_string
+from message_pubsub import publish_new_message
 
 # --- Database Schema (Adapted for SQLite) ---
 MESSAGING_SCHEMA = """
@@ -28,45 +37,157 @@ CREATE TABLE IF NOT EXISTS messages (
     sender_id INTEGER NOT NULL,
     timestamp DATETIME DEFAULT (STRFTIME('%Y-%m-%d %H:%M:%S', 'now')) NOT NULL,
     content TEXT NOT NULL,
-    is_read INTEGER DEFAULT 0 NOT NULL, -- SQLite uses 0 for False, 1 for True
+    is_read INTEGER DEFAULT 0 NOT NULL, -- Legacy per-message flag (0/1); read state now lives in user_conversations.last_read_message_id
     FOREIGN KEY (conversation_id) REFERENCES conversations(conversation_id) ON DELETE CASCADE,
     FOREIGN KEY (sender_id) REFERENCES users(user_id) ON DELETE CASCADE
 );
 
-CREATE INDEX IF NOT EXISTS idx_conversations_participant1 ON conversations(participant1_id);
+-- Per-user inbox: one row per (user, conversation). The rows are created together with the
+-- conversation (last_message_id 0 until the first message) and kept current by create_message
+-- in the same transaction as the message insert. Listing a user's conversations is then an
+-- indexed range read on idx_user_conversations_recent instead of a scan over messages.
+CREATE TABLE IF NOT EXISTS user_conversations (
+    user_id INTEGER NOT NULL,
+    conversation_id INTEGER NOT NULL,
+    other_participant_id INTEGER NOT NULL,
+    last_message_id INTEGER NOT NULL,
+    last_message_preview TEXT NOT NULL,
+    last_message_at DATETIME NOT NULL,
+    unread_count INTEGER DEFAULT 0 NOT NULL,
+    last_read_message_id INTEGER DEFAULT 0 NOT NULL, -- Read cursor: every message up to this ID has been read
+    PRIMARY KEY (user_id, conversation_id),
+    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
+    FOREIGN KEY (conversation_id) REFERENCES conversations(conversation_id) ON DELETE CASCADE,
+    FOREIGN KEY (other_participant_id) REFERENCES users(user_id) ON DELETE CASCADE
+);
+
+-- Lookups by participant1_id use the UNIQUE (participant1_id, participant2_id) index,
+-- which made the single-column idx_conversations_participant1 redundant (index_advisor.py).
+DROP INDEX IF EXISTS idx_conversations_participant1;
 CREATE INDEX IF NOT EXISTS idx_conversations_participant2 ON conversations(participant2_id);
 CREATE INDEX IF NOT EXISTS idx_conversations_updated_at ON conversations(updated_at);
 
-CREATE INDEX IF NOT EXISTS idx_messages_conversation_id ON messages(conversation_id);
+-- Keyset pagination index: a page of a conversation is a single range scan on
+-- (conversation_id, message_id), so fetch cost depends on page size, not thread length.
+-- It supersedes the old single-column idx_messages_conversation_id.
+DROP INDEX IF EXISTS idx_messages_conversation_id;
+CREATE INDEX IF NOT EXISTS idx_messages_conversation_message ON messages(conversation_id, message_id);
 CREATE INDEX IF NOT EXISTS idx_messages_sender_id ON messages(sender_id);
 CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp);
+
+-- Inbox ordering: most recent activity first. message_id is monotonically increasing, so
+-- last_message_id orders conversations by their latest message; conversation_id breaks the tie
+-- between conversations that have no messages yet (all 0), making (last_message_id,
+-- conversation_id) a unique keyset cursor. It supersedes idx_user_conversations_inbox.
+DROP INDEX IF EXISTS idx_user_conversations_inbox;
+CREATE INDEX IF NOT EXISTS idx_user_conversations_recent ON user_conversations(user_id, last_message_id, conversation_id);
+-- Badge counts: summing a user's unread counts only visits conversations that have unread messages.
+CREATE INDEX IF NOT EXISTS idx_user_conversations_unread ON user_conversations(user_id, unread_count) WHERE unread_count > 0;
+-- Foreign-key lookups from conversations (ON DELETE CASCADE) would otherwise scan the whole inbox
+-- table, since its primary key leads with user_id. The key never changes, so inbox updates skip it.
+CREATE INDEX IF NOT EXISTS idx_user_conversations_conversation_id ON user_conversations(conversation_id);
+
+-- Full-text search. messages_fts is an external-content FTS5 index over this view, so message
+-- text is not stored twice. Besides the content it indexes "scope" tokens (u<user_id> for both
+-- participants, c<conversation_id>), which lets a search be restricted to one user's (or one
+-- conversation's) messages inside the FTS index itself instead of filtering ranked results.
+CREATE VIEW IF NOT EXISTS messages_fts_source AS
+SELECT m.message_id, m.content,
+       'u' || c.participant1_id || ' u' || c.participant2_id || ' c' || c.conversation_id AS scope
+FROM messages m
+JOIN conversations c ON c.conversation_id = m.conversation_id;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, scope,
+    content = 'messages_fts_source', content_rowid = 'message_id',
+    tokenize = 'porter unicode61'
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, content, scope)
+    SELECT NEW.message_id, NEW.content, 'u' || participant1_id || ' u' || participant2_id || ' c' || conversation_id
+    FROM conversations WHERE conversation_id = NEW.conversation_id;
+END;
+
+-- External-content deletes must supply the values that were indexed. When a conversation is
+-- deleted, its messages are removed from the index before the cascade runs (the conversation
+-- row is already gone when the cascaded message triggers fire, so they find nothing to do).
+CREATE TRIGGER IF NOT EXISTS trg_messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content, scope)
+    SELECT 'delete', OLD.message_id, OLD.content, 'u' || participant1_id || ' u' || participant2_id || ' c' || conversation_id
+    FROM conversations WHERE conversation_id = OLD.conversation_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content, scope)
+    SELECT 'delete', OLD.message_id, OLD.content, 'u' || participant1_id || ' u' || participant2_id || ' c' || conversation_id
+    FROM conversations WHERE conversation_id = OLD.conversation_id;
+    INSERT INTO messages_fts (rowid, content, scope)
+    SELECT NEW.message_id, NEW.content, 'u' || participant1_id || ' u' || participant2_id || ' c' || conversation_id
+    FROM conversations WHERE conversation_id = NEW.conversation_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_conversations_fts_delete BEFORE DELETE ON conversations BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content, scope)
+    SELECT 'delete', m.message_id, m.content, 'u' || OLD.participant1_id || ' u' || OLD.participant2_id || ' c' || OLD.conversation_id
+    FROM messages m WHERE m.conversation_id = OLD.conversation_id;
+END;
 """
 
+# --- Pagination Defaults ---
+DEFAULT_MESSAGE_PAGE_SIZE = 50
+MAX_MESSAGE_PAGE_SIZE = 200
+DEFAULT_CONVERSATION_PAGE_SIZE = 50
+MAX_CONVERSATION_PAGE_SIZE = 200
+
+# Number of characters of the latest message kept in the inbox row
+INBOX_PREVIEW_LENGTH = 100
+
+# --- Search Defaults ---
+DEFAULT_SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 100
+MAX_SEARCH_OFFSET = 1000            # Ranked results are paged by offset; deep pages are not useful
+SEARCH_SNIPPET_TOKENS = 12          # Approximate snippet length in tokens
+SEARCH_HIGHLIGHT_START = '<mark>'
+SEARCH_HIGHLIGHT_END = '</mark>'
+# BM25 term-frequency saturation and length normalisation used by search_messages
+SEARCH_BM25_K1 = 1.2
+SEARCH_BM25_B = 0.75
+
+# --- Group-Commit Write Queue Defaults ---
+# Used by MessageWriteQueue: a batch is committed once it holds WRITE_QUEUE_BATCH_SIZE
+# messages or WRITE_QUEUE_FLUSH_INTERVAL_MS after its first message, whichever comes first.
+WRITE_QUEUE_BATCH_SIZE = int(os.getenv('MESSAGING_WRITE_QUEUE_BATCH_SIZE', '64'))
+WRITE_QUEUE_FLUSH_INTERVAL_MS = float(os.getenv('MESSAGING_WRITE_QUEUE_FLUSH_INTERVAL_MS', '2'))
+WRITE_QUEUE_MAX_DEPTH = int(os.getenv('MESSAGING_WRITE_QUEUE_MAX_DEPTH', '10000'))
+WRITE_QUEUE_SUBMIT_TIMEOUT = 5.0 # Seconds submit() waits for room when the queue is full
+
 # --- Database Utility Functions ---
 
 def get_db_connection(db_name='messaging_app.db'):
     """
-    Establishes and returns an SQLite3 connection object.
+    Checks out a connection from the shared SQLite connection pool.
 
-    The connection is configured to:
+    The connection is configured (once, when the pool opens it) to:
     - Use `sqlite3.Row` as the row_factory for accessing columns by name.
     - Enable foreign key constraint enforcement (`PRAGMA foreign_keys = ON`).
+    - Use WAL journaling, `synchronous=NORMAL`, a busy timeout and a larger page cache.
+
+    Calling `close()` on the returned object hands it back to the pool.
 
     Args:
         db_name (str): The name of the SQLite database file.
                        Defaults to 'messaging_app.db'.
 
     Returns:
-        sqlite3.Connection: The SQLite3 connection object.
+        PooledConnection: A pooled connection exposing the sqlite3.Connection API.
 
     Raises:
-        sqlite3.Error: If any error occurs during database connection.
+        sqlite3.Error: If any error occurs during database connection
+                       (including PoolTimeoutError when the pool is exhausted).
     """
     try:
-        conn = sqlite3.connect(db_name)
-        conn.row_factory = sqlite3.Row # Access columns by name
-        conn.execute("PRAGMA foreign_keys = ON;") # Enable foreign key constraint enforcement
-        return conn
+        return get_pooled_connection(db_name)
     except sqlite3.Error as e:
         # Log or handle more gracefully if this were a library for others
         print(f"Database connection error to '{db_name}': {e}")
@@ -76,9 +197,13 @@ def initialize_schema(conn: sqlite3.Connection):
     """
     Initializes the database schema using the MESSAGING_SCHEMA constant.
 
-    This function creates the `users`, `conversations`, and `messages` tables
-    if they do not already exist. It's intended for setting up the database
-    for development or testing.
+    This function creates the `users`, `conversations`, `messages` and
+    `user_conversations` tables if they do not already exist. It's intended for
+    setting up the database for development or testing. If the inbox table is
+    empty while messages exist (a database created before the inbox was
+    introduced), it is backfilled with `rebuild_user_conversations`. Likewise the
+    `messages_fts` search index is rebuilt when it is created on a database that
+    already has messages.
 
     Args:
         conn (sqlite3.Connection): An active SQLite3 connection object.
@@ -88,14 +213,121 @@ def initialize_schema(conn: sqlite3.Connection):
     """
     try:
         cursor = conn.cursor()
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM sqlite_master WHERE name = 'messages_fts')")
+        search_index_existed = cursor.fetchone()[0]
         cursor.executescript(MESSAGING_SCHEMA)
         conn.commit()
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM user_conversations), EXISTS (SELECT 1 FROM messages)")
+        inbox_populated, has_messages = cursor.fetchone()
+        if has_messages and not inbox_populated:
+            rebuild_user_conversations(conn)
+        if has_messages and not search_index_existed:
+            rebuild_message_search_index(conn)
         print("Database schema initialized successfully.")
     except sqlite3.Error as e:
         print(f"Schema initialization error: {e}")
         conn.rollback() # Rollback changes if any error occurs
         raise
 
+def rebuild_user_conversations(conn: sqlite3.Connection):
+    """
+    Rebuilds the `user_conversations` inbox table from `conversations` and `messages`.
+
+    This is a full scan and is only meant for backfilling existing databases or
+    repairing the inbox; during normal operation `create_message` and
+    `mark_conversation_read` keep the inbox up to date incrementally.
+
+    Existing read cursors are preserved. Unread counts are recomputed as the
+    messages from the other participant beyond the read cursor that are not
+    flagged by the legacy `messages.is_read` column. Conversations without
+    messages get an empty row (last_message_id 0, dated at the conversation's
+    creation) so they still appear in the inbox.
+
+    Args:
+        conn (sqlite3.Connection): An active SQLite3 connection object.
+
+    Raises:
+        sqlite3.Error: If a database error occurs, and rolls back changes.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            WITH LastMessage AS (
+                SELECT conversation_id, MAX(message_id) AS last_message_id
+                FROM messages
+                GROUP BY conversation_id
+            ),
+            Participants AS (
+                SELECT conversation_id, participant1_id AS user_id, participant2_id AS other_participant_id, created_at
+                FROM conversations
+                UNION ALL
+                SELECT conversation_id, participant2_id, participant1_id, created_at FROM conversations
+            ),
+            Cursors AS (
+                SELECT p.*, COALESCE(uc.last_read_message_id, 0) AS last_read_message_id
+                FROM Participants p
+                LEFT JOIN user_conversations uc
+                    ON uc.user_id = p.user_id AND uc.conversation_id = p.conversation_id
+            )
+            INSERT INTO user_conversations (user_id, conversation_id, other_participant_id, last_message_id,
+                                            last_message_preview, last_message_at, unread_count, last_read_message_id)
+            SELECT
+                p.user_id,
+                p.conversation_id,
+                p.other_participant_id,
+                COALESCE(lm.last_message_id, 0),
+                COALESCE(SUBSTR(m.content, 1, :preview_length), ''),
+                COALESCE(m.timestamp, p.created_at),
+                (SELECT COUNT(*) FROM messages um
+                 WHERE um.conversation_id = p.conversation_id
+                   AND um.message_id > p.last_read_message_id
+                   AND um.sender_id <> p.user_id
+                   AND um.is_read = 0),
+                p.last_read_message_id
+            FROM Cursors p
+            LEFT JOIN LastMessage lm ON lm.conversation_id = p.conversation_id
+            LEFT JOIN messages m ON m.message_id = lm.last_message_id
+            WHERE true -- Required by SQLite to disambiguate INSERT ... SELECT from the upsert clause
+            ON CONFLICT (user_id, conversation_id) DO UPDATE SET
+                other_participant_id = excluded.other_participant_id,
+                last_message_id = excluded.last_message_id,
+                last_message_preview = excluded.last_message_preview,
+                last_message_at = excluded.last_message_at,
+                unread_count = excluded.unread_count
+            """,
+            {"preview_length": INBOX_PREVIEW_LENGTH}
+        )
+        rebuilt_rows = cursor.rowcount
+        conn.commit()
+        print(f"Rebuilt user_conversations inbox ({rebuilt_rows} rows).")
+    except sqlite3.Error as e:
+        print(f"Error in rebuild_user_conversations: {e}")
+        conn.rollback()
+        raise
+
+def rebuild_message_search_index(conn: sqlite3.Connection):
+    """
+    Rebuilds the `messages_fts` full-text index from the messages table.
+
+    Only needed to backfill an existing database or repair the index; the triggers
+    in MESSAGING_SCHEMA keep it in sync during normal operation.
+
+    Args:
+        conn (sqlite3.Connection): An active SQLite3 connection object.
+
+    Raises:
+        sqlite3.Error: If a database error occurs, and rolls back changes.
+    """
+    try:
+        conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+        conn.commit()
+        print("Rebuilt messages_fts search index.")
+    except sqlite3.Error as e:
+        print(f"Error in rebuild_message_search_index: {e}")
+        conn.rollback()
+        raise
+
 def find_or_create_conversation(conn: sqlite3.Connection, participant1_id: int, participant2_id: int) -> int:
     """
     Finds an existing conversation between two participants or creates a new one.
@@ -105,6 +337,10 @@ def find_or_create_conversation(conn: sqlite3.Connection, participant1_id: int,
     `participant1_id < participant2_id` and `UNIQUE (participant1_id, participant2_id)`
     in the `conversations` table schema.
 
+    A new conversation gets both participants' `user_conversations` inbox rows
+    (with no last message yet) in the same transaction, so it is listed in their
+    inboxes before the first message is sent.
+
     Args:
         conn (sqlite3.Connection): An active SQLite3 connection object.
         participant1_id (int): The user ID of the first participant.
@@ -127,7 +363,7 @@ def find_or_create_conversation(conn: sqlite3.Connection, participant1_id: int,
     p1 = min(participant1_id, participant2_id)
     p2 = max(participant1_id, participant2_id)
 
-    current_timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    current_timestamp = now_datetime_string()
     cursor = conn.cursor()
 
     try:
@@ -152,11 +388,19 @@ def find_or_create_conversation(conn: sqlite3.Connection, participant1_id: int,
                 """,
                 (p1, p2, current_timestamp, current_timestamp)
             )
-            conn.commit() # Commit the new conversation
             new_conversation_id = cursor.lastrowid
             # print(f"Created new conversation: {new_conversation_id}") # For debugging
             if new_conversation_id is None: # Should not happen with AUTOINCREMENT if insert was successful
                  raise sqlite3.Error("Failed to retrieve lastrowid for new conversation after insert.")
+            cursor.executemany(
+                """
+                INSERT INTO user_conversations (user_id, conversation_id, other_participant_id, last_message_id,
+                                                last_message_preview, last_message_at)
+                VALUES (?, ?, ?, 0, '', ?)
+                """,
+                [(p1, new_conversation_id, p2, current_timestamp), (p2, new_conversation_id, p1, current_timestamp)]
+            )
+            conn.commit() # Commit the new conversation and its inbox rows
             return new_conversation_id
     except sqlite3.Error as e: # Catches IntegrityError (like CHECK fail) and other DB errors
         print(f"Error in find_or_create_conversation for participants {p1}, {p2}: {e}")
@@ -167,6 +411,11 @@ def create_message(conn: sqlite3.Connection, conversation_id: int, sender_id: in
     """
     Inserts a new message into the messages table and updates the conversation's timestamp.
 
+    Both participants' `user_conversations` inbox rows are upserted in the same
+    transaction: the last message details are replaced and the recipient's
+    unread_count is incremented. After the commit the message is published to
+    both participants' real-time channels (see message_pubsub).
+
     Args:
         conn (sqlite3.Connection): An active SQLite3 connection object.
         conversation_id (int): The ID of the conversation this message belongs to.
@@ -186,7 +435,7 @@ def create_message(conn: sqlite3.Connection, conversation_id: int, sender_id: in
     if not isinstance(content, str) or not content.strip(): # Check if content is empty or just whitespace
         raise ValueError("Content must be a non-empty string.")
 
-    current_timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    current_timestamp = now_datetime_string()
     cursor = conn.cursor()
     try:
         # Insert the new message
@@ -203,10 +452,15 @@ def create_message(conn: sqlite3.Connection, conversation_id: int, sender_id: in
             # However, good to have a check.
             raise sqlite3.Error("Failed to retrieve lastrowid for new message after insert.")
 
+        participants = update_user_conversations(conn, conversation_id, sender_id, new_message_id, content, current_timestamp)
+
         # After successfully inserting a message, update the conversation's updated_at timestamp.
         # This also handles committing the transaction for both the message insert and conversation update.
         update_conversation_timestamp(conn, conversation_id)
 
+        # Only committed messages are pushed to real-time subscribers.
+        publish_new_message(_message_event(conversation_id, new_message_id, sender_id, content, current_timestamp), participants)
+
         # print(f"Created new message: {new_message_id} in conversation {conversation_id}") # For debugging
         return new_message_id
     except sqlite3.Error as e: # Catches IntegrityError (FK violations) and other DB errors
@@ -214,6 +468,169 @@ def create_message(conn: sqlite3.Connection, conversation_id: int, sender_id: in
         conn.rollback() # Rollback on error
         raise
 
+def _message_event(conversation_id: int, message_id: int, sender_id: int, content: str, message_timestamp: str) -> dict:
+    """Builds the message dict published to real-time subscribers (same fields as the read APIs)."""
+    return {
+        "message_id": message_id,
+        "conversation_id": conversation_id,
+        "sender_id": sender_id,
+        "content": content,
+        "timestamp": message_timestamp,
+        "is_read": 0,
+    }
+
+def _validate_direct_message(sender_id, receiver_id, content):
+    """Argument checks shared by `send_direct_message` and `MessageWriteQueue.submit`."""
+    if not isinstance(sender_id, int) or not isinstance(receiver_id, int):
+        raise ValueError("sender_id and receiver_id must be integers.")
+    if sender_id == receiver_id:
+        raise ValueError("Participants cannot be the same user.")
+    if not isinstance(content, str) or not content.strip():
+        raise ValueError("Content must be a non-empty string.")
+
+def _insert_direct_message(conn: sqlite3.Connection, sender_id: int, receiver_id: int,
+                           content: str, message_timestamp: str) -> tuple[int, int]:
+    """
+    Executes the statements of a send inside the caller's open transaction.
+
+    Upserts the conversation (bumping `updated_at`), inserts the message and
+    updates both inbox rows. Does not begin, commit or roll back.
+
+    Returns:
+        tuple[int, int]: (conversation_id, message_id).
+    """
+    # Same participant ordering as find_or_create_conversation (CHECK participant1_id < participant2_id)
+    p1 = min(sender_id, receiver_id)
+    p2 = max(sender_id, receiver_id)
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        INSERT INTO conversations (participant1_id, participant2_id, created_at, updated_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (participant1_id, participant2_id) DO UPDATE SET updated_at = excluded.updated_at
+        RETURNING conversation_id
+        """,
+        (p1, p2, message_timestamp, message_timestamp)
+    )
+    conversation_id = cursor.fetchone()[0]
+    cursor.execute(
+        """
+        INSERT INTO messages (conversation_id, sender_id, content, timestamp, is_read)
+        VALUES (?, ?, ?, ?, 0)
+        RETURNING message_id
+        """,
+        (conversation_id, sender_id, content, message_timestamp)
+    )
+    message_id = cursor.fetchone()[0]
+    update_user_conversations(conn, conversation_id, sender_id, message_id, content,
+                              message_timestamp, participants=(p1, p2))
+    return conversation_id, message_id
+
+def send_direct_message(conn: sqlite3.Connection, sender_id: int, receiver_id: int, content: str) -> tuple[int, int]:
+    """
+    Sends a message between two users in a single transaction with a single commit.
+
+    This is the write path used by POST /api/messages. It replaces the
+    `find_or_create_conversation` + `create_message` sequence (which commits up to
+    three times per message) with:
+    1. `INSERT ... ON CONFLICT DO UPDATE ... RETURNING` on `conversations`, which
+       finds or creates the conversation and bumps `updated_at` in one statement.
+    2. The message insert.
+    3. The inbox upsert for both participants.
+    All three run under `BEGIN IMMEDIATE`, so the write lock is taken up front
+    and the message costs one commit. After the commit the message is published
+    to both participants' real-time channels.
+
+    Args:
+        conn (sqlite3.Connection): An active SQLite3 connection object.
+        sender_id (int): The user ID of the message sender.
+        receiver_id (int): The user ID of the message recipient.
+        content (str): The text content of the message.
+
+    Returns:
+        tuple[int, int]: (conversation_id, message_id).
+
+    Raises:
+        ValueError: If IDs are not integers, are the same user, or content is empty/whitespace.
+        sqlite3.Error: If a database error occurs (e.g., IntegrityError for unknown users);
+                       the whole send is rolled back.
+    """
+    _validate_direct_message(sender_id, receiver_id, content)
+
+    current_timestamp = now_datetime_string()
+    begin_immediate(conn)
+    try:
+        conversation_id, message_id = _insert_direct_message(conn, sender_id, receiver_id, content, current_timestamp)
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Error in send_direct_message from {sender_id} to {receiver_id}: {e}")
+        conn.rollback()
+        raise
+
+    # Only committed messages are pushed to real-time subscribers.
+    publish_new_message(_message_event(conversation_id, message_id, sender_id, content, current_timestamp),
+                        (sender_id, receiver_id))
+    return conversation_id, message_id
+
+def update_user_conversations(conn: sqlite3.Connection, conversation_id: int, sender_id: int,
+                              message_id: int, content: str, message_timestamp: str,
+                              participants: tuple[int, int] = None):
+    """
+    Upserts both participants' inbox rows for a newly created message.
+
+    Does not commit; it is meant to run inside the caller's message transaction
+    (see `create_message` and `send_direct_message`).
+
+    Args:
+        conn (sqlite3.Connection): An active SQLite3 connection object.
+        conversation_id (int): The conversation the message was added to.
+        sender_id (int): The user ID of the message sender.
+        message_id (int): The ID of the new message.
+        content (str): The message content (truncated to INBOX_PREVIEW_LENGTH for the preview).
+        message_timestamp (str): The message timestamp ('YYYY-MM-DD HH:MM:SS').
+        participants (tuple[int, int], optional): The conversation's (participant1_id, participant2_id)
+                                                  if already known; saves a lookup.
+
+    Returns:
+        tuple[int, int]: The conversation's (participant1_id, participant2_id).
+
+    Raises:
+        sqlite3.Error: If the conversation does not exist or a database error occurs.
+    """
+    cursor = conn.cursor()
+    if participants is None:
+        cursor.execute(
+            "SELECT participant1_id, participant2_id FROM conversations WHERE conversation_id = ?",
+            (conversation_id,)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            raise sqlite3.IntegrityError(f"Conversation {conversation_id} does not exist.")
+        participants = (row['participant1_id'], row['participant2_id'])
+    p1, p2 = participants
+
+    preview = content[:INBOX_PREVIEW_LENGTH]
+    inbox_rows = [
+        # (user_id, other_participant_id, unread increment)
+        (p1, p2, 0 if p1 == sender_id else 1),
+        (p2, p1, 0 if p2 == sender_id else 1),
+    ]
+    cursor.executemany(
+        """
+        INSERT INTO user_conversations (user_id, conversation_id, other_participant_id, last_message_id,
+                                        last_message_preview, last_message_at, unread_count)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, conversation_id) DO UPDATE SET
+            last_message_id = excluded.last_message_id,
+            last_message_preview = excluded.last_message_preview,
+            last_message_at = excluded.last_message_at,
+            unread_count = user_conversations.unread_count + excluded.unread_count
+        """,
+        [(user_id, conversation_id, other_id, message_id, preview, message_timestamp, unread_increment)
+         for user_id, other_id, unread_increment in inbox_rows]
+    )
+    return participants
+
 def update_conversation_timestamp(conn: sqlite3.Connection, conversation_id: int):
     """
     Updates the 'updated_at' field of the specified conversation to the current timestamp.
@@ -229,7 +646,7 @@ def update_conversation_timestamp(conn: sqlite3.Connection, conversation_id: int
     if not isinstance(conversation_id, int):
         raise ValueError("conversation_id must be an integer.")
 
-    current_timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    current_timestamp = now_datetime_string()
     cursor = conn.cursor()
     try:
         cursor.execute(
@@ -243,11 +660,86 @@ def update_conversation_timestamp(conn: sqlite3.Connection, conversation_id: int
         conn.rollback() # Rollback on error
         raise
 
+def mark_conversation_read(conn: sqlite3.Connection, conversation_id: int, user_id: int,
+                           up_to_message_id: int = None) -> dict:
+    """
+    Moves a participant's read cursor forward in a single write.
+
+    Instead of flagging every message row as read, the user's `user_conversations`
+    row records `last_read_message_id`; every message up to that ID counts as read.
+    The cursor never moves backwards. The unread count is adjusted in the same
+    statement: it drops to zero when the cursor reaches the latest message, and
+    otherwise is reduced by the other participant's messages that were just passed.
+
+    Args:
+        conn (sqlite3.Connection): An active SQLite3 connection object.
+        conversation_id (int): The ID of the conversation being read.
+        user_id (int): The participant whose cursor moves.
+        up_to_message_id (int, optional): Last message the user has read.
+                                          Defaults to the latest message in the conversation.
+
+    Returns:
+        dict: {'last_read_message_id': int, 'unread_count': int}. Both are 0 if the
+              conversation has no messages yet (no inbox row).
+
+    Raises:
+        ValueError: If IDs are not integers.
+        sqlite3.Error: If a database error occurs, and rolls back changes.
+    """
+    if not isinstance(conversation_id, int) or not isinstance(user_id, int):
+        raise ValueError("conversation_id and user_id must be integers.")
+    if up_to_message_id is not None and not isinstance(up_to_message_id, int):
+        raise ValueError("up_to_message_id must be an integer.")
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            UPDATE user_conversations
+            SET
+                unread_count = CASE
+                    WHEN :up_to >= last_message_id THEN 0
+                    ELSE MAX(0, unread_count - (
+                        SELECT COUNT(*) FROM messages m
+                        WHERE m.conversation_id = user_conversations.conversation_id
+                          AND m.message_id > user_conversations.last_read_message_id
+                          AND m.message_id <= :up_to
+                          AND m.sender_id <> user_conversations.user_id))
+                END,
+                last_read_message_id = MIN(:up_to, last_message_id)
+            WHERE user_id = :user_id
+              AND conversation_id = :conversation_id
+              AND last_read_message_id < MIN(:up_to, last_message_id)
+            """,
+            {
+                "user_id": user_id,
+                "conversation_id": conversation_id,
+                # No explicit position means "everything so far"; the MIN() above caps it at the latest message.
+                "up_to": up_to_message_id if up_to_message_id is not None else sys.maxsize,
+            }
+        )
+        conn.commit()
+        cursor.execute(
+            "SELECT last_read_message_id, unread_count FROM user_conversations WHERE user_id = ? AND conversation_id = ?",
+            (user_id, conversation_id)
+        )
+        row = cursor.fetchone()
+        return dict(row) if row else {"last_read_message_id": 0, "unread_count": 0}
+    except sqlite3.Error as e:
+        print(f"Error in mark_conversation_read for conversation {conversation_id}, user {user_id}: {e}")
+        conn.rollback()
+        raise
+
 # --- Read Operations ---
 
 def get_messages_by_conversation_id(conn: sqlite3.Connection, conversation_id: int) -> list[dict]:
     """
-    Retrieves all messages for a given conversation_id, ordered by timestamp (oldest first).
+    Retrieves all messages for a given conversation_id, oldest first.
+
+    Messages are ordered by `message_id`, which is monotonically increasing and
+    therefore gives a deterministic order even when several messages share the
+    same (second-granularity) timestamp. For long threads prefer
+    `get_messages_page`, which reads only one page.
 
     Args:
         conn (sqlite3.Connection): An active SQLite3 connection object.
@@ -273,7 +765,7 @@ def get_messages_by_conversation_id(conn: sqlite3.Connection, conversation_id: i
             SELECT message_id, conversation_id, sender_id, content, timestamp, is_read
             FROM messages
             WHERE conversation_id = ?
-            ORDER BY timestamp ASC
+            ORDER BY message_id ASC
             """,
             (conversation_id,)
         )
@@ -285,12 +777,128 @@ def get_messages_by_conversation_id(conn: sqlite3.Connection, conversation_id: i
         print(f"Error in get_messages_by_conversation_id for conversation {conversation_id}: {e}")
         return [] # Return empty list on error, consistent with previous behavior
 
+def get_messages_page(conn: sqlite3.Connection, conversation_id: int,
+                      before_message_id: int = None, after_message_id: int = None,
+                      limit: int = DEFAULT_MESSAGE_PAGE_SIZE, newest_first: bool = False) -> dict:
+    """
+    Retrieves one page of a conversation's messages using keyset (cursor) pagination.
+
+    Instead of OFFSET, the page boundary is a `message_id` cursor, so every page is a
+    single range scan on the (conversation_id, message_id) index and costs
+    O(limit) regardless of how long the conversation is.
+
+    Cursor semantics:
+    - `before_message_id`: the `limit` messages immediately preceding the cursor
+      (used to scroll back through history).
+    - `after_message_id`: the `limit` messages immediately following the cursor
+      (used to fetch newer messages).
+    - Neither: the newest page, in the order `newest_first` asks for (a chat view opens
+      on its latest messages; pass after_message_id=0 for the oldest page). `has_more`
+      then tells whether older messages exist, reached with before_message_id=before_cursor.
+    - Both: messages strictly between the two cursors, scanned from the end
+      indicated by `newest_first`.
+
+    Args:
+        conn (sqlite3.Connection): An active SQLite3 connection object.
+        conversation_id (int): The ID of the conversation.
+        before_message_id (int, optional): Exclusive upper bound cursor.
+        after_message_id (int, optional): Exclusive lower bound cursor.
+        limit (int): Page size, between 1 and MAX_MESSAGE_PAGE_SIZE.
+        newest_first (bool): If True, messages in the page are returned newest first.
+
+    Returns:
+        dict: {
+            'messages': list[dict],       # Same fields as get_messages_by_conversation_id
+            'has_more': bool,             # More messages exist beyond this page in the scan direction
+            'before_cursor': int | None,  # Smallest message_id in the page (pass as before_message_id)
+            'after_cursor': int | None    # Largest message_id in the page (pass as after_message_id)
+        }
+
+    Raises:
+        ValueError: If IDs/cursors are not integers or `limit` is out of range.
+        sqlite3.Error: If a database error occurs.
+    """
+    if not isinstance(conversation_id, int):
+        raise ValueError("conversation_id must be an integer.")
+    for cursor_value in (before_message_id, after_message_id):
+        if cursor_value is not None and not isinstance(cursor_value, int):
+            raise ValueError("Message cursors must be integers.")
+    if not isinstance(limit, int) or not (1 <= limit <= MAX_MESSAGE_PAGE_SIZE):
+        raise ValueError(f"limit must be an integer between 1 and {MAX_MESSAGE_PAGE_SIZE}.")
+
+    # Scan away from the cursor that was given; with no cursor, start from the newest message.
+    if after_message_id is not None and before_message_id is None:
+        scan_descending = False
+    elif after_message_id is not None:
+        scan_descending = newest_first
+    else:
+        scan_descending = True
+
+    query = """
+    SELECT message_id, conversation_id, sender_id, content, timestamp, is_read
+    FROM messages
+    WHERE conversation_id = ?
+    """
+    params = [conversation_id]
+    if before_message_id is not None:
+        query += " AND message_id < ?"
+        params.append(before_message_id)
+    if after_message_id is not None:
+        query += " AND message_id > ?"
+        params.append(after_message_id)
+    query += f" ORDER BY message_id {'DESC' if scan_descending else 'ASC'} LIMIT ?"
+    params.append(limit + 1) # One extra row tells us whether another page exists
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query, tuple(params))
+        rows = [dict(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        print(f"Error in get_messages_page for conversation {conversation_id}: {e}")
+        raise
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if scan_descending != newest_first:
+        rows.reverse()
+
+    message_ids = [row['message_id'] for row in rows]
+    return {
+        "messages": rows,
+        "has_more": has_more,
+        "before_cursor": min(message_ids) if message_ids else None,
+        "after_cursor": max(message_ids) if message_ids else None,
+    }
+
+_INBOX_SELECT = """
+SELECT
+    uc.conversation_id,
+    c.participant1_id,
+    c.participant2_id,
+    uc.other_participant_id,
+    u_other.username AS other_participant_username,
+    uc.last_message_id,
+    uc.last_message_preview AS last_message_content,
+    uc.last_message_at AS last_message_timestamp,
+    uc.unread_count,
+    uc.last_read_message_id,
+    c.updated_at AS conversation_updated_at
+FROM user_conversations uc
+JOIN conversations c ON c.conversation_id = uc.conversation_id
+JOIN users u_other ON u_other.user_id = uc.other_participant_id
+WHERE uc.user_id = :user_id
+"""
+
 def get_conversations_by_user_id(conn: sqlite3.Connection, user_id: int) -> list[dict]:
     """
     Retrieves all conversations for a given user_id, enriched with details of the
     other participant and the last message exchanged.
 
-    Conversations are ordered by their last update time (most recent first).
+    Reads the denormalized `user_conversations` inbox, so the cost depends on the
+    number of conversations the user has, not on the size of the messages table.
+    Conversations are ordered by most recent message first, followed by those
+    without messages yet (newest first). For users with many conversations
+    prefer `get_conversations_page`.
 
     Args:
         conn (sqlite3.Connection): An active SQLite3 connection object.
@@ -299,8 +907,12 @@ def get_conversations_by_user_id(conn: sqlite3.Connection, user_id: int) -> list
     Returns:
         list[dict]: A list of dictionaries, each representing a conversation summary.
                     Each summary includes: 'conversation_id', 'participant1_id', 'participant2_id',
-                    'other_participant_id', 'other_participant_username', 'last_message_content',
-                    'last_message_timestamp', 'conversation_updated_at'.
+                    'other_participant_id', 'other_participant_username', 'last_message_id',
+                    'last_message_content' (truncated to INBOX_PREVIEW_LENGTH characters),
+                    'last_message_timestamp', 'unread_count', 'last_read_message_id',
+                    'conversation_updated_at'. A conversation without messages has
+                    'last_message_id' 0, an empty 'last_message_content' and its creation
+                    time as 'last_message_timestamp'.
                     Returns an empty list if the user has no conversations or on database error.
 
     Raises:
@@ -309,61 +921,311 @@ def get_conversations_by_user_id(conn: sqlite3.Connection, user_id: int) -> list
     if not isinstance(user_id, int):
         raise ValueError("user_id must be an integer.")
 
-    conversations_data = []
     cursor = conn.cursor()
     try:
-        # This SQL query uses a Common Table Expression (CTE) `LastMessagePerConversation`
-        # to efficiently find the last message for each conversation using ROW_NUMBER().
-        # It then joins this with conversation and user details to construct the summary.
-        # SQLite versions 3.25.0 and newer support window functions.
-        query = """
-        WITH LastMessagePerConversation AS (
-            SELECT
-                m.conversation_id,
-                m.content AS last_message_content,
-                m.timestamp AS last_message_timestamp,
-                -- Assign a row number to each message within its conversation, ordered by time (newest is 1)
-                ROW_NUMBER() OVER(PARTITION BY m.conversation_id ORDER BY m.timestamp DESC) as rn
-            FROM messages m
+        cursor.execute(_INBOX_SELECT + " ORDER BY uc.last_message_id DESC, uc.conversation_id DESC", {"user_id": user_id})
+        return [dict(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        print(f"Error in get_conversations_by_user_id for user {user_id}: {e}")
+        return [] # Return empty list on error
+
+def get_conversations_page(conn: sqlite3.Connection, user_id: int, before_message_id: int = None,
+                           limit: int = DEFAULT_CONVERSATION_PAGE_SIZE, before_conversation_id: int = None) -> dict:
+    """
+    Retrieves one page of a user's inbox, most recent activity first.
+
+    Uses keyset pagination on (`last_message_id`, `conversation_id`), so each page is a
+    single range read on the idx_user_conversations_recent index. Conversations without
+    messages (`last_message_id` 0) come last, newest first; conversation_id is what
+    pages through them.
+
+    Args:
+        conn (sqlite3.Connection): An active SQLite3 connection object.
+        user_id (int): The ID of the user whose conversations are to be fetched.
+        before_message_id (int, optional): Only return conversations whose last message is
+                                           older than this cursor (use the previous page's `next_cursor`).
+        limit (int): Page size, between 1 and MAX_CONVERSATION_PAGE_SIZE.
+        before_conversation_id (int, optional): Tie-breaker for `before_message_id` (use the previous
+                                                page's `next_conversation_cursor`). Without it, every
+                                                conversation whose last message is `before_message_id`
+                                                is skipped.
+
+    Returns:
+        dict: {
+            'conversations': list[dict],           # Same fields as get_conversations_by_user_id
+            'has_more': bool,
+            'next_cursor': int | None,             # last_message_id of the last conversation in the page
+            'next_conversation_cursor': int | None # conversation_id of the last conversation in the page
+        }
+
+    Raises:
+        ValueError: If user_id/cursors are not integers, `before_conversation_id` is given
+                    without `before_message_id`, or `limit` is out of range.
+        sqlite3.Error: If a database error occurs.
+    """
+    if not isinstance(user_id, int):
+        raise ValueError("user_id must be an integer.")
+    for cursor_value in (before_message_id, before_conversation_id):
+        if cursor_value is not None and not isinstance(cursor_value, int):
+            raise ValueError("Conversation cursor must be an integer.")
+    if before_conversation_id is not None and before_message_id is None:
+        raise ValueError("before_conversation_id requires before_message_id.")
+    if not isinstance(limit, int) or not (1 <= limit <= MAX_CONVERSATION_PAGE_SIZE):
+        raise ValueError(f"limit must be an integer between 1 and {MAX_CONVERSATION_PAGE_SIZE}.")
+
+    query = _INBOX_SELECT
+    params = {"user_id": user_id, "limit": limit + 1} # One extra row tells us whether another page exists
+    if before_conversation_id is not None:
+        query += " AND (uc.last_message_id, uc.conversation_id) < (:before_message_id, :before_conversation_id)"
+        params["before_message_id"] = before_message_id
+        params["before_conversation_id"] = before_conversation_id
+    elif before_message_id is not None:
+        query += " AND uc.last_message_id < :before_message_id"
+        params["before_message_id"] = before_message_id
+    query += " ORDER BY uc.last_message_id DESC, uc.conversation_id DESC LIMIT :limit"
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query, params)
+        rows = [dict(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        print(f"Error in get_conversations_page for user {user_id}: {e}")
+        raise
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "conversations": rows,
+        "has_more": has_more,
+        "next_cursor": rows[-1]['last_message_id'] if rows else None,
+        "next_conversation_cursor": rows[-1]['conversation_id'] if rows else None,
+    }
+
+def get_messages_for_user_since(conn: sqlite3.Connection, user_id: int, after_message_id: int,
+                                limit: int = MAX_MESSAGE_PAGE_SIZE) -> list[dict]:
+    """
+    Retrieves messages newer than a cursor across all of a user's conversations.
+
+    Used by the real-time stream to catch a client up after (re)connecting. The
+    inbox index narrows the search to conversations whose last message is past the
+    cursor, and each of those is read with a range scan on (conversation_id, message_id).
+
+    Args:
+        conn (sqlite3.Connection): An active SQLite3 connection object.
+        user_id (int): The ID of the user.
+        after_message_id (int): Exclusive lower bound on message_id.
+        limit (int): Maximum number of messages to return.
+
+    Returns:
+        list[dict]: Messages (same fields as get_messages_by_conversation_id), oldest first.
+
+    Raises:
+        ValueError: If user_id or after_message_id is not an integer.
+        sqlite3.Error: If a database error occurs.
+    """
+    if not isinstance(user_id, int) or not isinstance(after_message_id, int):
+        raise ValueError("user_id and after_message_id must be integers.")
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            SELECT m.message_id, m.conversation_id, m.sender_id, m.content, m.timestamp, m.is_read
+            FROM user_conversations uc
+            JOIN messages m ON m.conversation_id = uc.conversation_id AND m.message_id > :after
+            WHERE uc.user_id = :user_id AND uc.last_message_id > :after
+            ORDER BY m.message_id ASC
+            LIMIT :limit
+            """,
+            {"user_id": user_id, "after": after_message_id, "limit": limit}
         )
-        SELECT
-            c.conversation_id,
-            c.participant1_id,
-            c.participant2_id,
-            -- Determine the other participant's ID relative to the current user_id
-            CASE
-                WHEN c.participant1_id = :user_id THEN c.participant2_id
-                ELSE c.participant1_id
-            END AS other_participant_id,
-            -- Get the other participant's username by joining with the users table
-            u_other.username AS other_participant_username,
-            lmpc.last_message_content,
-            lmpc.last_message_timestamp,
-            c.updated_at AS conversation_updated_at -- This is the primary sort key for conversations
-        FROM conversations c
-        -- Join with users table to get the username of the other participant
-        JOIN users u_other ON u_other.user_id = (
-            CASE
-                WHEN c.participant1_id = :user_id THEN c.participant2_id
-                ELSE c.participant1_id
-            END
+        return [dict(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        print(f"Error in get_messages_for_user_since for user {user_id}: {e}")
+        raise
+
+def get_latest_message_id_for_user(conn: sqlite3.Connection, user_id: int) -> int:
+    """
+    Returns the newest message_id in any of the user's conversations (0 if none).
+
+    Answered from the (user_id, last_message_id) inbox index; used as the starting
+    cursor when a real-time client connects without one.
+
+    Raises:
+        ValueError: If user_id is not an integer.
+        sqlite3.Error: If a database error occurs.
+    """
+    if not isinstance(user_id, int):
+        raise ValueError("user_id must be an integer.")
+    cursor = conn.cursor()
+    cursor.execute("SELECT COALESCE(MAX(last_message_id), 0) FROM user_conversations WHERE user_id = ?", (user_id,))
+    return cursor.fetchone()[0]
+
+def _build_search_match(query: str, user_id: int, conversation_id: int = None) -> str:
+    """
+    Turns free text into a safe FTS5 MATCH expression scoped to a user (and conversation).
+
+    Every word is quoted, so FTS5 operators and punctuation in user input are treated
+    as plain text; words are ANDed. A trailing `*` on a word keeps prefix matching
+    ("lab res*"). The scope tokens are ANDed in so the FTS index itself restricts the
+    search to the user's conversations.
+
+    Raises:
+        ValueError: If the query contains no searchable words.
+    """
+    terms = []
+    for raw_term in query.split():
+        words = re.findall(r'\w+', raw_term)
+        for index, word in enumerate(words):
+            is_prefix = raw_term.endswith('*') and index == len(words) - 1
+            terms.append(f'"{word}"' + ('*' if is_prefix else ''))
+    if not terms:
+        raise ValueError("Search query must contain at least one word.")
+    scope = f'u{user_id}' + (f' AND scope : c{conversation_id}' if conversation_id is not None else '')
+    return f"scope : {scope} AND content : ({' '.join(terms)})"
+
+def search_messages(conn: sqlite3.Connection, user_id: int, query: str, conversation_id: int = None,
+                    limit: int = DEFAULT_SEARCH_PAGE_SIZE, offset: int = 0) -> dict:
+    """
+    Full-text searches the messages in a user's conversations, best matches first.
+
+    Uses the `messages_fts` FTS5 index. Because the user (and optional conversation)
+    restriction is part of the MATCH expression, only postings belonging to that
+    user's messages are visited, so latency tracks the user's own matches rather than
+    the size of the messages table.
+
+    Results are scored with the term-frequency and length-normalisation part of BM25,
+    computed over the matched rows only. FTS5's built-in bm25() is not used because it
+    derives each term's document frequency by walking the term's full doclist on every
+    query, which grows with the table. Every result contains every search word, so
+    dropping the IDF factor changes little in the ordering.
+
+    Prefix terms (`word*`) are the exception: FTS5 merges the doclists of every indexed
+    term with that prefix, so their cost does grow with the table.
+
+    Args:
+        conn (sqlite3.Connection): An active SQLite3 connection object.
+        user_id (int): The requesting user; only their conversations are searched.
+        query (str): Free-text search terms (all must match; `word*` for prefix match).
+        conversation_id (int, optional): Restrict the search to one conversation.
+        limit (int): Page size, between 1 and MAX_SEARCH_PAGE_SIZE.
+        offset (int): Number of ranked results to skip, between 0 and MAX_SEARCH_OFFSET.
+
+    Returns:
+        dict: {
+            'results': list[dict],  # 'message_id', 'conversation_id', 'sender_id', 'timestamp',
+                                    # 'snippet' (matches wrapped in SEARCH_HIGHLIGHT_START/END), 'rank'
+            'has_more': bool
+        }
+        Lower `rank` values are better matches (negated score, as with FTS5 bm25).
+
+    Raises:
+        ValueError: If arguments are invalid or the query has no searchable words.
+        sqlite3.Error: If a database error occurs.
+    """
+    if not isinstance(user_id, int):
+        raise ValueError("user_id must be an integer.")
+    if conversation_id is not None and not isinstance(conversation_id, int):
+        raise ValueError("conversation_id must be an integer.")
+    if not isinstance(query, str):
+        raise ValueError("Search query must be a string.")
+    if not isinstance(limit, int) or not (1 <= limit <= MAX_SEARCH_PAGE_SIZE):
+        raise ValueError(f"limit must be an integer between 1 and {MAX_SEARCH_PAGE_SIZE}.")
+    if not isinstance(offset, int) or not (0 <= offset <= MAX_SEARCH_OFFSET):
+        raise ValueError(f"offset must be an integer between 0 and {MAX_SEARCH_OFFSET}.")
+
+    match_expression = _build_search_match(query, user_id, conversation_id)
+    cursor = conn.cursor()
+    try:
+        # highlight() with a one-character start marker and an empty end marker lengthens the
+        # text by exactly one character per matched token, which gives the term frequency.
+        cursor.execute(
+            """
+            WITH matches AS (
+                SELECT
+                    rowid AS message_id,
+                    length(highlight(messages_fts, 0, char(1), '')) AS highlighted_length,
+                    snippet(messages_fts, 0, :highlight_start, :highlight_end, '...', :snippet_tokens) AS snippet
+                FROM messages_fts
+                WHERE messages_fts MATCH :match
+            ),
+            scored AS (
+                SELECT
+                    m.message_id,
+                    m.conversation_id,
+                    m.sender_id,
+                    m.timestamp,
+                    matches.snippet,
+                    matches.highlighted_length - length(m.content) AS term_frequency,
+                    length(m.content) * 1.0 / AVG(length(m.content)) OVER () AS relative_length
+                FROM matches
+                JOIN messages m ON m.message_id = matches.message_id
+            )
+            SELECT
+                message_id,
+                conversation_id,
+                sender_id,
+                timestamp,
+                snippet,
+                -(term_frequency * (:k1 + 1.0)
+                  / (term_frequency + :k1 * (1.0 - :b + :b * relative_length))) AS rank
+            FROM scored
+            ORDER BY rank, message_id DESC
+            LIMIT :limit OFFSET :offset
+            """,
+            {
+                "match": match_expression,
+                "highlight_start": SEARCH_HIGHLIGHT_START,
+                "highlight_end": SEARCH_HIGHLIGHT_END,
+                "snippet_tokens": SEARCH_SNIPPET_TOKENS,
+                "k1": SEARCH_BM25_K1,
+                "b": SEARCH_BM25_B,
+                "limit": limit + 1, # One extra row tells us whether another page exists
+                "offset": offset,
+            }
         )
-        -- Left join to get the last message details; only keep the one ranked as newest (rn=1)
-        LEFT JOIN LastMessagePerConversation lmpc ON c.conversation_id = lmpc.conversation_id AND lmpc.rn = 1
-        -- Filter conversations to include only those where the given user_id is a participant
-        WHERE c.participant1_id = :user_id OR c.participant2_id = :user_id
-        -- Order conversations by their last update time (most recent first)
-        ORDER BY c.updated_at DESC;
-        """
-        # Using named placeholders for clarity with multiple uses of user_id
-        cursor.execute(query, {"user_id": user_id})
+        rows = [dict(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        print(f"Error in search_messages for user {user_id}: {e}")
+        raise
 
-        for row in cursor.fetchall():
-            conversations_data.append(dict(row))
-        return conversations_data
+    return {"results": rows[:limit], "has_more": len(rows) > limit}
+
+def get_unread_summary(conn: sqlite3.Connection, user_id: int) -> dict:
+    """
+    Returns a user's total unread message count for badge displays.
+
+    Sums the incrementally maintained per-conversation counters through the partial
+    index on conversations with unread messages; the messages table is never scanned.
+
+    Args:
+        conn (sqlite3.Connection): An active SQLite3 connection object.
+        user_id (int): The ID of the user.
+
+    Returns:
+        dict: {'total_unread': int, 'conversations_with_unread': int}
+
+    Raises:
+        ValueError: If user_id is not an integer.
+        sqlite3.Error: If a database error occurs.
+    """
+    if not isinstance(user_id, int):
+        raise ValueError("user_id must be an integer.")
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            SELECT COALESCE(SUM(unread_count), 0) AS total_unread, COUNT(*) AS conversations_with_unread
+            FROM user_conversations
+            WHERE user_id = ? AND unread_count > 0
+            """,
+            (user_id,)
+        )
+        return dict(cursor.fetchone())
     except sqlite3.Error as e:
-        print(f"Error in get_conversations_by_user_id for user {user_id}: {e}")
-        return [] # Return empty list on error
+        print(f"Error in get_unread_summary for user {user_id}: {e}")
+        raise
 
 def get_conversation_by_id(conn: sqlite3.Connection, conversation_id: int) -> dict | None:
     """
@@ -397,6 +1259,284 @@ def get_conversation_by_id(conn: sqlite3.Connection, conversation_id: int) -> di
         return None # Return None on error
 
 
+# --- Group-Commit Write Queue ---
+
+class MessageWriteQueue:
+    """
+    Optional write-behind queue that commits message sends in batches.
+
+    Under bursty traffic every `send_direct_message` call competes for SQLite's
+    single write lock and pays for its own commit. This queue instead hands sends
+    to one writer thread, which drains up to `batch_size` pending sends (or
+    whatever arrived within `flush_interval_ms` of the first one) and applies them
+    in one transaction with one commit.
+
+    Each send runs inside its own SAVEPOINT, so a send that fails (e.g. unknown
+    user) fails only its own future; the rest of the batch still commits.
+    Futures are resolved only after the batch's commit has returned. The batch is
+    committed with `PRAGMA synchronous = FULL` (the pool's default, NORMAL, can lose
+    the last commits in WAL mode on power loss), so a resolved send is durable; the
+    fsync is paid once per batch rather than once per message.
+
+    Usage:
+        write_queue = get_message_write_queue('messaging_app.db')
+        conversation_id, message_id = write_queue.submit(sender_id, receiver_id, content).result()
+    """
+
+    _STOP = object() # Sentinel telling the writer thread to exit
+
+    def __init__(self, db_name: str, batch_size: int = WRITE_QUEUE_BATCH_SIZE,
+                 flush_interval_ms: float = WRITE_QUEUE_FLUSH_INTERVAL_MS,
+                 max_queue_depth: int = WRITE_QUEUE_MAX_DEPTH):
+        """
+        Starts the writer thread.
+
+        Args:
+            db_name (str): The SQLite database file the messages are written to.
+            batch_size (int): Maximum number of sends committed together.
+            flush_interval_ms (float): Maximum time a batch waits for more sends after its first one.
+            max_queue_depth (int): Maximum number of pending sends before `submit` blocks.
+
+        Raises:
+            ValueError: If batch_size or max_queue_depth is smaller than 1 or flush_interval_ms is negative.
+        """
+        if batch_size < 1 or max_queue_depth < 1 or flush_interval_ms < 0:
+            raise ValueError("batch_size and max_queue_depth must be >= 1 and flush_interval_ms >= 0.")
+        self.db_name = db_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue_depth)
+        self._closed = False
+        self._submit_lock = threading.Lock() # Orders submits against close(), so nothing is queued after _STOP
+        self._lock = threading.Lock()
+        self._started_at = time.monotonic()
+        self._stats = {
+            "messages_submitted": 0,
+            "messages_written": 0,
+            "messages_failed": 0,
+            "batches_committed": 0,
+            "batches_failed": 0,
+            "max_batch_size": 0,
+            "max_queue_depth": 0,
+            "commit_time_total_seconds": 0.0,
+        }
+        self._writer = threading.Thread(target=self._run, name=f"MessageWriteQueue[{db_name}]", daemon=True)
+        self._writer.start()
+
+    def submit(self, sender_id: int, receiver_id: int, content: str) -> Future:
+        """
+        Queues a message send.
+
+        Args:
+            sender_id (int): The user ID of the message sender.
+            receiver_id (int): The user ID of the message recipient.
+            content (str): The text content of the message.
+
+        Returns:
+            Future: Resolves to (conversation_id, message_id) once the batch containing the
+                    message has been committed, or raises the sqlite3.Error that failed it.
+
+        Raises:
+            ValueError: If the arguments are invalid (checked before queueing).
+            sqlite3.OperationalError: If the queue is closed, or still full after WRITE_QUEUE_SUBMIT_TIMEOUT.
+        """
+        _validate_direct_message(sender_id, receiver_id, content)
+
+        future = Future()
+        future.set_running_or_notify_cancel()
+        with self._submit_lock:
+            if self._closed:
+                raise sqlite3.OperationalError("Message write queue is closed.")
+            try:
+                self._queue.put((sender_id, receiver_id, content, future), timeout=WRITE_QUEUE_SUBMIT_TIMEOUT)
+            except queue.Full:
+                raise sqlite3.OperationalError("Message write queue is full.")
+        with self._lock:
+            self._stats["messages_submitted"] += 1
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self._queue.qsize())
+        return future
+
+    def _next_batch(self) -> tuple[list, bool]:
+        """
+        Blocks for the first pending send, then gathers more until the batch is full or the
+        flush interval has elapsed. Returns (batch, stop_requested).
+        """
+        first = self._queue.get()
+        if first is self._STOP:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is self._STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _write_batch(self, batch: list):
+        """Applies one batch in a single transaction and resolves its futures after the commit."""
+        current_timestamp = now_datetime_string()
+        results = []
+        conn = None
+        synchronous = None
+        try:
+            conn = get_db_connection(self.db_name)
+            synchronous = conn.execute("PRAGMA synchronous").fetchone()[0]
+            conn.execute("PRAGMA synchronous = FULL")
+            begin_immediate(conn)
+            for sender_id, receiver_id, content, future in batch:
+                conn.execute("SAVEPOINT queued_message")
+                try:
+                    results.append((future, _insert_direct_message(conn, sender_id, receiver_id, content, current_timestamp)))
+                    conn.execute("RELEASE SAVEPOINT queued_message")
+                except sqlite3.Error as e:
+                    conn.execute("ROLLBACK TO SAVEPOINT queued_message")
+                    conn.execute("RELEASE SAVEPOINT queued_message")
+                    results.append((future, e))
+            commit_started = time.monotonic()
+            conn.commit()
+            commit_seconds = time.monotonic() - commit_started
+        except sqlite3.Error as e:
+            print(f"Error in MessageWriteQueue batch of {len(batch)} messages: {e}")
+            if conn:
+                conn.rollback()
+            with self._lock:
+                self._stats["batches_failed"] += 1
+                self._stats["messages_failed"] += len(batch)
+            for _, _, _, future in batch:
+                future.set_exception(e)
+            return
+        finally:
+            if conn:
+                if synchronous is not None:
+                    conn.execute(f"PRAGMA synchronous = {synchronous}") # Back to the pool's setting
+                conn.close()
+
+        failed = sum(1 for _, outcome in results if isinstance(outcome, Exception))
+        with self._lock:
+            self._stats["batches_committed"] += 1
+            self._stats["messages_written"] += len(batch) - failed
+            self._stats["messages_failed"] += failed
+            self._stats["max_batch_size"] = max(self._stats["max_batch_size"], len(batch))
+            self._stats["commit_time_total_seconds"] += commit_seconds
+        for (sender_id, receiver_id, content, _), (future, outcome) in zip(batch, results):
+            if isinstance(outcome, Exception):
+                future.set_exception(outcome)
+            else:
+                future.set_result(outcome)
+                conversation_id, message_id = outcome
+                publish_new_message(_message_event(conversation_id, message_id, sender_id, content, current_timestamp),
+                                    (sender_id, receiver_id))
+
+    def _run(self):
+        """Writer thread main loop."""
+        while True:
+            batch, stop = self._next_batch()
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except Exception as e: # Never let the writer thread die with futures outstanding
+                    print(f"Unexpected error in MessageWriteQueue writer: {e}")
+                    for _, _, _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+            if stop:
+                self._fail_remaining()
+                return
+
+    def _fail_remaining(self):
+        """Fails any send still queued when the writer thread exits, so no future is left pending."""
+        error = sqlite3.OperationalError("Message write queue is closed.")
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not self._STOP:
+                item[3].set_exception(error)
+                with self._lock:
+                    self._stats["messages_failed"] += 1
+
+    def close(self, timeout: float = None):
+        """
+        Stops accepting sends, flushes everything already queued and stops the writer thread.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait for the flush.
+        """
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put(self._STOP) # Every accepted send is ahead of it
+        self._writer.join(timeout)
+
+    def metrics(self) -> dict:
+        """
+        Returns throughput, batch-size and queue-depth counters.
+
+        Returns:
+            dict: The cumulative counters plus 'queue_depth' (current), 'avg_batch_size'
+                  and 'messages_per_second' (written messages over the queue's lifetime).
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        elapsed = time.monotonic() - self._started_at
+        batches = stats["batches_committed"] + stats["batches_failed"]
+        stats["queue_depth"] = self._queue.qsize()
+        stats["avg_batch_size"] = (stats["messages_written"] + stats["messages_failed"]) / batches if batches else 0.0
+        stats["messages_per_second"] = stats["messages_written"] / elapsed if elapsed > 0 else 0.0
+        return stats
+
+
+_write_queues = {}
+_write_queues_lock = threading.Lock()
+
+def get_message_write_queue(db_name: str) -> MessageWriteQueue:
+    """
+    Returns the shared MessageWriteQueue for `db_name`, starting it on first use.
+
+    Args:
+        db_name (str): The SQLite database file.
+
+    Returns:
+        MessageWriteQueue: The queue for that database.
+    """
+    key = os.path.abspath(db_name)
+    with _write_queues_lock:
+        write_queue = _write_queues.get(key)
+        if write_queue is None or write_queue._closed:
+            write_queue = MessageWriteQueue(db_name)
+            _write_queues[key] = write_queue
+        return write_queue
+
+def close_message_write_queue(db_name: str):
+    """
+    Flushes and stops the shared MessageWriteQueue for `db_name`, if one is running.
+
+    Args:
+        db_name (str): The SQLite database file.
+    """
+    with _write_queues_lock:
+        write_queue = _write_queues.pop(os.path.abspath(db_name), None)
+    if write_queue:
+        write_queue.close()
+
+def close_all_message_write_queues():
+    """Flushes and stops every shared MessageWriteQueue (registered with atexit)."""
+    with _write_queues_lock:
+        write_queues = list(_write_queues.values())
+        _write_queues.clear()
+    for write_queue in write_queues:
+        write_queue.close()
+
+atexit.register(close_all_message_write_queues)
+
+
 if __name__ == '__main__':
     # This section provides an example of how to use the utility functions.
     # It's useful for direct testing of this module.
@@ -497,6 +1637,7 @@ if __name__ == '__main__':
     finally:
         if conn:
             conn.close()
+            close_pool(db_file) # Release pooled file handles so the WAL is checkpointed before removal
             print(f"\nClosed connection to {db_file}.")
             # Clean up the test database file after example run
             if os.path.exists(db_file):
@@ -1,6 +1,8 @@
 import sqlite3
 from datetime import datetime, date # For type hinting and default date values
 import json # Not strictly needed if details are TEXT, but good for conceptual JSON
+from db_connection_pool import PooledConnection, begin_immediate, get_pooled_connection, close_pool
+from time_utils import parse_date, date_range_to_epoch_bounds, add_epoch_columns
 
 # --- Database Schema (SQLite Compatible) ---
 PRESCRIPTION_SCHEMA = """
@@ -39,10 +41,7 @@ CREATE TABLE IF NOT EXISTS prescriptions (
     FOREIGN KEY (provider_id) REFERENCES users(user_id) ON DELETE CASCADE
 );
 
-CREATE INDEX IF NOT EXISTS idx_presc_patient_id ON prescriptions(patient_id);
-CREATE INDEX IF NOT EXISTS idx_presc_provider_id ON prescriptions(provider_id);
 CREATE INDEX IF NOT EXISTS idx_presc_appointment_id ON prescriptions(appointment_id);
-CREATE INDEX IF NOT EXISTS idx_presc_issue_date ON prescriptions(issue_date);
 CREATE INDEX IF NOT EXISTS idx_presc_status ON prescriptions(status);
 
 CREATE TABLE IF NOT EXISTS prescription_medications (
@@ -62,41 +61,100 @@ CREATE TABLE IF NOT EXISTS prescription_medications (
 CREATE INDEX IF NOT EXISTS idx_presc_med_prescription_id ON prescription_medications(prescription_id);
 CREATE INDEX IF NOT EXISTS idx_presc_med_medication_name ON prescription_medications(medication_name);
 
--- Trigger for prescriptions.updated_at
-CREATE TRIGGER IF NOT EXISTS update_prescriptions_updated_at
+-- Append-only history of prescription status changes (see update_prescription_status).
+-- Each change is one small insert, instead of rewriting an ever-growing notes_for_pharmacist.
+CREATE TABLE IF NOT EXISTS prescription_status_events (
+    event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    prescription_id INTEGER NOT NULL,
+    old_status TEXT NOT NULL,
+    new_status TEXT NOT NULL,
+    changed_by INTEGER NOT NULL, -- The acting provider's user_id
+    notes TEXT NULLABLE,
+    created_at DATETIME DEFAULT (STRFTIME('%Y-%m-%d %H:%M:%S', 'now')) NOT NULL,
+    FOREIGN KEY (prescription_id) REFERENCES prescriptions(prescription_id) ON DELETE CASCADE
+);
+
+-- A prescription's history is read newest first, one page at a time (keyset on event_id)
+CREATE INDEX IF NOT EXISTS idx_presc_status_events_prescription ON prescription_status_events(prescription_id, event_id);
+"""
+
+# Trigger for prescriptions.updated_at, for updates that do not set it themselves.
+# update_prescription_status sets updated_at in its own UPDATE, and the WHEN clause then
+# skips the trigger's second UPDATE of the same row. Dropped and recreated so databases
+# created with the earlier unconditional trigger pick up the WHEN clause.
+PRESCRIPTION_TRIGGERS = """
+DROP TRIGGER IF EXISTS update_prescriptions_updated_at;
+CREATE TRIGGER update_prescriptions_updated_at
 AFTER UPDATE ON prescriptions
 FOR EACH ROW
+WHEN OLD.updated_at = NEW.updated_at -- Avoid a second write if updated_at was explicitly set
 BEGIN
     UPDATE prescriptions SET updated_at = (STRFTIME('%Y-%m-%d %H:%M:%S', 'now'))
     WHERE prescription_id = OLD.prescription_id;
 END;
 """
 
+# Integer epoch column generated from issue_date (see time_utils). Date-range
+# filters and ordering use it, so they are plain range predicates on an indexed
+# integer instead of DATE(issue_date) comparisons that cannot use an index.
+# initialize_prescription_schema adds it with ALTER TABLE (which also upgrades
+# existing databases) and then creates PRESCRIPTION_EPOCH_INDEXES.
+PRESCRIPTION_EPOCH_COLUMNS = {
+    "prescriptions": {
+        "issue_date_epoch": "issue_date",
+    },
+}
+
+PRESCRIPTION_EPOCH_INDEXES = """
+-- Superseded by the epoch index below
+DROP INDEX IF EXISTS idx_presc_issue_date;
+
+CREATE INDEX IF NOT EXISTS idx_presc_issue_date_epoch ON prescriptions(issue_date_epoch);
+
+-- Composite indexes proposed by index_advisor.py: a user's prescription list filters on
+-- patient_id/provider_id and sorts by issue date (then prescription_id, which every index
+-- entry already ends with), so it is read in order from one index with no temp B-tree sort.
+-- They replace the single-column patient/provider indexes.
+DROP INDEX IF EXISTS idx_presc_patient_id;
+DROP INDEX IF EXISTS idx_presc_provider_id;
+CREATE INDEX IF NOT EXISTS idx_presc_patient_issue_date_epoch ON prescriptions(patient_id, issue_date_epoch);
+CREATE INDEX IF NOT EXISTS idx_presc_provider_issue_date_epoch ON prescriptions(provider_id, issue_date_epoch);
+"""
+
+# --- Pagination Defaults ---
+DEFAULT_STATUS_EVENT_PAGE_SIZE = 20
+MAX_STATUS_EVENT_PAGE_SIZE = 100
+# Prescriptions per chunk when a list is streamed (see iter_prescriptions_for_user); also
+# the size of each chunk's `prescription_id IN (...)` medications query.
+PRESCRIPTION_LIST_CHUNK_SIZE = 500
+
 # --- Database Utility Functions ---
 
-def get_db_connection(db_name='prescription_app.db') -> sqlite3.Connection:
+def get_db_connection(db_name='prescription_app.db') -> PooledConnection:
     """
-    Establishes and returns an SQLite3 connection object.
+    Checks out a connection from the shared SQLite connection pool.
 
-    The connection is configured to:
+    The connection is configured (once, when the pool opens it) to:
     - Use `sqlite3.Row` as the row_factory for accessing columns by name.
     - Enable foreign key constraint enforcement (`PRAGMA foreign_keys = ON`).
+    - Use WAL journaling, `synchronous=NORMAL`, a busy timeout and a larger page cache.
+
+    Leaving a `with get_db_connection(...) as conn:` block commits (or rolls back)
+    and returns the connection to the pool; so does calling `close()`.
 
     Args:
         db_name (str): The name of the SQLite database file.
                        Defaults to 'prescription_app.db'.
 
     Returns:
-        sqlite3.Connection: The SQLite3 connection object.
+        PooledConnection: A pooled connection exposing the sqlite3.Connection API.
 
     Raises:
-        sqlite3.Error: If any error occurs during database connection.
+        sqlite3.Error: If any error occurs during database connection
+                       (including PoolTimeoutError when the pool is exhausted).
     """
     try:
-        conn = sqlite3.connect(db_name)
-        conn.row_factory = sqlite3.Row
-        conn.execute("PRAGMA foreign_keys = ON;")
-        return conn
+        return get_pooled_connection(db_name)
     except sqlite3.Error as e:
         print(f"Database connection error to '{db_name}': {e}")
         raise
@@ -107,8 +165,10 @@ def initialize_prescription_schema(conn: sqlite3.Connection):
 
     Executes the SQL statements defined in `PRESCRIPTION_SCHEMA` to create
     `users`, a minimal `appointments` table (for FKs), `prescriptions`,
-    and `prescription_medications` tables, along with their indexes and triggers,
-    if they do not already exist. This is idempotent due to `IF NOT EXISTS`.
+    `prescription_medications` and `prescription_status_events` tables, along with
+    their indexes, if they do not already exist, then (re)creates the triggers
+    (`PRESCRIPTION_TRIGGERS`) and adds the generated epoch columns
+    (`PRESCRIPTION_EPOCH_COLUMNS`) and their indexes. This is idempotent.
 
     Args:
         conn (sqlite3.Connection): An active SQLite3 connection object.
@@ -120,6 +180,11 @@ def initialize_prescription_schema(conn: sqlite3.Connection):
     try:
         cursor = conn.cursor()
         cursor.executescript(PRESCRIPTION_SCHEMA)
+        cursor.executescript(PRESCRIPTION_TRIGGERS)
+        for table, epoch_columns in PRESCRIPTION_EPOCH_COLUMNS.items():
+            add_epoch_columns(conn, table, epoch_columns)
+        conn.commit()
+        cursor.executescript(PRESCRIPTION_EPOCH_INDEXES)
         conn.commit()
         print("Prescription database schema initialized successfully.")
     except sqlite3.Error as e:
@@ -127,6 +192,55 @@ def initialize_prescription_schema(conn: sqlite3.Connection):
         conn.rollback()
         raise
 
+_INSERT_PRESCRIPTION_SQL = """
+INSERT INTO prescriptions (prescription_id, appointment_id, patient_id, provider_id, issue_date,
+                           notes_for_patient, notes_for_pharmacist, status, pharmacy_details)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+_INSERT_MEDICATION_SQL = """
+INSERT INTO prescription_medications
+    (prescription_id, medication_name, dosage, frequency, duration,
+     quantity, refills_available, instructions, is_prn)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+_REQUIRED_MEDICATION_FIELDS = ('medication_name', 'dosage', 'frequency', 'quantity')
+_OPTIONAL_MEDICATION_TEXT_FIELDS = ('duration', 'instructions')
+_OPTIONAL_PRESCRIPTION_TEXT_FIELDS = ('notes_for_patient', 'notes_for_pharmacist', 'pharmacy_details', 'status')
+
+def _optional_text(item: dict, field: str):
+    """Returns item[field] if it is a string or missing/None (as None), so it can be bound as TEXT."""
+    value = item.get(field)
+    if value is not None and not isinstance(value, str):
+        raise ValueError(f"'{field}' must be a string if provided.")
+    return value
+
+def _medication_values(med_item: dict) -> tuple:
+    """
+    Validates one medication item and returns its _INSERT_MEDICATION_SQL values after prescription_id.
+
+    Raises:
+        ValueError: If the item is not a dict, a required field is missing, empty or not a
+                    string or number, an optional text field is not a string, or
+                    refills_available is not an integer.
+    """
+    if not isinstance(med_item, dict):
+        raise ValueError(f"Medication item is not a valid medication object: {med_item}")
+    for field in _REQUIRED_MEDICATION_FIELDS:
+        if field not in med_item or not med_item[field]: # Also check for empty values
+            raise ValueError(f"Medication item missing required or has empty field: '{field}'. Medication: {med_item}")
+        if isinstance(med_item[field], bool) or not isinstance(med_item[field], (str, int, float)):
+            raise ValueError(f"Medication field '{field}' must be a string or number. Medication: {med_item}")
+    duration, instructions = (_optional_text(med_item, field) for field in _OPTIONAL_MEDICATION_TEXT_FIELDS)
+    try:
+        refills_available = int(med_item.get('refills_available', 0)) # Ensure integer
+    except (TypeError, ValueError):
+        raise ValueError(f"refills_available must be an integer. Medication: {med_item}")
+    return (med_item['medication_name'], med_item['dosage'], med_item['frequency'],
+            duration, med_item['quantity'], refills_available, instructions,
+            1 if med_item.get('is_prn', False) else 0) # Convert boolean to 0/1 for SQLite
+
 def create_prescription(conn: sqlite3.Connection, patient_id: int, provider_id: int,
                         issue_date: str, medications_list: list[dict],
                         appointment_id: int = None, notes_for_patient: str = None,
@@ -170,7 +284,7 @@ def create_prescription(conn: sqlite3.Connection, patient_id: int, provider_id:
     if not isinstance(issue_date, str):
         raise ValueError("issue_date must be a string.")
     try: # Validate date format
-        datetime.strptime(issue_date, '%Y-%m-%d')
+        parse_date(issue_date)
     except ValueError:
         raise ValueError("issue_date must be in YYYY-MM-DD format.")
     if not isinstance(medications_list, list) or not medications_list: # Must be a non-empty list
@@ -200,26 +314,8 @@ def create_prescription(conn: sqlite3.Connection, patient_id: int, provider_id:
             raise sqlite3.Error("Failed to retrieve lastrowid for new prescription after insert.")
 
         # Insert into prescription_medications table
-        required_med_fields = ['medication_name', 'dosage', 'frequency', 'quantity']
         for med_item in medications_list:
-            # Validate each medication item
-            for field in required_med_fields:
-                if field not in med_item or not med_item[field]: # Also check for empty values
-                    raise ValueError(f"Medication item missing required or has empty field: '{field}'. Medication: {med_item}")
-
-            cursor.execute(
-                """
-                INSERT INTO prescription_medications
-                    (prescription_id, medication_name, dosage, frequency, duration,
-                     quantity, refills_available, instructions, is_prn)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (new_prescription_id, med_item['medication_name'], med_item['dosage'], med_item['frequency'],
-                 med_item.get('duration'), med_item['quantity'],
-                 int(med_item.get('refills_available', 0)), # Ensure integer
-                 med_item.get('instructions'),
-                 1 if med_item.get('is_prn', False) else 0) # Convert boolean to 0/1 for SQLite
-            )
+            cursor.execute(_INSERT_MEDICATION_SQL, (new_prescription_id,) + _medication_values(med_item))
 
         conn.commit() # Commit transaction only if all operations succeed
         return new_prescription_id
@@ -229,6 +325,134 @@ def create_prescription(conn: sqlite3.Connection, patient_id: int, provider_id:
         conn.rollback() # Rollback transaction on any error (ValueError or sqlite3.Error)
         raise # Re-raise the caught exception to inform the caller
 
+def _prescription_values(item: dict) -> tuple[tuple, list[tuple]]:
+    """
+    Validates one create_prescriptions_batch item, like create_prescription validates its arguments.
+
+    Returns:
+        tuple: (_INSERT_PRESCRIPTION_SQL values after prescription_id, [medication values]).
+
+    Raises:
+        ValueError: With create_prescription's message for the first problem found.
+    """
+    if not isinstance(item, dict):
+        raise ValueError("Prescription item must be an object.")
+    patient_id, provider_id = item.get('patient_id'), item.get('provider_id')
+    appointment_id, issue_date = item.get('appointment_id'), item.get('issue_date')
+    medications_list = item.get('medications')
+    if not all(isinstance(id_val, int) for id_val in [patient_id, provider_id]):
+        raise ValueError("patient_id and provider_id must be integers.")
+    if appointment_id is not None and not isinstance(appointment_id, int):
+        raise ValueError("appointment_id must be an integer if provided.")
+    if not isinstance(issue_date, str):
+        raise ValueError("issue_date must be a string.")
+    try: # Validate date format
+        parse_date(issue_date)
+    except ValueError:
+        raise ValueError("issue_date must be in YYYY-MM-DD format.")
+    if not isinstance(medications_list, list) or not medications_list: # Must be a non-empty list
+        raise ValueError("medications_list must be a non-empty list of medication dictionaries.")
+    notes_for_patient, notes_for_pharmacist, pharmacy_details, status = (
+        _optional_text(item, field) for field in _OPTIONAL_PRESCRIPTION_TEXT_FIELDS)
+    medications = [_medication_values(med_item) for med_item in medications_list]
+    return ((appointment_id, patient_id, provider_id, issue_date, notes_for_patient, notes_for_pharmacist,
+             status if status is not None else 'active', pharmacy_details),
+            medications)
+
+def create_prescriptions_batch(conn: sqlite3.Connection, prescriptions: list[dict],
+                               all_or_nothing: bool = True) -> list[dict]:
+    """
+    Creates many prescriptions, with their medications, in one transaction.
+
+    Every item is validated before anything is written: its fields as in
+    create_prescription, then (with set-based lookups inside the write transaction) that
+    its patient, provider and appointment exist. The valid items are then inserted with
+    one executemany for the prescriptions and one for all their medications. Their IDs are
+    assigned up front from the table's AUTOINCREMENT sequence, which is safe because the
+    transaction holds the write lock (BEGIN IMMEDIATE) until it commits.
+
+    Args:
+        conn (sqlite3.Connection): An active SQLite3 connection.
+        prescriptions (list[dict]): Items with create_prescription's arguments as keys:
+                                    'patient_id', 'provider_id', 'issue_date', 'medications'
+                                    (required), 'appointment_id', 'notes_for_patient',
+                                    'notes_for_pharmacist', 'pharmacy_details', 'status' (optional).
+        all_or_nothing (bool): If True (default), nothing is created when any item is invalid.
+                               If False (best effort), the valid items are created anyway.
+
+    Returns:
+        list[dict]: One result per item, in order: {'index', 'status': 'created', 'prescription_id'},
+                    {'index', 'status': 'error', 'message'} for an invalid item, or
+                    {'index', 'status': 'not_created', 'message'} for a valid item left out
+                    because another item failed in all-or-nothing mode.
+
+    Raises:
+        ValueError: If `prescriptions` is not a non-empty list.
+        sqlite3.Error: For database errors; the whole batch is rolled back.
+    """
+    if not isinstance(prescriptions, list) or not prescriptions:
+        raise ValueError("prescriptions must be a non-empty list of prescription objects.")
+
+    results, valid = [], {} # valid: index -> (prescription values, medication values)
+    for index, item in enumerate(prescriptions):
+        try:
+            valid[index] = _prescription_values(item)
+            results.append({"index": index, "status": "created"})
+        except ValueError as ve:
+            results.append({"index": index, "status": "error", "message": str(ve)})
+
+    def fail_batch():
+        for result in results:
+            if result['status'] == 'created':
+                result.update(status="not_created", message="Not created: another item in the batch failed.")
+        return results
+
+    if not valid:
+        return results
+
+    cursor = conn.cursor()
+    begin_immediate(conn)
+    try:
+
+        # Referenced users and appointments, looked up once for the whole batch (also in
+        # all-or-nothing mode after a field error, so every item's own error is reported)
+        user_ids = sorted({user_id for values, _ in valid.values() for user_id in values[1:3]})
+        appointment_ids = sorted({values[0] for values, _ in valid.values() if values[0] is not None})
+        found_users = {row[0] for row in cursor.execute(
+            f"SELECT user_id FROM users WHERE user_id IN ({', '.join('?' * len(user_ids))})", user_ids)}
+        found_appointments = {row[0] for row in cursor.execute(
+            f"SELECT appointment_id FROM appointments WHERE appointment_id IN ({', '.join('?' * len(appointment_ids))})",
+            appointment_ids)} if appointment_ids else set()
+        for index, (values, _) in list(valid.items()):
+            appointment_id, patient_id, provider_id = values[:3]
+            if (patient_id not in found_users or provider_id not in found_users
+                    or (appointment_id is not None and appointment_id not in found_appointments)):
+                del valid[index]
+                results[index].update(status="error", message="Invalid patient_id, provider_id, or appointment_id "
+                                                              "(referenced user or appointment does not exist).")
+        if not valid or (all_or_nothing and len(valid) < len(prescriptions)):
+            conn.rollback()
+            return fail_batch()
+
+        next_id = cursor.execute("""
+            SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'prescriptions'), 0),
+                       COALESCE((SELECT MAX(prescription_id) FROM prescriptions), 0)) + 1
+        """).fetchone()[0]
+        prescription_rows, medication_rows = [], []
+        for prescription_id, (index, (values, medications)) in enumerate(valid.items(), start=next_id):
+            prescription_rows.append((prescription_id,) + values)
+            medication_rows.extend((prescription_id,) + med_values for med_values in medications)
+            results[index]['prescription_id'] = prescription_id
+        cursor.executemany(_INSERT_PRESCRIPTION_SQL, prescription_rows)
+        cursor.executemany(_INSERT_MEDICATION_SQL, medication_rows)
+        conn.commit()
+        return results
+
+    except sqlite3.Error as e:
+        print(f"Error in create_prescriptions_batch: {e}. Rolling back transaction.")
+        conn.rollback()
+        raise
+
 def get_prescription_by_id(conn: sqlite3.Connection, prescription_id: int) -> dict | None:
     """
     Fetches a specific prescription by its ID, including its medications and user details.
@@ -403,47 +627,25 @@ if __name__ == '__main__':
         print(f"Error during __main__ test run in {__file__}: {e}")
     finally:
         if conn: conn.close()
+        close_pool(db_file) # Release pooled file handles so the WAL is checkpointed before removal
         if os.path.exists(db_file): os.remove(db_file)
         print(f"\nCleaned up test DB: {db_file}")
 
 
-def get_prescriptions_for_user(conn: sqlite3.Connection, user_id: int, user_role: str,
-                               start_date_filter: str = None, end_date_filter: str = None,
-                               status_filter: str = None) -> list[dict]:
-    """
-    Fetches prescription summaries for a user based on their role (patient or provider).
-
-    Allows optional filtering by `issue_date` range and `status`.
-    Each summary includes key prescription information and patient/provider usernames.
-    Medications are not included in this summary view; `get_prescription_by_id`
-    should be used for full details including medications.
-
-    Args:
-        conn (sqlite3.Connection): An active SQLite3 connection.
-        user_id (int): The ID of the user (patient or provider).
-        user_role (str): Role of the user ('patient' or 'provider'). This determines
-                         whether to query based on `patient_id` or `provider_id`.
-        start_date_filter (str, optional): Start date for `issue_date` filtering ('YYYY-MM-DD').
-        end_date_filter (str, optional): End date for `issue_date` filtering ('YYYY-MM-DD').
-        status_filter (str, optional): Exact status to filter prescriptions by.
-
-    Returns:
-        list[dict]: A list of prescription summary dictionaries, ordered by `issue_date`
-                    descending, then by `prescription_id` descending. Returns an empty
-                    list if no matching prescriptions are found.
-
-    Raises:
-        ValueError: If `user_id` is not an integer, `user_role` is invalid, or if
-                    date filter strings are provided in an invalid format.
-        sqlite3.Error: For database operational errors during the query.
-    """
+def _prescriptions_for_user_query(user_id: int, user_role: str, start_date_filter: str = None,
+                                  end_date_filter: str = None, status_filter: str = None) -> tuple[str, dict]:
+    """Validates get_prescriptions_for_user's arguments and builds its (query, params)."""
     if not isinstance(user_id, int):
         raise ValueError("user_id must be an integer.")
     if user_role not in ['patient', 'provider']:
         raise ValueError("user_role must be 'patient' or 'provider'.")
 
-    prescriptions_list = []
-    cursor = conn.cursor()
+    # Validates the date strings and turns the inclusive range into half-open bounds
+    # on the indexed issue_date_epoch: [start of start_date, start of the day after end_date)
+    try: start_epoch, _ = date_range_to_epoch_bounds(start_date_filter, None)
+    except ValueError: raise ValueError("Invalid start_date_filter format. Use YYYY-MM-DD.")
+    try: _, end_epoch = date_range_to_epoch_bounds(None, end_date_filter)
+    except ValueError: raise ValueError("Invalid end_date_filter format. Use YYYY-MM-DD.")
 
     params = {} # Using named parameters for better query readability
 
@@ -472,43 +674,138 @@ def get_prescriptions_for_user(conn: sqlite3.Connection, user_id: int, user_role
     params['user_id'] = user_id
 
     # Add optional filters
-    if start_date_filter:
-        # Ensure date strings are valid before using in query
-        try: datetime.strptime(start_date_filter, '%Y-%m-%d')
-        except ValueError: raise ValueError("Invalid start_date_filter format. Use YYYY-MM-DD.")
-        query += " AND DATE(pr.issue_date) >= DATE(:start_date_filter)"
-        params['start_date_filter'] = start_date_filter
-
-    if end_date_filter:
-        try: datetime.strptime(end_date_filter, '%Y-%m-%d')
-        except ValueError: raise ValueError("Invalid end_date_filter format. Use YYYY-MM-DD.")
-        query += " AND DATE(pr.issue_date) <= DATE(:end_date_filter)"
-        params['end_date_filter'] = end_date_filter
+    if start_epoch is not None:
+        query += " AND pr.issue_date_epoch >= :start_epoch"
+        params['start_epoch'] = start_epoch
+
+    if end_epoch is not None:
+        query += " AND pr.issue_date_epoch < :end_epoch"
+        params['end_epoch'] = end_epoch
 
     if status_filter:
         query += " AND pr.status = :status_filter"
         params['status_filter'] = status_filter
 
     # Order results: most recent issue date first, then by ID for consistent tie-breaking
-    query += " ORDER BY pr.issue_date DESC, pr.prescription_id DESC;"
+    query += " ORDER BY pr.issue_date_epoch DESC, pr.prescription_id DESC;"
+    return query, params
+
+def _attach_medications(conn: sqlite3.Connection, prescriptions: list[dict]) -> list[dict]:
+    """
+    Adds a 'medications' list (as in get_prescription_by_id) to each prescription dict,
+    reading the medications of all of them with one query on idx_presc_med_prescription_id.
+    """
+    medications_by_id = {prescription['prescription_id']: [] for prescription in prescriptions}
+    if medications_by_id:
+        ids = list(medications_by_id)
+        cursor = conn.execute(f"""
+            SELECT * FROM prescription_medications
+            WHERE prescription_id IN ({', '.join('?' * len(ids))})
+            ORDER BY prescription_id, prescription_medication_id
+        """, ids)
+        for med_row in cursor:
+            med = dict(med_row)
+            med['is_prn'] = bool(med['is_prn'])
+            medications_by_id[med['prescription_id']].append(med)
+    for prescription in prescriptions:
+        prescription['medications'] = medications_by_id[prescription['prescription_id']]
+    return prescriptions
 
+def get_prescriptions_for_user(conn: sqlite3.Connection, user_id: int, user_role: str,
+                               start_date_filter: str = None, end_date_filter: str = None,
+                               status_filter: str = None, include_medications: bool = False) -> list[dict]:
+    """
+    Fetches prescription summaries for a user based on their role (patient or provider).
+
+    Allows optional filtering by `issue_date` range and `status`.
+    Each summary includes key prescription information and patient/provider usernames.
+    Medications are only included with `include_medications`: they are then read for
+    the whole list with one more query, rather than one `get_prescription_by_id` per row.
+
+    Args:
+        conn (sqlite3.Connection): An active SQLite3 connection.
+        user_id (int): The ID of the user (patient or provider).
+        user_role (str): Role of the user ('patient' or 'provider'). This determines
+                         whether to query based on `patient_id` or `provider_id`.
+        start_date_filter (str, optional): Start date for `issue_date` filtering ('YYYY-MM-DD').
+        end_date_filter (str, optional): End date for `issue_date` filtering ('YYYY-MM-DD').
+        status_filter (str, optional): Exact status to filter prescriptions by.
+        include_medications (bool, optional): Add each prescription's 'medications' list.
+
+    Returns:
+        list[dict]: A list of prescription summary dictionaries, ordered by `issue_date`
+                    descending, then by `prescription_id` descending. Returns an empty
+                    list if no matching prescriptions are found.
+
+    Raises:
+        ValueError: If `user_id` is not an integer, `user_role` is invalid, or if
+                    date filter strings are provided in an invalid format.
+        sqlite3.Error: For database operational errors during the query.
+    """
+    query, params = _prescriptions_for_user_query(user_id, user_role, start_date_filter,
+                                                  end_date_filter, status_filter)
+    cursor = conn.cursor()
     try:
         cursor.execute(query, params)
-        for row in cursor.fetchall():
-            prescriptions_list.append(dict(row))
+        prescriptions_list = [dict(row) for row in cursor.fetchall()]
+        if include_medications:
+            _attach_medications(conn, prescriptions_list)
         return prescriptions_list
     except sqlite3.Error as e:
         print(f"Error in get_prescriptions_for_user (user {user_id}, role {user_role}): {e}")
         raise
 
+def iter_prescriptions_for_user(conn: sqlite3.Connection, user_id: int, user_role: str,
+                                start_date_filter: str = None, end_date_filter: str = None,
+                                status_filter: str = None, include_medications: bool = False,
+                                chunk_size: int = PRESCRIPTION_LIST_CHUNK_SIZE):
+    """
+    Streams the prescriptions get_prescriptions_for_user would return, in chunks.
+
+    The summary query stays open while the caller consumes the chunks, and (with
+    `include_medications`) each chunk's medications are read with one
+    `prescription_id IN (...)` query. A list of up to `chunk_size` prescriptions is
+    therefore two queries, and memory depends on `chunk_size`, not on the list length.
+    Do not write on `conn` until the iteration is finished.
+
+    Args:
+        conn: Active SQLite3 connection.
+        user_id, user_role, start_date_filter, end_date_filter, status_filter,
+        include_medications: See get_prescriptions_for_user.
+        chunk_size: Maximum number of prescriptions per chunk.
+
+    Yields:
+        list[dict]: Non-empty chunks of prescription dictionaries, in the order of get_prescriptions_for_user.
+
+    Raises:
+        ValueError: For invalid arguments (when iteration starts).
+        sqlite3.Error: For database errors.
+    """
+    if not isinstance(chunk_size, int) or chunk_size < 1:
+        raise ValueError("chunk_size must be a positive integer.")
+    query, params = _prescriptions_for_user_query(user_id, user_role, start_date_filter,
+                                                  end_date_filter, status_filter)
+    try:
+        cursor = conn.execute(query, params)
+        while True:
+            chunk = [dict(row) for row in cursor.fetchmany(chunk_size)]
+            if not chunk:
+                return
+            yield _attach_medications(conn, chunk) if include_medications else chunk
+    except sqlite3.Error as e:
+        print(f"Error in iter_prescriptions_for_user (user {user_id}, role {user_role}): {e}")
+        raise
+
 def update_prescription_status(conn: sqlite3.Connection, prescription_id: int, new_status: str,
                                current_provider_id: int, notes: str = None) -> bool:
     """
     Updates the status of a given prescription.
 
     Authorization is performed to ensure only the issuing provider can modify its status.
-    Notes, if provided, are appended to the 'notes_for_pharmacist' field, prefixed with
-    context about the update. The 'updated_at' field is handled by a database trigger.
+    Each change is recorded as a row of `prescription_status_events` (old and new status,
+    acting provider, notes), so the write is the same size however often the prescription
+    changes; see get_prescription_status_events for the history. The status and 'updated_at'
+    are set by one conditional UPDATE, in the same transaction as the event.
 
     Args:
         conn (sqlite3.Connection): An active SQLite3 connection.
@@ -517,7 +814,7 @@ def update_prescription_status(conn: sqlite3.Connection, prescription_id: int, n
         current_provider_id (int): The ID of the provider attempting the update. This is used
                                    for authorization to ensure they are the issuing provider.
         notes (str, optional): Optional notes regarding the status change (e.g., reason
-                               for cancellation). These are appended to existing pharmacist notes.
+                               for cancellation). Stored with the status event.
 
     Returns:
         bool: `True` if the update was successful (one row affected and authorized),
@@ -525,59 +822,113 @@ def update_prescription_status(conn: sqlite3.Connection, prescription_id: int, n
 
     Raises:
         ValueError: For invalid input types (e.g., IDs not int, empty new_status).
-        sqlite3.Error: For database errors during fetch or update operations.
+        sqlite3.Error: For database errors during the update.
     """
     if not isinstance(prescription_id, int) or not isinstance(current_provider_id, int):
         raise ValueError("prescription_id and current_provider_id must be integers.")
     if not isinstance(new_status, str) or not new_status.strip():
         raise ValueError("new_status must be a non-empty string.")
 
+    params = {
+        "prescription_id": prescription_id,
+        "provider_id": current_provider_id,
+        "new_status": new_status,
+        "notes": notes.strip() if notes and notes.strip() else None, # Whitespace-only notes are dropped
+    }
     cursor = conn.cursor()
+    begin_immediate(conn)
     try:
-        # Step 1: Fetch the prescription to verify ownership by the current_provider_id
-        cursor.execute("SELECT provider_id, notes_for_pharmacist FROM prescriptions WHERE prescription_id = ?",
-                       (prescription_id,))
-        prescription = cursor.fetchone()
-
-        if not prescription:
-            print(f"Update failed: Prescription ID {prescription_id} not found.")
-            return False # Prescription does not exist
+        # The event copies the current status as its old_status. Both statements only match
+        # a prescription issued by the acting provider, which is the authorization check.
+        cursor.execute("""
+            INSERT INTO prescription_status_events (prescription_id, old_status, new_status, changed_by, notes)
+            SELECT prescription_id, status, :new_status, :provider_id, :notes
+            FROM prescriptions
+            WHERE prescription_id = :prescription_id AND provider_id = :provider_id
+        """, params)
+        if cursor.rowcount == 0:
+            conn.rollback()
+            owner = cursor.execute("SELECT provider_id FROM prescriptions WHERE prescription_id = ?",
+                                   (prescription_id,)).fetchone()
+            if not owner:
+                print(f"Update failed: Prescription ID {prescription_id} not found.")
+            else:
+                print(f"Authorization failed: Provider {current_provider_id} cannot update "
+                      f"prescription {prescription_id} owned by provider {owner['provider_id']}.")
+            return False
+
+        # Setting updated_at here keeps the updated_at trigger from writing the row again
+        cursor.execute("""
+            UPDATE prescriptions
+            SET status = :new_status, updated_at = (STRFTIME('%Y-%m-%d %H:%M:%S', 'now'))
+            WHERE prescription_id = :prescription_id AND provider_id = :provider_id
+        """, params)
+        conn.commit()
 
-        if prescription['provider_id'] != current_provider_id:
-            # Authorization check: Only the original provider can change the status.
-            print(f"Authorization failed: Provider {current_provider_id} cannot update "
-                  f"prescription {prescription_id} owned by provider {prescription['provider_id']}.")
-            return False # Current provider is not the issuing provider
+        return cursor.rowcount > 0 # True if exactly one row was affected
 
-        # Step 2: Prepare fields for update
-        fields_to_update = {"status": new_status}
-        current_pharmacist_notes = prescription['notes_for_pharmacist'] if prescription['notes_for_pharmacist'] else ""
+    except sqlite3.Error as e:
+        print(f"Error in update_prescription_status for prescription {prescription_id}: {e}")
+        conn.rollback() # Rollback on any error during the transaction
+        raise
 
-        if notes and notes.strip(): # Add notes only if provided and not just whitespace
-            # Append new notes with context (who, when, what status change, and the note itself)
-            note_prefix = f"[{new_status.upper()} by Provider {current_provider_id} on {date.today().isoformat()}]:"
-            updated_pharmacist_notes = f"{current_pharmacist_notes}\n{note_prefix} {notes}".strip()
-            fields_to_update["notes_for_pharmacist"] = updated_pharmacist_notes
+def get_prescription_status_events(conn: sqlite3.Connection, prescription_id: int, before_event_id: int = None,
+                                   limit: int = DEFAULT_STATUS_EVENT_PAGE_SIZE) -> dict:
+    """
+    Retrieves one page of a prescription's status history, most recent change first.
 
-        # Build the SET part of the SQL query dynamically using named placeholders
-        set_clauses = [f"{field} = :{field}" for field in fields_to_update.keys()]
+    Uses keyset pagination on `event_id`, so each page is a single range read on the
+    (prescription_id, event_id) index however long the history grows.
 
-        params_for_update = fields_to_update.copy() # Use a copy for params
-        params_for_update['prescription_id'] = prescription_id # For the WHERE clause
+    Args:
+        conn (sqlite3.Connection): An active SQLite3 connection.
+        prescription_id (int): The ID of the prescription.
+        before_event_id (int, optional): Only return events older than this cursor
+                                         (use the previous page's `next_cursor`).
+        limit (int): Page size, between 1 and MAX_STATUS_EVENT_PAGE_SIZE.
 
-        # The 'updated_at' field is automatically handled by the database trigger upon UPDATE.
-        update_query = f"UPDATE prescriptions SET {', '.join(set_clauses)} WHERE prescription_id = :prescription_id"
+    Returns:
+        dict: {
+            'events': list[dict],      # event_id, old_status, new_status, changed_by, notes, created_at
+            'has_more': bool,
+            'next_cursor': int | None  # Smallest event_id in the page
+        }
 
-        cursor.execute(update_query, params_for_update)
-        conn.commit()
+    Raises:
+        ValueError: If prescription_id/cursor are not integers or `limit` is out of range.
+        sqlite3.Error: For database operational errors during the query.
+    """
+    if not isinstance(prescription_id, int):
+        raise ValueError("prescription_id must be an integer.")
+    if before_event_id is not None and not isinstance(before_event_id, int):
+        raise ValueError("Status history cursor must be an integer.")
+    if not isinstance(limit, int) or not (1 <= limit <= MAX_STATUS_EVENT_PAGE_SIZE):
+        raise ValueError(f"limit must be an integer between 1 and {MAX_STATUS_EVENT_PAGE_SIZE}.")
 
-        return cursor.rowcount > 0 # True if exactly one row was affected
+    query = """
+    SELECT event_id, old_status, new_status, changed_by, notes, created_at
+    FROM prescription_status_events
+    WHERE prescription_id = :prescription_id
+    """
+    params = {"prescription_id": prescription_id, "limit": limit + 1} # One extra row tells us whether another page exists
+    if before_event_id is not None:
+        query += " AND event_id < :before_event_id"
+        params["before_event_id"] = before_event_id
+    query += " ORDER BY event_id DESC LIMIT :limit"
 
+    try:
+        rows = [dict(row) for row in conn.execute(query, params).fetchall()]
     except sqlite3.Error as e:
-        print(f"Error in update_prescription_status for prescription {prescription_id}: {e}")
-        conn.rollback() # Rollback on any error during the transaction
+        print(f"Error in get_prescription_status_events for prescription {prescription_id}: {e}")
         raise
 
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "events": rows,
+        "has_more": has_more,
+        "next_cursor": rows[-1]['event_id'] if rows else None,
+    }
 
 if __name__ == '__main__':
     import os
@@ -669,8 +1020,9 @@ if __name__ == '__main__':
         assert update_success, "Failed to update rx1 status by owner provider."
         rx1_details_cancelled = get_prescription_by_id(conn, rx1_id)
         assert rx1_details_cancelled['status'] == 'cancelled'
-        assert cancel_notes in rx1_details_cancelled['notes_for_pharmacist']
-        print(f"RX1 cancelled successfully. Status: {rx1_details_cancelled['status']}, Notes: '{rx1_details_cancelled['notes_for_pharmacist']}'")
+        rx1_history = get_prescription_status_events(conn, rx1_id)['events']
+        assert rx1_history[0]['old_status'] == 'active' and rx1_history[0]['notes'] == cancel_notes
+        print(f"RX1 cancelled successfully. Status: {rx1_details_cancelled['status']}, History: {rx1_history}")
 
         # Other_provider tries to cancel rx2 (should fail)
         update_fail_auth = update_prescription_status(conn, rx2_id, "cancelled", other_provider_id, "Attempt by wrong provider.")
@@ -690,5 +1042,6 @@ if __name__ == '__main__':
         print(f"Error during __main__ test run in {__file__}: {e}")
     finally:
         if conn: conn.close()
+        close_pool(db_file) # Release pooled file handles so the WAL is checkpointed before removal
         if os.path.exists(db_file): os.remove(db_file)
         print(f"Cleaned up test DB: {db_file}")
\ No newline at end of file
@@ -0,0 +1,684 @@
+"""
+Query-plan index advisor for the db_utils modules.
+
+For each module (appointment, prescription, messaging) the advisor seeds an
+in-memory database through the module's own schema, runs a representative
+workload through the module's public functions and records every distinct SQL
+statement they issue. Each statement is then run through EXPLAIN QUERY PLAN and
+flagged when the plan
+- scans a whole table or index ("SCAN appointments"), or
+- sorts through a temporary B-tree ("USE TEMP B-TREE FOR ORDER BY").
+
+Candidate indexes are derived from the statement itself: equality columns
+first, then the ORDER BY columns (or, without a sort, the first range column),
+plus a partial variant when the statement filters a column against a literal
+(`status = 'confirmed'`). Every candidate is created on the scratch database,
+the statement is re-planned and re-timed, and the candidate is proposed only if
+it clears a flag or makes the statement at least MIN_SPEEDUP times faster.
+
+Usage:
+    python index_advisor.py [--modules appointment,prescription,messaging] [--rows 20000]
+    python index_advisor.py --legacy    # Start from the pre-advisor indexes (before/after timings)
+
+Without --legacy the shipped schema is analysed, so an empty proposal list means
+every recorded statement already has a suitable index.
+"""
+import argparse
+import contextlib
+import io
+import random
+import re
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import db_utils_appointment
+import db_utils_messaging
+import db_utils_prescription
+from time_utils import format_datetime, datetime_to_epoch
+
+MIN_SPEEDUP = 2.0       # A candidate that clears no flag must be at least this much faster
+TIMING_REPEAT = 15      # Executions per timing; the median is reported
+PARTIAL_INDEX_WEIGHT = 0.8  # Partial indexes are smaller and only maintained for matching rows, so they win near-ties
+_SKIPPED_PREFIXES = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE', 'PRAGMA', 'CREATE', 'DROP', 'ALTER')
+
+# Indexes as they were before the advisor's proposals shipped, per module; --legacy
+# restores them so the report shows the original plans and the before/after timings.
+LEGACY_INDEXES = {
+    "appointment": """
+        DROP INDEX IF EXISTS idx_pa_provider_start_epoch;
+        DROP INDEX IF EXISTS idx_appt_patient_start_epoch;
+        DROP INDEX IF EXISTS idx_appt_provider_start_epoch;
+        DROP INDEX IF EXISTS idx_appt_status_start_epoch;
+        CREATE INDEX IF NOT EXISTS idx_pa_provider_id ON provider_availability(provider_id);
+        CREATE INDEX IF NOT EXISTS idx_appt_patient_id ON appointments(patient_id);
+        CREATE INDEX IF NOT EXISTS idx_appt_provider_id ON appointments(provider_id);
+        CREATE INDEX IF NOT EXISTS idx_appt_status ON appointments(status);
+    """,
+    "prescription": """
+        DROP INDEX IF EXISTS idx_presc_patient_issue_date_epoch;
+        DROP INDEX IF EXISTS idx_presc_provider_issue_date_epoch;
+        CREATE INDEX IF NOT EXISTS idx_presc_patient_id ON prescriptions(patient_id);
+        CREATE INDEX IF NOT EXISTS idx_presc_provider_id ON prescriptions(provider_id);
+    """,
+    "messaging": """
+        DROP INDEX IF EXISTS idx_user_conversations_conversation_id;
+        CREATE INDEX IF NOT EXISTS idx_conversations_participant1 ON conversations(participant1_id);
+    """,
+}
+
+
+# --- Statement recording ---
+
+class RecordingCursor(sqlite3.Cursor):
+    """A cursor that reports every statement it executes to its connection."""
+
+    def execute(self, sql, parameters=()):
+        self.connection.record(sql, parameters)
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)
+        if seq_of_parameters:
+            self.connection.record(sql, seq_of_parameters[0])
+        return super().executemany(sql, seq_of_parameters)
+
+
+class RecordingConnection(sqlite3.Connection):
+    """
+    A sqlite3.Connection that records the distinct statements run through it.
+
+    db_utils functions take the connection as an argument, so passing one of these
+    captures exactly the SQL (with placeholders, as written in the module) and one
+    set of real parameters for each statement. Set `recording` to False while seeding.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.recording = False
+        self.statements = {}  # normalised SQL -> (sql, parameters), in first-seen order
+
+    def record(self, sql, parameters):
+        normalised = ' '.join(sql.split()).rstrip(';')
+        if self.recording and normalised not in self.statements and not normalised.upper().startswith(_SKIPPED_PREFIXES):
+            self.statements[normalised] = (sql, parameters)
+
+    def cursor(self, factory=RecordingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def open_scratch_connection() -> RecordingConnection:
+    """Opens an in-memory RecordingConnection configured like a pooled connection."""
+    conn = sqlite3.connect(':memory:', factory=RecordingConnection, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    return conn
+
+
+# --- Plan analysis ---
+
+def explain(conn: sqlite3.Connection, sql: str, parameters=()) -> list[str]:
+    """Returns the EXPLAIN QUERY PLAN detail lines for a statement."""
+    rows = sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql.strip().rstrip(';'), parameters).fetchall()
+    return [row[3] for row in rows]
+
+
+def plan_issues(plan: list[str], sql: str = '') -> list[str]:
+    """
+    Returns the plan lines the advisor flags: full table/index scans and temp B-tree sorts.
+
+    Scans of FTS virtual tables, constant rows, subquery results, SQLite's internal
+    tables (sqlite_sequence etc., which cannot be indexed) and the statement's own CTEs
+    (`WITH name AS (...)`, already-filtered intermediate results) are not flagged.
+    """
+    ctes = {name.lower() for name in _CTE_NAME.findall(sql)}
+    issues = []
+    for detail in plan:
+        if detail.startswith('USE TEMP B-TREE'):
+            issues.append(detail)
+        elif detail.startswith('SCAN ') and not detail.startswith(('SCAN CONSTANT ROW', 'SCAN (subquery', 'SCAN sqlite_')) \
+                and 'VIRTUAL TABLE' not in detail and detail.split()[1].lower() not in ctes:
+            issues.append(detail)
+    return issues
+
+
+def time_statement(conn: sqlite3.Connection, sql: str, parameters=(), repeat: int = TIMING_REPEAT) -> float:
+    """
+    Returns the median execution time of a statement in milliseconds.
+
+    One untimed run warms the page cache first. Writes run inside a savepoint that
+    is rolled back, so timing leaves the data unchanged.
+    """
+    is_read = sql.lstrip().upper().startswith(('SELECT', 'WITH'))
+    timings = []
+    for _ in range(repeat + 1):
+        if not is_read:
+            sqlite3.Connection.execute(conn, "SAVEPOINT index_advisor")
+        started = time.perf_counter()
+        sqlite3.Connection.execute(conn, sql, parameters).fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+        if not is_read:
+            sqlite3.Connection.execute(conn, "ROLLBACK TO index_advisor")
+            sqlite3.Connection.execute(conn, "RELEASE index_advisor")
+    timings = sorted(timings[1:])
+    return timings[len(timings) // 2]
+
+
+# --- Candidate generation ---
+
+_TABLE_REF = re.compile(
+    r'\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)(?:\s+(?:AS\s+)?(?!(?:ON|WHERE|JOIN|LEFT|INNER|CROSS|ORDER|GROUP|LIMIT|SET|USING)\b)(\w+))?',
+    re.IGNORECASE
+)
+_PREDICATE = re.compile(r"(?:(\w+)\.)?(\w+)\s*(>=|<=|=|<|>)\s*(\?|:\w+|'[^']*'|-?\d+)")
+_ORDER_TERM = re.compile(r'(?:(\w+)\.)?(\w+)(?:\s+(ASC|DESC))?', re.IGNORECASE)
+_CTE_NAME = re.compile(r'(?:\bWITH|,)\s+(\w+)\s+AS\s*\(', re.IGNORECASE)
+
+
+def _table_columns(conn: sqlite3.Connection, table: str) -> list[str]:
+    return [row[1] for row in sqlite3.Connection.execute(conn, f"PRAGMA table_xinfo({table})")]
+
+
+def _rowid_column(conn: sqlite3.Connection, table: str) -> str | None:
+    """Returns the INTEGER PRIMARY KEY (rowid alias) column of a table, if it has one."""
+    primary_keys = [row for row in sqlite3.Connection.execute(conn, f"PRAGMA table_info({table})") if row[5]]
+    if len(primary_keys) == 1 and primary_keys[0][2].upper() == 'INTEGER':
+        return primary_keys[0][1]
+    return None
+
+
+def _existing_index_keys(conn: sqlite3.Connection, table: str) -> set[tuple]:
+    """
+    Returns (key columns, is_partial) for every index on a table, including UNIQUE constraints.
+
+    A trailing rowid-alias column is dropped from the key, since every index entry
+    already ends with the rowid: (conversation_id, message_id) on messages is the
+    same index as (conversation_id).
+    """
+    rowid = _rowid_column(conn, table)
+    keys = set()
+    for index in sqlite3.Connection.execute(conn, f"PRAGMA index_list({table})").fetchall():
+        columns = [row[2] for row in sqlite3.Connection.execute(conn, f"PRAGMA index_info({index[1]})")]
+        if columns and columns[-1] == rowid:
+            columns.pop()
+        keys.add((tuple(columns), bool(index[4])))
+    return keys
+
+
+def _clause(sql: str, keyword: str, terminators: tuple) -> str:
+    """Returns the text of a clause such as WHERE, up to the first terminator keyword."""
+    match = re.search(rf'\b{keyword}\b(.*)', sql, re.IGNORECASE | re.DOTALL)
+    if not match:
+        return ''
+    text = match.group(1)
+    for terminator in terminators:
+        end = re.search(rf'\b{terminator}\b', text, re.IGNORECASE)
+        if end:
+            text = text[:end.start()]
+    return text
+
+
+def _index_ddl(table: str, key: list[str], predicate: str = None) -> str:
+    name = f"advisor_{table}_{'_'.join(key)}" + ("_partial" if predicate else "")
+    return f"CREATE INDEX {name} ON {table}({', '.join(key)})" + (f" WHERE {predicate}" if predicate else "")
+
+
+def _foreign_key_candidates(conn: sqlite3.Connection, plan: list[str], tables: list[str],
+                            known_tables: set[str]) -> list[str]:
+    """
+    Proposes indexes for foreign-key checks that scan a child table.
+
+    When a statement writes a parent row, SQLite looks up the rows referencing it
+    in each child table (for ON DELETE/UPDATE actions and constraint checks). Those
+    lookups appear in the plan as scans of tables the statement never names, and
+    they need an index on the child's foreign-key columns.
+    """
+    candidates = []
+    for detail in plan:
+        if not detail.startswith('SCAN '):
+            continue
+        child = detail.split()[1]
+        if child in tables or child not in known_tables:
+            continue
+        existing = _existing_index_keys(conn, child)
+        for row in sqlite3.Connection.execute(conn, f"PRAGMA foreign_key_list({child})"):
+            key = (row[3],)  # The "from" column; the schemas only use single-column foreign keys
+            if row[2] in tables and not any(columns[:1] == key for columns, _ in existing):
+                candidates.append(_index_ddl(child, list(key)))
+    return candidates
+
+
+def propose_candidates(conn: sqlite3.Connection, sql: str, plan: list[str] = ()) -> list[str]:
+    """
+    Derives candidate CREATE INDEX statements for one statement.
+
+    Per referenced table, the key is equality-bound columns followed by the ORDER
+    BY columns (when the whole sort is on that table) or else the first
+    range-filtered column. Each leading run of the equality columns is tried, so
+    (patient_id, start) is offered alongside (patient_id, status, start) and one
+    index can serve several filter combinations. Literal equality filters
+    (`status = 'confirmed'`) add a partial-index variant and a variant with the
+    column as a key. Foreign-key child scans in `plan` add an index on the
+    child's foreign-key column. Candidates matching an existing index are dropped.
+    """
+    aliases = {}
+    for table, alias in _TABLE_REF.findall(sql):
+        aliases[table] = table
+        if alias:
+            aliases[alias] = table
+    known_tables = {row[0] for row in sqlite3.Connection.execute(
+        conn, "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite\\_%' ESCAPE '\\'")}
+    aliases = {alias: table for alias, table in aliases.items() if table in known_tables}
+    tables = sorted(set(aliases.values()))  # Views, CTEs and keywords such as DO UPDATE SET are skipped
+    columns = {table: _table_columns(conn, table) for table in tables}
+
+    def owner(qualifier, column):
+        if qualifier:
+            return aliases.get(qualifier)
+        matches = [table for table in tables if column in columns[table]]
+        return matches[0] if len(matches) == 1 else None
+
+    filters = {table: {"eq": [], "literal": [], "range": []} for table in tables}
+    on_clauses = ' '.join(re.findall(r'\bON\b(.*?)(?=\bJOIN\b|\bWHERE\b|$)', sql, re.IGNORECASE | re.DOTALL))
+    where = _clause(sql, 'WHERE', ('ORDER BY', 'GROUP BY', 'LIMIT', 'RETURNING'))
+    for qualifier, column, operator, value in _PREDICATE.findall(where + ' ' + on_clauses):
+        table = owner(qualifier, column)
+        if table is None or column not in columns[table]:
+            continue
+        if operator == '=' and value.startswith("'"):
+            bucket = "literal"
+        elif operator == '=':
+            bucket = "eq"
+        else:
+            bucket = "range"
+        entry = (column, value) if bucket == "literal" else column
+        if entry not in filters[table][bucket]:
+            filters[table][bucket].append(entry)
+
+    order_by = {}
+    for qualifier, column, direction in _ORDER_TERM.findall(_clause(sql, 'ORDER BY', ('LIMIT', 'RETURNING'))):
+        table = owner(qualifier, column)
+        if table is not None:
+            order_by.setdefault(table, []).append(column)
+
+    candidates = []
+    for table in tables:
+        rowid = _rowid_column(conn, table)
+        eq = filters[table]["eq"]
+        if rowid in eq:
+            continue  # Already a rowid lookup
+        sort = [column for column in order_by.get(table, []) if column != rowid] if len(order_by) == 1 else []
+        tail = sort or filters[table]["range"][:1]
+        literal = filters[table]["literal"]
+        predicate = ' AND '.join(f"{column} = {value}" for column, value in literal)
+        variants = []
+        for length in range(len(eq), -1, -1):
+            key = eq[:length] + [column for column in tail if column not in eq[:length]]
+            if key:
+                variants.append((key, None))
+                if literal:
+                    variants.append((key, predicate))
+        if literal:
+            variants.append((eq + [column for column, _ in literal] + [c for c in tail if c not in eq], None))
+        existing = _existing_index_keys(conn, table)
+        for key, key_predicate in variants:
+            if key and key[-1] == rowid:
+                key = key[:-1]
+            if not key or (tuple(key), key_predicate is not None) in existing:
+                continue
+            ddl = _index_ddl(table, key, key_predicate)
+            if ddl not in candidates:
+                candidates.append(ddl)
+    for ddl in _foreign_key_candidates(conn, plan, tables, known_tables):
+        if ddl not in candidates:
+            candidates.append(ddl)
+    return candidates
+
+
+def evaluate_statement(conn: sqlite3.Connection, sql: str, parameters) -> dict:
+    """
+    Plans and times one statement, then tries each candidate index on it.
+
+    A candidate is accepted when the planner uses it and it either clears a flag
+    or is at least MIN_SPEEDUP times faster.
+
+    Returns:
+        dict: {'plan': list[str], 'issues': list[str], 'ms': float,
+               'candidates': list[{'ddl', 'plan', 'issues', 'ms'}]}  # Accepted candidates, best first
+    """
+    plan = explain(conn, sql, parameters)
+    result = {"plan": plan, "issues": plan_issues(plan, sql), "ms": time_statement(conn, sql, parameters),
+              "candidates": []}
+    for ddl in propose_candidates(conn, sql, plan):
+        index_name = ddl.split()[2]
+        sqlite3.Connection.execute(conn, ddl)
+        try:
+            candidate_plan = explain(conn, sql, parameters)
+            if not any(index_name in detail for detail in candidate_plan):
+                continue  # The planner ignores it
+            candidate = {"ddl": ddl, "plan": candidate_plan, "issues": plan_issues(candidate_plan, sql),
+                         "ms": time_statement(conn, sql, parameters)}
+        finally:
+            sqlite3.Connection.execute(conn, f"DROP INDEX {index_name}")
+        if len(candidate["issues"]) < len(result["issues"]) or candidate["ms"] * MIN_SPEEDUP <= result["ms"]:
+            result["candidates"].append(candidate)
+    result["candidates"].sort(key=lambda candidate: (len(candidate["issues"]), candidate["ms"]))
+    return result
+
+
+def consolidate_proposals(results: list[dict]) -> list[str]:
+    """
+    Picks a small set of indexes that covers every statement with an accepted candidate.
+
+    Greedy set cover: repeatedly take the index accepted by the most still-uncovered
+    statements (ties go to the lower total time, with partial indexes weighted by
+    PARTIAL_INDEX_WEIGHT). One (provider_id, start) index thus wins over separate
+    per-filter variants of it. Each result gets a 'proposal'
+    entry: the chosen candidate for that statement, or None.
+    """
+    chosen = []
+    uncovered = [result for result in results if result["candidates"]]
+    for result in results:
+        result["proposal"] = None
+    while uncovered:
+        support = {}
+        for result in uncovered:
+            for candidate in result["candidates"]:
+                weight = PARTIAL_INDEX_WEIGHT if ' WHERE ' in candidate["ddl"] else 1.0
+                count, total_ms = support.get(candidate["ddl"], (0, 0.0))
+                support[candidate["ddl"]] = (count + 1, total_ms + candidate["ms"] * weight)
+        ddl = min(support, key=lambda key: (-support[key][0], support[key][1]))
+        chosen.append(ddl)
+        for result in uncovered:
+            result["proposal"] = next((c for c in result["candidates"] if c["ddl"] == ddl), result["proposal"])
+        uncovered = [result for result in uncovered if result["proposal"] is None]
+    return chosen
+
+
+def redundant_indexes(conn: sqlite3.Connection) -> list[tuple[str, str]]:
+    """
+    Finds indexes whose key is a leading prefix of another index on the same table.
+
+    Such an index serves no lookup the longer one cannot, and costs a write on
+    every insert. UNIQUE and partial indexes are never reported, since they
+    enforce or cover something the longer index does not.
+
+    Returns:
+        list[tuple[str, str]]: (redundant index, index that covers it).
+    """
+    redundant = []
+    for (table,) in sqlite3.Connection.execute(conn, "SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+        rowid = _rowid_column(conn, table)
+        indexes = {}
+        for index in sqlite3.Connection.execute(conn, f"PRAGMA index_list({table})").fetchall():
+            columns = [row[2] for row in sqlite3.Connection.execute(conn, f"PRAGMA index_info({index[1]})")]
+            if columns and columns[-1] == rowid:
+                columns.pop()
+            indexes[index[1]] = (tuple(columns), bool(index[2]), bool(index[4]))
+        for name, (columns, unique, partial) in indexes.items():
+            if unique or partial:
+                continue
+            for other, (other_columns, _, other_partial) in indexes.items():
+                if other != name and not other_partial and len(other_columns) > len(columns) \
+                        and other_columns[:len(columns)] == columns:
+                    redundant.append((name, other))
+                    break
+    return redundant
+
+
+# --- Module workloads ---
+# Each workload seeds a freshly initialised scratch database with `rows` rows in the
+# module's main table and then calls the module's functions the way the APIs and jobs do.
+
+def _seed_users(conn, count: int, rng: random.Random, with_contacts: bool = True) -> list[int]:
+    if with_contacts:
+        conn.executemany("INSERT INTO users (username, email, phone) VALUES (?, ?, ?)",
+                         [(f'advisor_user_{i}', f'user{i}@example.com', f'555-{i:07d}') for i in range(count)])
+    else:
+        conn.executemany("INSERT INTO users (username) VALUES (?)", [(f'advisor_user_{i}',) for i in range(count)])
+    return [row[0] for row in sqlite3.Connection.execute(conn, "SELECT user_id FROM users ORDER BY user_id")]
+
+
+def _appointment_workload(conn, rows: int, rng: random.Random):
+    user_ids = _seed_users(conn, 2200, rng)
+    providers, patients = user_ids[:200], user_ids[200:]
+    now = datetime.now().replace(second=0, microsecond=0)
+    statuses = ['confirmed'] * 5 + ['pending_provider_confirmation'] * 2 + ['completed'] * 2 + ['cancelled_by_patient']
+    appointments = []
+    booked = set() # (provider, slot): the overlap triggers reject double-booked seed rows
+    while len(appointments) < rows:
+        provider, slot = rng.choice(providers), rng.randint(-8760, 8760)
+        if (provider, slot) in booked:
+            continue
+        booked.add((provider, slot))
+        start = now + timedelta(minutes=30 * slot)
+        status = rng.choice(statuses)
+        reminded = format_datetime(start - timedelta(days=1)) if status == 'confirmed' and rng.random() < 0.3 else None
+        appointments.append((rng.choice(patients), provider, format_datetime(start),
+                             format_datetime(start + timedelta(minutes=30)), status, reminded))
+    conn.executemany("""INSERT INTO appointments (patient_id, provider_id, appointment_start_time, appointment_end_time,
+                        status, last_reminder_sent_at) VALUES (?, ?, ?, ?, ?, ?)""", appointments)
+    availability = []
+    for _ in range(rows // 4):
+        start = now.replace(hour=9, minute=0) + timedelta(days=rng.randint(-180, 180))
+        availability.append((rng.choice(providers), format_datetime(start), format_datetime(start + timedelta(hours=8))))
+    conn.executemany("INSERT INTO provider_availability (provider_id, start_datetime, end_datetime) VALUES (?, ?, ?)",
+                     availability)
+    conn.commit()
+
+    conn.recording = True
+    provider, patient = providers[0], patients[0]
+    # Beyond the seeded appointments, so the booking below cannot conflict with one
+    start = now + timedelta(days=800)
+    window = (format_datetime(start), format_datetime(start + timedelta(days=7)))
+    availability_id = db_utils_appointment.add_provider_availability(conn, provider, *window)
+    db_utils_appointment.get_provider_availability(conn, provider)
+    db_utils_appointment.get_provider_availability(conn, provider, *window)
+    db_utils_appointment.get_bookable_slots(conn, provider, *window, 30)
+    db_utils_appointment.find_first_available_slots(conn, providers[:50], *window, 30)
+    slot = (format_datetime(start), format_datetime(start + timedelta(minutes=30)))
+    hold = db_utils_appointment.place_hold(conn, patient, provider, *slot)
+    appointment_id = db_utils_appointment.request_appointment(conn, patient, provider, *slot, "Checkup",
+                                                              hold_id=hold["hold_id"])
+    db_utils_appointment.is_provider_free(conn, provider, *slot)
+    db_utils_appointment.delete_provider_availability(conn, availability_id, provider)
+    db_utils_appointment.get_appointment_by_id(conn, appointment_id)
+    today, next_month = now.date().isoformat(), (now + timedelta(days=30)).date().isoformat()
+    for user_id, role in ((patient, 'patient'), (provider, 'provider')):
+        db_utils_appointment.get_appointments_for_user(conn, user_id, role)
+        db_utils_appointment.get_appointments_for_user(conn, user_id, role, status_filter='confirmed')
+        db_utils_appointment.get_appointments_for_user(conn, user_id, role, start_date_filter=today,
+                                                       end_date_filter=next_month)
+    db_utils_appointment.update_appointment_status(conn, appointment_id, 'confirmed', provider, 'provider')
+    db_utils_appointment.get_appointments_needing_reminders(
+        conn, format_datetime(now), format_datetime(now + timedelta(hours=24)))
+    for _ in db_utils_appointment.iter_appointments_needing_reminders(
+            conn, format_datetime(now), format_datetime(now + timedelta(hours=24)), chunk_size=5):
+        pass
+    db_utils_appointment.mark_reminder_sent(conn, appointment_id)
+    reminders = db_utils_appointment.get_appointments_needing_reminders(
+        conn, format_datetime(now + timedelta(hours=23)), format_datetime(now + timedelta(hours=24)))
+    db_utils_appointment.enqueue_reminder_notifications(conn, reminders)
+    claimed = db_utils_appointment.claim_due_notifications(conn)
+    db_utils_appointment.record_notification_results(
+        conn, [(notification['notification_id'], notification['attempts'], index % 2 == 0, None)
+               for index, notification in enumerate(claimed)])
+    db_utils_appointment.get_next_notification_attempt_epoch(conn)
+    # Reminder daemon: load a slice, follow the change feed, fetch the due appointments
+    starts = db_utils_appointment.get_confirmed_appointment_starts(
+        conn, datetime_to_epoch(now), datetime_to_epoch(now + timedelta(hours=25)))
+    db_utils_appointment.get_reminder_appointments(conn, starts[:50])
+    change_cursor = db_utils_appointment.get_latest_appointment_change_id(conn)
+    db_utils_appointment.get_appointment_changes(conn, change_cursor - 100)
+    db_utils_appointment.prune_appointment_changes(conn)
+    conn.recording = False
+    # Recorded statements are replayed for timing; without the booking its INSERT does not conflict with itself.
+    conn.execute("DELETE FROM appointments WHERE appointment_id = ?", (appointment_id,))
+    conn.commit()
+
+
+def _prescription_workload(conn, rows: int, rng: random.Random):
+    user_ids = _seed_users(conn, 2200, rng)
+    providers, patients = user_ids[:200], user_ids[200:]
+    today = datetime.now().date()
+    statuses = ['active'] * 6 + ['completed'] * 3 + ['cancelled']
+    prescriptions = [(rng.choice(patients), rng.choice(providers),
+                      (today - timedelta(days=rng.randint(0, 730))).isoformat(), rng.choice(statuses))
+                     for _ in range(rows)]
+    conn.executemany("INSERT INTO prescriptions (patient_id, provider_id, issue_date, status) VALUES (?, ?, ?, ?)",
+                     prescriptions)
+    medications = [(prescription_id, rng.choice(('Amoxicillin', 'Ibuprofen', 'Metformin', 'Lisinopril')), '10mg', 'QD', '30')
+                   for prescription_id in range(1, rows + 1) for _ in range(2)]
+    conn.executemany("""INSERT INTO prescription_medications (prescription_id, medication_name, dosage, frequency, quantity)
+                        VALUES (?, ?, ?, ?, ?)""", medications)
+    conn.commit()
+
+    conn.recording = True
+    provider, patient = providers[0], patients[0]
+    prescription_id = db_utils_prescription.create_prescription(
+        conn, patient, provider, today.isoformat(),
+        [{"medication_name": "Amoxicillin", "dosage": "250mg", "frequency": "TID", "quantity": "21"}])
+    db_utils_prescription.get_prescription_by_id(conn, prescription_id)
+    batch_results = db_utils_prescription.create_prescriptions_batch(conn, [
+        {"patient_id": patient_id, "provider_id": provider, "issue_date": today.isoformat(),
+         "medications": [{"medication_name": "Metformin", "dosage": "500mg", "frequency": "BID", "quantity": "60"}]}
+        for patient_id in patients[:3]])
+    start = (today - timedelta(days=90)).isoformat()
+    for user_id, role in ((patient, 'patient'), (provider, 'provider')):
+        db_utils_prescription.get_prescriptions_for_user(conn, user_id, role)
+        db_utils_prescription.get_prescriptions_for_user(conn, user_id, role, status_filter='active')
+        for _ in db_utils_prescription.iter_prescriptions_for_user(conn, user_id, role, include_medications=True):
+            pass
+        db_utils_prescription.get_prescriptions_for_user(conn, user_id, role, start_date_filter=start,
+                                                         end_date_filter=today.isoformat())
+    db_utils_prescription.update_prescription_status(conn, prescription_id, 'cancelled', provider)
+    page = db_utils_prescription.get_prescription_status_events(conn, prescription_id, limit=1)
+    db_utils_prescription.get_prescription_status_events(conn, prescription_id, before_event_id=page['next_cursor'])
+    conn.recording = False
+    # The batch's INSERTs carry explicit IDs; without its prescriptions, replaying them for timing does not conflict.
+    conn.executemany("DELETE FROM prescriptions WHERE prescription_id = ?",
+                     [(result['prescription_id'],) for result in batch_results])
+    conn.commit()
+
+
+def _messaging_workload(conn, rows: int, rng: random.Random):
+    user_ids = _seed_users(conn, 1000, rng, with_contacts=False)
+    pairs = sorted({tuple(sorted(rng.sample(user_ids, 2))) for _ in range(5000)})
+    conn.executemany("INSERT INTO conversations (participant1_id, participant2_id) VALUES (?, ?)", pairs)
+    messages = []
+    for _ in range(rows):
+        conversation_id = rng.randint(1, len(pairs))
+        messages.append((conversation_id, rng.choice(pairs[conversation_id - 1]),
+                         rng.choice(('lab results are in', 'refill please', 'see you tomorrow', 'thanks doctor'))))
+    conn.executemany("INSERT INTO messages (conversation_id, sender_id, content) VALUES (?, ?, ?)", messages)
+    conn.commit()
+    db_utils_messaging.rebuild_user_conversations(conn)
+
+    conn.recording = True
+    sender, receiver = pairs[0]
+    conversation_id, message_id = db_utils_messaging.send_direct_message(conn, sender, receiver, 'advisor message')
+    conversation_id = db_utils_messaging.find_or_create_conversation(conn, sender, receiver)
+    db_utils_messaging.create_message(conn, conversation_id, receiver, 'advisor reply')
+    db_utils_messaging.get_conversation_by_id(conn, conversation_id)
+    db_utils_messaging.get_messages_by_conversation_id(conn, conversation_id)
+    db_utils_messaging.get_messages_page(conn, conversation_id)
+    db_utils_messaging.get_messages_page(conn, conversation_id, before_message_id=message_id, newest_first=True)
+    db_utils_messaging.get_conversations_by_user_id(conn, sender)
+    page = db_utils_messaging.get_conversations_page(conn, sender, limit=2)
+    db_utils_messaging.get_conversations_page(conn, sender, before_message_id=page['next_cursor'])
+    db_utils_messaging.get_conversations_page(conn, sender, before_message_id=page['next_cursor'],
+                                              before_conversation_id=page['next_conversation_cursor'])
+    db_utils_messaging.get_messages_for_user_since(conn, sender, max(message_id - 1000, 0))
+    db_utils_messaging.get_latest_message_id_for_user(conn, sender)
+    db_utils_messaging.get_unread_summary(conn, receiver)
+    db_utils_messaging.mark_conversation_read(conn, conversation_id, receiver)
+    db_utils_messaging.search_messages(conn, sender, 'lab results')
+
+
+# module -> (schema initializer, workload)
+WORKLOADS = {
+    "appointment": (db_utils_appointment.initialize_appointment_schema, _appointment_workload),
+    "prescription": (db_utils_prescription.initialize_prescription_schema, _prescription_workload),
+    "messaging": (db_utils_messaging.initialize_schema, _messaging_workload),
+}
+
+
+def analyse_module(module: str, rows: int, legacy: bool = False, seed: int = 42) -> list[dict]:
+    """
+    Seeds a scratch database for one module, records its workload and evaluates every statement.
+
+    Args:
+        module (str): A key of WORKLOADS.
+        rows (int): Rows seeded into the module's main table.
+        legacy (bool): Replace the shipped indexes with LEGACY_INDEXES before seeding.
+        seed (int): Random seed for the synthetic data.
+
+    Returns:
+        tuple[list[dict], list[tuple[str, str]]]: One evaluate_statement result per
+        recorded statement (with its 'sql' and consolidated 'proposal' added), and
+        the redundant_indexes of the analysed schema.
+    """
+    conn = open_scratch_connection()
+    try:
+        initialize_schema, workload = WORKLOADS[module]
+        with contextlib.redirect_stdout(io.StringIO()):  # The db_utils functions log progress with print()
+            initialize_schema(conn)
+            if legacy:
+                conn.executescript(LEGACY_INDEXES[module])
+            workload(conn, rows, random.Random(seed))
+        conn.recording = False
+        results = []
+        for sql, parameters in conn.statements.values():
+            result = evaluate_statement(conn, sql, parameters)
+            result["sql"] = ' '.join(sql.split())
+            results.append(result)
+        consolidate_proposals(results)
+        return results, redundant_indexes(conn)
+    finally:
+        conn.close()
+
+
+def print_report(module: str, results: list[dict], redundant: list[tuple[str, str]] = (), verbose: bool = False):
+    """Prints flagged statements, proposals with before/after timings, and a summary of proposed DDL."""
+    print(f"\n=== {module}: {len(results)} statements recorded ===")
+    proposals = []
+    for result in results:
+        if not result["issues"] and not result["proposal"] and not verbose:
+            continue
+        print(f"\n{result['sql'][:160]}{'...' if len(result['sql']) > 160 else ''}")
+        for detail in result["plan"]:
+            print(f"    {'!!' if detail in result['issues'] else '  '} {detail}")
+        proposal = result["proposal"]
+        if proposal:
+            print(f"  -> {proposal['ddl']}")
+            print(f"     {result['ms']:.3f} ms -> {proposal['ms']:.3f} ms "
+                  f"({result['ms'] / proposal['ms'] if proposal['ms'] else float('inf'):.1f}x); "
+                  f"flags {len(result['issues'])} -> {len(proposal['issues'])}")
+            if proposal["ddl"] not in proposals:
+                proposals.append(proposal["ddl"])
+        elif result["issues"]:
+            print(f"  -> no candidate index improves this plan ({result['ms']:.3f} ms)")
+    print(f"\n{module}: {len(proposals)} index proposal(s)")
+    for ddl in proposals:
+        print(f"  {ddl};")
+    for name, covering in redundant:
+        print(f"  Redundant: {name} is a prefix of {covering}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Flag scans and temp sorts in db_utils queries and propose indexes.")
+    parser.add_argument('--modules', default=','.join(WORKLOADS), help="Comma-separated modules to analyse.")
+    parser.add_argument('--rows', type=int, default=20000, help="Rows seeded into each module's main table.")
+    parser.add_argument('--legacy', action='store_true', help="Analyse the pre-advisor index set (LEGACY_INDEXES).")
+    parser.add_argument('--verbose', action='store_true', help="Also print statements whose plans are clean.")
+    args = parser.parse_args()
+
+    for module_name in args.modules.split(','):
+        module_results, module_redundant = analyse_module(module_name, args.rows, args.legacy)
+        print_report(module_name, module_results, module_redundant, args.verbose)
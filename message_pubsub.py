@@ -0,0 +1,329 @@
+import sqlite3
+import threading
+import queue
+import json
+import time
+import os
+import atexit
+
+from db_connection_pool import get_pooled_connection, close_pool
+
+# --- Pub/Sub Configuration ---
+# Backend selection follows the same environment-variable convention as the *_DB_NAME settings:
+#   MESSAGING_PUBSUB_BACKEND=memory  -> events stay inside this process (default)
+#   MESSAGING_PUBSUB_BACKEND=sqlite  -> events go through a shared SQLite "broker" file, so
+#                                       several worker processes see each other's messages
+PUBSUB_BACKEND = os.getenv('MESSAGING_PUBSUB_BACKEND', 'memory')
+PUBSUB_BROKER_DB_NAME = os.getenv('MESSAGING_PUBSUB_BROKER_DB', 'messaging_pubsub.db')
+PUBSUB_BROKER_POLL_INTERVAL_SECONDS = float(os.getenv('MESSAGING_PUBSUB_POLL_INTERVAL', '0.05'))
+PUBSUB_BROKER_RETENTION_SECONDS = float(os.getenv('MESSAGING_PUBSUB_RETENTION', '300'))
+SUBSCRIPTION_QUEUE_SIZE = 1000  # Events buffered per subscriber before it is marked as overflowed
+
+BROKER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pubsub_events (
+    event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_pubsub_events_created_at ON pubsub_events(created_at);
+"""
+
+
+def user_channel(user_id: int) -> str:
+    """Returns the channel name carrying events for one user."""
+    return f"user:{user_id}"
+
+
+class Subscription:
+    """
+    A subscriber's view of one or more channels.
+
+    Events are buffered in a bounded queue. If the subscriber falls more than
+    SUBSCRIPTION_QUEUE_SIZE events behind, further events are dropped and
+    `overflowed` is set; the consumer should then resynchronise from the database
+    (the messaging stream does this using its message_id cursor).
+    """
+
+    def __init__(self, hub: 'MessageHub', channels: tuple):
+        self._hub = hub
+        self.channels = channels
+        self._events = queue.Queue(maxsize=SUBSCRIPTION_QUEUE_SIZE)
+        self.overflowed = False
+        self.closed = False
+
+    def _deliver(self, event: dict) -> bool:
+        try:
+            self._events.put_nowait(event)
+            return True
+        except queue.Full:
+            self.overflowed = True
+            return False
+
+    def get(self, timeout: float = None) -> dict | None:
+        """
+        Waits for the next event.
+
+        Args:
+            timeout (float, optional): Seconds to wait; None waits forever.
+
+        Returns:
+            dict | None: The event payload, or None on timeout.
+        """
+        try:
+            return self._events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def drain(self) -> list[dict]:
+        """Returns every event already buffered without waiting."""
+        events = []
+        while True:
+            try:
+                events.append(self._events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def close(self):
+        """Unsubscribes. Safe to call more than once."""
+        if not self.closed:
+            self.closed = True
+            self._hub._unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+class InProcessBackend:
+    """
+    Delivers published events straight to this process's subscribers.
+
+    Backends implement `start(dispatch)`, `publish(channel, payload)` and `close()`;
+    `dispatch(channel, payload)` is the hub callback that fans an event out locally.
+    """
+
+    def start(self, dispatch):
+        self._dispatch = dispatch
+
+    def publish(self, channel: str, payload: dict):
+        self._dispatch(channel, payload)
+
+    def close(self):
+        pass
+
+
+class SQLiteBrokerBackend:
+    """
+    Shares events between processes through an append-only table in a SQLite file.
+
+    This is a local stand-in for a real broker (e.g. Redis pub/sub): `publish`
+    appends a row, and every process runs a poller thread that tails the table by
+    `event_id` and dispatches new rows to its local subscribers. Rows older than
+    `retention_seconds` are pruned by the pollers.
+
+    Args:
+        broker_db_name (str): The SQLite file shared by all worker processes.
+        poll_interval (float): Seconds between polls of the events table.
+        retention_seconds (float): How long events are kept for slow pollers.
+    """
+
+    def __init__(self, broker_db_name: str = PUBSUB_BROKER_DB_NAME,
+                 poll_interval: float = PUBSUB_BROKER_POLL_INTERVAL_SECONDS,
+                 retention_seconds: float = PUBSUB_BROKER_RETENTION_SECONDS):
+        self.broker_db_name = broker_db_name
+        self.poll_interval = poll_interval
+        self.retention_seconds = retention_seconds
+        self._stop = threading.Event()
+        self._poller = None
+        self._last_prune = time.monotonic()
+
+        conn = get_pooled_connection(broker_db_name)
+        try:
+            conn.executescript(BROKER_SCHEMA)
+            conn.commit()
+            # Only events published after this process started are delivered.
+            self._last_event_id = conn.execute("SELECT COALESCE(MAX(event_id), 0) FROM pubsub_events").fetchone()[0]
+        finally:
+            conn.close()
+
+    def start(self, dispatch):
+        self._dispatch = dispatch
+        self._poller = threading.Thread(target=self._poll_loop, name=f"SQLiteBrokerBackend[{self.broker_db_name}]",
+                                        daemon=True)
+        self._poller.start()
+
+    def publish(self, channel: str, payload: dict):
+        conn = get_pooled_connection(self.broker_db_name)
+        try:
+            conn.execute(
+                "INSERT INTO pubsub_events (channel, payload, created_at) VALUES (?, ?, ?)",
+                (channel, json.dumps(payload), time.time())
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def poll_once(self) -> int:
+        """Dispatches every event published since the last poll. Returns the number dispatched."""
+        conn = get_pooled_connection(self.broker_db_name)
+        try:
+            rows = conn.execute(
+                "SELECT event_id, channel, payload FROM pubsub_events WHERE event_id > ? ORDER BY event_id",
+                (self._last_event_id,)
+            ).fetchall()
+            if time.monotonic() - self._last_prune > self.retention_seconds / 10:
+                # Events older than the retention window have long been seen by every live poller.
+                conn.execute("DELETE FROM pubsub_events WHERE created_at < ?", (time.time() - self.retention_seconds,))
+                conn.commit()
+                self._last_prune = time.monotonic()
+        finally:
+            conn.close()
+        for row in rows:
+            self._last_event_id = row['event_id']
+            self._dispatch(row['channel'], json.loads(row['payload']))
+        return len(rows)
+
+    def _poll_loop(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.poll_once()
+            except sqlite3.Error as e:
+                print(f"Pub/sub broker poll error on '{self.broker_db_name}': {e}")
+
+    def close(self):
+        self._stop.set()
+        if self._poller:
+            self._poller.join(timeout=5)
+        close_pool(self.broker_db_name)
+
+
+class MessageHub:
+    """
+    Fans published events out to subscribers, through a pluggable backend.
+
+    Publishers call `publish(channel, payload)`; the backend transports the event
+    (in-process, or via a shared broker for multi-process deployments) and then
+    calls back into the hub, which delivers it to every local subscription on
+    that channel.
+
+    Args:
+        backend: An InProcessBackend (default) or SQLiteBrokerBackend instance.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or InProcessBackend()
+        self._lock = threading.Lock()
+        self._subscriptions = {}  # channel -> set of Subscription
+        self._metrics = {"published": 0, "delivered": 0, "dropped": 0}
+        self.backend.start(self._dispatch)
+
+    def subscribe(self, *channels: str) -> Subscription:
+        """
+        Subscribes to one or more channels.
+
+        Returns:
+            Subscription: Close it (or use it as a context manager) to unsubscribe.
+        """
+        subscription = Subscription(self, channels)
+        with self._lock:
+            for channel in channels:
+                self._subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscriptions.get(channel)
+                if subscribers:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscriptions[channel]
+
+    def publish(self, channel: str, payload: dict):
+        """
+        Publishes an event. Errors are logged and swallowed: real-time delivery is best
+        effort and must never fail the write that triggered it.
+        """
+        with self._lock:
+            self._metrics["published"] += 1
+        try:
+            self.backend.publish(channel, payload)
+        except Exception as e:
+            print(f"Error publishing to channel '{channel}': {e}")
+
+    def _dispatch(self, channel: str, payload: dict):
+        with self._lock:
+            subscribers = list(self._subscriptions.get(channel, ()))
+        delivered = sum(1 for subscription in subscribers if subscription._deliver(payload))
+        with self._lock:
+            self._metrics["delivered"] += delivered
+            self._metrics["dropped"] += len(subscribers) - delivered
+
+    def subscriber_count(self) -> int:
+        """Number of distinct live subscriptions."""
+        with self._lock:
+            return len({s for subscribers in self._subscriptions.values() for s in subscribers})
+
+    def metrics(self) -> dict:
+        """Returns published/delivered/dropped counters and the current subscriber count."""
+        with self._lock:
+            stats = dict(self._metrics)
+        stats["subscribers"] = self.subscriber_count()
+        return stats
+
+    def close(self):
+        self.backend.close()
+
+
+# --- Shared hub ---
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def _create_backend():
+    if PUBSUB_BACKEND == 'memory':
+        return InProcessBackend()
+    if PUBSUB_BACKEND == 'sqlite':
+        return SQLiteBrokerBackend()
+    raise ValueError(f"Unknown MESSAGING_PUBSUB_BACKEND '{PUBSUB_BACKEND}' (expected 'memory' or 'sqlite').")
+
+
+def get_message_hub() -> MessageHub:
+    """Returns the process-wide hub, creating it with the configured backend on first use."""
+    global _hub
+    with _hub_lock:
+        if _hub is None:
+            _hub = MessageHub(_create_backend())
+        return _hub
+
+
+def set_message_hub(hub: MessageHub | None):
+    """Replaces the process-wide hub (e.g. to switch backends in tests). Closes the previous one."""
+    global _hub
+    with _hub_lock:
+        previous, _hub = _hub, hub
+    if previous and previous is not hub:
+        previous.close()
+
+
+def publish_new_message(message: dict, participant_ids: tuple):
+    """
+    Publishes a newly committed message to both participants' channels.
+
+    Args:
+        message (dict): The message fields ('message_id', 'conversation_id', 'sender_id',
+                        'content', 'timestamp').
+        participant_ids (tuple): The conversation's two participant user IDs.
+    """
+    hub = get_message_hub()
+    event = dict(message, type="message")
+    for user_id in participant_ids:
+        hub.publish(user_channel(user_id), event)
+
+
+atexit.register(set_message_hub, None)
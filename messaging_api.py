@@ -1,19 +1,63 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 import sqlite3 # For handling database specific errors
 import os # For environment variable access
+import json
+import time
+from message_pubsub import get_message_hub, user_channel
 from db_utils_messaging import (
     get_db_connection,
     initialize_schema,
-    find_or_create_conversation,
-    create_message,
-    get_conversations_by_user_id,
-    get_messages_by_conversation_id,
-    get_conversation_by_id # For authorization check
+    send_direct_message,
+    get_message_write_queue,
+    get_conversations_page,
+    get_messages_page,
+    get_conversation_by_id, # For authorization check
+    mark_conversation_read,
+    get_unread_summary,
+    get_messages_for_user_since,
+    get_latest_message_id_for_user,
+    search_messages,
+    DEFAULT_MESSAGE_PAGE_SIZE,
+    MAX_MESSAGE_PAGE_SIZE,
+    DEFAULT_CONVERSATION_PAGE_SIZE,
+    MAX_CONVERSATION_PAGE_SIZE,
+    DEFAULT_SEARCH_PAGE_SIZE
 )
 
 app = Flask(__name__)
 # Define DB name, configurable via environment variable
 DB_NAME = os.getenv('MESSAGING_DB_NAME', 'messaging_app.db')
+# When enabled, sends go through the group-commit MessageWriteQueue instead of one transaction per request
+USE_WRITE_QUEUE = os.getenv('MESSAGING_USE_WRITE_QUEUE', 'false').lower() in ('1', 'true', 'yes')
+WRITE_QUEUE_RESULT_TIMEOUT = 30 # Seconds a request waits for its batch to commit
+
+# --- Real-time delivery settings ---
+STREAM_HEARTBEAT_SECONDS = 15      # SSE comment sent when idle, keeps proxies from closing the stream
+STREAM_MAX_SECONDS = 300           # SSE streams end after this; clients reconnect with Last-Event-ID
+LONG_POLL_DEFAULT_TIMEOUT = 25     # Seconds a long-poll request waits for new messages
+LONG_POLL_MAX_TIMEOUT = 60
+
+
+def _parse_optional_int_arg(name: str) -> int | None:
+    """
+    Reads an optional integer query parameter.
+
+    Args:
+        name (str): The query parameter name.
+
+    Returns:
+        int | None: The parsed value, or None if the parameter is absent or empty.
+
+    Raises:
+        ValueError: If the parameter is present but not an integer.
+    """
+    raw_value = request.args.get(name)
+    if raw_value is None or raw_value == '':
+        return None
+    try:
+        return int(raw_value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer")
 
 
 @app.route('/api/messages', methods=['POST'])
@@ -74,19 +118,20 @@ def send_message():
 
     conn = None
     try:
-        conn = get_db_connection(DB_NAME)
         # Ensure users exist (FK constraint will catch this if they don't, but good to check)
         # For now, we rely on FK constraints or assume users are pre-validated/exist.
 
-        conversation_id = find_or_create_conversation(conn, sender_id, receiver_id)
-        new_message_id = create_message(conn, conversation_id, sender_id, content)
-        # Note: create_message in db_utils now handles updating conversation_timestamp and committing.
+        if USE_WRITE_QUEUE:
+            # The future resolves once the batch holding this message has been committed.
+            future = get_message_write_queue(DB_NAME).submit(sender_id, receiver_id, content)
+            conversation_id, new_message_id = future.result(timeout=WRITE_QUEUE_RESULT_TIMEOUT)
+        else:
+            conn = get_db_connection(DB_NAME)
+            # Conversation upsert, message insert and inbox update share one transaction and one commit.
+            conversation_id, new_message_id = send_direct_message(conn, sender_id, receiver_id, content)
 
-        # --- Placeholder for Real-Time Notification Logic ---
-        # This part remains conceptual for now.
-        print(f"Conceptual: Identifying active connection for recipient_id {receiver_id} for real-time notification.")
-        print(f"Conceptual: Sending real-time notification to recipient_id {receiver_id} if connected.")
-        # --- End of Placeholder for Real-Time Notification Logic ---
+        # Real-time delivery: the send path publishes the committed message to both
+        # participants' hub channels, which feed /api/messages/stream and /api/messages/poll.
 
         return jsonify({
             "status": "success",
@@ -116,8 +161,26 @@ def send_message():
 @app.route('/api/conversations', methods=['GET'])
 def get_conversations():
     """
-    API endpoint to get all conversations for a user.
+    API endpoint to get one page of a user's conversations (their inbox).
     Expects a 'user_id' query parameter to identify the user.
+
+    Conversations are read from the denormalized `user_conversations` inbox and
+    ordered by most recent message first, followed by conversations without
+    messages yet.
+
+    Query Parameters:
+    - user_id (int, required): The user whose conversations are listed.
+    - limit (int, optional): Page size, 1..MAX_CONVERSATION_PAGE_SIZE (default DEFAULT_CONVERSATION_PAGE_SIZE).
+    - before_id (int, optional): Cursor from the previous page's `paging.next_cursor`.
+    - before_conversation_id (int, optional): Cursor from the previous page's
+      `paging.next_conversation_cursor`; requires before_id.
+
+    Responses:
+    - 200 OK: JSON: {"status": "success", "user_id": int, "conversations": [...],
+                     "paging": {"limit": int, "has_more": bool, "next_cursor": int | None,
+                                "next_conversation_cursor": int | None}}
+    - 400 Bad Request: Missing/invalid parameters.
+    - 500 Internal Server Error: Database or unexpected error.
     """
     user_id_str = request.args.get('user_id')
     if not user_id_str:
@@ -128,17 +191,41 @@ def get_conversations():
     except ValueError:
         return jsonify({"status": "error", "message": "user_id must be an integer"}), 400
 
+    try:
+        limit = _parse_optional_int_arg('limit')
+        if limit is None:
+            limit = DEFAULT_CONVERSATION_PAGE_SIZE
+        if not (1 <= limit <= MAX_CONVERSATION_PAGE_SIZE):
+            raise ValueError(f"limit must be between 1 and {MAX_CONVERSATION_PAGE_SIZE}")
+        before_id = _parse_optional_int_arg('before_id')
+        before_conversation_id = _parse_optional_int_arg('before_conversation_id')
+        if before_conversation_id is not None and before_id is None:
+            raise ValueError("before_conversation_id requires before_id")
+    except ValueError as ve:
+        return jsonify({"status": "error", "message": str(ve)}), 400
+
     conn = None
     try:
         conn = get_db_connection(DB_NAME)
-        # The db_utils function `get_conversations_by_user_id` will return an empty list
+        # The db_utils function `get_conversations_page` will return an empty page
         # if the user has no conversations or if the user_id does not exist,
         # which is acceptable for this endpoint (shows no conversations).
         # A specific check for user existence could be added if a 404 is preferred for unknown users.
 
-        conversations_list = get_conversations_by_user_id(conn, user_id)
+        page = get_conversations_page(conn, user_id, before_message_id=before_id, limit=limit,
+                                      before_conversation_id=before_conversation_id)
 
-        return jsonify({"status": "success", "user_id": user_id, "conversations": conversations_list}), 200
+        return jsonify({
+            "status": "success",
+            "user_id": user_id,
+            "conversations": page['conversations'],
+            "paging": {
+                "limit": limit,
+                "has_more": page['has_more'],
+                "next_cursor": page['next_cursor'],
+                "next_conversation_cursor": page['next_conversation_cursor']
+            }
+        }), 200
 
     except sqlite3.Error as e:
         # Log the error for server-side diagnostics
@@ -156,9 +243,32 @@ def get_conversations():
 @app.route('/api/conversations/<int:conversation_id>/messages', methods=['GET'])
 def get_messages_for_conversation(conversation_id):
     """
-    API endpoint to get all messages for a specific conversation.
+    API endpoint to get one page of messages for a specific conversation.
     Accepts 'conversation_id' as a path parameter.
     Requires 'user_id' query parameter for authorization.
+
+    Pagination uses message_id cursors (keyset pagination), so each page costs the
+    same no matter how long the conversation is.
+
+    Query Parameters:
+    - user_id (int, required): The requesting user, must be a participant.
+    - limit (int, optional): Page size, 1..MAX_MESSAGE_PAGE_SIZE (default DEFAULT_MESSAGE_PAGE_SIZE).
+    - before_id (int, optional): Return messages older than this message_id.
+    - after_id (int, optional): Return messages newer than this message_id.
+    - order (str, optional): 'asc' (chronological, default) or 'desc' (newest first) within the page.
+
+    Without a cursor the most recent page is returned. To page backwards through history,
+    pass paging.before_cursor as before_id while paging.has_more is true; to fetch messages
+    newer than a page, pass paging.after_cursor as after_id (after_id=0 starts from the oldest).
+
+    Responses:
+    - 200 OK: JSON: {"status": "success", "conversation_id": int, "messages": [...],
+                     "paging": {"limit": int, "order": str, "has_more": bool,
+                                "before_cursor": int | None, "after_cursor": int | None}}
+    - 400 Bad Request: Missing/invalid parameters.
+    - 403 Forbidden: User is not a participant.
+    - 404 Not Found: Conversation does not exist.
+    - 500 Internal Server Error: Database or unexpected error.
     """
     requesting_user_id_str = request.args.get('user_id')
     if not requesting_user_id_str:
@@ -169,6 +279,21 @@ def get_messages_for_conversation(conversation_id):
     except ValueError:
         return jsonify({"status": "error", "message": "user_id query parameter for authorization must be an integer"}), 400
 
+    try:
+        limit = _parse_optional_int_arg('limit')
+        if limit is None:
+            limit = DEFAULT_MESSAGE_PAGE_SIZE
+        if not (1 <= limit <= MAX_MESSAGE_PAGE_SIZE):
+            raise ValueError(f"limit must be between 1 and {MAX_MESSAGE_PAGE_SIZE}")
+        before_id = _parse_optional_int_arg('before_id')
+        after_id = _parse_optional_int_arg('after_id')
+    except ValueError as ve:
+        return jsonify({"status": "error", "message": str(ve)}), 400
+
+    order = request.args.get('order', 'asc').lower()
+    if order not in ('asc', 'desc'):
+        return jsonify({"status": "error", "message": "order must be 'asc' or 'desc'"}), 400
+
     conn = None
     try:
         conn = get_db_connection(DB_NAME)
@@ -185,10 +310,23 @@ def get_messages_for_conversation(conversation_id):
             print(f"Authorization failed: User {requesting_user_id} attempted to access conversation {conversation_id}.")
             return jsonify({"status": "error", "message": "User not authorized for this conversation"}), 403
 
-        # If authorized, fetch messages
-        messages_list = get_messages_by_conversation_id(conn, conversation_id)
+        # If authorized, fetch one page of messages
+        page = get_messages_page(conn, conversation_id,
+                                 before_message_id=before_id, after_message_id=after_id,
+                                 limit=limit, newest_first=(order == 'desc'))
 
-        return jsonify({"status": "success", "conversation_id": conversation_id, "messages": messages_list}), 200
+        return jsonify({
+            "status": "success",
+            "conversation_id": conversation_id,
+            "messages": page['messages'],
+            "paging": {
+                "limit": limit,
+                "order": order,
+                "has_more": page['has_more'],
+                "before_cursor": page['before_cursor'],
+                "after_cursor": page['after_cursor']
+            }
+        }), 200
 
     except sqlite3.Error as e:
         print(f"Database error in get_messages_for_conversation (conv_id {conversation_id}): {e}")
@@ -200,6 +338,375 @@ def get_messages_for_conversation(conversation_id):
         if conn:
             conn.close()
 
+@app.route('/api/conversations/<int:conversation_id>/read', methods=['POST'])
+def mark_conversation_as_read(conversation_id):
+    """
+    Marks a conversation as read for a participant by moving their read cursor.
+
+    This is a single write regardless of how many messages become read.
+
+    Request Body JSON:
+    {
+        "user_id": int,      // The participant marking the conversation read
+        "message_id": int    // Optional: last message read; defaults to the latest message
+    }
+
+    Responses:
+    - 200 OK: JSON: {"status": "success", "conversation_id": int, "user_id": int,
+                     "last_read_message_id": int, "unread_count": int}
+    - 400 Bad Request: Missing/invalid fields.
+    - 403 Forbidden: User is not a participant.
+    - 404 Not Found: Conversation does not exist.
+    - 500 Internal Server Error: Database or unexpected error.
+    """
+    data = request.get_json(silent=True)
+    if not data or 'user_id' not in data:
+        return jsonify({"status": "error", "message": "Missing required field: user_id"}), 400
+
+    user_id = data['user_id']
+    message_id = data.get('message_id')
+    if not isinstance(user_id, int) or (message_id is not None and not isinstance(message_id, int)):
+        return jsonify({"status": "error", "message": "user_id and message_id must be integers"}), 400
+
+    conn = None
+    try:
+        conn = get_db_connection(DB_NAME)
+
+        conversation = get_conversation_by_id(conn, conversation_id)
+        if not conversation:
+            return jsonify({"status": "error", "message": "Conversation not found"}), 404
+        if user_id not in (conversation['participant1_id'], conversation['participant2_id']):
+            print(f"Authorization failed: User {user_id} attempted to mark conversation {conversation_id} read.")
+            return jsonify({"status": "error", "message": "User not authorized for this conversation"}), 403
+
+        read_state = mark_conversation_read(conn, conversation_id, user_id, message_id)
+
+        return jsonify({
+            "status": "success",
+            "conversation_id": conversation_id,
+            "user_id": user_id,
+            "last_read_message_id": read_state['last_read_message_id'],
+            "unread_count": read_state['unread_count']
+        }), 200
+
+    except ValueError as ve:
+        return jsonify({"status": "error", "message": str(ve)}), 400
+    except sqlite3.Error as e:
+        print(f"Database error in mark_conversation_as_read (conv_id {conversation_id}): {e}")
+        return jsonify({"status": "error", "message": "A database error occurred while updating read state."}), 500
+    except Exception as e:
+        print(f"Unexpected error in mark_conversation_as_read (conv_id {conversation_id}): {e}")
+        return jsonify({"status": "error", "message": "An unexpected server error occurred."}), 500
+    finally:
+        if conn:
+            conn.close()
+
+
+@app.route('/api/conversations/unread_count', methods=['GET'])
+def get_unread_count():
+    """
+    API endpoint returning a user's total unread message count (e.g. for badge counts).
+    Expects a 'user_id' query parameter.
+
+    Responses:
+    - 200 OK: JSON: {"status": "success", "user_id": int, "total_unread": int,
+                     "conversations_with_unread": int}
+    - 400 Bad Request: Missing/invalid user_id.
+    - 500 Internal Server Error: Database or unexpected error.
+    """
+    user_id_str = request.args.get('user_id')
+    if not user_id_str:
+        return jsonify({"status": "error", "message": "user_id query parameter is required"}), 400
+
+    try:
+        user_id = int(user_id_str)
+    except ValueError:
+        return jsonify({"status": "error", "message": "user_id must be an integer"}), 400
+
+    conn = None
+    try:
+        conn = get_db_connection(DB_NAME)
+        summary = get_unread_summary(conn, user_id)
+        return jsonify({"status": "success", "user_id": user_id, **summary}), 200
+    except sqlite3.Error as e:
+        print(f"Database error in get_unread_count for user_id {user_id}: {e}")
+        return jsonify({"status": "error", "message": "A database error occurred while retrieving unread counts."}), 500
+    except Exception as e:
+        print(f"Unexpected error in get_unread_count for user_id {user_id}: {e}")
+        return jsonify({"status": "error", "message": "An unexpected server error occurred."}), 500
+    finally:
+        if conn:
+            conn.close()
+
+@app.route('/api/messages/search', methods=['GET'])
+def search_user_messages():
+    """
+    Full-text search over the messages in the requesting user's conversations.
+
+    Query Parameters:
+    - user_id (int, required): The requesting user; only their conversations are searched.
+    - q (str, required): Search words; all must match. End a word with `*` for prefix matching.
+    - conversation_id (int, optional): Restrict the search to one conversation.
+    - limit (int, optional): Page size (default DEFAULT_SEARCH_PAGE_SIZE, max MAX_SEARCH_PAGE_SIZE).
+    - offset (int, optional): Number of ranked results to skip (max MAX_SEARCH_OFFSET).
+
+    Responses:
+    - 200 OK: JSON: {"status": "success", "user_id": int, "query": str, "results": [...],
+                     "paging": {"limit": int, "offset": int, "has_more": bool, "next_offset": int | None}}
+      Each result has 'message_id', 'conversation_id', 'sender_id', 'timestamp', 'snippet'
+      (matches wrapped in <mark></mark>) and 'rank' (lower is better).
+    - 400 Bad Request: Missing/invalid parameters.
+    - 500 Internal Server Error: Database or unexpected error.
+    """
+    query = request.args.get('q', '')
+    try:
+        user_id = _parse_optional_int_arg('user_id')
+        if user_id is None:
+            raise ValueError("user_id query parameter is required")
+        if not query.strip():
+            raise ValueError("q query parameter is required")
+        conversation_id = _parse_optional_int_arg('conversation_id')
+        limit = _parse_optional_int_arg('limit')
+        if limit is None:
+            limit = DEFAULT_SEARCH_PAGE_SIZE
+        offset = _parse_optional_int_arg('offset') or 0
+    except ValueError as ve:
+        return jsonify({"status": "error", "message": str(ve)}), 400
+
+    conn = None
+    try:
+        conn = get_db_connection(DB_NAME)
+        page = search_messages(conn, user_id, query, conversation_id=conversation_id, limit=limit, offset=offset)
+        return jsonify({
+            "status": "success",
+            "user_id": user_id,
+            "query": query,
+            "results": page['results'],
+            "paging": {
+                "limit": limit,
+                "offset": offset,
+                "has_more": page['has_more'],
+                "next_offset": offset + limit if page['has_more'] else None
+            }
+        }), 200
+    except ValueError as ve: # Invalid limit/offset or a query without searchable words
+        return jsonify({"status": "error", "message": str(ve)}), 400
+    except sqlite3.Error as e:
+        print(f"Database error in search_user_messages for user_id {user_id}: {e}")
+        return jsonify({"status": "error", "message": "A database error occurred while searching messages."}), 500
+    except Exception as e:
+        print(f"Unexpected error in search_user_messages for user_id {user_id}: {e}")
+        return jsonify({"status": "error", "message": "An unexpected server error occurred."}), 500
+    finally:
+        if conn:
+            conn.close()
+
+
+# --- Real-time delivery (Server-Sent Events / long-poll) ---
+
+def _parse_stream_request():
+    """
+    Reads the user_id and starting cursor for the streaming endpoints.
+
+    The cursor comes from the `Last-Event-ID` header (SSE reconnects), then the
+    `after_id` query parameter; if neither is given the stream starts at the user's
+    newest message, i.e. only messages created from now on are delivered.
+
+    Returns:
+        tuple[int, int | None]: (user_id, after_id or None).
+
+    Raises:
+        ValueError: If user_id is missing or a value is not an integer.
+    """
+    user_id = _parse_optional_int_arg('user_id')
+    if user_id is None:
+        raise ValueError("user_id query parameter is required")
+    last_event_id = request.headers.get('Last-Event-ID')
+    if last_event_id:
+        try:
+            return user_id, int(last_event_id)
+        except ValueError:
+            raise ValueError("Last-Event-ID must be an integer message_id")
+    return user_id, _parse_optional_int_arg('after_id')
+
+
+def _catch_up(user_id: int, after_id: int | None) -> tuple[list[dict], int]:
+    """
+    Reads messages the client has not seen yet from the database, one page at a time.
+
+    At most MAX_MESSAGE_PAGE_SIZE messages are returned; a full page means more may
+    follow the new cursor (see _catch_up_rest).
+
+    Returns:
+        tuple[list[dict], int]: (messages oldest first, new cursor).
+    """
+    conn = get_db_connection(DB_NAME)
+    try:
+        if after_id is None:
+            return [], get_latest_message_id_for_user(conn, user_id)
+        messages = get_messages_for_user_since(conn, user_id, after_id)
+        return messages, (messages[-1]['message_id'] if messages else after_id)
+    finally:
+        conn.close()
+
+
+def _catch_up_rest(user_id: int, messages: list[dict], cursor: int):
+    """
+    Yields the pages that follow a page read by _catch_up, until a short page shows the
+    database has nothing more past the cursor.
+
+    Yields:
+        tuple[list[dict], int]: (messages oldest first, new cursor) for each further page.
+    """
+    while len(messages) >= MAX_MESSAGE_PAGE_SIZE:
+        messages, cursor = _catch_up(user_id, cursor)
+        yield messages, cursor
+
+
+def _new_events(subscription, events: list[dict], user_id: int, cursor: int) -> tuple[list[dict], int]:
+    """
+    Turns hub events into the messages to send, advancing the cursor.
+
+    Events at or below the cursor were already delivered (e.g. during catch-up) and
+    are skipped. If the subscription overflowed, events were dropped, so the
+    database is read instead.
+    """
+    if subscription.overflowed:
+        subscription.overflowed = False
+        subscription.drain()
+        return _catch_up(user_id, cursor)
+    messages = sorted((e for e in events if e.get('type') == 'message' and e['message_id'] > cursor),
+                      key=lambda e: e['message_id'])
+    messages = [{k: v for k, v in e.items() if k != 'type'} for e in messages]
+    return messages, (messages[-1]['message_id'] if messages else cursor)
+
+
+@app.route('/api/messages/stream', methods=['GET'])
+def stream_messages():
+    """
+    Streams new messages for all of a user's conversations as Server-Sent Events.
+
+    The connection is held open; each new message is sent as an event whose `id` is
+    the message_id, so a reconnecting client (EventSource does this automatically)
+    resumes from the `Last-Event-ID` header without gaps or duplicates. Messages are
+    pushed from the in-process pub/sub hub that message creation publishes to; the
+    database is only read to catch up on (re)connect or after a subscriber overflow.
+
+    Query Parameters:
+    - user_id (int, required): The user whose conversations are streamed.
+    - after_id (int, optional): Deliver messages with a higher message_id first
+      (ignored when the Last-Event-ID header is present).
+
+    Responses:
+    - 200 OK: `text/event-stream` of `event: message` items whose data is a message
+      JSON object. Idle streams get a `: keepalive` comment every STREAM_HEARTBEAT_SECONDS
+      and are closed after STREAM_MAX_SECONDS.
+    - 400 Bad Request: Missing/invalid parameters.
+    - 500 Internal Server Error: Database or unexpected error.
+    """
+    try:
+        user_id, after_id = _parse_stream_request()
+    except ValueError as ve:
+        return jsonify({"status": "error", "message": str(ve)}), 400
+
+    # Subscribe before reading the database so nothing published in between is missed.
+    subscription = get_message_hub().subscribe(user_channel(user_id))
+    try:
+        backlog, cursor = _catch_up(user_id, after_id)
+    except sqlite3.Error as e:
+        subscription.close()
+        print(f"Database error in stream_messages for user_id {user_id}: {e}")
+        return jsonify({"status": "error", "message": "A database error occurred while opening the stream."}), 500
+    except Exception as e:
+        subscription.close()
+        print(f"Unexpected error in stream_messages for user_id {user_id}: {e}")
+        return jsonify({"status": "error", "message": "An unexpected server error occurred."}), 500
+
+    def format_event(message: dict) -> str:
+        return f"id: {message['message_id']}\nevent: message\ndata: {json.dumps(message)}\n\n"
+
+    def generate():
+        nonlocal cursor
+        deadline = time.monotonic() + STREAM_MAX_SECONDS
+        try:
+            yield "retry: 3000\n\n" # Reconnect delay hint for EventSource clients
+            for message in backlog:
+                yield format_event(message)
+            # The whole backlog is delivered before hub events are read
+            for messages, cursor in _catch_up_rest(user_id, backlog, cursor):
+                for message in messages:
+                    yield format_event(message)
+            while time.monotonic() < deadline:
+                event = subscription.get(timeout=min(STREAM_HEARTBEAT_SECONDS, max(0.0, deadline - time.monotonic())))
+                if event is None and not subscription.overflowed:
+                    yield ": keepalive\n\n"
+                    continue
+                messages, cursor = _new_events(subscription, ([event] if event else []) + subscription.drain(),
+                                               user_id, cursor)
+                for message in messages:
+                    yield format_event(message)
+                # After an overflow the messages come from the database, which may have more pages
+                for messages, cursor in _catch_up_rest(user_id, messages, cursor):
+                    for message in messages:
+                        yield format_event(message)
+        except sqlite3.Error as e:
+            print(f"Database error in stream_messages for user_id {user_id}: {e}")
+        finally:
+            # Runs when the stream ends or the client disconnects.
+            subscription.close()
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route('/api/messages/poll', methods=['GET'])
+def poll_messages():
+    """
+    Long-poll fallback for clients that cannot use Server-Sent Events.
+
+    Returns immediately if messages newer than `after_id` exist; otherwise waits up
+    to `timeout` seconds for the next message to be published and returns it.
+
+    Query Parameters:
+    - user_id (int, required): The user whose conversations are watched.
+    - after_id (int, optional): Cursor from the previous response. Without it the
+      request waits for messages created from now on.
+    - timeout (int, optional): Seconds to wait, 0..LONG_POLL_MAX_TIMEOUT (default LONG_POLL_DEFAULT_TIMEOUT).
+
+    Responses:
+    - 200 OK: JSON: {"status": "success", "user_id": int, "messages": [...], "cursor": int}
+      (`messages` is empty if the wait timed out; pass `cursor` as the next `after_id`).
+    - 400 Bad Request: Missing/invalid parameters.
+    - 500 Internal Server Error: Database or unexpected error.
+    """
+    try:
+        user_id, after_id = _parse_stream_request()
+        timeout = _parse_optional_int_arg('timeout')
+        if timeout is None:
+            timeout = LONG_POLL_DEFAULT_TIMEOUT
+        if not (0 <= timeout <= LONG_POLL_MAX_TIMEOUT):
+            raise ValueError(f"timeout must be between 0 and {LONG_POLL_MAX_TIMEOUT}")
+    except ValueError as ve:
+        return jsonify({"status": "error", "message": str(ve)}), 400
+
+    try:
+        with get_message_hub().subscribe(user_channel(user_id)) as subscription:
+            messages, cursor = _catch_up(user_id, after_id)
+            deadline = time.monotonic() + timeout
+            while not messages and time.monotonic() < deadline:
+                event = subscription.get(timeout=deadline - time.monotonic())
+                if event is None and not subscription.overflowed:
+                    break
+                messages, cursor = _new_events(subscription, ([event] if event else []) + subscription.drain(),
+                                               user_id, cursor)
+        return jsonify({"status": "success", "user_id": user_id, "messages": messages, "cursor": cursor}), 200
+    except sqlite3.Error as e:
+        print(f"Database error in poll_messages for user_id {user_id}: {e}")
+        return jsonify({"status": "error", "message": "A database error occurred while retrieving messages."}), 500
+    except Exception as e:
+        print(f"Unexpected error in poll_messages for user_id {user_id}: {e}")
+        return jsonify({"status": "error", "message": "An unexpected server error occurred."}), 500
+
 if __name__ == '__main__':
     # Initialize the database schema when running the app directly.
     # This is suitable for development and testing.
@@ -230,4 +737,4 @@ if __name__ == '__main__':
     except Exception as e:
         print(f"An unexpected error occurred during initial setup: {e}")
 
-    app.run(debug=True, port=5000)
+    app.run(debug=True, port=5000, threaded=True) # Streaming requests each hold a worker thread
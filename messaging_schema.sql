@@ -35,11 +35,42 @@ CREATE TABLE messages (
     FOREIGN KEY (sender_id) REFERENCES users(user_id) ON DELETE CASCADE
 );
 
+-- Table definition for the per-user inbox.
+-- One row per (user, conversation), created with the conversation and maintained by the
+-- application in the same transaction as each message insert so listing conversations
+-- never scans messages.
+CREATE TABLE user_conversations (
+    user_id INT NOT NULL,
+    conversation_id INT NOT NULL,
+    other_participant_id INT NOT NULL,
+    last_message_id INT NOT NULL,
+    last_message_preview VARCHAR(100) NOT NULL,
+    last_message_at DATETIME NOT NULL,
+    unread_count INT DEFAULT 0 NOT NULL,
+    last_read_message_id INT DEFAULT 0 NOT NULL, -- Read cursor: every message up to this ID has been read
+    PRIMARY KEY (user_id, conversation_id),
+    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
+    FOREIGN KEY (conversation_id) REFERENCES conversations(conversation_id) ON DELETE CASCADE,
+    FOREIGN KEY (other_participant_id) REFERENCES users(user_id) ON DELETE CASCADE
+);
+
+-- Inbox ordering and keyset pagination: WHERE user_id = ? AND (last_message_id, conversation_id) < (?, ?)
+-- ORDER BY last_message_id DESC, conversation_id DESC. Conversations without messages have last_message_id 0.
+CREATE INDEX idx_user_conversations_recent ON user_conversations(user_id, last_message_id, conversation_id);
+-- Badge counts: summing a user's unread counts only visits conversations that have unread messages
+CREATE INDEX idx_user_conversations_unread ON user_conversations(user_id, unread_count) WHERE unread_count > 0;
+-- Foreign-key lookups from conversations (ON DELETE CASCADE); the primary key leads with user_id
+CREATE INDEX idx_user_conversations_conversation_id ON user_conversations(conversation_id);
+
 -- Indexes for messages table
-CREATE INDEX idx_messages_conversation_id ON messages(conversation_id);
+-- Composite index backs keyset pagination: WHERE conversation_id = ? AND message_id < ? ORDER BY message_id
+CREATE INDEX idx_messages_conversation_message ON messages(conversation_id, message_id);
 CREATE INDEX idx_messages_sender_id ON messages(sender_id);
 CREATE INDEX idx_messages_timestamp ON messages(timestamp);
 CREATE INDEX idx_messages_is_read ON messages(is_read);
+-- Full-text search over message content (GET /api/messages/search):
+-- SELECT ... WHERE MATCH(content) AGAINST (? IN NATURAL LANGUAGE MODE), joined to conversations for user scoping
+CREATE FULLTEXT INDEX ft_messages_content ON messages(content);
 
 -- Note: The updated_at column in the conversations table would typically be
 -- updated using a trigger when a new message is inserted, or by application logic.
@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Notification Dispatch Configuration ---
+# Reminder notifications are network round trips to an email or SMS provider, so they are
+# sent from a pool of worker threads instead of one after another. Each channel gets its
+# own bounded pool (its concurrency limit) and, optionally, a token bucket matched to the
+# provider's quota. A rate of 0 means "not rate limited".
+# Timeouts belong to the transports (see NOTIFICATION_SEND_TIMEOUT_SECONDS in
+# appointment_reminder_job): a send that times out raises, and is reported as failed.
+CHANNEL_CONCURRENCY = {
+    'email': int(os.getenv('REMINDER_EMAIL_CONCURRENCY', '8')),
+    'sms': int(os.getenv('REMINDER_SMS_CONCURRENCY', '4')),
+}
+CHANNEL_RATE_PER_SECOND = {
+    'email': float(os.getenv('REMINDER_EMAIL_RATE_PER_SECOND', '0')),
+    'sms': float(os.getenv('REMINDER_SMS_RATE_PER_SECOND', '0')),
+}
+
+
+class TokenBucket:
+    """
+    Blocking token-bucket rate limiter. Thread-safe.
+
+    Tokens accrue at `rate_per_second` up to `capacity`; each acquire() takes one,
+    waiting for it if the bucket is empty. The bucket starts full, so up to `capacity`
+    calls can go out in a burst.
+
+    Args:
+        rate_per_second (float): Sustained rate allowed; must be positive.
+        capacity (int): Largest burst allowed. Defaults to one second's worth of tokens (at least 1).
+    """
+
+    def __init__(self, rate_per_second: float, capacity: int = None):
+        if rate_per_second <= 0:
+            raise ValueError("rate_per_second must be positive.")
+        self.rate = rate_per_second
+        self.capacity = capacity if capacity is not None else max(1, int(rate_per_second))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Takes one token, sleeping until one is available."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class NotificationDispatcher:
+    """
+    Sends notifications concurrently, bounded per channel.
+
+    Args:
+        senders (dict): channel name -> callable(address, details) returning True on success.
+                        A sender that raises (e.g. on a transport timeout) counts as a failure.
+        channel_concurrency (dict): channel -> maximum sends in flight. Defaults to CHANNEL_CONCURRENCY (or 1).
+        channel_rates (dict): channel -> sends per second allowed, 0 for no limit.
+                              Defaults to CHANNEL_RATE_PER_SECOND.
+
+    Use as a context manager, or call close() when done, to stop the worker threads.
+    """
+
+    def __init__(self, senders: dict, channel_concurrency: dict = None, channel_rates: dict = None):
+        concurrency = channel_concurrency if channel_concurrency is not None else CHANNEL_CONCURRENCY
+        rates = channel_rates if channel_rates is not None else CHANNEL_RATE_PER_SECOND
+        self._senders = dict(senders)
+        self._pools = {
+            channel: ThreadPoolExecutor(max_workers=max(1, concurrency.get(channel, 1)),
+                                        thread_name_prefix=f"notify-{channel}")
+            for channel in self._senders
+        }
+        self._buckets = {channel: TokenBucket(rates[channel]) for channel in self._senders if rates.get(channel)}
+
+    def _send(self, channel: str, address: str, details: dict) -> tuple[bool, str | None]:
+        bucket = self._buckets.get(channel)
+        if bucket is not None:
+            bucket.acquire()
+        try:
+            if self._senders[channel](address, details):
+                return True, None
+            return False, f"{channel} send was not accepted"
+        except Exception as e:
+            print(f"  - ERROR: {channel} notification to {address} for appointment ID "
+                  f"{details.get('appointment_id')} failed: {e}")
+            return False, f"{type(e).__name__}: {e}"
+
+    def dispatch_with_errors(self, notifications: list) -> list[tuple[bool, str | None]]:
+        """
+        Sends a batch of notifications and waits for all of them to finish.
+
+        Args:
+            notifications (list): (channel, address, details) tuples.
+
+        Returns:
+            list[tuple]: (sent, error message or None) for each notification, in the order given.
+
+        Raises:
+            ValueError: If a notification names a channel without a sender.
+        """
+        for channel, _, _ in notifications:
+            if channel not in self._pools:
+                raise ValueError(f"No sender configured for channel '{channel}'.")
+        futures = [self._pools[channel].submit(self._send, channel, address, details)
+                   for channel, address, details in notifications]
+        return [future.result() for future in futures]
+
+    def dispatch(self, notifications: list) -> list[bool]:
+        """Like dispatch_with_errors, but returns only whether each notification was sent."""
+        return [sent for sent, _ in self.dispatch_with_errors(notifications)]
+
+    def close(self):
+        for pool in self._pools.values():
+            pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
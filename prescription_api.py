@@ -1,5 +1,7 @@
-from flask import Flask, request, jsonify
-from datetime import date, datetime # For handling dates and validating datetime strings
+from flask import Flask, Response, request, jsonify
+from datetime import date # For the default issue_date
+import itertools
+import json
 import sqlite3
 import os
 
@@ -7,34 +9,114 @@ from db_utils_prescription import (
     get_db_connection,
     initialize_prescription_schema,
     create_prescription as db_create_prescription,
+    create_prescriptions_batch as db_create_prescriptions_batch,
     get_prescription_by_id as db_get_prescription_by_id,
     get_prescriptions_for_user as db_get_prescriptions_for_user,
-    update_prescription_status as db_update_prescription_status
+    iter_prescriptions_for_user as db_iter_prescriptions_for_user,
+    update_prescription_status as db_update_prescription_status,
+    get_prescription_status_events as db_get_prescription_status_events,
+    DEFAULT_STATUS_EVENT_PAGE_SIZE,
+    MAX_STATUS_EVENT_PAGE_SIZE
 )
+from time_utils import is_valid_date_string
 
 app = Flask(__name__)
 # Configure DB_NAME using an environment variable with a default
 DB_NAME = os.getenv('PRESCRIPTION_DB_NAME', 'prescription_app.db')
+# Largest number of prescriptions accepted by one POST /api/prescriptions/batch request
+MAX_PRESCRIPTION_BATCH_SIZE = int(os.getenv('PRESCRIPTION_BATCH_MAX_SIZE', '200'))
+PRESCRIPTION_BATCH_MODES = ('all_or_nothing', 'best_effort')
 
-# --- Helper ---
-def _validate_date_string(date_str: str, format_str: str = '%Y-%m-%d') -> bool:
+
+def _parse_optional_int_arg(name: str) -> int | None:
     """
-    Validates if a string matches the specified date format.
+    Reads an optional integer query parameter.
 
     Args:
-        date_str (str): The string to validate.
-        format_str (str): The expected date format.
+        name (str): The query parameter name.
 
     Returns:
-        bool: True if the string matches the format, False otherwise.
+        int | None: The parsed value, or None if the parameter is absent or empty.
+
+    Raises:
+        ValueError: If the parameter is present but not an integer.
     """
-    if not isinstance(date_str, str):
-        return False
+    raw_value = request.args.get(name)
+    if raw_value is None or raw_value == '':
+        return None
     try:
-        datetime.strptime(date_str, format_str)
-        return True
+        return int(raw_value)
     except ValueError:
+        raise ValueError(f"{name} must be an integer")
+
+def _parse_include_arg() -> bool:
+    """
+    Reads the optional `include` query parameter of the prescription lists.
+
+    Returns:
+        bool: True for `include=medications`, False if the parameter is absent or empty.
+
+    Raises:
+        ValueError: For any other value.
+    """
+    include = request.args.get('include')
+    if include is None or include == '':
         return False
+    if include != 'medications':
+        raise ValueError("include must be 'medications'")
+    return True
+
+def _stream_prescriptions_with_medications(owner_key: str, owner_id: int, user_role: str,
+                                           start_date: str, end_date: str, status: str):
+    """
+    Responds with a user's prescription list, each with its 'medications', streamed as JSON.
+
+    The body has the same shape as the plain list ({"status", <owner_key>, "prescriptions"})
+    and is assembled chunk by chunk from db_iter_prescriptions_for_user, i.e. two queries per
+    PRESCRIPTION_LIST_CHUNK_SIZE prescriptions instead of one detail request per row. The
+    first chunk is read before the response starts, so invalid filters and database errors
+    still get a 400/500 JSON error; the pooled connection is held until the stream ends.
+    """
+    conn = get_db_connection(DB_NAME)
+    try:
+        chunks = db_iter_prescriptions_for_user(
+            conn, user_id=owner_id, user_role=user_role, start_date_filter=start_date,
+            end_date_filter=end_date, status_filter=status, include_medications=True
+        )
+        first_chunk = next(chunks, [])
+    except ValueError as ve:
+        conn.close()
+        return jsonify({"status": "error", "message": str(ve)}), 400
+    except sqlite3.Error as e:
+        conn.close()
+        print(f"Database error listing prescriptions with medications for {user_role} {owner_id}: {e}")
+        return jsonify({"status": "error", "message": "A database error occurred."}), 500
+
+    def close():
+        # The chunk generator's cursor goes first, then the connection goes back to the pool.
+        # Both are idempotent; this runs when the stream ends and again when the response closes.
+        chunks.close()
+        conn.close()
+
+    def generate():
+        try:
+            yield json.dumps({"status": "success", owner_key: owner_id})[:-1] + ', "prescriptions": ['
+            separator = ''
+            for chunk in itertools.chain([first_chunk], chunks):
+                if chunk:
+                    yield separator + ', '.join(json.dumps(prescription) for prescription in chunk)
+                    separator = ', '
+            yield ']}'
+        except sqlite3.Error as e:
+            # The 200 status is already sent; the client sees a truncated (invalid) JSON body.
+            print(f"Database error while streaming prescriptions for {user_role} {owner_id}: {e}")
+        finally:
+            # Runs when the stream ends or the client disconnects.
+            close()
+
+    response = Response(generate(), mimetype='application/json')
+    response.call_on_close(close) # Also covers a stream that never started
+    return response
 
 # --- Prescription API Endpoints ---
 
@@ -108,7 +190,7 @@ def create_prescription_api():
         return jsonify({"status": "error", "message": "Missing required fields: patient_id, provider_id, and medications list are required."}), 400
     if not isinstance(patient_id, int) or not isinstance(provider_id, int):
          return jsonify({"status": "error", "message": "patient_id and provider_id must be integers."}), 400
-    if not _validate_date_string(issue_date_str): # Validates format
+    if not is_valid_date_string(issue_date_str): # Validates format
         return jsonify({"status": "error", "message": "Invalid issue_date format. Use YYYY-MM-DD."}), 400
     if not isinstance(medications_list, list) or not medications_list: # Must be a non-empty list
         return jsonify({"status": "error", "message": "medications_list must be a non-empty list of medication objects."}), 400
@@ -158,27 +240,127 @@ def create_prescription_api():
             return jsonify({"status": "error", "message": "An unexpected server error occurred."}), 500
 
 
+@app.route('/api/prescriptions/batch', methods=['POST'])
+def create_prescriptions_batch_api():
+    """
+    Provider: Create many prescriptions at once (e.g., batch renewals).
+
+    All items are validated before anything is written, then the valid ones are inserted,
+    with their medications, in one transaction (see db_create_prescriptions_batch). The
+    `mode` decides what happens when some items are invalid:
+      - "all_or_nothing" (default): nothing is created.
+      - "best_effort": the valid items are created and the invalid ones reported.
+
+    Request Body JSON Example:
+    {
+        "provider_id": 1,
+        "mode": "best_effort",
+        "prescriptions": [
+            {
+                "patient_id": 101,
+                "issue_date": "2024-07-29",
+                "medications": [{"medication_name": "Metformin 500mg", "dosage": "1 tablet",
+                                 "frequency": "Twice daily", "quantity": "60 tablets", "refills_available": 2}],
+                "notes_for_patient": "Renewal."
+            }
+        ]
+    }
+    Items take the fields of POST /api/prescriptions. `provider_id` is the acting provider
+    (simulated auth) and applies to every item; an item naming another provider is invalid.
+    `issue_date` defaults to today.
+
+    Responses:
+    - 201 Created: Every item was created.
+    - 207 Multi-Status: best_effort mode, some items created and some failed.
+    - 400 Bad Request: Invalid payload, or no item was created because of invalid items.
+      JSON (201/207/400 with results): {
+          "status": "success" | "partial" | "error",
+          "mode": str, "created": int, "failed": int,
+          "results": [ {"index": int, "status": "created", "prescription_id": int}
+                       | {"index": int, "status": "error" | "not_created", "message": str} ]
+      }
+    - 500 Internal Server Error: Database error; nothing was created.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"status": "error", "message": "Invalid JSON payload."}), 400
+
+    provider_id = data.get('provider_id') # In a real app, this would come from auth context
+    mode = data.get('mode', 'all_or_nothing')
+    items = data.get('prescriptions')
+    if not isinstance(provider_id, int):
+        return jsonify({"status": "error", "message": "provider_id is required and must be an integer."}), 400
+    if mode not in PRESCRIPTION_BATCH_MODES:
+        return jsonify({"status": "error", "message": f"mode must be one of: {', '.join(PRESCRIPTION_BATCH_MODES)}."}), 400
+    if not isinstance(items, list) or not items:
+        return jsonify({"status": "error", "message": "prescriptions must be a non-empty list of prescription objects."}), 400
+    if len(items) > MAX_PRESCRIPTION_BATCH_SIZE:
+        return jsonify({"status": "error", "message": f"A batch may contain at most {MAX_PRESCRIPTION_BATCH_SIZE} prescriptions."}), 400
+
+    today = date.today().isoformat()
+    prescriptions = []
+    for item in items:
+        if isinstance(item, dict):
+            # An item naming another provider keeps its provider_id and fails authorization below
+            item = {'issue_date': today, **item, 'provider_id': item.get('provider_id', provider_id)}
+        prescriptions.append(item)
+    unauthorized = {index for index, item in enumerate(prescriptions)
+                    if isinstance(item, dict) and item['provider_id'] != provider_id}
+    # Unauthorized items are sent as invalid so the batch's mode applies to them too
+    batch = [None if index in unauthorized else item for index, item in enumerate(prescriptions)]
+
+    with get_db_connection(DB_NAME) as conn:
+        try:
+            results = db_create_prescriptions_batch(conn, batch, all_or_nothing=(mode == 'all_or_nothing'))
+        except ValueError as ve:
+            return jsonify({"status": "error", "message": str(ve)}), 400
+        except sqlite3.Error as e:
+            print(f"Database error in create_prescriptions_batch_api: {e}")
+            return jsonify({"status": "error", "message": "A database error occurred while creating the prescriptions."}), 500
+        except Exception as e_gen:
+            print(f"Unexpected error in create_prescriptions_batch_api: {e_gen}")
+            return jsonify({"status": "error", "message": "An unexpected server error occurred."}), 500
+
+    for index in unauthorized:
+        results[index]['message'] = f"Provider {provider_id} cannot create prescriptions for another provider."
+    created = sum(1 for result in results if result['status'] == 'created')
+    body = {"mode": mode, "created": created, "failed": len(results) - created, "results": results}
+    if created == len(results):
+        return jsonify({"status": "success", **body}), 201
+    if created:
+        return jsonify({"status": "partial", **body}), 207
+    return jsonify({"status": "error", **body}), 400
+
+
 @app.route('/api/prescriptions/<int:prescription_id>', methods=['GET'])
 def get_prescription_details_api(prescription_id: int):
     """
     User (Patient/Provider): Get specific prescription details.
 
     Retrieves the full details for a single prescription, including all associated
-    medication items and the usernames of the patient and provider.
+    medication items and the usernames of the patient and provider, and the most recent
+    page of its status history (newest change first; older pages via `history_before_id`).
     Authorization is simulated: requires a `user_id` query parameter, and this user
     must be either the patient or the provider associated with the prescription.
 
     Path Parameters:
         prescription_id (int): The unique ID of the prescription to retrieve.
 
-    Query Parameters (for simulated auth):
-        user_id (int): Required. The ID of the user making the request.
+    Query Parameters:
+        user_id (int): Required (simulated auth). The ID of the user making the request.
+        history_limit (int, optional): Status history page size, 1..MAX_STATUS_EVENT_PAGE_SIZE
+                                       (default DEFAULT_STATUS_EVENT_PAGE_SIZE).
+        history_before_id (int, optional): Cursor from the previous page's
+                                           `status_history.paging.next_cursor`.
 
     Responses:
     - 200 OK: Prescription details retrieved successfully.
-      JSON: { "status": "success", "prescription": <PrescriptionObject> }
+      JSON: { "status": "success", "prescription": <PrescriptionObject>,
+              "status_history": {"events": [<StatusEvent>],
+                                 "paging": {"limit": int, "has_more": bool, "next_cursor": int | None}} }
             (where <PrescriptionObject> includes 'medications' list)
-    - 400 Bad Request: `user_id` query parameter is missing or invalid.
+    - 400 Bad Request: `user_id` query parameter is missing or invalid, or an invalid
+      `history_limit`/`history_before_id`.
       JSON: { "status": "error", "message": "Error description" }
     - 403 Forbidden: The `user_id` provided is not authorized to view this prescription.
       JSON: { "status": "error", "message": "User not authorized to view this prescription." }
@@ -195,6 +377,16 @@ def get_prescription_details_api(prescription_id: int):
     except ValueError:
         return jsonify({"status": "error", "message": "user_id must be an integer."}), 400
 
+    try:
+        history_limit = _parse_optional_int_arg('history_limit')
+        if history_limit is None:
+            history_limit = DEFAULT_STATUS_EVENT_PAGE_SIZE
+        if not (1 <= history_limit <= MAX_STATUS_EVENT_PAGE_SIZE):
+            raise ValueError(f"history_limit must be between 1 and {MAX_STATUS_EVENT_PAGE_SIZE}")
+        history_before_id = _parse_optional_int_arg('history_before_id')
+    except ValueError as ve:
+        return jsonify({"status": "error", "message": str(ve)}), 400
+
     # Auth Placeholder: In a real system, `requesting_user_id` and their role would be
     # determined from a session cookie or authorization token (e.g., JWT).
 
@@ -211,7 +403,20 @@ def get_prescription_details_api(prescription_id: int):
                 print(f"Authorization failed: User {requesting_user_id} attempted to access prescription {prescription_id}.")
                 return jsonify({"status": "error", "message": "User not authorized to view this prescription."}), 403
 
-            return jsonify({"status": "success", "prescription": prescription}), 200
+            history = db_get_prescription_status_events(conn, prescription_id,
+                                                        before_event_id=history_before_id, limit=history_limit)
+            return jsonify({
+                "status": "success",
+                "prescription": prescription,
+                "status_history": {
+                    "events": history['events'],
+                    "paging": {
+                        "limit": history_limit,
+                        "has_more": history['has_more'],
+                        "next_cursor": history['next_cursor']
+                    }
+                }
+            }), 200
         except ValueError as ve: # Should be caught by Flask for path param, but good for direct db_util call issues
             return jsonify({"status": "error", "message": str(ve)}), 400
         except sqlite3.Error as e:
@@ -240,12 +445,15 @@ def get_patient_prescriptions_api(patient_id: int):
         start_date_filter (str, optional): Filter by issue_date on or after (YYYY-MM-DD).
         end_date_filter (str, optional): Filter by issue_date on or before (YYYY-MM-DD).
         status_filter (str, optional): Filter by exact prescription status.
+        include (str, optional): `medications` to embed each prescription's medication
+                                 list (the response is then streamed).
 
     Responses:
     - 200 OK: Successfully retrieved prescriptions.
       JSON: { "status": "success", "patient_id": int, "prescriptions": list[dict] }
-            (list contains prescription summaries, not full medication details)
-    - 400 Bad Request: Missing/invalid `user_id` or invalid filter formats.
+            (list contains prescription summaries, not full medication details,
+             unless `include=medications` is given)
+    - 400 Bad Request: Missing/invalid `user_id`, invalid filter formats or `include` value.
       JSON: { "status": "error", "message": "Error description" }
     - 403 Forbidden: `user_id` does not match `patient_id`.
       JSON: { "status": "error", "message": "User not authorized..." }
@@ -270,10 +478,16 @@ def get_patient_prescriptions_api(patient_id: int):
     status = request.args.get('status_filter')
 
     # Validate date filter formats
-    if start_date and not _validate_date_string(start_date):
+    if start_date and not is_valid_date_string(start_date):
         return jsonify({"status": "error", "message": "Invalid start_date_filter format. Use YYYY-MM-DD."}), 400
-    if end_date and not _validate_date_string(end_date):
+    if end_date and not is_valid_date_string(end_date):
         return jsonify({"status": "error", "message": "Invalid end_date_filter format. Use YYYY-MM-DD."}), 400
+    try:
+        include_medications = _parse_include_arg()
+    except ValueError as ve:
+        return jsonify({"status": "error", "message": str(ve)}), 400
+    if include_medications:
+        return _stream_prescriptions_with_medications('patient_id', patient_id, 'patient', start_date, end_date, status)
 
     with get_db_connection(DB_NAME) as conn:
         try:
@@ -310,12 +524,14 @@ def get_provider_prescriptions_api(provider_id: int):
         start_date_filter (str, optional): Filter by issue_date on or after (YYYY-MM-DD).
         end_date_filter (str, optional): Filter by issue_date on or before (YYYY-MM-DD).
         status_filter (str, optional): Filter by exact prescription status.
+        include (str, optional): `medications` to embed each prescription's medication
+                                 list (the response is then streamed).
 
     Responses:
     - 200 OK: Successfully retrieved prescriptions.
       JSON: { "status": "success", "provider_id": int, "prescriptions": list[dict] }
-            (list contains prescription summaries)
-    - 400 Bad Request: Missing/invalid `user_id` or invalid filter formats.
+            (list contains prescription summaries, with 'medications' if `include=medications`)
+    - 400 Bad Request: Missing/invalid `user_id`, invalid filter formats or `include` value.
     - 403 Forbidden: `user_id` does not match `provider_id`.
     - 500 Internal Server Error: Database error.
     """
@@ -336,10 +552,16 @@ def get_provider_prescriptions_api(provider_id: int):
     end_date = request.args.get('end_date_filter')
     status = request.args.get('status_filter')
 
-    if start_date and not _validate_date_string(start_date):
+    if start_date and not is_valid_date_string(start_date):
         return jsonify({"status": "error", "message": "Invalid start_date_filter format. Use YYYY-MM-DD."}), 400
-    if end_date and not _validate_date_string(end_date):
+    if end_date and not is_valid_date_string(end_date):
         return jsonify({"status": "error", "message": "Invalid end_date_filter format. Use YYYY-MM-DD."}), 400
+    try:
+        include_medications = _parse_include_arg()
+    except ValueError as ve:
+        return jsonify({"status": "error", "message": str(ve)}), 400
+    if include_medications:
+        return _stream_prescriptions_with_medications('provider_id', provider_id, 'provider', start_date, end_date, status)
 
     with get_db_connection(DB_NAME) as conn:
         try:
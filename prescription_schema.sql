@@ -49,9 +49,13 @@ CREATE TABLE prescriptions (
 );
 
 -- Indexes for prescriptions table
-CREATE INDEX idx_presc_patient_id ON prescriptions(patient_id);
-CREATE INDEX idx_presc_provider_id ON prescriptions(provider_id);
+-- A user's prescription list filters on patient_id/provider_id and sorts by issue_date
+-- (then prescription_id, which InnoDB appends to every secondary index) (see index_advisor.py)
+CREATE INDEX idx_presc_patient_issue_date ON prescriptions(patient_id, issue_date);
+CREATE INDEX idx_presc_provider_issue_date ON prescriptions(provider_id, issue_date);
 CREATE INDEX idx_presc_appointment_id ON prescriptions(appointment_id);
+-- Filter issue_date with plain range predicates (never wrapped in a function) so this index is usable.
+-- (The SQLite build keys these filters on a generated integer issue_date_epoch column instead.)
 CREATE INDEX idx_presc_issue_date ON prescriptions(issue_date);
 CREATE INDEX idx_presc_status ON prescriptions(status);
 
@@ -76,6 +80,25 @@ CREATE TABLE prescription_medications (
 CREATE INDEX idx_pm_prescription_id ON prescription_medications(prescription_id);
 CREATE INDEX idx_pm_medication_name ON prescription_medications(medication_name); -- If frequently searching by medication name
 
+-- Table definition for prescription_status_events
+-- Append-only history of status changes: each change is one small insert (old and new
+-- status, acting provider, notes) instead of a rewrite of a growing notes_for_pharmacist.
+CREATE TABLE prescription_status_events (
+    event_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    prescription_id INT NOT NULL,
+    old_status VARCHAR(50) NOT NULL,
+    new_status VARCHAR(50) NOT NULL,
+    changed_by INT NOT NULL, -- user_id of the provider who made the change
+    notes TEXT NULL, -- e.g., reason for cancellation
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+
+    CONSTRAINT fk_pse_prescription
+        FOREIGN KEY (prescription_id) REFERENCES prescriptions(prescription_id) ON DELETE CASCADE
+);
+
+-- A prescription's history is read newest first, one page at a time (keyset on event_id)
+CREATE INDEX idx_pse_prescription_event ON prescription_status_events(prescription_id, event_id);
+
 -- Example statuses for prescriptions.status:
 -- 'active': Currently valid and can be filled.
 -- 'pending_provider_signature': Drafted, awaiting final sign-off (if e-signature workflow)
@@ -0,0 +1,174 @@
+import heapq
+import os
+import threading
+
+from time_utils import now_epoch
+
+# --- Reminder Schedule Configuration ---
+# The reminder daemon (appointment_reminder_job.run_reminder_daemon) sends several
+# reminders per confirmed appointment, one at each offset before its start. Instead of
+# rescanning a window on every run, it keeps the upcoming due times in a heap and sleeps
+# until the earliest one. Appointments are loaded a slice at a time, LOOKAHEAD seconds
+# beyond the largest offset, and kept current from the appointment change feed (see
+# db_utils_appointment). A reminder more than CATCHUP seconds late (e.g. the daemon was
+# down, or the appointment was confirmed after the reminder was due) is skipped.
+REMINDER_OFFSETS_MINUTES = tuple(int(offset) for offset in os.getenv('REMINDER_OFFSETS_MINUTES', '1440,120,15').split(','))
+REMINDER_LOOKAHEAD_SECONDS = int(os.getenv('REMINDER_LOOKAHEAD_SECONDS', '3600'))
+REMINDER_CATCHUP_SECONDS = int(os.getenv('REMINDER_CATCHUP_SECONDS', '900'))
+
+
+
+class SystemClock:
+    """
+    The clock the reminder daemon and dispatch_outbox run on: the current time in epoch
+    seconds, and waits in real seconds. Replaced with an accelerated clock by
+    simulate_reminder_job.py.
+    """
+
+    def now(self) -> int:
+        return now_epoch()
+
+    def wait(self, event: threading.Event, seconds: float) -> bool:
+        """Waits until `event` is set or `seconds` have passed; returns whether it was set."""
+        return event.wait(seconds)
+
+
+class ReminderSchedule:
+    """
+    Upcoming reminder due times for confirmed appointments.
+
+    A heap of (due, appointment_id, offset_minutes, start) entries, plus the start time
+    each scheduled appointment currently has. Cancelling or rescheduling only updates the
+    latter; heap entries left behind are recognised by their start time and dropped when
+    they reach the top. All times are epoch seconds (see time_utils). Not thread-safe: it
+    belongs to the daemon loop.
+
+    `loaded_until` is the end of the start-time range loaded so far: every confirmed
+    appointment starting before it has been scheduled, later ones are loaded as time
+    moves on (see next_load_range).
+
+    Args:
+        offsets_minutes (tuple): How long before the start each reminder is due. Defaults to REMINDER_OFFSETS_MINUTES.
+        lookahead_seconds (int): Start times loaded per slice beyond the largest offset.
+        catchup_seconds (int): How late a reminder may still be sent.
+    """
+
+    def __init__(self, offsets_minutes: tuple = None, lookahead_seconds: int = REMINDER_LOOKAHEAD_SECONDS,
+                 catchup_seconds: int = REMINDER_CATCHUP_SECONDS):
+        offsets = sorted(set(offsets_minutes if offsets_minutes is not None else REMINDER_OFFSETS_MINUTES))
+        if not offsets or offsets[0] < 0:
+            raise ValueError("Reminder offsets must be a non-empty list of non-negative minutes.")
+        self.offsets_minutes = tuple(offsets)
+        self.lookahead_seconds = lookahead_seconds
+        self.catchup_seconds = catchup_seconds
+        self.loaded_until = None
+        self._max_offset_seconds = offsets[-1] * 60
+        self._heap = []       # (due, appointment_id, offset_minutes, start)
+        self._starts = {}     # appointment_id -> start of the scheduled appointment
+
+    def __len__(self):
+        """Number of appointments with reminders still to come."""
+        return len(self._starts)
+
+    def schedule(self, appointment_id: int, start: int, now: int) -> int:
+        """
+        Schedules the reminders of a confirmed appointment, replacing any it had for another start time.
+
+        Returns:
+            int: The number of reminders scheduled; 0 if it is already scheduled for `start`, has
+                 started, or all its reminders are more than catchup_seconds overdue.
+        """
+        if self._starts.get(appointment_id) == start:
+            return 0 # Keeps reminders already sent from being scheduled again
+        self._starts.pop(appointment_id, None)
+        if start <= now:
+            return 0
+        scheduled = 0
+        for offset in self.offsets_minutes:
+            due = start - offset * 60
+            if due >= now - self.catchup_seconds:
+                heapq.heappush(self._heap, (due, appointment_id, offset, start))
+                scheduled += 1
+        if scheduled:
+            self._starts[appointment_id] = start
+        return scheduled
+
+    def cancel(self, appointment_id: int):
+        """Drops the reminders of an appointment. Unknown IDs are ignored."""
+        self._starts.pop(appointment_id, None)
+
+    def apply_change(self, appointment_id: int, status: str, start: int, now: int):
+        """
+        Applies one row of the appointment change feed.
+
+        A confirmation inside the loaded range is scheduled (one beyond it is picked up when
+        that range is loaded); anything else removes the appointment. Replaying a change
+        that is already reflected does nothing, so the feed can be read from slightly before
+        the initial load.
+        """
+        if status != 'confirmed' or self.loaded_until is None or start >= self.loaded_until:
+            self.cancel(appointment_id)
+        else:
+            self.schedule(appointment_id, start, now)
+
+    def next_load_range(self, now: int) -> tuple[int, int] | None:
+        """
+        Returns the (from, to) start-time range to load next, or None if none is needed yet.
+
+        A slice is needed once the largest offset's reminder for an appointment starting at
+        loaded_until could be due; the first range starts at `now`.
+        """
+        if self.loaded_until is None:
+            return now, now + self._max_offset_seconds + self.lookahead_seconds
+        if self.loaded_until - self._max_offset_seconds <= now:
+            return self.loaded_until, now + self._max_offset_seconds + self.lookahead_seconds
+        return None
+
+    def _drop_stale(self):
+        while self._heap:
+            _, appointment_id, _, start = self._heap[0]
+            if self._starts.get(appointment_id) == start:
+                return
+            heapq.heappop(self._heap)
+
+    def pop_due(self, now: int) -> list[tuple[int, int, int]]:
+        """
+        Removes and returns the reminders due at `now`.
+
+        Returns:
+            list[tuple]: (appointment_id, start, offset_minutes) for each due reminder, earliest due
+                         first. Reminders more than catchup_seconds overdue are dropped instead.
+        """
+        due_reminders, previous = [], None
+        while True:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return due_reminders
+            entry = heapq.heappop(self._heap)
+            if entry == previous: # Pushed twice: rescheduled away and back again
+                continue
+            previous = due, appointment_id, offset, start = entry
+            if offset == self.offsets_minutes[0]: # Its last reminder
+                del self._starts[appointment_id]
+            if due >= now - self.catchup_seconds:
+                due_reminders.append((appointment_id, start, offset))
+
+    def requeue(self, reminders: list[tuple[int, int, int]]):
+        """
+        Puts back reminders pop_due returned, e.g. because queueing them failed; they are
+        returned again by the next pop_due (subject to catchup_seconds as usual).
+
+        Call it before applying further changes: a reminder whose appointment has since
+        been scheduled for another start time is dropped.
+        """
+        for appointment_id, start, offset in reminders:
+            if self._starts.setdefault(appointment_id, start) == start:
+                heapq.heappush(self._heap, (start - offset * 60, appointment_id, offset, start))
+
+    def next_wake_epoch(self) -> int | None:
+        """When the daemon must next act: the earliest due reminder or the next slice to load, whichever is sooner."""
+        self._drop_stale()
+        candidates = [self._heap[0][0]] if self._heap else []
+        if self.loaded_until is not None:
+            candidates.append(self.loaded_until - self._max_offset_seconds)
+        return min(candidates) if candidates else None
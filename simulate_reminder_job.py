@@ -0,0 +1,318 @@
+"""
+Capacity simulation for the reminder daemon (appointment_reminder_job.run_reminder_daemon).
+
+A day of confirmed appointments, synthetic or loaded from a file, is replayed through the
+real daemon, schedule, outbox and dispatcher at accelerated time: the daemon runs on a
+ReplayClock that advances `--speedup` simulated seconds per real second, starting now.
+The appointments are placed just over the largest reminder offset ahead, so every
+reminder (24h, 2h and 15min before by default) falls due during the replay. Email and
+SMS go to stub senders with a configurable latency (real time, like a provider's API)
+and failure rate; failures go through the outbox's retry and dead-letter path. Channel
+concurrency and rate limits are those of notification_dispatch
+(REMINDER_{EMAIL,SMS}_CONCURRENCY, REMINDER_{EMAIL,SMS}_RATE_PER_SECOND).
+
+The report is printed as JSON (and written to --report if given):
+  * notifications sent / retrying / dead, and reminders_per_second (sent per wall second),
+  * reminders expected, queued, and skipped for being over --catchup-seconds late (the
+    daemon fell behind the accelerated clock; defaults to REMINDER_CATCHUP_SECONDS, raise
+    it to see how far behind the backlog runs instead of dropping reminders),
+  * db_seconds (time in db_utils_appointment calls) and send_seconds (time in senders,
+    summed over the dispatcher threads),
+  * latency_seconds: p50/p95/p99/max simulated seconds from a reminder's due time to
+    its successful send,
+  * peak_memory_kib: tracemalloc peak during the replay.
+
+Usage:
+    python simulate_reminder_job.py [--appointments 2000] [--speedup 3600] [--day-hours 10]
+                                    [--load FILE] [--offsets 1440,120,15]
+                                    [--email-latency-ms 50] [--sms-latency-ms 150]
+                                    [--email-failure-rate 0.01] [--sms-failure-rate 0.02]
+                                    [--catchup-seconds 900] [--seed 42] [--report FILE]
+
+--load replays a real day instead: a file with one appointment start time
+(YYYY-MM-DD HH:MM:SS) per line, e.g. exported with
+`SELECT appointment_start_time FROM appointments WHERE status = 'confirmed' AND ...`.
+The times keep their spacing and are shifted to start at the replay's first slot.
+
+Each run uses a fresh scratch database file which is removed afterwards.
+"""
+import argparse
+import contextlib
+import heapq
+import json
+import os
+import random
+import threading
+import time
+import tracemalloc
+
+import appointment_reminder_job
+import db_utils_appointment
+from db_connection_pool import close_pool
+from db_utils_appointment import get_db_connection, initialize_appointment_schema
+from reminder_scheduler import ReminderSchedule, REMINDER_CATCHUP_SECONDS, REMINDER_OFFSETS_MINUTES
+from time_utils import datetime_to_epoch, epoch_to_datetime_string, now_epoch
+
+SIMULATION_DB_NAME = 'simulate_reminder_job.db'
+APPOINTMENT_MINUTES = 15
+# db_utils_appointment functions the daemon and dispatch_outbox call; their time is db_seconds
+TIMED_DB_FUNCTIONS = (
+    'get_latest_appointment_change_id', 'get_confirmed_appointment_starts', 'get_appointment_changes',
+    'get_reminder_appointments', 'enqueue_reminder_notifications', 'get_next_notification_attempt_epoch',
+    'claim_due_notifications', 'record_notification_results', 'prune_appointment_changes',
+)
+
+
+class ReplayClock:
+    """
+    Accelerated clock for run_reminder_daemon: reads `start_epoch` when started and then
+    advances `speedup` simulated seconds per real second; waits are shortened to match.
+    """
+
+    def __init__(self, start_epoch: int, speedup: float):
+        self.start_epoch = start_epoch
+        self.speedup = speedup
+        self.start()
+
+    def start(self):
+        """(Re)starts the clock at start_epoch."""
+        self._started = time.monotonic()
+
+    def now(self) -> int:
+        return self.start_epoch + int((time.monotonic() - self._started) * self.speedup)
+
+    def wait(self, event: threading.Event, seconds: float) -> bool:
+        return event.wait(seconds / self.speedup)
+
+
+class StubSender:
+    """
+    Stands in for send_email_reminder / send_sms_reminder: sleeps `latency_seconds`, then
+    fails (raises OSError) with probability `failure_rate`, else records the delivery time
+    on the replay clock. Thread-safe.
+    """
+
+    def __init__(self, clock: ReplayClock, latency_seconds: float, failure_rate: float, seed: int):
+        self.clock = clock
+        self.latency_seconds = latency_seconds
+        self.failure_rate = failure_rate
+        self.deliveries = [] # (idempotency_key, delivered epoch)
+        self.busy_seconds = 0.0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __call__(self, address: str, details: dict) -> bool:
+        started = time.perf_counter()
+        time.sleep(self.latency_seconds)
+        with self._lock:
+            failed = self._rng.random() < self.failure_rate
+            self.busy_seconds += time.perf_counter() - started
+            if not failed:
+                self.deliveries.append((details['idempotency_key'], self.clock.now()))
+        if failed:
+            raise OSError("Simulated provider failure")
+        return True
+
+
+@contextlib.contextmanager
+def _timed_db_calls(totals: dict):
+    """Accumulates the time spent in TIMED_DB_FUNCTIONS into totals['db_seconds'] while active."""
+    originals = {name: getattr(db_utils_appointment, name) for name in TIMED_DB_FUNCTIONS}
+
+    def timed(function):
+        def call(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                totals['db_seconds'] += time.perf_counter() - started
+        return call
+
+    for name, function in originals.items():
+        setattr(db_utils_appointment, name, timed(function))
+    try:
+        yield
+    finally:
+        for name, function in originals.items():
+            setattr(db_utils_appointment, name, function)
+
+
+def _synthetic_day(count: int, first_start: int, day_hours: float, rng: random.Random) -> list[int]:
+    """`count` start times, on the minute, spread at random over `day_hours` from first_start."""
+    minutes = max(1, int(day_hours * 60))
+    return sorted(first_start + 60 * rng.randrange(minutes) for _ in range(count))
+
+
+def _load_day(path: str, first_start: int) -> list[int]:
+    """Start times from a file (one per line), shifted so the earliest is first_start."""
+    with open(path) as day_file:
+        starts = sorted(datetime_to_epoch(line.strip()) for line in day_file if line.strip())
+    if not starts:
+        raise ValueError(f"No appointment start times in {path}.")
+    return [first_start + start - starts[0] for start in starts]
+
+
+def _remove_database():
+    close_pool(SIMULATION_DB_NAME)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(SIMULATION_DB_NAME + suffix):
+            os.remove(SIMULATION_DB_NAME + suffix)
+
+
+def _create_database(starts: list[int]):
+    """Confirmed appointments at the given start times, each patient with an email address and a phone."""
+    _remove_database()
+    conn = get_db_connection(SIMULATION_DB_NAME)
+    try:
+        initialize_appointment_schema(conn)
+        # Fewest providers without overlaps: reuse the provider that is free soonest
+        free_at, provider_count, assignments = [], 0, []
+        for start in starts:
+            if free_at and free_at[0][0] <= start:
+                _, provider = heapq.heappop(free_at)
+            else:
+                provider, provider_count = provider_count, provider_count + 1
+            heapq.heappush(free_at, (start + APPOINTMENT_MINUTES * 60, provider))
+            assignments.append(provider)
+        conn.executemany("INSERT INTO users (username) VALUES (?)",
+                         [(f'sim_provider_{i}',) for i in range(provider_count)])
+        conn.executemany("INSERT INTO users (username, email, phone) VALUES (?, ?, ?)",
+                         [(f'sim_patient_{i}', f'sim_patient_{i}@example.com', f'555-{i:07d}')
+                          for i in range(len(starts))])
+        user_ids = [row[0] for row in conn.execute("SELECT user_id FROM users ORDER BY user_id")]
+        providers, patients = user_ids[:provider_count], user_ids[provider_count:]
+        conn.executemany("""INSERT INTO appointments (patient_id, provider_id, appointment_start_time,
+                            appointment_end_time, status) VALUES (?, ?, ?, ?, 'confirmed')""",
+                         [(patients[i], providers[assignments[i]], epoch_to_datetime_string(start),
+                           epoch_to_datetime_string(start + APPOINTMENT_MINUTES * 60))
+                          for i, start in enumerate(starts)])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _percentile(sorted_values: list, percent: float):
+    """Nearest-rank percentile of an ascending list (None if empty)."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, -(-len(sorted_values) * percent // 100) - 1)]
+
+
+def run_simulation(starts: list[int], clock: ReplayClock, offsets_minutes: tuple, email_sender: StubSender,
+                   sms_sender: StubSender, max_wall_seconds: float,
+                   catchup_seconds: int = REMINDER_CATCHUP_SECONDS) -> dict:
+    """
+    Replays the appointments starting at `starts` through run_reminder_daemon on `clock`
+    until every reminder has fallen due and the outbox has nothing left to send (or
+    max_wall_seconds pass), and returns the report.
+    """
+    _create_database(starts)
+    schedule = ReminderSchedule(offsets_minutes, catchup_seconds=catchup_seconds)
+    last_due = starts[-1] - schedule.offsets_minutes[0] * 60
+    totals = {'db_seconds': 0.0}
+    saved = {name: getattr(appointment_reminder_job, name) for name in
+             ('DB_NAME', 'send_email_reminder', 'send_sms_reminder')}
+    appointment_reminder_job.DB_NAME = SIMULATION_DB_NAME
+    appointment_reminder_job.send_email_reminder = email_sender
+    appointment_reminder_job.send_sms_reminder = sms_sender
+    stop = threading.Event()
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), _timed_db_calls(totals):
+            tracemalloc.start()
+            clock.start() # Setting up the database took no simulated time
+            started = time.perf_counter()
+            daemon = threading.Thread(target=appointment_reminder_job.run_reminder_daemon, args=(stop, schedule, clock))
+            daemon.start()
+            conn = get_db_connection(SIMULATION_DB_NAME)
+            try:
+                while time.perf_counter() - started < max_wall_seconds:
+                    time.sleep(0.05)
+                    if clock.now() > last_due and not len(schedule) and not conn.execute(
+                            "SELECT 1 FROM notification_outbox WHERE status IN ('pending', 'sending') LIMIT 1").fetchone():
+                        break
+            finally:
+                conn.close()
+                stop.set()
+                daemon.join()
+            wall_seconds = time.perf_counter() - started
+            simulated_seconds = clock.now() - clock.start_epoch
+            peak_memory_kib = tracemalloc.get_traced_memory()[1] / 1024
+            tracemalloc.stop()
+    finally:
+        for name, value in saved.items():
+            setattr(appointment_reminder_job, name, value)
+
+    conn = get_db_connection(SIMULATION_DB_NAME)
+    try:
+        outbox = {status: count for status, count in conn.execute(
+            "SELECT status, COUNT(*) FROM notification_outbox GROUP BY status")}
+        keys = [row[0] for row in conn.execute("SELECT idempotency_key FROM notification_outbox")]
+    finally:
+        conn.close()
+        _remove_database()
+
+    # Keys are reminder:{appointment_id}:{channel}:{start}:{offset}m (see enqueue_reminder_notifications)
+    queued = len({(key.split(':')[1], key.split(':')[4]) for key in keys})
+    latencies = []
+    for key, delivered in email_sender.deliveries + sms_sender.deliveries:
+        _, _, _, start, offset = key.split(':')
+        latencies.append(delivered - (int(start) - int(offset[:-1]) * 60))
+    latencies.sort()
+    expected = len(starts) * len(schedule.offsets_minutes)
+    return {
+        "appointments": len(starts),
+        "offsets_minutes": list(schedule.offsets_minutes),
+        "speedup": clock.speedup,
+        "wall_seconds": round(wall_seconds, 3),
+        "simulated_seconds": simulated_seconds,
+        "completed": clock.now() > last_due and not outbox.get('pending') and not outbox.get('sending'),
+        "reminders": {"expected": expected, "queued": queued, "skipped_late": expected - queued},
+        "notifications": {"sent": outbox.get('sent', 0), "retrying": outbox.get('pending', 0) + outbox.get('sending', 0),
+                          "dead": outbox.get('dead', 0)},
+        "reminders_per_second": round(outbox.get('sent', 0) / wall_seconds, 1),
+        "db_seconds": round(totals['db_seconds'], 3),
+        "send_seconds": round(email_sender.busy_seconds + sms_sender.busy_seconds, 3),
+        "latency_seconds": {"p50": _percentile(latencies, 50), "p95": _percentile(latencies, 95),
+                            "p99": _percentile(latencies, 99), "max": latencies[-1] if latencies else None},
+        "peak_memory_kib": round(peak_memory_kib),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay a day of appointments through the reminder daemon at accelerated time.")
+    parser.add_argument('--appointments', type=int, default=2000, help="Synthetic appointments in the day.")
+    parser.add_argument('--day-hours', type=float, default=10, help="Hours the synthetic appointments are spread over.")
+    parser.add_argument('--load', help="File of appointment start times to replay instead of a synthetic day.")
+    parser.add_argument('--speedup', type=float, default=3600, help="Simulated seconds per real second.")
+    parser.add_argument('--offsets', default=','.join(map(str, REMINDER_OFFSETS_MINUTES)),
+                        help="Reminder offsets in minutes before the start.")
+    parser.add_argument('--email-latency-ms', type=float, default=50)
+    parser.add_argument('--sms-latency-ms', type=float, default=150)
+    parser.add_argument('--email-failure-rate', type=float, default=0.01)
+    parser.add_argument('--sms-failure-rate', type=float, default=0.02)
+    parser.add_argument('--catchup-seconds', type=int, default=REMINDER_CATCHUP_SECONDS,
+                        help="How late (simulated seconds) a reminder may still be sent.")
+    parser.add_argument('--max-wall-seconds', type=float, default=600, help="Stop the replay after this long.")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--report', help="Also write the JSON report to this file.")
+    args = parser.parse_args()
+
+    offsets = tuple(int(offset) for offset in args.offsets.split(','))
+    replay_clock = ReplayClock(now_epoch(), args.speedup)
+    # Just past the largest offset, so the first reminder is due shortly after the replay starts
+    first_start = replay_clock.start_epoch + max(offsets) * 60 + 300
+    rng = random.Random(args.seed)
+    day = (_load_day(args.load, first_start) if args.load
+           else _synthetic_day(args.appointments, first_start, args.day_hours, rng))
+    try:
+        report = run_simulation(
+            day, replay_clock, offsets,
+            StubSender(replay_clock, args.email_latency_ms / 1000, args.email_failure_rate, args.seed),
+            StubSender(replay_clock, args.sms_latency_ms / 1000, args.sms_failure_rate, args.seed + 1),
+            args.max_wall_seconds, args.catchup_seconds)
+    finally:
+        _remove_database()
+    print(json.dumps(report, indent=2))
+    if args.report:
+        with open(args.report, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
@@ -0,0 +1,269 @@
+import heapq
+from functools import lru_cache
+from itertools import islice, takewhile
+
+from time_utils import SECONDS_PER_DAY, parse_datetime, datetime_to_epoch
+
+# --- Recurrence Rules ---
+# provider_availability.recurring_rule holds an iCalendar RRULE (RFC 5545). The
+# block's own start/end is the first occurrence (DTSTART) and fixes the duration of
+# every later one. Only the subset that describes working hours is supported:
+#   FREQ=DAILY|WEEKLY, INTERVAL, BYDAY (weekday codes, no ordinals), COUNT, UNTIL.
+# UNTIL may be a date (YYYYMMDD) or date-time (YYYYMMDDTHHMMSS, optional trailing Z);
+# like every other time in these services it is read as naive wall-clock time.
+# Anything else raises ValueError, so unsupported rules are refused when they are
+# stored instead of being silently mis-expanded later.
+WEEKDAY_CODES = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+SECONDS_PER_WEEK = 7 * SECONDS_PER_DAY
+_SUPPORTED_PARTS = {'FREQ', 'INTERVAL', 'BYDAY', 'COUNT', 'UNTIL', 'WKST'}
+
+
+def _parse_until(value: str) -> int:
+    """Converts an RRULE UNTIL value to epoch seconds (inclusive bound on occurrence starts)."""
+    value = value[:-1] if value.endswith('Z') else value
+    if len(value) == 8 and value.isdigit():
+        value += 'T235959'
+    if len(value) != 15 or value[8] != 'T' or not (value[:8] + value[9:]).isdigit():
+        raise ValueError(f"Invalid UNTIL '{value}'. Use YYYYMMDD or YYYYMMDDTHHMMSS.")
+    return datetime_to_epoch(parse_datetime(
+        f"{value[0:4]}-{value[4:6]}-{value[6:8]} {value[9:11]}:{value[11:13]}:{value[13:15]}"))
+
+
+@lru_cache(maxsize=1024)
+def parse_rrule(rule: str) -> dict:
+    """
+    Parses the supported subset of an iCalendar RRULE.
+
+    Args:
+        rule (str): e.g. "FREQ=WEEKLY;BYDAY=MO,WE,FR;UNTIL=20241231T235959Z". An "RRULE:" prefix is allowed.
+
+    Returns:
+        dict: {"freq": 'DAILY' | 'WEEKLY', "interval": int, "byday": tuple[int, ...] | None
+        (0 = Monday), "count": int | None, "until": int | None (epoch seconds)}.
+        DAILY with BYDAY is normalised to the equivalent WEEKLY rule.
+
+    Raises:
+        ValueError: If the rule is malformed or uses a part outside the supported subset.
+    """
+    if not isinstance(rule, str) or not rule.strip():
+        raise ValueError("recurring_rule must be a non-empty RRULE string.")
+    body = rule.strip()
+    if body.upper().startswith('RRULE:'):
+        body = body[6:]
+
+    parts = {}
+    for part in body.split(';'):
+        name, sep, value = part.partition('=')
+        name = name.strip().upper()
+        if not sep or not value.strip():
+            raise ValueError(f"Invalid RRULE part '{part}'.")
+        if name not in _SUPPORTED_PARTS:
+            raise ValueError(f"Unsupported RRULE part '{name}'. Supported: FREQ, INTERVAL, BYDAY, COUNT, UNTIL.")
+        if name in parts:
+            raise ValueError(f"RRULE part '{name}' is given more than once.")
+        parts[name] = value.strip().upper()
+
+    freq = parts.get('FREQ')
+    if freq not in ('DAILY', 'WEEKLY'):
+        raise ValueError("RRULE FREQ must be DAILY or WEEKLY.")
+    if parts.get('WKST', 'MO') != 'MO':
+        raise ValueError("Only WKST=MO is supported.")
+    if 'COUNT' in parts and 'UNTIL' in parts:
+        raise ValueError("RRULE must not contain both COUNT and UNTIL.")
+
+    def positive_int(name):
+        value = parts[name]
+        if not value.isdigit() or int(value) < 1:
+            raise ValueError(f"RRULE {name} must be a positive integer.")
+        return int(value)
+
+    interval = positive_int('INTERVAL') if 'INTERVAL' in parts else 1
+    count = positive_int('COUNT') if 'COUNT' in parts else None
+    until = _parse_until(parts['UNTIL']) if 'UNTIL' in parts else None
+
+    byday = None
+    if 'BYDAY' in parts:
+        codes = parts['BYDAY'].split(',')
+        if any(code not in WEEKDAY_CODES for code in codes):
+            raise ValueError(f"Invalid BYDAY '{parts['BYDAY']}'. Use weekday codes MO..SU without ordinals.")
+        byday = tuple(sorted({WEEKDAY_CODES.index(code) for code in codes}))
+        if freq == 'DAILY':
+            # Every day, restricted to some weekdays, is the same as weekly on those weekdays.
+            # With INTERVAL > 1 the two differ, and the day-stepping form is not worth supporting.
+            if interval != 1:
+                raise ValueError("FREQ=DAILY with BYDAY requires INTERVAL=1; use FREQ=WEEKLY instead.")
+            freq = 'WEEKLY'
+
+    return {"freq": freq, "interval": interval, "byday": byday, "count": count, "until": until}
+
+
+def expand_occurrences(start_epoch: int, end_epoch: int, rule: str | None,
+                       window_start: int, window_end: int) -> list[tuple[int, int]]:
+    """
+    Lists the occurrences of an availability block that overlap [window_start, window_end).
+
+    Occurrences are generated arithmetically from the period containing the window, so
+    the cost depends on the window length, not on how long ago the rule started.
+
+    Args:
+        start_epoch (int): Start of the first occurrence (DTSTART).
+        end_epoch (int): End of the first occurrence; every occurrence has the same duration.
+        rule (str | None): RRULE string, or None for a one-off block.
+        window_start (int): Window start, inclusive (epoch seconds).
+        window_end (int): Window end, exclusive (epoch seconds).
+
+    Returns:
+        list[tuple[int, int]]: (start, end) epoch pairs in start order. They are not clipped to the window.
+
+    Raises:
+        ValueError: If the rule is invalid (see parse_rrule).
+    """
+    duration = end_epoch - start_epoch
+    if not rule:
+        return [(start_epoch, end_epoch)] if start_epoch < window_end and end_epoch > window_start else []
+
+    parsed = parse_rrule(rule)
+    if parsed["freq"] == 'DAILY':
+        anchor, period, offsets = start_epoch, parsed["interval"] * SECONDS_PER_DAY, (0,)
+    else:
+        # Weeks start on Monday at DTSTART's time of day; BYDAY picks days within each week.
+        weekday = (start_epoch // SECONDS_PER_DAY + 3) % 7   # 1970-01-01 was a Thursday
+        anchor = start_epoch - weekday * SECONDS_PER_DAY
+        period = parsed["interval"] * SECONDS_PER_WEEK
+        offsets = tuple(day * SECONDS_PER_DAY for day in (parsed["byday"] or (weekday,)))
+
+    # Occurrences in period 0 that fall before DTSTART do not exist; they shift COUNT ordinals.
+    first_period_count = sum(1 for offset in offsets if anchor + offset >= start_epoch)
+    count, until = parsed["count"], parsed["until"]
+
+    # First period that can hold an occurrence ending after window_start.
+    period_index = max(0, (window_start - duration - anchor - offsets[-1]) // period)
+    occurrences = []
+    while anchor + period_index * period < window_end:
+        period_start = anchor + period_index * period
+        ordinal = 0 if period_index == 0 else first_period_count + (period_index - 1) * len(offsets)
+        for offset in offsets:
+            occurrence_start = period_start + offset
+            if occurrence_start < start_epoch:
+                continue
+            if (count is not None and ordinal >= count) or (until is not None and occurrence_start > until):
+                return occurrences
+            if occurrence_start >= window_end:
+                return occurrences
+            if occurrence_start + duration > window_start:
+                occurrences.append((occurrence_start, occurrence_start + duration))
+            ordinal += 1
+        period_index += 1
+    return occurrences
+
+
+# --- Interval Arithmetic ---
+# Intervals are half-open (start, end) epoch pairs. The functions below take and
+# return lists sorted by start; merged lists are also disjoint, which lets the
+# subtraction run as a single linear sweep over both inputs.
+
+def merge_intervals(intervals) -> list[tuple[int, int]]:
+    """Sorts intervals and merges any that overlap or touch."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract_intervals(free: list[tuple[int, int]], busy: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """
+    Removes `busy` time from `free` time.
+
+    Args:
+        free (list): Merged (sorted, disjoint) intervals.
+        busy (list): Merged (sorted, disjoint) intervals.
+
+    Returns:
+        list[tuple[int, int]]: The parts of `free` not covered by `busy`, sorted and disjoint.
+    """
+    result = []
+    busy_index = 0
+    for start, end in free:
+        # Skip busy intervals that end before this free interval starts.
+        while busy_index < len(busy) and busy[busy_index][1] <= start:
+            busy_index += 1
+        cursor = start
+        scan = busy_index
+        while scan < len(busy) and busy[scan][0] < end:
+            busy_start, busy_end = busy[scan]
+            if busy_start > cursor:
+                result.append((cursor, busy_start))
+            cursor = max(cursor, busy_end)
+            scan += 1
+        if cursor < end:
+            result.append((cursor, end))
+    return result
+
+
+def iter_slots(free: list[tuple[int, int]], duration: int, step: int, not_before: int | None = None):
+    """
+    Cuts free intervals into bookable slots of `duration` seconds, lazily.
+
+    Slot starts are aligned to multiples of `step` from midnight, so slots land on
+    clock-friendly times (e.g. :00 and :30 for a 30-minute step) wherever a free
+    interval begins.
+
+    Args:
+        free (list): Merged free intervals.
+        duration (int): Slot length in seconds.
+        step (int): Distance between consecutive slot starts in seconds.
+        not_before (int, optional): Earliest allowed slot start (e.g. now).
+
+    Yields:
+        tuple[int, int]: (start, end) slot pairs in start order.
+    """
+    for start, end in free:
+        if not_before is not None and start < not_before:
+            start = not_before
+        midnight = start - start % SECONDS_PER_DAY
+        slot_start = midnight + -(-(start - midnight) // step) * step
+        while slot_start + duration <= end:
+            yield slot_start, slot_start + duration
+            slot_start += step
+
+
+def carve_slots(free: list[tuple[int, int]], duration: int, step: int,
+                not_before: int | None = None) -> list[tuple[int, int]]:
+    """Lists every slot iter_slots yields for `free`."""
+    return list(iter_slots(free, duration, step, not_before))
+
+
+def _tag_slots(key, slots):
+    for start, end in slots:
+        yield start, end, key
+
+
+def earliest_slots(free_by_key: dict, duration: int, step: int, limit: int,
+                   not_before: int | None = None, starts_before: int | None = None) -> list[tuple]:
+    """
+    Finds the `limit` earliest slots across several calendars (e.g. one per provider).
+
+    Each calendar's slots are generated lazily in start order and the streams are
+    merged through a heap, so the work is about `limit` slots plus one per calendar,
+    however much free time the calendars have.
+
+    Args:
+        free_by_key (dict): key -> merged free intervals.
+        duration (int): Slot length in seconds.
+        step (int): Distance between consecutive slot starts in seconds.
+        limit (int): Number of slots to return.
+        not_before (int, optional): Earliest allowed slot start.
+        starts_before (int, optional): Slots must start before this time.
+
+    Returns:
+        list[tuple]: (start, end, key) in start order; ties are broken by key.
+    """
+    merged = heapq.merge(*(_tag_slots(key, iter_slots(free, duration, step, not_before))
+                           for key, free in sorted(free_by_key.items())))
+    if starts_before is not None:
+        merged = takewhile(lambda slot: slot[0] < starts_before, merged)
+    return list(islice(merged, limit))
@@ -0,0 +1,128 @@
+import heapq
+import os
+import threading
+from bisect import bisect_left, insort
+
+# --- Slot Hold Configuration ---
+# A hold reserves a provider's time for one patient for a short while, so the patient can
+# finish booking without racing everyone else for the same slot. Holds are persisted in
+# the appointment_holds table (see db_utils_appointment), which is authoritative; this
+# module keeps an in-memory mirror per database file so that a request for held time can
+# be turned away with a lock, a binary search and one read instead of a write transaction.
+HOLD_TTL_SECONDS = int(os.getenv('APPOINTMENT_HOLD_TTL_SECONDS', '300'))
+MAX_HOLD_TTL_SECONDS = 3600
+
+
+class SlotHoldRegistry:
+    """
+    Unexpired holds for one database, indexed by provider.
+
+    Each provider maps to a list of (start, end, expires, hold_id, patient_id) tuples
+    sorted by start, and a heap of (expires, hold_id) drives TTL expiry: every call first
+    pops what has expired, so the structure only ever holds live entries. All times are
+    epoch seconds (see time_utils). Thread-safe.
+
+    The mirror only covers holds placed or released through this process, so a conflict
+    it reports is a hint: callers confirm it against the database (and remove the entry
+    if the hold is gone) before refusing. Holds placed by another process are enforced
+    by the database check in the write transaction.
+
+    Args:
+        max_span_seconds (int): Longest time a single hold can cover; bounds the overlap search.
+    """
+
+    def __init__(self, max_span_seconds: int):
+        self.max_span_seconds = max_span_seconds
+        self._lock = threading.Lock()
+        self._by_provider = {}  # provider_id -> sorted list of hold tuples
+        self._by_id = {}        # hold_id -> (provider_id, hold tuple)
+        self._expiry = []       # heap of (expires, hold_id)
+
+    def _purge(self, now: int):
+        while self._expiry and self._expiry[0][0] <= now:
+            expires, hold_id = heapq.heappop(self._expiry)
+            found = self._by_id.get(hold_id)
+            if found and found[1][2] == expires: # Skip entries left behind by a re-added hold
+                self._remove(hold_id)
+
+    def _remove(self, hold_id: str):
+        found = self._by_id.pop(hold_id, None)
+        if found is None:
+            return
+        provider_id, hold = found
+        holds = self._by_provider[provider_id]
+        holds.pop(bisect_left(holds, hold))
+        if not holds:
+            del self._by_provider[provider_id]
+
+    def add(self, provider_id: int, hold_id: str, patient_id: int, start: int, end: int, expires: int):
+        """Records a hold that was persisted."""
+        with self._lock:
+            self._remove(hold_id)
+            hold = (start, end, expires, hold_id, patient_id)
+            insort(self._by_provider.setdefault(provider_id, []), hold)
+            self._by_id[hold_id] = (provider_id, hold)
+            heapq.heappush(self._expiry, (expires, hold_id))
+
+    def remove(self, hold_id: str):
+        """Forgets a hold that was released or consumed. Unknown IDs are ignored."""
+        with self._lock:
+            self._remove(hold_id)
+
+    def find_conflict(self, provider_id: int, start: int, end: int, now: int,
+                      patient_id: int = None, hold_id: str = None) -> tuple | None:
+        """
+        Returns a live hold overlapping [start, end), or None.
+
+        Holds belonging to `patient_id`, or with ID `hold_id`, do not count as conflicts.
+        """
+        with self._lock:
+            self._purge(now)
+            holds = self._by_provider.get(provider_id)
+            if not holds:
+                return None
+            index = bisect_left(holds, (start - self.max_span_seconds,))
+            while index < len(holds) and holds[index][0] < end:
+                hold = holds[index]
+                if hold[1] > start and hold[4] != patient_id and hold[3] != hold_id:
+                    return hold
+                index += 1
+            return None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._by_id)
+
+
+# --- Registries by database ---
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_hold_registry(db_path: str, max_span_seconds: int, loader) -> SlotHoldRegistry | None:
+    """
+    Returns the registry for a database file, creating it on first use.
+
+    Args:
+        db_path (str): The database file path (as reported by PRAGMA database_list).
+                       In-memory databases ('') have no registry.
+        max_span_seconds (int): See SlotHoldRegistry.
+        loader (callable): Called with a new registry to fill it from the persisted holds,
+                           so holds survive a restart.
+    """
+    if not db_path:
+        return None
+    with _registries_lock:
+        registry = _registries.get(db_path)
+        if registry is None:
+            registry = SlotHoldRegistry(max_span_seconds)
+            loader(registry)
+            _registries[db_path] = registry
+        return registry
+
+
+def reset_hold_registries():
+    """Drops every registry (e.g. after a database file is deleted in tests); they reload on next use."""
+    with _registries_lock:
+        _registries.clear()
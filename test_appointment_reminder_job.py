@@ -1,26 +1,54 @@
 import unittest
 from unittest.mock import patch, MagicMock, ANY
 from datetime import datetime, timedelta
+import os
+import re
+import signal
 import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 
 # Functions to be tested are in appointment_reminder_job
-from appointment_reminder_job import send_reminders
+import appointment_reminder_job
+from appointment_reminder_job import send_reminders, dispatch_outbox, run_reminder_daemon, run_reminder_worker
 # We will also patch functions imported by appointment_reminder_job
+from db_connection_pool import close_pool
+from db_utils_appointment import (
+    get_db_connection,
+    initialize_appointment_schema,
+    get_appointments_needing_reminders,
+    iter_appointments_needing_reminders,
+    enqueue_reminder_notifications,
+    claim_due_notifications,
+    record_notification_results,
+    acquire_reminder_shards,
+    release_reminder_shards,
+    OUTBOX_BASE_BACKOFF_SECONDS,
+    APPOINTMENT_CHANGE_RETENTION_SECONDS
+)
+from reminder_scheduler import ReminderSchedule
+from time_utils import format_datetime, now_epoch, datetime_to_epoch
+
+TEST_DB_NAME = 'test_reminder_outbox.db'
+WORKERS_TEST_DB_NAME = 'test_reminder_workers.db'
 
 class TestAppointmentReminderJob(unittest.TestCase):
 
     # --- Test send_reminders scenarios ---
 
-    @patch('appointment_reminder_job.send_sms_reminder')
+    @patch('appointment_reminder_job.dispatch_outbox')
     @patch('appointment_reminder_job.send_email_reminder')
-    @patch('appointment_reminder_job.db_utils_appointment.mark_reminder_sent')
-    @patch('appointment_reminder_job.db_utils_appointment.get_appointments_needing_reminders')
+    @patch('appointment_reminder_job.db_utils_appointment.enqueue_reminder_notifications')
+    @patch('appointment_reminder_job.db_utils_appointment.iter_appointments_needing_reminders')
     @patch('appointment_reminder_job.get_db_connection')
     def test_send_reminders_success_multiple_appointments(
             self, mock_get_db_conn, mock_get_appts_needing_reminders,
-            mock_mark_sent, mock_send_email, mock_send_sms):
+            mock_enqueue, mock_send_email, mock_dispatch_outbox):
         """
-        Test successful sending of reminders for multiple appointments.
+        Test that reminders for multiple appointments are queued in one batch, then dispatched.
         """
         mock_conn = MagicMock()
         mock_get_db_conn.return_value.__enter__.return_value = mock_conn # For 'with' statement
@@ -44,10 +72,8 @@ class TestAppointmentReminderJob(unittest.TestCase):
                 "last_reminder_sent_at": "2024-01-10 09:00:00" # Old reminder
             }
         ]
-        mock_get_appts_needing_reminders.return_value = mock_appointments
-        mock_mark_sent.return_value = True # Simulate successful marking
-        mock_send_email.return_value = True
-        mock_send_sms.return_value = True
+        mock_get_appts_needing_reminders.return_value = iter([mock_appointments]) # One chunk
+        mock_enqueue.return_value = {"appointments_marked": 2, "notifications_enqueued": 4}
 
         # Call the main function
         send_reminders(time_window_start_hours_ahead=23, time_window_end_hours_ahead=24, reminder_grace_period_hours=2)
@@ -55,51 +81,38 @@ class TestAppointmentReminderJob(unittest.TestCase):
         # Assertions
         mock_get_db_conn.assert_called_once()
         mock_get_appts_needing_reminders.assert_called_once()
-        # Check call args for get_appointments_needing_reminders based on datetime.now() is complex,
-        # so we'll test that separately or trust the call was made.
-
-        self.assertEqual(mock_send_email.call_count, 2)
-        mock_send_email.assert_any_call(mock_appointments[0]["patient_email"], mock_appointments[0])
-        mock_send_email.assert_any_call(mock_appointments[1]["patient_email"], mock_appointments[1])
-
-        self.assertEqual(mock_send_sms.call_count, 2)
-        mock_send_sms.assert_any_call(mock_appointments[0]["patient_phone"], mock_appointments[0])
-        mock_send_sms.assert_any_call(mock_appointments[1]["patient_phone"], mock_appointments[1])
-
-        self.assertEqual(mock_mark_sent.call_count, 2)
-        mock_mark_sent.assert_any_call(mock_conn, mock_appointments[0]['appointment_id'])
-        mock_mark_sent.assert_any_call(mock_conn, mock_appointments[1]['appointment_id'])
+        # Both appointments are queued in one batch; sending is left to the outbox dispatcher
+        mock_enqueue.assert_called_once_with(mock_conn, mock_appointments, offset_minutes=None)
+        mock_send_email.assert_not_called()
+        mock_dispatch_outbox.assert_called_once()
 
-    @patch('appointment_reminder_job.send_sms_reminder')
-    @patch('appointment_reminder_job.send_email_reminder')
-    @patch('appointment_reminder_job.db_utils_appointment.mark_reminder_sent')
-    @patch('appointment_reminder_job.db_utils_appointment.get_appointments_needing_reminders')
+    @patch('appointment_reminder_job.dispatch_outbox')
+    @patch('appointment_reminder_job.db_utils_appointment.enqueue_reminder_notifications')
+    @patch('appointment_reminder_job.db_utils_appointment.iter_appointments_needing_reminders')
     @patch('appointment_reminder_job.get_db_connection')
     def test_send_reminders_no_appointments_found(
             self, mock_get_db_conn, mock_get_appts_needing_reminders,
-            mock_mark_sent, mock_send_email, mock_send_sms):
+            mock_enqueue, mock_dispatch_outbox):
         """
         Test behavior when no appointments are found needing reminders.
         """
         mock_conn = MagicMock()
         mock_get_db_conn.return_value.__enter__.return_value = mock_conn
-        mock_get_appts_needing_reminders.return_value = [] # No appointments
+        mock_get_appts_needing_reminders.return_value = iter([]) # No appointments
 
         send_reminders() # Use default time windows
 
         mock_get_appts_needing_reminders.assert_called_once()
-        mock_send_email.assert_not_called()
-        mock_send_sms.assert_not_called()
-        mock_mark_sent.assert_not_called()
+        mock_enqueue.assert_not_called()
+        mock_dispatch_outbox.assert_called_once() # Retries queued by earlier runs may be due
 
-    @patch('appointment_reminder_job.send_sms_reminder')
-    @patch('appointment_reminder_job.send_email_reminder')
-    @patch('appointment_reminder_job.db_utils_appointment.mark_reminder_sent')
-    @patch('appointment_reminder_job.db_utils_appointment.get_appointments_needing_reminders')
+    @patch('appointment_reminder_job.dispatch_outbox')
+    @patch('appointment_reminder_job.db_utils_appointment.enqueue_reminder_notifications')
+    @patch('appointment_reminder_job.db_utils_appointment.iter_appointments_needing_reminders')
     @patch('appointment_reminder_job.get_db_connection')
     def test_send_reminders_db_error_on_fetch(
             self, mock_get_db_conn, mock_get_appts_needing_reminders,
-            mock_mark_sent, mock_send_email, mock_send_sms):
+            mock_enqueue, mock_dispatch_outbox):
         """
         Test behavior when fetching appointments raises a database error.
         """
@@ -110,87 +123,52 @@ class TestAppointmentReminderJob(unittest.TestCase):
         send_reminders()
 
         mock_get_appts_needing_reminders.assert_called_once()
-        mock_send_email.assert_not_called()
-        mock_send_sms.assert_not_called()
-        mock_mark_sent.assert_not_called()
+        mock_enqueue.assert_not_called()
         # The job should print an error message, which could be captured by mocking print if needed.
 
-    @patch('appointment_reminder_job.send_sms_reminder')
-    @patch('appointment_reminder_job.send_email_reminder')
-    @patch('appointment_reminder_job.db_utils_appointment.mark_reminder_sent')
-    @patch('appointment_reminder_job.db_utils_appointment.get_appointments_needing_reminders')
+    @patch('appointment_reminder_job.dispatch_outbox')
+    @patch('appointment_reminder_job.db_utils_appointment.enqueue_reminder_notifications')
+    @patch('appointment_reminder_job.db_utils_appointment.iter_appointments_needing_reminders')
     @patch('appointment_reminder_job.get_db_connection')
-    def test_send_reminders_db_error_on_mark_sent(
+    def test_send_reminders_db_error_on_enqueue(
             self, mock_get_db_conn, mock_get_appts_needing_reminders,
-            mock_mark_sent, mock_send_email, mock_send_sms):
+            mock_enqueue, mock_dispatch_outbox):
         """
-        Test behavior when marking a reminder as sent raises a database error.
-        The job should attempt to process other appointments if one mark_reminder_sent fails.
+        Test behavior when queueing a batch of reminders raises a database error.
+        The job should go on to queue the remaining batches if one enqueue_reminder_notifications fails.
         """
         mock_conn = MagicMock()
         mock_get_db_conn.return_value.__enter__.return_value = mock_conn
 
         mock_appointments = [
-            {"appointment_id": 101, "patient_email": "test1@example.com", "patient_phone": "111"},
-            {"appointment_id": 102, "patient_email": "test2@example.com", "patient_phone": "222"}
-        ]
-        mock_get_appts_needing_reminders.return_value = mock_appointments
-
-        # Simulate error on first call to mark_reminder_sent, success on second
-        mock_mark_sent.side_effect = [sqlite3.Error("Simulated DB error on mark_sent"), True]
-        mock_send_email.return_value = True # Assume notifications send successfully
-        mock_send_sms.return_value = True
-
-        send_reminders()
-
-        self.assertEqual(mock_send_email.call_count, 2) # Both should be attempted
-        self.assertEqual(mock_send_sms.call_count, 2)
-        self.assertEqual(mock_mark_sent.call_count, 2) # Both should be attempted
-        mock_mark_sent.assert_any_call(mock_conn, 101)
-        mock_mark_sent.assert_any_call(mock_conn, 102)
-        # Error message for the failed mark_sent would be printed by the job.
-
-    @patch('appointment_reminder_job.send_sms_reminder')
-    @patch('appointment_reminder_job.send_email_reminder')
-    @patch('appointment_reminder_job.db_utils_appointment.mark_reminder_sent')
-    @patch('appointment_reminder_job.db_utils_appointment.get_appointments_needing_reminders')
-    @patch('appointment_reminder_job.get_db_connection')
-    def test_send_reminders_missing_contact_info(
-            self, mock_get_db_conn, mock_get_appts_needing_reminders,
-            mock_mark_sent, mock_send_email, mock_send_sms):
-        """
-        Test that reminders are skipped if contact info is missing, but marking still occurs if one was sent.
-        """
-        mock_conn = MagicMock()
-        mock_get_db_conn.return_value.__enter__.return_value = mock_conn
-        mock_appointments = [
-            {"appointment_id": 101, "patient_email": None, "patient_phone": "111-2222"}, # No email
-            {"appointment_id": 102, "patient_email": "test2@example.com", "patient_phone": None}, # No phone
-            {"appointment_id": 103, "patient_email": None, "patient_phone": None} # No contact
+            {"appointment_id": appointment_id, "patient_username": "Patient", "provider_username": "Dr. Who",
+             "appointment_start_time": "2024-01-15 10:00:00", "last_reminder_sent_at": None,
+             "patient_email": f"test{appointment_id}@example.com", "patient_phone": None}
+            for appointment_id in (101, 102, 103)
         ]
-        mock_get_appts_needing_reminders.return_value = mock_appointments
-        mock_mark_sent.return_value = True
-        mock_send_email.return_value = True
-        mock_send_sms.return_value = True
-
-        send_reminders()
+        mock_get_appts_needing_reminders.return_value = iter([mock_appointments[:2], mock_appointments[2:]])
 
-        # Email should only be called for appt 102
-        mock_send_email.assert_called_once_with(mock_appointments[1]["patient_email"], mock_appointments[1])
+        # Simulate error on the first batch, success on the second
+        mock_enqueue.side_effect = [sqlite3.Error("Simulated DB error on enqueue"),
+                                    {"appointments_marked": 1, "notifications_enqueued": 1}]
 
-        # SMS should only be called for appt 101
-        mock_send_sms.assert_called_once_with(mock_appointments[0]["patient_phone"], mock_appointments[0])
+        with patch('appointment_reminder_job.REMINDER_MARK_BATCH_SIZE', 2):
+            send_reminders()
 
-        # mark_reminder_sent should be called for appt 101 and 102, but not 103
-        self.assertEqual(mock_mark_sent.call_count, 2)
-        mock_mark_sent.assert_any_call(mock_conn, 101)
-        mock_mark_sent.assert_any_call(mock_conn, 102)
+        mock_get_appts_needing_reminders.assert_called_once_with(mock_conn, ANY, ANY, ANY, chunk_size=2,
+                                                                 shard_ids=None, shard_count=None)
+        self.assertEqual(mock_enqueue.call_count, 2) # Both batches should be attempted
+        mock_enqueue.assert_any_call(mock_conn, mock_appointments[:2], offset_minutes=None)
+        mock_enqueue.assert_any_call(mock_conn, mock_appointments[2:], offset_minutes=None)
+        mock_dispatch_outbox.assert_called_once()
+        # Error message for the failed batch would be printed by the job.
 
-    @patch('appointment_reminder_job.db_utils_appointment.get_appointments_needing_reminders')
+    @patch('appointment_reminder_job.dispatch_outbox')
+    @patch('appointment_reminder_job.db_utils_appointment.iter_appointments_needing_reminders')
     @patch('appointment_reminder_job.get_db_connection')
     @patch('appointment_reminder_job.datetime') # Patch datetime module used in send_reminders
     def test_send_reminders_time_window_calculation(
-            self, mock_datetime_module, mock_get_db_conn, mock_get_appts):
+            self, mock_datetime_module, mock_get_db_conn, mock_get_appts, mock_dispatch_outbox):
         """
         Test that the time window for fetching appointments is calculated correctly.
         """
@@ -204,7 +182,7 @@ class TestAppointmentReminderJob(unittest.TestCase):
         mock_datetime_module.timedelta = timedelta
 
 
-        mock_get_appts.return_value = [] # No appointments needed for this test of args
+        mock_get_appts.return_value = iter([]) # No appointments needed for this test of args
 
         start_hours = 23
         end_hours = 24
@@ -224,8 +202,401 @@ class TestAppointmentReminderJob(unittest.TestCase):
             mock_conn,
             expected_window_start_iso,
             expected_window_end_iso,
-            grace_hours
+            grace_hours,
+            chunk_size=ANY,
+            shard_ids=None,
+            shard_count=None
         )
 
+
+class TestNotificationOutbox(unittest.TestCase):
+    """The outbox functions and dispatch_outbox against a real database."""
+
+    def setUp(self):
+        close_pool(TEST_DB_NAME)
+        if os.path.exists(TEST_DB_NAME):
+            os.remove(TEST_DB_NAME)
+        self.conn = get_db_connection(TEST_DB_NAME)
+        initialize_appointment_schema(self.conn)
+        users = [('outbox_provider', None, None), ('outbox_both', 'both@example.com', '5550001'),
+                 ('outbox_email_only', 'email@example.com', None), ('outbox_no_contact', None, None)]
+        user_ids = []
+        for username, email, phone in users:
+            user_ids.append(self.conn.execute("INSERT INTO users (username, email, phone) VALUES (?, ?, ?)",
+                                              (username, email, phone)).lastrowid)
+        start = datetime.now().replace(microsecond=0) + timedelta(hours=23, minutes=30)
+        for offset, patient_id in enumerate(user_ids[1:]):
+            appointment_start = start + timedelta(minutes=10 * offset)
+            self.conn.execute("""INSERT INTO appointments (patient_id, provider_id, appointment_start_time,
+                                 appointment_end_time, status) VALUES (?, ?, ?, ?, 'confirmed')""",
+                              (patient_id, user_ids[0], format_datetime(appointment_start),
+                               format_datetime(appointment_start + timedelta(minutes=10))))
+        self.conn.commit()
+        self.window = (format_datetime(start - timedelta(hours=1)), format_datetime(start + timedelta(hours=1)))
+
+        patcher = patch.object(appointment_reminder_job, 'DB_NAME', TEST_DB_NAME)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.conn.close()
+        close_pool(TEST_DB_NAME)
+        if os.path.exists(TEST_DB_NAME):
+            os.remove(TEST_DB_NAME)
+
+    def _outbox(self):
+        return [dict(row) for row in self.conn.execute(
+            "SELECT channel, address, status, attempts, last_error FROM notification_outbox ORDER BY notification_id")]
+
+    def test_enqueue_marks_appointments_and_is_idempotent(self):
+        appointments = get_appointments_needing_reminders(self.conn, *self.window)
+        self.assertEqual(len(appointments), 3)
+        result = enqueue_reminder_notifications(self.conn, appointments)
+        self.assertEqual(result, {"appointments_marked": 2, "notifications_enqueued": 3})
+        self.assertEqual([(row['channel'], row['address'], row['status']) for row in self._outbox()],
+                         [('email', 'both@example.com', 'pending'), ('sms', '5550001', 'pending'),
+                          ('email', 'email@example.com', 'pending')])
+        # The appointment without contacts is left for the next run; the others are done
+        self.assertEqual([appt['patient_email'] for appt in get_appointments_needing_reminders(self.conn, *self.window)],
+                         [None])
+        # Rerunning after a crash queues nothing twice
+        self.assertEqual(enqueue_reminder_notifications(self.conn, appointments)['notifications_enqueued'], 0)
+        self.assertEqual(len(self._outbox()), 3)
+
+    def test_streamed_chunks_match_the_full_read_and_tolerate_writes_between_chunks(self):
+        # Same start time across providers: the keyset must break ties on appointment_id
+        provider_ids = []
+        for index in range(5):
+            provider_ids.append(self.conn.execute("INSERT INTO users (username) VALUES (?)",
+                                                  (f'outbox_extra_provider_{index}',)).lastrowid)
+        patient_id = self.conn.execute("SELECT user_id FROM users WHERE username = 'outbox_both'").fetchone()[0]
+        # Inside the window, before the fixture appointments
+        start = format_datetime(datetime.strptime(self.window[0], '%Y-%m-%d %H:%M:%S') + timedelta(minutes=5))
+        for provider_id in provider_ids:
+            self.conn.execute("""INSERT INTO appointments (patient_id, provider_id, appointment_start_time,
+                                 appointment_end_time, status) VALUES (?, ?, ?, ?, 'confirmed')""",
+                              (patient_id, provider_id, start, self.window[1]))
+        self.conn.commit()
+
+        expected = [appt['appointment_id'] for appt in sorted(
+            get_appointments_needing_reminders(self.conn, *self.window),
+            key=lambda appt: (appt['appointment_start_time'], appt['appointment_id']))]
+        self.assertEqual(len(expected), 8)
+        streamed = []
+        for chunk in iter_appointments_needing_reminders(self.conn, *self.window, chunk_size=3):
+            self.assertLessEqual(len(chunk), 3)
+            streamed.extend(appt['appointment_id'] for appt in chunk)
+            enqueue_reminder_notifications(self.conn, chunk) # Marks the chunk before the next one is read
+        self.assertEqual(streamed, expected)
+        # Only the appointment without contacts is left
+        self.assertEqual(list(iter_appointments_needing_reminders(self.conn, *self.window, chunk_size=3)),
+                         [get_appointments_needing_reminders(self.conn, *self.window)])
+        with self.assertRaises(ValueError):
+            next(iter_appointments_needing_reminders(self.conn, *self.window, chunk_size=0))
+
+    def test_failed_sends_back_off_then_dead_letter(self):
+        enqueue_reminder_notifications(self.conn, get_appointments_needing_reminders(self.conn, *self.window)[1:2])
+        now = now_epoch()
+        for attempt in (1, 2, 3):
+            claimed = claim_due_notifications(self.conn, now=now)
+            self.assertEqual([notification['attempts'] for notification in claimed], [attempt])
+            self.assertTrue(claimed[0]['details']['idempotency_key'].startswith('reminder:'))
+            counts = record_notification_results(
+                self.conn, [(claimed[0]['notification_id'], claimed[0]['attempts'], False, "timed out")],
+                now=now, max_attempts=3)
+            if attempt < 3:
+                self.assertEqual(counts, {"sent": 0, "retrying": 1, "dead": 0})
+                backoff = OUTBOX_BASE_BACKOFF_SECONDS * 2 ** (attempt - 1)
+                self.assertEqual(claim_due_notifications(self.conn, now=now + backoff - 1), [])
+                now += backoff
+        self.assertEqual(counts, {"sent": 0, "retrying": 0, "dead": 1})
+        self.assertEqual(claim_due_notifications(self.conn, now=now + 10 ** 6), [])
+        self.assertEqual(self._outbox()[0]['status'], 'dead')
+        self.assertEqual(self._outbox()[0]['last_error'], "timed out")
+
+    def test_expired_lease_is_claimed_again(self):
+        enqueue_reminder_notifications(self.conn, get_appointments_needing_reminders(self.conn, *self.window)[1:2])
+        now = now_epoch()
+        first = claim_due_notifications(self.conn, lease_seconds=300, now=now)
+        self.assertEqual(claim_due_notifications(self.conn, now=now + 299), []) # Still leased
+        again = claim_due_notifications(self.conn, now=now + 300) # The first dispatcher died
+        self.assertEqual(again[0]['notification_id'], first[0]['notification_id'])
+        self.assertEqual(again[0]['details']['idempotency_key'], first[0]['details']['idempotency_key'])
+        # The first dispatcher comes back late: its claim is gone, so its outcome is ignored
+        self.assertEqual(record_notification_results(
+            self.conn, [(first[0]['notification_id'], first[0]['attempts'], False, "timed out")], now=now + 301),
+            {"sent": 0, "retrying": 0, "dead": 0})
+        self.assertEqual(self._outbox()[0]['status'], 'sending')
+        self.assertEqual(record_notification_results(
+            self.conn, [(again[0]['notification_id'], again[0]['attempts'], True, None)], now=now + 301),
+            {"sent": 1, "retrying": 0, "dead": 0})
+
+    def test_reminders_for_cancelled_appointments_are_not_claimed(self):
+        appointments = get_appointments_needing_reminders(self.conn, *self.window)[1:2]
+        enqueue_reminder_notifications(self.conn, appointments)
+        self.conn.execute("UPDATE appointments SET status = 'cancelled_by_patient' WHERE appointment_id = ?",
+                          (appointments[0]['appointment_id'],))
+        self.conn.commit()
+        self.assertEqual(claim_due_notifications(self.conn), [])
+        self.assertEqual([(row['status'], row['last_error']) for row in self._outbox()],
+                         [('dead', 'Appointment is no longer confirmed')])
+
+    def test_daemon_requeues_reminders_whose_batch_failed(self):
+        user_ids = {row['username']: row['user_id'] for row in self.conn.execute("SELECT user_id, username FROM users")}
+        start = datetime.now().replace(microsecond=0) + timedelta(minutes=10)
+        appointment_id = self.conn.execute(
+            """INSERT INTO appointments (patient_id, provider_id, appointment_start_time, appointment_end_time,
+               status) VALUES (?, ?, ?, ?, 'confirmed')""",
+            (user_ids['outbox_both'], user_ids['outbox_provider'], format_datetime(start),
+             format_datetime(start + timedelta(minutes=10)))).lastrowid
+        self.conn.commit()
+        stop = threading.Event()
+        real_enqueue, enqueue_calls = enqueue_reminder_notifications, []
+
+        def locked_once(conn, appointments, **kwargs):
+            enqueue_calls.append([appt['appointment_id'] for appt in appointments])
+            if len(enqueue_calls) == 1:
+                raise sqlite3.OperationalError('database is locked')
+            stop.set()
+            return real_enqueue(conn, appointments, **kwargs)
+
+        # Its 15-minute (and only) reminder was due 5 minutes ago; the first attempt to queue it fails
+        schedule = ReminderSchedule(offsets_minutes=(15,), catchup_seconds=900)
+        with patch('appointment_reminder_job.db_utils_appointment.enqueue_reminder_notifications',
+                   side_effect=locked_once), \
+                patch('appointment_reminder_job.dispatch_outbox'), \
+                patch('appointment_reminder_job.REMINDER_DAEMON_RETRY_SECONDS', 0.05), patch('builtins.print'):
+            worker = threading.Thread(target=run_reminder_daemon, args=(stop, schedule))
+            worker.start()
+            worker.join(timeout=10)
+        stop.set()
+        self.assertFalse(worker.is_alive())
+
+        self.assertEqual(enqueue_calls, [[appointment_id], [appointment_id]])
+        self.assertEqual(len(schedule), 0)
+        self.assertEqual([(row['appointment_id'], row['status']) for row in self.conn.execute(
+            "SELECT appointment_id, status FROM notification_outbox ORDER BY notification_id")],
+            [(appointment_id, 'pending'), (appointment_id, 'pending')])
+
+    def test_outbox_claims_fit_in_the_lease(self):
+        with patch('appointment_reminder_job.NOTIFICATION_SEND_TIMEOUT_SECONDS', 10), \
+                patch.dict('appointment_reminder_job.CHANNEL_CONCURRENCY', {'email': 8, 'sms': 4}), \
+                patch.dict('appointment_reminder_job.CHANNEL_RATE_PER_SECOND', {'email': 0, 'sms': 0}):
+            self.assertEqual(appointment_reminder_job._outbox_claim_limit(300), 60) # 4 SMS in flight x 15 timeouts
+            with patch.dict('appointment_reminder_job.CHANNEL_RATE_PER_SECOND', {'sms': 0.1}):
+                self.assertEqual(appointment_reminder_job._outbox_claim_limit(300), 15)
+            with patch('appointment_reminder_job.REMINDER_MARK_BATCH_SIZE', 20):
+                self.assertEqual(appointment_reminder_job._outbox_claim_limit(300), 20)
+
+    @patch('appointment_reminder_job.send_sms_reminder')
+    @patch('appointment_reminder_job.send_email_reminder')
+    def test_send_reminders_delivers_and_retries_through_the_outbox(self, mock_send_email, mock_send_sms):
+        mock_send_email.side_effect = OSError("SMTP server unreachable")
+        mock_send_sms.return_value = True
+
+        with patch('builtins.print'):
+            send_reminders()
+
+        self.assertEqual([(row['channel'], row['status']) for row in self._outbox()],
+                         [('email', 'pending'), ('sms', 'sent'), ('email', 'pending')])
+        self.assertIn("SMTP server unreachable", self._outbox()[0]['last_error'])
+        sms_details = mock_send_sms.call_args[0][1]
+        self.assertEqual(sms_details['idempotency_key'], f"reminder:{sms_details['appointment_id']}:sms:"
+                         f"{datetime_to_epoch(sms_details['appointment_start_time'])}")
+        # Failed emails wait out their backoff; nothing else is due
+        with patch('builtins.print'):
+            self.assertEqual(dispatch_outbox(), {"sent": 0, "retrying": 0, "dead": 0})
+        self.assertEqual(mock_send_email.call_count, 2)
+
+    @patch('appointment_reminder_job.send_sms_reminder')
+    @patch('appointment_reminder_job.send_email_reminder')
+    def test_send_reminders_prunes_the_change_feed(self, mock_send_email, mock_send_sms):
+        mock_send_email.return_value = mock_send_sms.return_value = True
+        self.conn.execute("INSERT INTO appointment_changes (appointment_id, status, appointment_start_epoch, changed_epoch) "
+                          "VALUES (0, 'confirmed', 0, ?)", (now_epoch() - APPOINTMENT_CHANGE_RETENTION_SECONDS - 60,))
+        self.conn.commit()
+        recent = self.conn.execute("SELECT COUNT(*) FROM appointment_changes").fetchone()[0] - 1
+        with patch('builtins.print'):
+            send_reminders()
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM appointment_changes").fetchone()[0], recent)
+
+    @patch('appointment_reminder_job.send_sms_reminder')
+    @patch('appointment_reminder_job.send_email_reminder')
+    def test_daemon_sends_due_offsets_and_follows_the_change_feed(self, mock_send_email, mock_send_sms):
+        mock_send_email.return_value = mock_send_sms.return_value = True
+        user_ids = {row['username']: row['user_id'] for row in self.conn.execute("SELECT user_id, username FROM users")}
+        second_provider = self.conn.execute("INSERT INTO users (username) VALUES ('outbox_provider_2')").lastrowid
+        self.conn.commit()
+        soon = datetime.now().replace(microsecond=0)
+
+        def add_confirmed(patient_id, provider_id, minutes_ahead):
+            start = soon + timedelta(minutes=minutes_ahead)
+            appointment_id = self.conn.execute(
+                """INSERT INTO appointments (patient_id, provider_id, appointment_start_time, appointment_end_time,
+                   status) VALUES (?, ?, ?, ?, 'confirmed')""",
+                (patient_id, provider_id, format_datetime(start), format_datetime(start + timedelta(minutes=10)))).lastrowid
+            self.conn.commit()
+            return appointment_id
+
+        # Its 15-minute reminder was due 5 minutes ago, inside the catch-up window
+        loaded_id = add_confirmed(user_ids['outbox_both'], user_ids['outbox_provider'], 10)
+        stop = threading.Event()
+        real_dispatch_outbox, dispatch_calls, confirmed_later = appointment_reminder_job.dispatch_outbox, [], []
+
+        def dispatch_then_script(clock=None):
+            totals = real_dispatch_outbox(clock)
+            dispatch_calls.append(totals)
+            if len(dispatch_calls) == 1: # Confirmed while the daemon runs: arrives through the change feed
+                confirmed_later.append(add_confirmed(user_ids['outbox_email_only'], second_provider, 12))
+            else:
+                stop.set()
+            return totals
+
+        schedule = ReminderSchedule(offsets_minutes=(1440, 15), catchup_seconds=900)
+        with patch('appointment_reminder_job.dispatch_outbox', side_effect=dispatch_then_script), \
+                patch('appointment_reminder_job.REMINDER_DAEMON_POLL_SECONDS', 0.05), patch('builtins.print'):
+            worker = threading.Thread(target=run_reminder_daemon, args=(stop, schedule))
+            worker.start()
+            worker.join(timeout=10)
+        stop.set()
+        self.assertFalse(worker.is_alive())
+
+        self.assertEqual(dispatch_calls, [{"sent": 2, "retrying": 0, "dead": 0}, {"sent": 1, "retrying": 0, "dead": 0}])
+        rows = self.conn.execute("SELECT appointment_id, idempotency_key, status FROM notification_outbox "
+                                 "ORDER BY notification_id").fetchall()
+        self.assertEqual([(row['appointment_id'], row['status']) for row in rows],
+                         [(loaded_id, 'sent'), (loaded_id, 'sent'), (confirmed_later[0], 'sent')])
+        self.assertTrue(all(row['idempotency_key'].endswith(':15m') for row in rows))
+        # The fixture appointments, about 24 hours ahead, still have their 15-minute reminders to come
+        self.assertEqual(len(schedule), 3)
+
+class TestShardedReminderWorkers(unittest.TestCase):
+    """Shard leases, the provider shard filter, and worker processes sharing one database file."""
+
+    PROVIDER_COUNT = 12
+    APPOINTMENTS_PER_PROVIDER = 3
+
+    def setUp(self):
+        self._remove_database()
+        self.conn = get_db_connection(WORKERS_TEST_DB_NAME)
+        initialize_appointment_schema(self.conn)
+        provider_ids = [self.conn.execute("INSERT INTO users (username) VALUES (?)", (f'shard_provider_{i}',)).lastrowid
+                        for i in range(self.PROVIDER_COUNT)]
+        start = datetime.now().replace(microsecond=0) + timedelta(hours=23, minutes=15)
+        for index in range(self.PROVIDER_COUNT * self.APPOINTMENTS_PER_PROVIDER):
+            patient_id = self.conn.execute("INSERT INTO users (username, email) VALUES (?, ?)",
+                                           (f'shard_patient_{index}', f'patient{index}@example.com')).lastrowid
+            appointment_start = start + timedelta(minutes=10 * (index // self.PROVIDER_COUNT))
+            self.conn.execute("""INSERT INTO appointments (patient_id, provider_id, appointment_start_time,
+                                 appointment_end_time, status) VALUES (?, ?, ?, ?, 'confirmed')""",
+                              (patient_id, provider_ids[index % self.PROVIDER_COUNT], format_datetime(appointment_start),
+                               format_datetime(appointment_start + timedelta(minutes=10))))
+        self.conn.commit()
+        self.window = (format_datetime(start - timedelta(hours=1)), format_datetime(start + timedelta(hours=1)))
+
+    def tearDown(self):
+        self.conn.close()
+        self._remove_database()
+
+    def _remove_database(self):
+        close_pool(WORKERS_TEST_DB_NAME)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(WORKERS_TEST_DB_NAME + suffix):
+                os.remove(WORKERS_TEST_DB_NAME + suffix)
+
+    def test_shards_rebalance_and_expired_leases_are_taken_over(self):
+        now = now_epoch()
+        self.assertEqual(acquire_reminder_shards(self.conn, 'a', 4, lease_seconds=60, now=now), [0, 1, 2, 3])
+        # 'b' joins: its share is still held by 'a' until 'a' heartbeats and gives it up
+        self.assertEqual(acquire_reminder_shards(self.conn, 'b', 4, lease_seconds=60, now=now + 1), [])
+        self.assertEqual(acquire_reminder_shards(self.conn, 'a', 4, lease_seconds=60, now=now + 2), [0, 1])
+        self.assertEqual(acquire_reminder_shards(self.conn, 'b', 4, lease_seconds=60, now=now + 3), [2, 3])
+        # 'a' stops heartbeating: once its leases expire 'b' holds everything
+        self.assertEqual(acquire_reminder_shards(self.conn, 'b', 4, lease_seconds=60, now=now + 61), [2, 3])
+        self.assertEqual(acquire_reminder_shards(self.conn, 'b', 4, lease_seconds=60, now=now + 62), [0, 1, 2, 3])
+        # Three workers share five shards 2/2/1
+        acquire_reminder_shards(self.conn, 'c', 5, lease_seconds=60, now=now + 63)
+        acquire_reminder_shards(self.conn, 'd', 5, lease_seconds=60, now=now + 63)
+        self.assertEqual(acquire_reminder_shards(self.conn, 'b', 5, lease_seconds=60, now=now + 64), [0, 1])
+        self.assertEqual(acquire_reminder_shards(self.conn, 'c', 5, lease_seconds=60, now=now + 64), [2, 4])
+        self.assertEqual(acquire_reminder_shards(self.conn, 'd', 5, lease_seconds=60, now=now + 64), [3])
+        # A worker that stops cleanly hands its shards over at once
+        self.assertEqual(release_reminder_shards(self.conn, 'c'), 2)
+        self.assertEqual(acquire_reminder_shards(self.conn, 'd', 5, lease_seconds=60, now=now + 65), [2, 3])
+        self.assertEqual(acquire_reminder_shards(self.conn, 'b', 5, lease_seconds=60, now=now + 65), [0, 1, 4])
+
+    def test_worker_prunes_the_change_feed_once_per_interval(self):
+        self.conn.execute("INSERT INTO appointment_changes (appointment_id, status, appointment_start_epoch, changed_epoch) "
+                          "VALUES (0, 'confirmed', 0, ?)", (now_epoch() - APPOINTMENT_CHANGE_RETENTION_SECONDS - 60,))
+        self.conn.commit()
+        stop, prune_flags = threading.Event(), []
+        real_enqueue_reminders = appointment_reminder_job.enqueue_reminders
+
+        def enqueue_and_record(**kwargs):
+            prune_flags.append(kwargs['prune_changes'])
+            if len(prune_flags) == 3:
+                stop.set()
+            return real_enqueue_reminders(**kwargs)
+
+        with patch.object(appointment_reminder_job, 'DB_NAME', WORKERS_TEST_DB_NAME), \
+                patch('appointment_reminder_job.REMINDER_WORKER_INTERVAL_SECONDS', 0), \
+                patch('appointment_reminder_job.enqueue_reminders', side_effect=enqueue_and_record), \
+                patch('appointment_reminder_job.dispatch_outbox'), patch('builtins.print'):
+            run_reminder_worker(stop, worker_id='pruner', shard_count=2)
+
+        self.assertEqual(prune_flags, [True, False, False])
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM appointment_changes WHERE changed_epoch < ?",
+                                           (now_epoch() - APPOINTMENT_CHANGE_RETENTION_SECONDS,)).fetchone()[0], 0)
+
+    def test_shard_filter_partitions_the_candidates(self):
+        everything = sorted(appt['appointment_id'] for appt in get_appointments_needing_reminders(self.conn, *self.window))
+        by_shard = [[appt['appointment_id'] for chunk in iter_appointments_needing_reminders(
+                        self.conn, *self.window, chunk_size=4, shard_ids=[shard_id], shard_count=5) for appt in chunk]
+                    for shard_id in range(5)]
+        self.assertTrue(all(by_shard))
+        self.assertEqual(sorted(sum(by_shard, [])), everything)
+        self.assertEqual(list(iter_appointments_needing_reminders(self.conn, *self.window, shard_ids=[], shard_count=5)), [])
+        with self.assertRaises(ValueError):
+            next(iter_appointments_needing_reminders(self.conn, *self.window, shard_ids=[0]))
+
+    def test_worker_processes_split_shards_and_send_each_reminder_once(self):
+        appointment_count = self.PROVIDER_COUNT * self.APPOINTMENTS_PER_PROVIDER
+        environment = dict(os.environ, APPOINTMENT_DB_NAME=os.path.abspath(WORKERS_TEST_DB_NAME),
+                           REMINDER_JOB_MODE='worker', REMINDER_SHARD_COUNT='6',
+                           REMINDER_WORKER_INTERVAL_SECONDS='0.2', REMINDER_SHARD_LEASE_SECONDS='5')
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'appointment_reminder_job.py')
+        workers = []
+        for _ in range(3):
+            output = tempfile.TemporaryFile(mode='w+')
+            self.addCleanup(output.close)
+            workers.append((subprocess.Popen([sys.executable, script], env=environment, stdout=output,
+                                             stderr=subprocess.STDOUT), output))
+        try:
+            deadline = time.monotonic() + 30
+            while time.monotonic() < deadline:
+                sent = self.conn.execute("SELECT COUNT(*) FROM notification_outbox WHERE status = 'sent'").fetchone()[0]
+                shares = sorted(count for (count,) in self.conn.execute(
+                    "SELECT COUNT(*) FROM reminder_shard_leases WHERE worker_id IS NOT NULL GROUP BY worker_id"))
+                if sent == appointment_count and shares == [2, 2, 2]:
+                    break
+                time.sleep(0.2)
+            self.assertEqual((sent, shares), (appointment_count, [2, 2, 2]))
+        finally:
+            for process, _ in workers:
+                process.send_signal(signal.SIGTERM)
+            for process, _ in workers:
+                process.wait(timeout=20)
+
+        sends = []
+        for process, output in workers:
+            self.assertEqual(process.returncode, 0)
+            output.seek(0)
+            sends += re.findall(r"SIMULATING: Sending EMAIL reminder to \S+ for appointment ID (\d+)", output.read())
+        self.assertEqual(len(sends), appointment_count)
+        self.assertEqual(len(set(sends)), appointment_count) # No appointment was reminded twice
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM reminder_shard_leases WHERE worker_id IS NOT NULL")
+                         .fetchone()[0], 0) # Released on SIGTERM
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM reminder_workers").fetchone()[0], 0)
+
 if __name__ == '__main__':
     unittest.main(argv=['first-arg-is-ignored'], exit=False)
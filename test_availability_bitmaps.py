@@ -0,0 +1,59 @@
+import unittest
+
+from availability_bitmaps import (
+    CELLS_PER_DAY,
+    FULL_DAY,
+    days_spanned,
+    touched_cells,
+    covered_cells,
+    to_blob,
+    from_blob,
+    is_range_free
+)
+from time_utils import datetime_to_epoch
+
+DAY = datetime_to_epoch('2024-07-01 00:00:00')
+
+
+def _at(clock: str) -> int:
+    return datetime_to_epoch(f'2024-07-01 {clock}')
+
+
+def _cells(*numbers):
+    return sum(1 << number for number in numbers)
+
+
+class TestAvailabilityBitmaps(unittest.TestCase):
+
+    def test_touched_and_covered_cells_round_in_opposite_directions(self):
+        # 09:02-09:13 touches cells 108-110 (09:00-09:15) but only covers cell 109 (09:05-09:10)
+        interval = [(_at('09:02:00'), _at('09:13:00'))]
+        self.assertEqual(touched_cells(interval, DAY), _cells(108, 109, 110))
+        self.assertEqual(covered_cells(interval, DAY), _cells(109))
+        self.assertEqual(covered_cells([(_at('09:02:00'), _at('09:04:00'))], DAY), 0)
+        # Intervals running past the day are clamped to it
+        self.assertEqual(touched_cells([(DAY - 600, DAY + 2 * 86400)], DAY), FULL_DAY)
+        self.assertEqual(covered_cells([(_at('23:55:00'), DAY + 86400 + 300)], DAY), _cells(CELLS_PER_DAY - 1))
+
+    def test_blob_round_trip_is_36_bytes(self):
+        bits = _cells(0, 100, CELLS_PER_DAY - 1)
+        self.assertEqual(len(to_blob(bits)), 36)
+        self.assertEqual(from_blob(to_blob(bits)), bits)
+
+    def test_is_range_free_checks_every_spanned_day(self):
+        next_day = DAY + 86400
+        self.assertEqual(list(days_spanned(_at('23:00:00'), next_day + 3600)), [DAY, next_day])
+        self.assertEqual(list(days_spanned(_at('09:00:00'), next_day)), [DAY])
+        bitmaps = {
+            DAY: (covered_cells([(_at('09:00:00'), next_day)], DAY), touched_cells([(_at('10:00:00'), _at('10:30:00'))], DAY)),
+            next_day: (covered_cells([(next_day, next_day + 3600)], next_day), 0),
+        }
+        self.assertTrue(is_range_free(bitmaps, _at('09:00:00'), _at('10:00:00')))
+        self.assertFalse(is_range_free(bitmaps, _at('09:30:00'), _at('10:05:00')))
+        self.assertFalse(is_range_free(bitmaps, _at('08:55:00'), _at('09:30:00')))
+        self.assertTrue(is_range_free(bitmaps, _at('23:30:00'), next_day + 3600))
+        self.assertFalse(is_range_free(bitmaps, _at('23:30:00'), next_day + 3900))
+
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)
@@ -0,0 +1,189 @@
+import unittest
+import os
+import gc
+import sqlite3
+import threading
+import time
+
+from db_connection_pool import ConnectionPool, PoolTimeoutError, begin_immediate, get_pool, close_pool
+
+TEST_DB_NAME = 'test_db_connection_pool.db'
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        close_pool(TEST_DB_NAME)
+        if os.path.exists(TEST_DB_NAME):
+            os.remove(TEST_DB_NAME)
+        self.pool = ConnectionPool(TEST_DB_NAME, max_size=2, acquire_timeout=0.2)
+
+    def tearDown(self):
+        self.pool.close()
+        close_pool(TEST_DB_NAME)
+        if os.path.exists(TEST_DB_NAME):
+            os.remove(TEST_DB_NAME)
+
+    def test_pragmas_applied_on_new_connection(self):
+        conn = self.pool.acquire()
+        try:
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+            self.assertEqual(conn.execute("PRAGMA foreign_keys").fetchone()[0], 1)
+            self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1) # 1 == NORMAL
+            self.assertGreater(conn.execute("PRAGMA busy_timeout").fetchone()[0], 0)
+            self.assertIs(conn.row_factory, sqlite3.Row)
+        finally:
+            conn.close()
+
+    def test_connection_is_reused_after_close(self):
+        conn1 = self.pool.acquire()
+        raw1 = conn1.raw_connection
+        conn1.close()
+        conn2 = self.pool.acquire()
+        self.assertIs(conn2.raw_connection, raw1)
+        conn2.close()
+        metrics = self.pool.metrics()
+        self.assertEqual(metrics['connections_created'], 1)
+        self.assertEqual(metrics['checkouts'], 2)
+        self.assertEqual(metrics['releases'], 2)
+        self.assertEqual(metrics['in_use'], 0)
+
+    def test_context_manager_commits_and_releases(self):
+        with self.pool.acquire() as conn:
+            conn.execute("CREATE TABLE t (x INTEGER)")
+            conn.execute("INSERT INTO t (x) VALUES (1)")
+        self.assertEqual(self.pool.metrics()['in_use'], 0)
+        with self.pool.acquire() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM t").fetchone()[0], 1)
+
+    def test_uncommitted_work_is_rolled_back_on_release(self):
+        with self.pool.acquire() as conn:
+            conn.execute("CREATE TABLE t (x INTEGER)")
+        conn = self.pool.acquire()
+        conn.execute("INSERT INTO t (x) VALUES (1)") # Implicit transaction, never committed
+        conn.close()
+        with self.pool.acquire() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM t").fetchone()[0], 0)
+
+    def test_closed_wrapper_rejects_use(self):
+        conn = self.pool.acquire()
+        conn.close()
+        conn.close() # Idempotent
+        with self.assertRaises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+
+    def test_pool_size_limit_and_timeout(self):
+        conn1 = self.pool.acquire()
+        conn2 = self.pool.acquire()
+        with self.assertRaises(PoolTimeoutError):
+            self.pool.acquire()
+        self.assertEqual(self.pool.metrics()['acquire_timeouts'], 1)
+        conn1.close()
+        conn2.close()
+
+    def test_waiter_gets_connection_when_released(self):
+        conn1 = self.pool.acquire()
+        conn2 = self.pool.acquire()
+        acquired = []
+
+        def waiter():
+            conn = self.pool.acquire(timeout=2)
+            acquired.append(conn)
+            conn.close()
+
+        thread = threading.Thread(target=waiter)
+        thread.start()
+        time.sleep(0.05)
+        conn1.close()
+        thread.join(timeout=2)
+        conn2.close()
+        self.assertEqual(len(acquired), 1)
+        self.assertGreater(self.pool.metrics()['wait_time_max_seconds'], 0)
+
+    def test_leaked_connection_is_detected_and_reclaimed(self):
+        conn = self.pool.acquire()
+        del conn
+        gc.collect()
+        metrics = self.pool.metrics()
+        self.assertEqual(metrics['leaks_detected'], 1)
+        self.assertEqual(metrics['in_use'], 0)
+        self.assertEqual(metrics['idle'], 1)
+
+    def test_connection_to_replaced_file_is_discarded(self):
+        with self.pool.acquire() as conn:
+            conn.execute("CREATE TABLE t (x INTEGER)")
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(TEST_DB_NAME + suffix):
+                os.remove(TEST_DB_NAME + suffix)
+        # The idle connection still points at the deleted file and must not be handed out.
+        with self.pool.acquire() as conn:
+            tables = conn.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()
+        self.assertEqual(tables, [])
+        self.assertEqual(self.pool.metrics()['health_check_failures'], 1)
+
+    def test_health_check_runs_for_stale_idle_connections(self):
+        pool = ConnectionPool(TEST_DB_NAME, max_size=1, health_check_interval=0)
+        try:
+            pool.acquire().close()
+            pool.acquire().close()
+            self.assertGreaterEqual(pool.metrics()['health_checks'], 1)
+            self.assertEqual(pool.metrics()['health_check_failures'], 0)
+        finally:
+            pool.close()
+
+    def test_in_memory_database_is_not_pooled(self):
+        for db_name in (':memory:', ''):
+            with self.assertRaises(ValueError):
+                ConnectionPool(db_name)
+
+    def test_open_cursors_are_closed_on_release(self):
+        with self.pool.acquire() as conn:
+            conn.execute("CREATE TABLE t (x INTEGER)")
+            conn.executemany("INSERT INTO t (x) VALUES (?)", [(i,) for i in range(10)])
+        conn = self.pool.acquire()
+        cursor = conn.execute("SELECT x FROM t")
+        cursor.fetchone() # Half-read: its statement still holds a read snapshot
+        conn.close()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            cursor.fetchone()
+
+    def test_new_connection_is_opened_outside_the_lock(self):
+        opening, proceed = threading.Event(), threading.Event()
+        real_open = self.pool._open_connection
+
+        def slow_open():
+            opening.set()
+            proceed.wait(5)
+            return real_open()
+
+        idle = self.pool.acquire()
+        self.pool._open_connection = slow_open
+        checkout = threading.Thread(target=lambda: self.pool.acquire().close())
+        checkout.start()
+        self.assertTrue(opening.wait(5))
+        started = time.monotonic()
+        idle.close() # Release and metrics do not wait for the slow open
+        self.assertEqual(self.pool.metrics()['open'], 2)
+        self.assertLess(time.monotonic() - started, 1)
+        proceed.set()
+        checkout.join(5)
+        self.assertEqual(self.pool.metrics()['in_use'], 0)
+
+    def test_begin_immediate_refuses_an_open_transaction(self):
+        with self.pool.acquire() as conn:
+            conn.execute("CREATE TABLE t (x INTEGER)")
+            conn.execute("INSERT INTO t (x) VALUES (1)") # The caller's pending work
+            with self.assertRaises(sqlite3.ProgrammingError):
+                begin_immediate(conn)
+            self.assertTrue(conn.in_transaction) # Neither committed nor rolled back
+            conn.rollback()
+            begin_immediate(conn)
+            self.assertTrue(conn.in_transaction)
+            conn.rollback()
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM t").fetchone()[0], 0)
+
+    def test_get_pool_returns_shared_instance(self):
+        self.assertIs(get_pool(TEST_DB_NAME), get_pool(os.path.abspath(TEST_DB_NAME)))
+
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)
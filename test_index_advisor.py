@@ -0,0 +1,94 @@
+import unittest
+
+from index_advisor import (
+    open_scratch_connection,
+    explain,
+    plan_issues,
+    propose_candidates,
+    evaluate_statement,
+    consolidate_proposals,
+    redundant_indexes,
+    analyse_module
+)
+
+
+class TestIndexAdvisor(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = open_scratch_connection()
+        self.conn.executescript("""
+            CREATE TABLE owners (owner_id INTEGER PRIMARY KEY, name TEXT);
+            CREATE TABLE items (
+                item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                owner_id INTEGER NOT NULL REFERENCES owners(owner_id) ON DELETE CASCADE,
+                status TEXT NOT NULL,
+                start_epoch INTEGER NOT NULL
+            );
+            CREATE INDEX idx_items_owner ON items(owner_id);
+        """)
+        self.conn.executemany("INSERT INTO owners (owner_id, name) VALUES (?, ?)", [(i, f'o{i}') for i in range(1, 51)])
+        self.conn.executemany("INSERT INTO items (owner_id, status, start_epoch) VALUES (?, ?, ?)",
+                              [(i % 50 + 1, ('open', 'closed')[i % 2], i * 60) for i in range(5000)])
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_plan_issues_flags_scans_and_temp_sorts_only(self):
+        plan = explain(self.conn, "SELECT * FROM items WHERE owner_id = ? ORDER BY start_epoch", (1,))
+        self.assertEqual(plan_issues(plan), ['USE TEMP B-TREE FOR ORDER BY'])
+        self.assertEqual(plan_issues(explain(self.conn, "SELECT * FROM items WHERE status = 'open'")),
+                         ['SCAN items'])
+        sql = "WITH recent AS (SELECT item_id FROM items WHERE owner_id = 1) SELECT * FROM recent"
+        self.assertFalse([issue for issue in plan_issues(explain(self.conn, sql), sql) if 'recent' in issue])
+        self.assertEqual(plan_issues(explain(self.conn, "SELECT * FROM items WHERE item_id = ?", (1,))), [])
+
+    def test_candidates_put_equality_columns_before_sort_and_offer_partial_variants(self):
+        sql = ("SELECT i.* FROM items i JOIN owners o ON o.owner_id = i.owner_id "
+               "WHERE i.owner_id = ? AND i.status = 'open' ORDER BY i.start_epoch DESC")
+        candidates = propose_candidates(self.conn, sql)
+        self.assertIn("CREATE INDEX advisor_items_owner_id_start_epoch ON items(owner_id, start_epoch)", candidates)
+        self.assertIn("CREATE INDEX advisor_items_owner_id_start_epoch_partial ON items(owner_id, start_epoch) "
+                      "WHERE status = 'open'", candidates)
+        self.assertIn("CREATE INDEX advisor_items_owner_id_status_start_epoch ON items(owner_id, status, start_epoch)",
+                      candidates)
+        # The existing idx_items_owner already has the key (owner_id), and rowid lookups need nothing
+        self.assertFalse([ddl for ddl in candidates if ddl.endswith("ON items(owner_id)")])
+        self.assertEqual(propose_candidates(self.conn, "SELECT * FROM items WHERE item_id = ? ORDER BY start_epoch"), [])
+
+    def test_foreign_key_child_scans_get_a_candidate(self):
+        self.conn.execute("DROP INDEX idx_items_owner")
+        sql = "DELETE FROM owners WHERE owner_id = ?"
+        plan = explain(self.conn, sql, (1,))
+        self.assertIn('SCAN items', plan_issues(plan, sql))
+        self.assertIn("CREATE INDEX advisor_items_owner_id ON items(owner_id)", propose_candidates(self.conn, sql, plan))
+
+    def test_consolidation_prefers_one_index_serving_several_statements(self):
+        results = [
+            evaluate_statement(self.conn, "SELECT * FROM items WHERE owner_id = ? ORDER BY start_epoch", (3,)),
+            evaluate_statement(self.conn, "SELECT * FROM items WHERE owner_id = ? AND status = ? ORDER BY start_epoch",
+                               (3, 'open')),
+        ]
+        self.assertTrue(all(result["candidates"] for result in results))
+        chosen = consolidate_proposals(results)
+        self.assertEqual(chosen, ["CREATE INDEX advisor_items_owner_id_start_epoch ON items(owner_id, start_epoch)"])
+        self.assertTrue(all(result["proposal"]["issues"] == [] for result in results))
+
+    def test_redundant_indexes_reports_prefixes(self):
+        self.assertEqual(redundant_indexes(self.conn), [])
+        self.conn.execute("CREATE INDEX idx_items_owner_start ON items(owner_id, start_epoch)")
+        self.assertEqual(redundant_indexes(self.conn), [('idx_items_owner', 'idx_items_owner_start')])
+
+    def test_shipped_schemas_have_no_flagged_plans_or_redundant_indexes(self):
+        for module in ('appointment', 'prescription'):
+            results, redundant = analyse_module(module, rows=2000)
+            self.assertTrue(results, module)
+            flagged = [(result['sql'], result['issues']) for result in results if result['issues']]
+            self.assertEqual(flagged, [], module)
+            self.assertEqual(redundant, [], module)
+        results, redundant = analyse_module('messaging', rows=2000)
+        self.assertEqual(redundant, [])
+        self.assertFalse([result for result in results if any(issue.startswith('SCAN') for issue in result['issues'])])
+
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)
@@ -16,9 +16,15 @@ from db_utils_appointment import (
     get_appointment_by_id,            # For reminder logic test & general verification
     # We'll use API calls for most actions, but direct DB utils for setup/verification sometimes
     add_provider_availability as db_add_provider_availability,
+    delete_provider_availability as db_delete_provider_availability,
+    is_provider_free as db_is_provider_free,
     request_appointment as db_request_appointment,
+    get_bookable_slots as db_get_bookable_slots,
     update_appointment_status as db_update_appointment_status
 )
+from db_connection_pool import close_pool # Pooled connections must be released before the DB file is removed
+from slot_holds import reset_hold_registries
+from time_utils import epoch_to_datetime_string # The in-memory hold mirror must not outlive the rows it mirrors
 
 TEST_DB_NAME = 'test_appointment_integration.db'
 
@@ -34,6 +40,8 @@ class TestIntegrationAppointment(unittest.TestCase):
         cls.original_db_name = appointment_api.DB_NAME
         appointment_api.DB_NAME = TEST_DB_NAME
 
+        close_pool(TEST_DB_NAME)
+        reset_hold_registries()
         if os.path.exists(TEST_DB_NAME):
             os.remove(TEST_DB_NAME)
 
@@ -72,6 +80,7 @@ class TestIntegrationAppointment(unittest.TestCase):
 
     @classmethod
     def tearDownClass(cls):
+        close_pool(TEST_DB_NAME)
         if os.path.exists(TEST_DB_NAME):
             os.remove(TEST_DB_NAME)
         if cls.original_db_name:
@@ -88,8 +97,11 @@ class TestIntegrationAppointment(unittest.TestCase):
         cursor = self.db_conn.cursor()
         cursor.execute("DELETE FROM appointments;")
         cursor.execute("DELETE FROM provider_availability;")
+        cursor.execute("DELETE FROM appointment_holds;")
+        cursor.execute("DELETE FROM provider_day_bitmaps;")
         self.db_conn.commit()
         self.db_conn.close()
+        reset_hold_registries()
 
     # Helper to reduce boilerplate for POST
     def _post_json(self, endpoint, payload):
@@ -244,6 +256,272 @@ class TestIntegrationAppointment(unittest.TestCase):
         response_unauth_delete = self._delete_json(f'/api/providers/availability/{avail_id_p1}', delete_payload_p2)
         self.assertEqual(response_unauth_delete.status_code, 404) # API returns 404 if not found for that provider
 
+    def test_date_filters_are_inclusive_half_open_ranges_on_epoch_index(self):
+        print("\nRunning: test_date_filters_are_inclusive_half_open_ranges_on_epoch_index")
+        start_times = ['2024-04-30 23:59:59', '2024-05-01 00:00:00', '2024-05-01 23:59:59', '2024-05-02 00:00:00']
+        db_add_provider_availability(self.db_conn, self.provider1_id, "2024-04-30 23:00:00", "2024-05-02 01:00:00")
+        appt_ids = []
+        for start in start_times:
+            end = (datetime.strptime(start, '%Y-%m-%d %H:%M:%S') + timedelta(seconds=1)).strftime('%Y-%m-%d %H:%M:%S')
+            appt_ids.append(db_request_appointment(self.db_conn, self.patient1_id, self.provider1_id, start, end, "Range"))
+
+        response = self.client.get(f'/api/patients/{self.patient1_id}/appointments?date_from=2024-05-01&date_to=2024-05-01')
+        self.assertEqual(response.status_code, 200)
+        returned_ids = [a['appointment_id'] for a in json.loads(response.data.decode())['appointments']]
+        self.assertEqual(returned_ids, appt_ids[1:3]) # Both ends of 2024-05-01, in start-time order
+
+        response = self.client.get(f'/api/providers/{self.provider1_id}/appointments?date_from=2024-05-02')
+        returned_ids = [a['appointment_id'] for a in json.loads(response.data.decode())['appointments']]
+        self.assertEqual(returned_ids, appt_ids[3:])
+
+        response = self.client.get(f'/api/patients/{self.patient1_id}/appointments?date_from=2024-5-1')
+        self.assertEqual(response.status_code, 400)
+
+        plan = ' '.join(row['detail'] for row in self.db_conn.execute(
+            "EXPLAIN QUERY PLAN SELECT appointment_id FROM appointments "
+            "WHERE appointment_start_epoch >= ? AND appointment_start_epoch < ?", (0, 1)))
+        self.assertIn('idx_appt_start_epoch', plan)
+
+    def test_slots_expand_recurring_availability_and_skip_booked_time(self):
+        print("\nRunning: test_slots_expand_recurring_availability_and_skip_booked_time")
+        # Mondays 09:00-11:00, starting on a Monday a few weeks from now
+        today = datetime.now().date()
+        first_monday = today + timedelta(days=21 - today.weekday())
+        second_monday = first_monday + timedelta(days=7)
+        db_add_provider_availability(self.db_conn, self.provider1_id, f"{first_monday} 09:00:00",
+                                     f"{first_monday} 11:00:00", "FREQ=WEEKLY;BYDAY=MO")
+        booked_id = db_request_appointment(self.db_conn, self.patient1_id, self.provider1_id,
+                                           f"{second_monday} 09:30:00", f"{second_monday} 10:00:00", "Booked")
+        cancelled_id = db_request_appointment(self.db_conn, self.patient2_id, self.provider1_id,
+                                              f"{second_monday} 10:30:00", f"{second_monday} 11:00:00", "Cancelled")
+        db_update_appointment_status(self.db_conn, cancelled_id, 'cancelled_by_patient', self.patient2_id, 'patient')
+
+        response = self.client.get(f'/api/providers/{self.provider1_id}/slots?date_from={first_monday}'
+                                   f'&date_to={second_monday}&duration_minutes=30')
+        self.assertEqual(response.status_code, 200)
+        slots = [slot['start_time'] for slot in json.loads(response.data.decode())['slots']]
+        self.assertEqual(slots, [f"{first_monday} 09:00:00", f"{first_monday} 09:30:00", f"{first_monday} 10:00:00",
+                                 f"{first_monday} 10:30:00", f"{second_monday} 09:00:00", f"{second_monday} 10:00:00",
+                                 f"{second_monday} 10:30:00"])
+
+        # Cancelling the booked appointment frees its slot again; a 60-minute step yields hourly slots
+        db_update_appointment_status(self.db_conn, booked_id, 'cancelled_by_patient', self.patient1_id, 'patient')
+        response = self.client.get(f'/api/providers/{self.provider1_id}/slots?date_from={second_monday}'
+                                   f'&date_to={second_monday}&duration_minutes=45&step_minutes=60')
+        slots = json.loads(response.data.decode())['slots']
+        self.assertEqual(slots, [{"start_time": f"{second_monday} 09:00:00", "end_time": f"{second_monday} 09:45:00"},
+                                 {"start_time": f"{second_monday} 10:00:00", "end_time": f"{second_monday} 10:45:00"}])
+
+        # Too long a range, a missing duration and an unsupported rule are rejected
+        far = first_monday + timedelta(days=120)
+        response = self.client.get(f'/api/providers/{self.provider1_id}/slots?date_from={first_monday}'
+                                   f'&date_to={far}&duration_minutes=30')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(f'/api/providers/{self.provider1_id}/slots?date_from={first_monday}&date_to={far}')
+        self.assertEqual(response.status_code, 400)
+        response = self._post_json(f'/api/providers/{self.provider1_id}/availability',
+                                   {"start_datetime": f"{first_monday} 13:00:00", "end_datetime": f"{first_monday} 14:00:00",
+                                    "recurring_rule": "FREQ=MONTHLY;BYMONTHDAY=1"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_first_available_across_providers(self):
+        print("\nRunning: test_first_available_across_providers")
+        day = datetime.now().date() + timedelta(days=14)
+        next_day = day + timedelta(days=1)
+        # Provider 1 works 09:00-10:00 every day from `day`; provider 2 works 09:30-11:00 on `day` only
+        db_add_provider_availability(self.db_conn, self.provider1_id, f"{day} 09:00:00", f"{day} 10:00:00",
+                                     "FREQ=DAILY")
+        db_add_provider_availability(self.db_conn, self.provider2_id, f"{day} 09:30:00", f"{day} 11:00:00")
+        db_request_appointment(self.db_conn, self.patient1_id, self.provider1_id,
+                               f"{day} 09:00:00", f"{day} 09:30:00", "Booked")
+
+        def search(provider_ids, limit, date_to=day):
+            return self.client.get(f'/api/providers/first-available?provider_ids={provider_ids}&date_from={day}'
+                                   f'&date_to={date_to}&duration_minutes=30&limit={limit}')
+
+        response = search(f"{self.provider1_id},{self.provider2_id}", 4)
+        self.assertEqual(response.status_code, 200)
+        slots = [(slot['provider_id'], slot['start_time'][11:]) for slot in json.loads(response.data.decode())['slots']]
+        self.assertEqual(slots, [(self.provider1_id, "09:30:00"), (self.provider2_id, "09:30:00"),
+                                 (self.provider2_id, "10:00:00"), (self.provider2_id, "10:30:00")])
+        # The search spans days, and a provider with no free time simply has no slots
+        response = search(f"{self.provider2_id},{self.patient1_id}", 5, next_day)
+        self.assertEqual(len(json.loads(response.data.decode())['slots']), 3)
+        response = search(f"{self.provider1_id}", 5, next_day)
+        self.assertEqual([slot['start_time'] for slot in json.loads(response.data.decode())['slots']],
+                         [f"{day} 09:30:00", f"{next_day} 09:00:00", f"{next_day} 09:30:00"])
+
+        self.assertEqual(search("1,x", 4).status_code, 400)
+        self.assertEqual(search(f"{self.provider1_id}", 0).status_code, 400)
+        self.assertEqual(search(",".join(str(i) for i in range(1, appointment_api.MAX_SEARCH_PROVIDERS + 2)), 4).status_code,
+                         400)
+
+    def test_overlapping_and_unavailable_requests_are_rejected(self):
+        print("\nRunning: test_overlapping_and_unavailable_requests_are_rejected")
+        db_add_provider_availability(self.db_conn, self.provider1_id, "2024-09-02 09:00:00",
+                                     "2024-09-02 12:00:00", "FREQ=WEEKLY;BYDAY=MO")
+        db_add_provider_availability(self.db_conn, self.provider1_id, "2024-09-09 12:00:00", "2024-09-09 13:00:00")
+
+        def request(patient_id, start, end):
+            return self._post_json('/api/appointments/request', {
+                "patient_id": patient_id, "provider_id": self.provider1_id,
+                "appointment_start_time": start, "appointment_end_time": end})
+
+        first = request(self.patient1_id, "2024-09-09 10:00:00", "2024-09-09 10:30:00")
+        self.assertEqual(first.status_code, 201)
+        first_id = json.loads(first.data.decode())['appointment_id']
+        # Overlaps on either side, or fully inside, conflict; touching intervals do not
+        for start, end in (("2024-09-09 09:45:00", "2024-09-09 10:15:00"), ("2024-09-09 10:15:00", "2024-09-09 10:45:00"),
+                           ("2024-09-09 10:10:00", "2024-09-09 10:20:00")):
+            self.assertEqual(request(self.patient2_id, start, end).status_code, 409, start)
+        self.assertEqual(request(self.patient2_id, "2024-09-09 10:30:00", "2024-09-09 11:00:00").status_code, 201)
+        # Outside availability (a Tuesday), or only partly inside it, is refused
+        self.assertEqual(request(self.patient2_id, "2024-09-10 10:00:00", "2024-09-10 10:30:00").status_code, 400)
+        self.assertEqual(request(self.patient2_id, "2024-09-09 08:45:00", "2024-09-09 09:15:00").status_code, 400)
+        # Adjacent recurring and one-off blocks merge, so a request may span them
+        self.assertEqual(request(self.patient2_id, "2024-09-09 11:45:00", "2024-09-09 12:15:00").status_code, 201)
+
+        # A cancelled appointment frees its time; re-confirming it once the time is rebooked conflicts
+        db_update_appointment_status(self.db_conn, first_id, 'cancelled_by_patient', self.patient1_id, 'patient')
+        self.assertEqual(request(self.patient2_id, "2024-09-09 10:00:00", "2024-09-09 10:30:00").status_code, 201)
+        response = self._put_json(f'/api/appointments/{first_id}/confirm', {"provider_id": self.provider1_id})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(get_appointment_by_id(self.db_conn, first_id)['status'], 'cancelled_by_patient')
+
+        # The overlap check is a bounded range seek on the provider's start-time index
+        trigger_sql = self.db_conn.execute(
+            "SELECT sql FROM sqlite_master WHERE name = 'trg_appointments_no_overlap_insert'").fetchone()['sql']
+        check = trigger_sql[trigger_sql.index('SELECT 1'):trigger_sql.rindex(')')]
+        for column in ('appointment_start_time', 'appointment_end_time', 'provider_id', 'appointment_id'):
+            check = check.replace(f'NEW.{column}', '?')
+        plan = ' '.join(row['detail'] for row in self.db_conn.execute(
+            "EXPLAIN QUERY PLAN " + check, (self.provider1_id, '2024-09-09 10:00:00', '2024-09-09 10:30:00',
+                                            '2024-09-09 10:00:00', 0)))
+        self.assertIn('idx_appt_provider_start_epoch (provider_id=? AND appointment_start_epoch>? AND appointment_start_epoch<?)', plan)
+
+    def test_slot_hold_blocks_other_patients_until_booked_or_released(self):
+        print("\nRunning: test_slot_hold_blocks_other_patients_until_booked_or_released")
+        db_add_provider_availability(self.db_conn, self.provider1_id, "2024-09-09 09:00:00", "2024-09-09 11:00:00")
+        slot = {"provider_id": self.provider1_id,
+                "appointment_start_time": "2024-09-09 09:30:00", "appointment_end_time": "2024-09-09 10:00:00"}
+
+        response = self._post_json('/api/appointments/holds', dict(slot, patient_id=self.patient1_id))
+        self.assertEqual(response.status_code, 201)
+        hold = json.loads(response.data.decode())['hold']
+        self.assertEqual((hold['start_time'], hold['end_time']), ("2024-09-09 09:30:00", "2024-09-09 10:00:00"))
+
+        # Held time is missing from the slots and refused to another patient
+        slots = db_get_bookable_slots(self.db_conn, self.provider1_id, "2024-09-09 00:00:00", "2024-09-10 00:00:00", 30)
+        self.assertEqual([slot_['start_time'] for slot_ in slots],
+                         ["2024-09-09 09:00:00", "2024-09-09 10:00:00", "2024-09-09 10:30:00"])
+        overlapping = dict(slot, patient_id=self.patient2_id, appointment_start_time="2024-09-09 09:45:00",
+                           appointment_end_time="2024-09-09 10:15:00")
+        self.assertEqual(self._post_json('/api/appointments/request', overlapping).status_code, 409)
+        self.assertEqual(self._post_json('/api/appointments/holds', overlapping).status_code, 409)
+        # ...and the refusal also holds when the in-memory registry is rebuilt from the table
+        reset_hold_registries()
+        self.assertEqual(self._post_json('/api/appointments/request', overlapping).status_code, 409)
+
+        # The holder books with the hold, which consumes it; a bogus hold_id is refused
+        bogus = dict(slot, patient_id=self.patient1_id, hold_id="not-a-hold")
+        self.assertEqual(self._post_json('/api/appointments/request', bogus).status_code, 400)
+        response = self._post_json('/api/appointments/request', dict(bogus, hold_id=hold['hold_id']))
+        self.assertEqual(response.status_code, 201)
+        count = self.db_conn.execute("SELECT COUNT(*) FROM appointment_holds").fetchone()[0]
+        self.assertEqual(count, 0)
+
+        # A new hold replaces the patient's previous one; releasing frees the time for others
+        later = dict(slot, patient_id=self.patient2_id, appointment_start_time="2024-09-09 10:00:00",
+                     appointment_end_time="2024-09-09 10:30:00")
+        first = json.loads(self._post_json('/api/appointments/holds', later).data.decode())['hold']
+        second = json.loads(self._post_json('/api/appointments/holds', dict(
+            later, appointment_start_time="2024-09-09 10:30:00", appointment_end_time="2024-09-09 11:00:00"
+        )).data.decode())['hold']
+        self.assertEqual(self._post_json('/api/appointments/holds', dict(later, patient_id=self.patient1_id)).status_code, 201)
+        self.assertEqual(self.client.delete(f"/api/appointments/holds/{first['hold_id']}",
+                                            json={"patient_id": self.patient2_id}).status_code, 404)
+        self.assertEqual(self.client.delete(f"/api/appointments/holds/{second['hold_id']}",
+                                            json={"patient_id": self.patient1_id}).status_code, 404)
+        self.assertEqual(self.client.delete(f"/api/appointments/holds/{second['hold_id']}",
+                                            json={"patient_id": self.patient2_id}).status_code, 200)
+        taken = dict(slot, patient_id=self.patient1_id, appointment_start_time="2024-09-09 10:30:00",
+                     appointment_end_time="2024-09-09 11:00:00")
+        self.assertEqual(self._post_json('/api/appointments/request', taken).status_code, 201)
+
+        # Holds on booked time, outside availability, or with a bad TTL are refused
+        self.assertEqual(self._post_json('/api/appointments/holds', dict(slot, patient_id=self.patient2_id)).status_code, 409)
+        self.assertEqual(self._post_json('/api/appointments/holds', dict(
+            slot, patient_id=self.patient2_id, appointment_start_time="2024-09-09 11:00:00",
+            appointment_end_time="2024-09-09 11:30:00")).status_code, 400)
+        self.assertEqual(self._post_json('/api/appointments/holds', dict(
+            later, ttl_seconds=0)).status_code, 400)
+
+        # A hold released by another process (only the table changes) no longer blocks anyone here
+        early = dict(slot, patient_id=self.patient1_id, appointment_start_time="2024-09-09 09:00:00",
+                     appointment_end_time="2024-09-09 09:30:00")
+        elsewhere = json.loads(self._post_json('/api/appointments/holds', early).data.decode())['hold']
+        self.db_conn.execute("DELETE FROM appointment_holds WHERE hold_id = ?", (elsewhere['hold_id'],))
+        self.db_conn.commit()
+        self.assertEqual(self._post_json('/api/appointments/request', dict(early, patient_id=self.patient2_id)).status_code, 201)
+
+    def test_free_busy_bitmaps_follow_availability_and_appointment_changes(self):
+        print("\nRunning: test_free_busy_bitmaps_follow_availability_and_appointment_changes")
+        monday, tuesday = "2024-09-09", "2024-09-10"
+
+        def free(day, start, end):
+            return db_is_provider_free(self.db_conn, self.provider1_id, f"{day} {start}", f"{day} {end}")
+
+        def rebuilt():
+            # Bitmaps kept up to date incrementally must match ones built from scratch
+            rows = self.db_conn.execute("SELECT * FROM provider_day_bitmaps ORDER BY day_epoch").fetchall()
+            self.db_conn.execute("DELETE FROM provider_day_bitmaps")
+            self.db_conn.commit()
+            for row in rows:
+                free(epoch_to_datetime_string(row['day_epoch'])[:10], "00:00:00", "00:05:00")
+            return [tuple(row) for row in rows] == [tuple(row) for row in self.db_conn.execute(
+                "SELECT * FROM provider_day_bitmaps ORDER BY day_epoch").fetchall()]
+
+        self.assertFalse(free(monday, "09:00:00", "09:30:00"))
+        weekly_id = db_add_provider_availability(self.db_conn, self.provider1_id, f"{monday} 09:00:00",
+                                                 f"{monday} 12:00:00", "FREQ=WEEKLY;BYDAY=MO,TU")
+        self.assertTrue(free(monday, "09:00:00", "09:30:00"))
+        self.assertTrue(free(tuesday, "11:00:00", "12:00:00"))
+        self.assertFalse(free(tuesday, "11:30:00", "12:05:00"))
+
+        booked_id = db_request_appointment(self.db_conn, self.patient1_id, self.provider1_id,
+                                           f"{monday} 10:00:00", f"{monday} 10:30:00", "Booked")
+        self.assertFalse(free(monday, "10:15:00", "10:45:00"))
+        self.assertTrue(free(monday, "10:30:00", "11:00:00"))
+        self.assertTrue(rebuilt())
+
+        # Cancelling frees the time and confirming takes it again; deleting availability removes it
+        db_update_appointment_status(self.db_conn, booked_id, 'cancelled_by_patient', self.patient1_id, 'patient')
+        self.assertTrue(free(monday, "10:00:00", "10:30:00"))
+        db_update_appointment_status(self.db_conn, booked_id, 'confirmed', self.provider1_id, 'provider')
+        self.assertFalse(free(monday, "10:00:00", "10:30:00"))
+        db_update_appointment_status(self.db_conn, booked_id, 'cancelled_by_provider', self.provider1_id, 'provider')
+        db_add_provider_availability(self.db_conn, self.provider1_id, f"{monday} 12:00:00", f"{monday} 13:00:00")
+        self.assertTrue(free(monday, "11:30:00", "12:30:00"))  # Adjoining blocks merge
+        self.assertTrue(db_delete_provider_availability(self.db_conn, weekly_id, self.provider1_id))
+        self.assertFalse(free(tuesday, "09:00:00", "09:30:00"))
+        self.assertTrue(free(monday, "12:00:00", "13:00:00"))
+        self.assertTrue(rebuilt())
+
+        # Inside the caller's transaction a missing day is built but neither stored nor committed
+        self.db_conn.execute("DELETE FROM provider_day_bitmaps")
+        self.assertTrue(self.db_conn.in_transaction)
+        self.assertTrue(free(monday, "12:00:00", "13:00:00"))
+        self.assertTrue(self.db_conn.in_transaction)
+        self.assertEqual(self.db_conn.execute("SELECT COUNT(*) FROM provider_day_bitmaps").fetchone()[0], 0)
+        self.db_conn.rollback()
+
+        response = self.client.get(f'/api/providers/{self.provider1_id}/free'
+                                   f'?start_time={monday} 12:00:00&end_time={monday} 12:30:00')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(json.loads(response.data.decode())['free'])
+        response = self.client.get(f'/api/providers/{self.provider1_id}/free?start_time={monday} 12:00:00')
+        self.assertEqual(response.status_code, 400)
+
     def test_get_appointments_needing_reminders_logic(self):
         print("\nRunning: test_get_appointments_needing_reminders_logic")
         now = datetime.now(timezone.utc) # Use timezone aware datetime
@@ -252,31 +530,34 @@ class TestIntegrationAppointment(unittest.TestCase):
         def dt_str(dt_obj):
             return dt_obj.strftime('%Y-%m-%d %H:%M:%S')
 
+        # Short, non-overlapping appointments inside one availability block
+        db_add_provider_availability(self.db_conn, self.provider1_id, dt_str(now), dt_str(now + timedelta(hours=25)))
+
         # Scenario 1: Appointment needs reminder (in window, not reminded)
         start1 = now + timedelta(hours=23, minutes=30)
-        appt1_id = db_request_appointment(self.db_conn, self.patient1_id, self.provider1_id, dt_str(start1), dt_str(start1 + timedelta(minutes=30)), "Reminder Test 1")
+        appt1_id = db_request_appointment(self.db_conn, self.patient1_id, self.provider1_id, dt_str(start1), dt_str(start1 + timedelta(minutes=5)), "Reminder Test 1")
         db_update_appointment_status(self.db_conn, appt1_id, 'confirmed', self.provider1_id, 'provider')
 
         # Scenario 2: Appointment needs reminder (in window, reminded long ago)
         start2 = now + timedelta(hours=23, minutes=40)
-        appt2_id = db_request_appointment(self.db_conn, self.patient2_id, self.provider1_id, dt_str(start2), dt_str(start2 + timedelta(minutes=30)), "Reminder Test 2")
+        appt2_id = db_request_appointment(self.db_conn, self.patient2_id, self.provider1_id, dt_str(start2), dt_str(start2 + timedelta(minutes=5)), "Reminder Test 2")
         db_update_appointment_status(self.db_conn, appt2_id, 'confirmed', self.provider1_id, 'provider')
         mark_reminder_sent(self.db_conn, appt2_id, dt_str(now - timedelta(hours=5))) # Reminded 5 hours ago
 
         # Scenario 3: Appointment does NOT need reminder (in window, but reminded recently)
         start3 = now + timedelta(hours=23, minutes=50)
-        appt3_id = db_request_appointment(self.db_conn, self.patient1_id, self.provider1_id, dt_str(start3), dt_str(start3 + timedelta(minutes=30)), "Reminder Test 3")
+        appt3_id = db_request_appointment(self.db_conn, self.patient1_id, self.provider1_id, dt_str(start3), dt_str(start3 + timedelta(minutes=5)), "Reminder Test 3")
         db_update_appointment_status(self.db_conn, appt3_id, 'confirmed', self.provider1_id, 'provider')
         mark_reminder_sent(self.db_conn, appt3_id, dt_str(now - timedelta(minutes=30))) # Reminded 30 mins ago
 
         # Scenario 4: Appointment outside window (starts too soon)
         start4 = now + timedelta(hours=1)
-        appt4_id = db_request_appointment(self.db_conn, self.patient2_id, self.provider1_id, dt_str(start4), dt_str(start4 + timedelta(minutes=30)), "Reminder Test 4")
+        appt4_id = db_request_appointment(self.db_conn, self.patient2_id, self.provider1_id, dt_str(start4), dt_str(start4 + timedelta(minutes=5)), "Reminder Test 4")
         db_update_appointment_status(self.db_conn, appt4_id, 'confirmed', self.provider1_id, 'provider')
 
         # Scenario 5: Appointment not confirmed
         start5 = now + timedelta(hours=23, minutes=55)
-        appt5_id = db_request_appointment(self.db_conn, self.patient1_id, self.provider1_id, dt_str(start5), dt_str(start5 + timedelta(minutes=30)), "Reminder Test 5")
+        appt5_id = db_request_appointment(self.db_conn, self.patient1_id, self.provider1_id, dt_str(start5), dt_str(start5 + timedelta(minutes=5)), "Reminder Test 5")
         # Status is 'pending_provider_confirmation' by default
 
         # Define reminder window (e.g., appointments starting between 23 and 24 hours from now)
@@ -3,11 +3,13 @@ import json
 import os
 import sqlite3
 import time # To add slight delays if needed for timestamp differentiation
+import threading
 
 # Import the Flask app and db utils from the main application files
 from messaging_api import app, DB_NAME as APP_DB_NAME # Import app and its original DB_NAME
 import messaging_api # To allow modifying DB_NAME used by the app
-from db_utils_messaging import get_db_connection, initialize_schema # For setup
+from db_utils_messaging import get_db_connection, initialize_schema, rebuild_user_conversations, send_direct_message, find_or_create_conversation, MessageWriteQueue, MAX_MESSAGE_PAGE_SIZE # For setup
+from db_connection_pool import close_pool # Pooled connections must be released before the DB file is removed
 
 TEST_DB_NAME = 'test_messaging_integration.db'
 
@@ -26,6 +28,7 @@ class TestIntegrationMessaging(unittest.TestCase):
         messaging_api.DB_NAME = TEST_DB_NAME      # Point app to test DB
 
         # Ensure no old test DB exists
+        close_pool(TEST_DB_NAME)
         if os.path.exists(TEST_DB_NAME):
             os.remove(TEST_DB_NAME)
 
@@ -67,6 +70,7 @@ class TestIntegrationMessaging(unittest.TestCase):
         - Restores the app's original DB_NAME.
         - Removes the test database file.
         """
+        close_pool(TEST_DB_NAME)
         if os.path.exists(TEST_DB_NAME):
             os.remove(TEST_DB_NAME)
             print(f"tearDownClass: Removed test database {TEST_DB_NAME}")
@@ -194,6 +198,402 @@ class TestIntegrationMessaging(unittest.TestCase):
         self.assertEqual(response_data['status'], 'error')
         self.assertEqual(response_data['message'], 'Conversation not found')
 
+    def _create_user(self, username):
+        """Helper to create a dedicated user so a test's conversation is isolated from other tests."""
+        conn = get_db_connection(TEST_DB_NAME)
+        try:
+            cursor = conn.cursor()
+            cursor.execute("INSERT INTO users (username) VALUES (?)", (username,))
+            conn.commit()
+            return cursor.lastrowid
+        finally:
+            conn.close()
+
+    def test_get_messages_keyset_pagination(self):
+        """Test paging through a conversation with limit, before_id/after_id cursors and order."""
+        sender_id = self._create_user('paging_user_a')
+        receiver_id = self._create_user('paging_user_b')
+        message_ids = []
+        for i in range(5):
+            response = self._post_message(sender_id, receiver_id, f'Paged message {i}')
+            self.assertEqual(response.status_code, 201)
+            data = json.loads(response.data.decode())
+            message_ids.append(data['message_id'])
+            conversation_id = data['conversation_id']
+        base_url = f'/api/conversations/{conversation_id}/messages?user_id={sender_id}'
+
+        # Without a cursor: the newest page, in chronological order; has_more means older messages exist
+        data = json.loads(self.client.get(f'{base_url}&limit=2').data.decode())
+        self.assertEqual([m['message_id'] for m in data['messages']], message_ids[3:])
+        self.assertTrue(data['paging']['has_more'])
+        self.assertEqual(data['paging']['before_cursor'], message_ids[3])
+        data = json.loads(self.client.get(f"{base_url}&limit=2&before_id={data['paging']['before_cursor']}").data.decode())
+        self.assertEqual([m['message_id'] for m in data['messages']], message_ids[1:3])
+
+        # after_id=0 starts from the oldest message
+        data = json.loads(self.client.get(f'{base_url}&limit=2&after_id=0').data.decode())
+        self.assertEqual([m['message_id'] for m in data['messages']], message_ids[:2])
+        self.assertTrue(data['paging']['has_more'])
+        self.assertEqual(data['paging']['after_cursor'], message_ids[1])
+
+        # Follow the after cursor to the next page
+        data = json.loads(self.client.get(f"{base_url}&limit=2&after_id={data['paging']['after_cursor']}").data.decode())
+        self.assertEqual([m['message_id'] for m in data['messages']], message_ids[2:4])
+        self.assertTrue(data['paging']['has_more'])
+
+        # Newest page, newest first
+        data = json.loads(self.client.get(f'{base_url}&limit=2&order=desc').data.decode())
+        self.assertEqual([m['message_id'] for m in data['messages']], [message_ids[4], message_ids[3]])
+        self.assertEqual(data['paging']['before_cursor'], message_ids[3])
+
+        # Scroll back from the before cursor; the last page reports has_more = False
+        data = json.loads(self.client.get(f"{base_url}&limit=3&order=desc&before_id={data['paging']['before_cursor']}").data.decode())
+        self.assertEqual([m['message_id'] for m in data['messages']], [message_ids[2], message_ids[1], message_ids[0]])
+        self.assertFalse(data['paging']['has_more'])
+
+        # Invalid paging parameters are rejected
+        self.assertEqual(self.client.get(f'{base_url}&limit=0').status_code, 400)
+        self.assertEqual(self.client.get(f'{base_url}&before_id=abc').status_code, 400)
+        self.assertEqual(self.client.get(f'{base_url}&order=sideways').status_code, 400)
+
+    def test_get_conversations_inbox_pagination(self):
+        """Test that the inbox is ordered by latest message, paginates, and tracks previews and unread counts."""
+        owner_id = self._create_user('inbox_owner')
+        peer_ids = [self._create_user(f'inbox_peer_{i}') for i in range(3)]
+        for peer_id in peer_ids:
+            self.assertEqual(self._post_message(peer_id, owner_id, f'Hi from {peer_id}').status_code, 201)
+        # Reply in the first conversation so it becomes the most recent one
+        self.assertEqual(self._post_message(owner_id, peer_ids[0], 'x' * 300).status_code, 201)
+
+        data = json.loads(self.client.get(f'/api/conversations?user_id={owner_id}&limit=2').data.decode())
+        self.assertEqual([c['other_participant_id'] for c in data['conversations']], [peer_ids[0], peer_ids[2]])
+        self.assertTrue(data['paging']['has_more'])
+        latest = data['conversations'][0]
+        self.assertEqual(latest['last_message_content'], 'x' * 100) # Preview is truncated
+        self.assertEqual(latest['unread_count'], 1) # Owner's own reply does not count as unread
+
+        data = json.loads(self.client.get(
+            f"/api/conversations?user_id={owner_id}&limit=2&before_id={data['paging']['next_cursor']}").data.decode())
+        self.assertEqual([c['other_participant_id'] for c in data['conversations']], [peer_ids[1]])
+        self.assertFalse(data['paging']['has_more'])
+
+        # The peer's inbox row reflects the owner's reply as unread
+        data = json.loads(self.client.get(f'/api/conversations?user_id={peer_ids[0]}').data.decode())
+        self.assertEqual(data['conversations'][0]['unread_count'], 1)
+        self.assertEqual(data['conversations'][0]['other_participant_username'], 'inbox_owner')
+
+        self.assertEqual(self.client.get(f'/api/conversations?user_id={owner_id}&limit=500').status_code, 400)
+
+    def test_get_conversations_includes_conversations_without_messages(self):
+        """Conversations with no messages yet are listed after the active ones and page by conversation_id."""
+        owner_id = self._create_user('empty_inbox_owner')
+        active_peer_id = self._create_user('empty_inbox_active_peer')
+        empty_peer_ids = [self._create_user(f'empty_inbox_peer_{i}') for i in range(3)]
+        conn = get_db_connection(TEST_DB_NAME)
+        try:
+            empty_conversation_ids = [find_or_create_conversation(conn, owner_id, peer_id) for peer_id in empty_peer_ids]
+        finally:
+            conn.close()
+        self.assertEqual(self._post_message(active_peer_id, owner_id, 'Hello').status_code, 201)
+
+        seen, cursor = [], ''
+        while True:
+            data = json.loads(self.client.get(f'/api/conversations?user_id={owner_id}&limit=2{cursor}').data.decode())
+            seen.extend(data['conversations'])
+            if not data['paging']['has_more']:
+                break
+            cursor = (f"&before_id={data['paging']['next_cursor']}"
+                      f"&before_conversation_id={data['paging']['next_conversation_cursor']}")
+        self.assertEqual([c['other_participant_id'] for c in seen], [active_peer_id] + empty_peer_ids[::-1])
+        self.assertEqual([c['conversation_id'] for c in seen[1:]], empty_conversation_ids[::-1])
+        self.assertEqual((seen[-1]['last_message_id'], seen[-1]['last_message_content'], seen[-1]['unread_count']),
+                         (0, '', 0))
+
+        # The peer sees the conversation too, and rebuilding the inbox keeps it
+        data = json.loads(self.client.get(f'/api/conversations?user_id={empty_peer_ids[0]}').data.decode())
+        self.assertEqual([c['conversation_id'] for c in data['conversations']], [empty_conversation_ids[0]])
+        conn = get_db_connection(TEST_DB_NAME)
+        try:
+            rebuild_user_conversations(conn)
+        finally:
+            conn.close()
+        data = json.loads(self.client.get(f'/api/conversations?user_id={owner_id}').data.decode())
+        self.assertEqual([c['conversation_id'] for c in data['conversations'][1:]], empty_conversation_ids[::-1])
+
+        self.assertEqual(self.client.get(f'/api/conversations?user_id={owner_id}&before_conversation_id=1').status_code, 400)
+
+    def test_rebuild_user_conversations_matches_incremental_inbox(self):
+        """Rebuilding the inbox from messages must produce the same rows create_message maintained."""
+        conn = get_db_connection(TEST_DB_NAME)
+        try:
+            before = [tuple(r) for r in conn.execute(
+                "SELECT * FROM user_conversations ORDER BY user_id, conversation_id").fetchall()]
+            rebuild_user_conversations(conn)
+            after = [tuple(r) for r in conn.execute(
+                "SELECT * FROM user_conversations ORDER BY user_id, conversation_id").fetchall()]
+        finally:
+            conn.close()
+        self.assertEqual(before, after)
+
+    def test_mark_read_moves_cursor_and_updates_unread_counts(self):
+        """Test read cursors: partial and full mark-read, no backwards moves, and badge totals."""
+        reader_id = self._create_user('read_cursor_reader')
+        writer_id = self._create_user('read_cursor_writer')
+        message_ids = []
+        for i in range(4):
+            data = json.loads(self._post_message(writer_id, reader_id, f'Unread {i}').data.decode())
+            message_ids.append(data['message_id'])
+        conversation_id = data['conversation_id']
+        self._post_message(reader_id, writer_id, 'Own reply') # Never unread for its sender
+
+        summary = json.loads(self.client.get(f'/api/conversations/unread_count?user_id={reader_id}').data.decode())
+        self.assertEqual(summary['total_unread'], 4)
+        self.assertEqual(summary['conversations_with_unread'], 1)
+
+        # Partial read up to the second message
+        response = self.client.post(f'/api/conversations/{conversation_id}/read',
+                                    json={'user_id': reader_id, 'message_id': message_ids[1]})
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data.decode())
+        self.assertEqual(data['last_read_message_id'], message_ids[1])
+        self.assertEqual(data['unread_count'], 2)
+
+        # Moving the cursor backwards is a no-op
+        data = json.loads(self.client.post(f'/api/conversations/{conversation_id}/read',
+                                           json={'user_id': reader_id, 'message_id': message_ids[0]}).data.decode())
+        self.assertEqual(data['last_read_message_id'], message_ids[1])
+        self.assertEqual(data['unread_count'], 2)
+
+        # Without message_id the whole conversation is read
+        data = json.loads(self.client.post(f'/api/conversations/{conversation_id}/read',
+                                           json={'user_id': reader_id}).data.decode())
+        self.assertEqual(data['unread_count'], 0)
+        summary = json.loads(self.client.get(f'/api/conversations/unread_count?user_id={reader_id}').data.decode())
+        self.assertEqual(summary['total_unread'], 0)
+
+        # New messages after the cursor are counted again
+        self._post_message(writer_id, reader_id, 'One more')
+        inbox = json.loads(self.client.get(f'/api/conversations?user_id={reader_id}').data.decode())
+        self.assertEqual(inbox['conversations'][0]['unread_count'], 1)
+
+        # Authorization and validation
+        outsider_id = self._create_user('read_cursor_outsider')
+        self.assertEqual(self.client.post(f'/api/conversations/{conversation_id}/read',
+                                          json={'user_id': outsider_id}).status_code, 403)
+        self.assertEqual(self.client.post('/api/conversations/99999/read',
+                                          json={'user_id': reader_id}).status_code, 404)
+        self.assertEqual(self.client.post(f'/api/conversations/{conversation_id}/read',
+                                          json={'user_id': 'abc'}).status_code, 400)
+
+    def test_send_direct_message_is_atomic(self):
+        """A failed send must not leave behind a conversation, and a successful one bumps updated_at."""
+        sender_id = self._create_user('atomic_sender')
+        conn = get_db_connection(TEST_DB_NAME)
+        try:
+            with self.assertRaises(sqlite3.IntegrityError):
+                send_direct_message(conn, sender_id, 99999, 'To nobody')
+            orphan = conn.execute(
+                "SELECT COUNT(*) FROM conversations WHERE participant1_id = ? OR participant2_id = ?",
+                (sender_id, sender_id)
+            ).fetchone()[0]
+            self.assertEqual(orphan, 0)
+
+            receiver_id = self._create_user('atomic_receiver')
+            conversation_id, first_id = send_direct_message(conn, sender_id, receiver_id, 'First')
+            again_id, second_id = send_direct_message(conn, receiver_id, sender_id, 'Second')
+            self.assertEqual(again_id, conversation_id)
+            self.assertGreater(second_id, first_id)
+            self.assertFalse(conn.in_transaction)
+            inbox = conn.execute(
+                "SELECT last_message_id, unread_count FROM user_conversations WHERE user_id = ? AND conversation_id = ?",
+                (sender_id, conversation_id)
+            ).fetchone()
+            self.assertEqual((inbox['last_message_id'], inbox['unread_count']), (second_id, 1))
+        finally:
+            conn.close()
+
+    def test_message_write_queue_group_commits(self):
+        """Queued sends are committed in batches; a bad send fails only its own future."""
+        sender_id = self._create_user('queue_sender')
+        receiver_id = self._create_user('queue_receiver')
+        write_queue = MessageWriteQueue(TEST_DB_NAME, batch_size=16, flush_interval_ms=50)
+        try:
+            futures = [write_queue.submit(sender_id, receiver_id, f'Queued {i}') for i in range(40)]
+            bad_future = write_queue.submit(sender_id, 99999, 'To nobody')
+            results = [future.result(timeout=10) for future in futures]
+            with self.assertRaises(sqlite3.IntegrityError):
+                bad_future.result(timeout=10)
+            with self.assertRaises(ValueError):
+                write_queue.submit(sender_id, sender_id, 'To myself')
+        finally:
+            write_queue.close()
+
+        message_ids = [message_id for _, message_id in results]
+        self.assertEqual(len(set(conversation_id for conversation_id, _ in results)), 1)
+        self.assertEqual(message_ids, sorted(message_ids)) # Written in submission order
+        metrics = write_queue.metrics()
+        self.assertEqual(metrics['messages_written'], 40)
+        self.assertEqual(metrics['messages_failed'], 1)
+        self.assertLess(metrics['batches_committed'], 41)
+        self.assertLessEqual(metrics['max_batch_size'], 16)
+        self.assertEqual(metrics['queue_depth'], 0)
+
+        inbox = json.loads(self.client.get(f'/api/conversations?user_id={receiver_id}').data.decode())
+        self.assertEqual(inbox['conversations'][0]['last_message_id'], message_ids[-1])
+        self.assertEqual(inbox['conversations'][0]['unread_count'], 40)
+        with self.assertRaises(sqlite3.OperationalError):
+            write_queue.submit(sender_id, receiver_id, 'After close')
+
+    def test_message_write_queue_close_races_submits(self):
+        """Sends racing close() are either written or rejected; none is left pending."""
+        sender_id = self._create_user('queue_race_sender')
+        receiver_id = self._create_user('queue_race_receiver')
+        write_queue = MessageWriteQueue(TEST_DB_NAME, batch_size=8, flush_interval_ms=1)
+        futures, rejected = [], []
+
+        def submit_until_closed():
+            for i in range(200):
+                try:
+                    futures.append(write_queue.submit(sender_id, receiver_id, f'Race {i}'))
+                except sqlite3.OperationalError:
+                    rejected.append(i)
+
+        submitters = [threading.Thread(target=submit_until_closed) for _ in range(4)]
+        for submitter in submitters:
+            submitter.start()
+        write_queue.close()
+        for submitter in submitters:
+            submitter.join(timeout=10)
+
+        self.assertEqual(len(futures) + len(rejected), 800)
+        for future in futures:
+            self.assertIsNotNone(future.result(timeout=1)) # Accepted before close: written
+        conn = get_db_connection(TEST_DB_NAME)
+        try:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM messages WHERE sender_id = ?",
+                                          (sender_id,)).fetchone()[0], len(futures))
+            self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1) # Batches restore NORMAL
+        finally:
+            conn.close()
+
+    def test_long_poll_returns_backlog_and_waits_for_new_messages(self):
+        """Long-poll returns missed messages at once, and otherwise wakes up when a message is sent."""
+        watcher_id = self._create_user('poll_watcher')
+        peer_id = self._create_user('poll_peer')
+        first_id = json.loads(self._post_message(peer_id, watcher_id, 'Before poll').data.decode())['message_id']
+
+        data = json.loads(self.client.get(f'/api/messages/poll?user_id={watcher_id}&after_id=0&timeout=0').data.decode())
+        self.assertEqual([m['message_id'] for m in data['messages']], [first_id])
+        cursor = data['cursor']
+
+        timer = threading.Timer(0.2, lambda: self._post_message(peer_id, watcher_id, 'During poll'))
+        timer.start()
+        started = time.monotonic()
+        data = json.loads(self.client.get(f'/api/messages/poll?user_id={watcher_id}&after_id={cursor}&timeout=5').data.decode())
+        timer.join()
+        self.assertLess(time.monotonic() - started, 4)
+        self.assertEqual([m['content'] for m in data['messages']], ['During poll'])
+        self.assertGreater(data['cursor'], cursor)
+
+        # Nothing new: the poll times out with an empty list and the same cursor
+        data = json.loads(self.client.get(
+            f"/api/messages/poll?user_id={watcher_id}&after_id={data['cursor']}&timeout=0").data.decode())
+        self.assertEqual(data['messages'], [])
+        self.assertEqual(self.client.get('/api/messages/poll?timeout=0').status_code, 400)
+
+    def test_sse_stream_pushes_new_messages(self):
+        """The SSE stream replays from Last-Event-ID, then pushes messages as they are sent."""
+        watcher_id = self._create_user('sse_watcher')
+        peer_id = self._create_user('sse_peer')
+        missed_id = json.loads(self._post_message(peer_id, watcher_id, 'Missed').data.decode())['message_id']
+
+        response = self.client.get(f'/api/messages/stream?user_id={watcher_id}',
+                                   headers={'Last-Event-ID': str(missed_id - 1)})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.mimetype.startswith('text/event-stream'))
+        chunks = (chunk.decode() for chunk in response.response)
+        self.assertTrue(next(chunks).startswith('retry:'))
+        self.assertIn(f'id: {missed_id}', next(chunks))
+
+        live_id = json.loads(self._post_message(peer_id, watcher_id, 'Live').data.decode())['message_id']
+        chunk = next(chunks)
+        self.assertIn(f'id: {live_id}', chunk)
+        payload = json.loads(chunk.split('data: ', 1)[1])
+        self.assertEqual(payload['content'], 'Live')
+        response.close() # Client disconnect unsubscribes from the hub
+
+    def test_sse_stream_replays_backlog_longer_than_one_page(self):
+        """More missed messages than one page are all delivered, in order, before live messages."""
+        watcher_id = self._create_user('sse_backlog_watcher')
+        peer_id = self._create_user('sse_backlog_peer')
+        missed_ids = [json.loads(self._post_message(peer_id, watcher_id, f'Missed {i}').data.decode())['message_id']
+                      for i in range(MAX_MESSAGE_PAGE_SIZE + 5)]
+
+        response = self.client.get(f'/api/messages/stream?user_id={watcher_id}',
+                                   headers={'Last-Event-ID': str(missed_ids[0] - 1)})
+        self.assertEqual(response.status_code, 200)
+        chunks = (chunk.decode() for chunk in response.response)
+        self.assertTrue(next(chunks).startswith('retry:'))
+        for missed_id in missed_ids:
+            self.assertIn(f'id: {missed_id}\n', next(chunks))
+
+        live_id = json.loads(self._post_message(peer_id, watcher_id, 'Live').data.decode())['message_id']
+        self.assertIn(f'id: {live_id}\n', next(chunks))
+        response.close()
+
+    def test_search_messages_is_scoped_ranked_and_paginated(self):
+        """Search only sees the requester's conversations, ranks matches and pages through them."""
+        patient_id = self._create_user('search_patient')
+        doctor_id = self._create_user('search_doctor')
+        stranger_id = self._create_user('search_stranger')
+        self._post_message(doctor_id, patient_id, 'Your lab results are in. The lab report looks normal.')
+        self._post_message(patient_id, doctor_id, 'Thanks, can you send the results?')
+        self._post_message(doctor_id, patient_id, 'Reminder: appointment next week')
+        self._post_message(stranger_id, doctor_id, 'Private lab results for someone else')
+
+        data = json.loads(self.client.get(f'/api/messages/search?user_id={patient_id}&q=lab').data.decode())
+        self.assertEqual(len(data['results']), 1) # The stranger's message is not visible to the patient
+        self.assertIn('<mark>lab</mark>', data['results'][0]['snippet'])
+
+        data = json.loads(self.client.get(f'/api/messages/search?user_id={patient_id}&q=result*&limit=1').data.decode())
+        self.assertEqual(len(data['results']), 1)
+        self.assertTrue(data['paging']['has_more'])
+        first_message_id = data['results'][0]['message_id']
+        data = json.loads(self.client.get(
+            f"/api/messages/search?user_id={patient_id}&q=result*&limit=1&offset={data['paging']['next_offset']}").data.decode())
+        self.assertEqual(len(data['results']), 1)
+        self.assertNotEqual(data['results'][0]['message_id'], first_message_id)
+        self.assertFalse(data['paging']['has_more'])
+
+        # The doctor sees both conversations; restricting to one conversation narrows the results
+        data = json.loads(self.client.get(f'/api/messages/search?user_id={doctor_id}&q=lab results').data.decode())
+        self.assertEqual(len(data['results']), 2)
+        conversation_id = data['results'][0]['conversation_id']
+        data = json.loads(self.client.get(
+            f'/api/messages/search?user_id={doctor_id}&q=lab results&conversation_id={conversation_id}').data.decode())
+        self.assertEqual({r['conversation_id'] for r in data['results']}, {conversation_id})
+
+        # FTS syntax in user input is treated as plain text; invalid input is rejected
+        self.assertEqual(self.client.get(f'/api/messages/search?user_id={patient_id}&q="lab" NEAR(').status_code, 200)
+        self.assertEqual(self.client.get(f'/api/messages/search?user_id={patient_id}&q=%20').status_code, 400)
+        self.assertEqual(self.client.get(f'/api/messages/search?user_id={patient_id}&q=*!?').status_code, 400)
+        self.assertEqual(self.client.get('/api/messages/search?q=lab').status_code, 400)
+
+    def test_messages_page_uses_composite_index(self):
+        """The page query should be a range scan on (conversation_id, message_id), not a sort."""
+        conn = get_db_connection(TEST_DB_NAME)
+        try:
+            plan = conn.execute(
+                "EXPLAIN QUERY PLAN SELECT message_id FROM messages "
+                "WHERE conversation_id = ? AND message_id < ? ORDER BY message_id DESC LIMIT ?",
+                (1, 100, 10)
+            ).fetchall()
+        finally:
+            conn.close()
+        plan_text = ' '.join(row['detail'] for row in plan)
+        self.assertIn('idx_messages_conversation_message', plan_text)
+        self.assertNotIn('TEMP B-TREE', plan_text)
+
     def test_get_conversations_for_user_with_no_conversations(self):
         """Test fetching conversations for a user who has none."""
         # Assuming user3_id was created but hasn't participated in any convos in this test context yet
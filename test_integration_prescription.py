@@ -8,7 +8,15 @@ import time # For minor delays if needed
 # Import the Flask app and db utils
 from prescription_api import app # To get the test client
 import prescription_api # To modify prescription_api.DB_NAME
-from db_utils_prescription import get_db_connection, initialize_prescription_schema, get_prescription_by_id as db_get_prescription_by_id
+from db_utils_prescription import (
+    get_db_connection,
+    initialize_prescription_schema,
+    create_prescription as db_create_prescription,
+    get_prescription_by_id as db_get_prescription_by_id,
+    update_prescription_status as db_update_prescription_status,
+    iter_prescriptions_for_user as db_iter_prescriptions_for_user
+)
+from db_connection_pool import close_pool, get_pool # Pooled connections must be released before the DB file is removed
 
 TEST_DB_NAME = 'test_prescription_integration.db'
 
@@ -25,6 +33,7 @@ class TestIntegrationPrescription(unittest.TestCase):
         cls.original_db_name = prescription_api.DB_NAME
         prescription_api.DB_NAME = TEST_DB_NAME
 
+        close_pool(TEST_DB_NAME)
         if os.path.exists(TEST_DB_NAME):
             os.remove(TEST_DB_NAME)
 
@@ -71,6 +80,7 @@ class TestIntegrationPrescription(unittest.TestCase):
 
     @classmethod
     def tearDownClass(cls):
+        close_pool(TEST_DB_NAME)
         if os.path.exists(TEST_DB_NAME):
             os.remove(TEST_DB_NAME)
         if cls.original_db_name:
@@ -154,6 +164,29 @@ class TestIntegrationPrescription(unittest.TestCase):
         self.assertEqual(len(list_data_prov['prescriptions']), 1)
         self.assertEqual(list_data_prov['prescriptions'][0]['prescription_id'], prescription_id)
 
+    def test_issue_date_filters_are_inclusive_and_use_epoch_index(self):
+        print("\nRunning: test_issue_date_filters_are_inclusive_and_use_epoch_index")
+        meds = [{"medication_name": "Range Med", "dosage": "1 tab", "frequency": "QD", "quantity": "30"}]
+        rx_ids = {}
+        for issue_date in ('2024-01-31', '2024-02-01', '2024-02-29', '2024-03-01'):
+            rx_ids[issue_date] = db_create_prescription(self.db_conn, self.patient1_id, self.provider1_id, issue_date, meds)
+
+        response = self.client.get(f'/api/patients/{self.patient1_id}/prescriptions?user_id={self.patient1_id}'
+                                   f'&start_date_filter=2024-02-01&end_date_filter=2024-02-29')
+        self.assertEqual(response.status_code, 200)
+        returned_ids = [p['prescription_id'] for p in json.loads(response.data.decode())['prescriptions']]
+        self.assertEqual(returned_ids, [rx_ids['2024-02-29'], rx_ids['2024-02-01']]) # issue_date descending
+
+        response = self.client.get(f'/api/providers/{self.provider1_id}/prescriptions?user_id={self.provider1_id}'
+                                   f'&end_date_filter=2024-01-31')
+        returned_ids = [p['prescription_id'] for p in json.loads(response.data.decode())['prescriptions']]
+        self.assertEqual(returned_ids, [rx_ids['2024-01-31']])
+
+        plan = ' '.join(row['detail'] for row in self.db_conn.execute(
+            "EXPLAIN QUERY PLAN SELECT prescription_id FROM prescriptions "
+            "WHERE issue_date_epoch >= ? AND issue_date_epoch < ?", (0, 1)))
+        self.assertIn('idx_presc_issue_date_epoch', plan)
+
     def test_cancel_prescription_flow(self):
         print("\nRunning: test_cancel_prescription_flow")
         # Provider1 creates a prescription for Patient1
@@ -174,7 +207,162 @@ class TestIntegrationPrescription(unittest.TestCase):
         details_after_cancel = db_get_prescription_by_id(self.db_conn, rx_id)
         self.assertIsNotNone(details_after_cancel)
         self.assertEqual(details_after_cancel['status'], 'cancelled')
-        self.assertIn("Patient condition changed", details_after_cancel['notes_for_pharmacist'])
+        history = self.db_conn.execute(
+            "SELECT old_status, new_status, notes FROM prescription_status_events WHERE prescription_id = ?",
+            (rx_id,)).fetchall()
+        self.assertEqual([tuple(row) for row in history], [('active', 'cancelled', "Patient condition changed")])
+
+    def test_status_history_is_appended_and_paginated_in_details(self):
+        print("\nRunning: test_status_history_is_appended_and_paginated_in_details")
+        meds = [{"medication_name": "History Med", "dosage": "1 tab", "frequency": "QD", "quantity": "30"}]
+        rx_id = db_create_prescription(self.db_conn, self.patient1_id, self.provider1_id, date.today().isoformat(),
+                                       meds, notes_for_pharmacist="Original note.")
+        statuses = ['on_hold', 'active', 'on_hold', 'active', 'cancelled']
+        for i, status in enumerate(statuses):
+            self.assertTrue(db_update_prescription_status(self.db_conn, rx_id, status, self.provider1_id, f"Change {i}"))
+        self.assertFalse(db_update_prescription_status(self.db_conn, rx_id, 'expired', self.provider2_id, "Not mine"))
+
+        row = self.db_conn.execute("SELECT status, notes_for_pharmacist FROM prescriptions WHERE prescription_id = ?",
+                                   (rx_id,)).fetchone()
+        self.assertEqual(tuple(row), ('cancelled', "Original note.")) # Notes are no longer rewritten
+
+        pages, cursor_param = [], ''
+        while True:
+            response = self.client.get(f'/api/prescriptions/{rx_id}?user_id={self.patient1_id}&history_limit=2{cursor_param}')
+            self.assertEqual(response.status_code, 200)
+            history = json.loads(response.data.decode())['status_history']
+            pages.append([(event['old_status'], event['new_status'], event['notes']) for event in history['events']])
+            if not history['paging']['has_more']:
+                break
+            cursor_param = f"&history_before_id={history['paging']['next_cursor']}"
+
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        events = [event for page in pages for event in page]
+        self.assertEqual(events, [(old, new, f"Change {i}") for i, (old, new)
+                                  in reversed(list(enumerate(zip(['active'] + statuses, statuses))))])
+
+        response = self.client.get(f'/api/prescriptions/{rx_id}?user_id={self.patient1_id}&history_limit=0')
+        self.assertEqual(response.status_code, 400)
+
+        plan = ' '.join(row['detail'] for row in self.db_conn.execute(
+            "EXPLAIN QUERY PLAN SELECT event_id FROM prescription_status_events "
+            "WHERE prescription_id = ? AND event_id < ? ORDER BY event_id DESC LIMIT 3", (rx_id, 10)))
+        self.assertIn('idx_presc_status_events_prescription', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_list_with_medications_matches_details_in_two_queries(self):
+        print("\nRunning: test_list_with_medications_matches_details_in_two_queries")
+        rx_ids = []
+        for day in range(1, 4):
+            meds = [{"medication_name": f"Med {day}-{i}", "dosage": "1 tab", "frequency": "QD", "quantity": "30",
+                     "is_prn": i == 1} for i in range(day)]
+            rx_ids.append(db_create_prescription(self.db_conn, self.patient1_id, self.provider1_id, f"2024-05-0{day}", meds))
+        db_create_prescription(self.db_conn, self.patient2_id, self.provider2_id, "2024-05-02",
+                               [{"medication_name": "Other", "dosage": "1", "frequency": "QD", "quantity": "1"}])
+
+        response = self.client.get(f'/api/providers/{self.provider1_id}/prescriptions'
+                                   f'?user_id={self.provider1_id}&include=medications')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data.decode())
+        self.assertEqual(data['provider_id'], self.provider1_id)
+        self.assertEqual([p['prescription_id'] for p in data['prescriptions']], rx_ids[::-1])
+        for prescription in data['prescriptions']:
+            details = json.loads(self.client.get(f"/api/prescriptions/{prescription['prescription_id']}"
+                                                 f"?user_id={self.provider1_id}").data.decode())['prescription']
+            self.assertEqual(prescription['medications'], details['medications'])
+
+        response = self.client.get(f'/api/patients/{self.patient1_id}/prescriptions?user_id={self.patient1_id}')
+        self.assertNotIn('medications', json.loads(response.data.decode())['prescriptions'][0])
+
+        # A client that disconnects mid-stream, or before it starts, returns the connection
+        metrics = get_pool(TEST_DB_NAME).metrics()
+        url = f'/api/providers/{self.provider1_id}/prescriptions?user_id={self.provider1_id}&include=medications'
+        response = self.client.get(url)
+        next(iter(response.response))
+        response.close()
+        self.client.get(url).close()
+        after = get_pool(TEST_DB_NAME).metrics()
+        self.assertEqual((after['in_use'], after['leaks_detected']), (metrics['in_use'], metrics['leaks_detected']))
+        response = self.client.get(f'/api/patients/{self.patient1_id}/prescriptions'
+                                   f'?user_id={self.patient1_id}&include=history')
+        self.assertEqual(response.status_code, 400)
+
+        statements = []
+        self.db_conn.set_trace_callback(statements.append)
+        try:
+            chunks = list(db_iter_prescriptions_for_user(self.db_conn, self.patient1_id, 'patient',
+                                                          include_medications=True, chunk_size=2))
+        finally:
+            self.db_conn.set_trace_callback(None)
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 1])
+        self.assertEqual([len(p['medications']) for chunk in chunks for p in chunk], [3, 2, 1])
+        self.assertEqual(len(statements), 3) # The list, then one medications query per chunk
+
+    def test_batch_create_modes_and_per_item_results(self):
+        print("\nRunning: test_batch_create_modes_and_per_item_results")
+        def item(patient_id, name="Renewal Med", **fields):
+            return {"patient_id": patient_id, "issue_date": "2024-06-01", **fields,
+                    "medications": [{"medication_name": name, "dosage": "1 tab", "frequency": "QD", "quantity": "30"},
+                                    {"medication_name": f"{name} PRN", "dosage": "1 tab", "frequency": "PRN",
+                                     "quantity": "10", "is_prn": True, "refills_available": 2}]}
+        valid = [item(self.patient1_id, appointment_id=self.appointment1_id), item(self.patient2_id, "Second")]
+        invalid = [
+            item(self.patient1_id, name=""),                           # Missing medication_name
+            item(9999),                                                # Unknown patient
+            item(self.patient1_id, provider_id=self.provider2_id),     # Another provider's prescription
+        ]
+        batch = [valid[0], invalid[0], invalid[1], valid[1], invalid[2]]
+        count_sql = "SELECT (SELECT COUNT(*) FROM prescriptions), (SELECT COUNT(*) FROM prescription_medications)"
+
+        response = self._post_json('/api/prescriptions/batch', {"provider_id": self.provider1_id, "prescriptions": batch})
+        self.assertEqual(response.status_code, 400)
+        data = json.loads(response.data.decode())
+        self.assertEqual([r['status'] for r in data['results']], ['not_created', 'error', 'error', 'not_created', 'error'])
+        self.assertEqual(tuple(self.db_conn.execute(count_sql).fetchone()), (0, 0))
+
+        response = self._post_json('/api/prescriptions/batch', {"provider_id": self.provider1_id, "mode": "best_effort",
+                                                                "prescriptions": batch})
+        self.assertEqual(response.status_code, 207)
+        data = json.loads(response.data.decode())
+        self.assertEqual((data['created'], data['failed']), (2, 3))
+        self.assertEqual([r['index'] for r in data['results'] if r['status'] == 'created'], [0, 3])
+        self.assertIn("medication_name", data['results'][1]['message'])
+        self.assertIn("does not exist", data['results'][2]['message'])
+        self.assertIn("another provider", data['results'][4]['message'])
+        self.assertEqual(tuple(self.db_conn.execute(count_sql).fetchone()), (2, 4))
+        for result, expected in zip((data['results'][0], data['results'][3]), valid):
+            details = db_get_prescription_by_id(self.db_conn, result['prescription_id'])
+            self.assertEqual((details['patient_id'], details['provider_id'], details['appointment_id']),
+                             (expected['patient_id'], self.provider1_id, expected.get('appointment_id')))
+            self.assertEqual([(m['medication_name'], m['refills_available'], m['is_prn']) for m in details['medications']],
+                             [(expected['medications'][0]['medication_name'], 0, False),
+                              (expected['medications'][1]['medication_name'], 2, True)])
+
+        # IDs continue after the batch, also for single-item creation
+        response = self._post_json('/api/prescriptions/batch', {"provider_id": self.provider1_id, "prescriptions": valid})
+        self.assertEqual(response.status_code, 201)
+        batch_ids = [r['prescription_id'] for r in json.loads(response.data.decode())['results']]
+        self.assertEqual(batch_ids[1], batch_ids[0] + 1)
+        single_id = db_create_prescription(self.db_conn, self.patient1_id, self.provider1_id, "2024-06-02",
+                                           valid[0]['medications'])
+        self.assertEqual(single_id, batch_ids[1] + 1)
+
+        response = self._post_json('/api/prescriptions/batch', {"provider_id": self.provider1_id, "mode": "some",
+                                                                "prescriptions": valid})
+        self.assertEqual(response.status_code, 400)
+
+        # Optional fields of the wrong type are per-item errors, not a failed insert
+        wrong_types = [item(self.patient1_id), item(self.patient1_id, notes_for_patient=["x"]), item(self.patient1_id)]
+        wrong_types[0]['medications'][0]['instructions'] = {"x": 1}
+        wrong_types[2]['medications'][1]['quantity'] = {"x": 1}
+        response = self._post_json('/api/prescriptions/batch', {"provider_id": self.provider1_id, "mode": "best_effort",
+                                                                "prescriptions": wrong_types + valid[:1]})
+        self.assertEqual(response.status_code, 207)
+        data = json.loads(response.data.decode())
+        self.assertEqual([r['status'] for r in data['results']], ['error', 'error', 'error', 'created'])
+        self.assertIn("'instructions' must be a string", data['results'][0]['message'])
+        self.assertIn("'notes_for_patient' must be a string", data['results'][1]['message'])
+        self.assertIn("'quantity' must be a string or number", data['results'][2]['message'])
 
     def test_create_prescription_invalid_data(self):
         print("\nRunning: test_create_prescription_invalid_data")
@@ -0,0 +1,76 @@
+import unittest
+import os
+from unittest.mock import patch
+
+import message_pubsub
+from message_pubsub import MessageHub, InProcessBackend, SQLiteBrokerBackend, user_channel
+from db_connection_pool import close_pool
+
+TEST_BROKER_DB_NAME = 'test_message_pubsub_broker.db'
+
+class TestMessageHub(unittest.TestCase):
+
+    def setUp(self):
+        self.hub = MessageHub(InProcessBackend())
+
+    def test_subscriber_receives_events_for_its_channel_only(self):
+        with self.hub.subscribe(user_channel(1)) as sub1, self.hub.subscribe(user_channel(2)) as sub2:
+            self.hub.publish(user_channel(1), {"message_id": 10})
+            self.assertEqual(sub1.get(timeout=1), {"message_id": 10})
+            self.assertIsNone(sub2.get(timeout=0.01))
+        self.assertEqual(self.hub.subscriber_count(), 0)
+
+    def test_unsubscribed_subscription_receives_nothing(self):
+        subscription = self.hub.subscribe(user_channel(1))
+        subscription.close()
+        subscription.close() # Idempotent
+        self.hub.publish(user_channel(1), {"message_id": 10})
+        self.assertEqual(subscription.drain(), [])
+        self.assertEqual(self.hub.metrics()['delivered'], 0)
+
+    def test_overflow_is_flagged_and_counted(self):
+        with patch.object(message_pubsub, 'SUBSCRIPTION_QUEUE_SIZE', 2):
+            subscription = self.hub.subscribe(user_channel(1))
+        for message_id in range(3):
+            self.hub.publish(user_channel(1), {"message_id": message_id})
+        self.assertTrue(subscription.overflowed)
+        self.assertEqual(len(subscription.drain()), 2)
+        self.assertEqual(self.hub.metrics()['dropped'], 1)
+        subscription.close()
+
+    def test_publish_errors_are_swallowed(self):
+        class FailingBackend(InProcessBackend):
+            def publish(self, channel, payload):
+                raise RuntimeError("broker down")
+        hub = MessageHub(FailingBackend())
+        hub.publish(user_channel(1), {"message_id": 1}) # Must not raise
+        self.assertEqual(hub.metrics()['published'], 1)
+
+
+class TestSQLiteBrokerBackend(unittest.TestCase):
+
+    def setUp(self):
+        close_pool(TEST_BROKER_DB_NAME)
+        if os.path.exists(TEST_BROKER_DB_NAME):
+            os.remove(TEST_BROKER_DB_NAME)
+
+    def tearDown(self):
+        close_pool(TEST_BROKER_DB_NAME)
+        if os.path.exists(TEST_BROKER_DB_NAME):
+            os.remove(TEST_BROKER_DB_NAME)
+
+    def test_events_are_shared_between_hubs(self):
+        """Two hubs on the same broker file behave like two worker processes."""
+        publisher = MessageHub(SQLiteBrokerBackend(TEST_BROKER_DB_NAME, poll_interval=0.01))
+        listener = MessageHub(SQLiteBrokerBackend(TEST_BROKER_DB_NAME, poll_interval=0.01))
+        try:
+            with listener.subscribe(user_channel(5)) as subscription:
+                publisher.publish(user_channel(5), {"message_id": 42, "content": "hi"})
+                self.assertEqual(subscription.get(timeout=2), {"message_id": 42, "content": "hi"})
+        finally:
+            publisher.close()
+            listener.close()
+
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)
@@ -0,0 +1,162 @@
+import unittest
+import email
+import json
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest.mock import patch
+
+import appointment_reminder_job
+from notification_dispatch import TokenBucket, NotificationDispatcher
+
+APPOINTMENT = {"appointment_id": 7, "appointment_start_time": "2024-03-15 14:30:00",
+               "patient_username": "pat", "provider_username": "Dr. Smith", "reason_for_visit": "Check-up"}
+
+
+# --- Local transport stand-ins ---
+
+class _SMTPStandIn(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib.send_message; stores (recipients, message) on the server."""
+
+    def handle(self):
+        self.wfile.write(b"220 stand-in ready\r\n")
+        recipients, message_lines, in_data = [], [], False
+        for raw in self.rfile:
+            line = raw.decode().rstrip('\r\n')
+            if in_data:
+                if line == '.':
+                    in_data = False
+                    self.server.received.append((recipients, '\n'.join(message_lines)))
+                    self.wfile.write(b"250 queued\r\n")
+                else:
+                    message_lines.append(line)
+                continue
+            command = line.split(' ', 1)[0].upper()
+            if command == 'RCPT':
+                recipients.append(line.split(':', 1)[1].strip('<> '))
+            if command == 'DATA':
+                in_data = True
+                self.wfile.write(b"354 go ahead\r\n")
+            elif command == 'QUIT':
+                self.wfile.write(b"221 bye\r\n")
+                return
+            else:
+                self.wfile.write(b"250 ok\r\n")
+
+
+class _SMSGatewayStandIn(BaseHTTPRequestHandler):
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        time.sleep(self.server.delay)
+        self.server.received.append(payload)
+        self.send_response(202)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def _serve(server, received):
+    server.received = received
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_burst_then_sustained_rate(self):
+        bucket = TokenBucket(rate_per_second=50, capacity=5)
+        started = time.monotonic()
+        for _ in range(5):
+            bucket.acquire()
+        self.assertLess(time.monotonic() - started, 0.05)  # The initial burst does not wait
+        for _ in range(5):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)  # 5 more tokens at 50/s
+
+    def test_rate_must_be_positive(self):
+        with self.assertRaises(ValueError):
+            TokenBucket(0)
+
+
+class TestNotificationDispatcher(unittest.TestCase):
+
+    def test_per_channel_concurrency_limit(self):
+        lock, in_flight, peak = threading.Lock(), [0], [0]
+
+        def slow_send(address, details):
+            with lock:
+                in_flight[0] += 1
+                peak[0] = max(peak[0], in_flight[0])
+            time.sleep(0.02)
+            with lock:
+                in_flight[0] -= 1
+            return True
+
+        with NotificationDispatcher({'sms': slow_send}, channel_concurrency={'sms': 3}, channel_rates={}) as dispatcher:
+            started = time.monotonic()
+            results = dispatcher.dispatch([('sms', str(i), {}) for i in range(12)])
+        self.assertEqual(results, [True] * 12)
+        self.assertEqual(peak[0], 3)
+        self.assertLess(time.monotonic() - started, 12 * 0.02)  # Faster than sending one by one
+
+    def test_results_keep_order_and_failures_are_reported(self):
+        def send(address, details):
+            if address == 'boom':
+                raise OSError("connection refused")
+            return address != 'rejected'
+
+        with NotificationDispatcher({'email': send, 'sms': send}, channel_rates={}) as dispatcher:
+            results = dispatcher.dispatch([('email', 'a', {}), ('sms', 'boom', {}), ('email', 'rejected', {}),
+                                           ('sms', 'b', {})])
+            self.assertEqual(results, [True, False, False, True])
+            with self.assertRaises(ValueError):
+                dispatcher.dispatch([('fax', 'a', {})])
+
+
+class TestReminderTransports(unittest.TestCase):
+    """send_email_reminder / send_sms_reminder against local SMTP and SMS gateway stand-ins."""
+
+    def setUp(self):
+        self.smtp_received, self.sms_received = [], []
+        self.smtp = _serve(socketserver.ThreadingTCPServer(('127.0.0.1', 0), _SMTPStandIn), self.smtp_received)
+        self.gateway = _serve(HTTPServer(('127.0.0.1', 0), _SMSGatewayStandIn), self.sms_received)
+        self.gateway.delay = 0
+        for server in (self.smtp, self.gateway):
+            self.addCleanup(server.server_close)
+            self.addCleanup(server.shutdown)
+        settings = {
+            'REMINDER_SMTP_HOST': '127.0.0.1',
+            'REMINDER_SMTP_PORT': self.smtp.server_address[1],
+            'REMINDER_SMS_GATEWAY_URL': f'http://127.0.0.1:{self.gateway.server_address[1]}/sms',
+            'NOTIFICATION_SEND_TIMEOUT_SECONDS': 0.5,
+        }
+        for name, value in settings.items():
+            patcher = patch.object(appointment_reminder_job, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.senders = {'email': appointment_reminder_job.send_email_reminder,
+                        'sms': appointment_reminder_job.send_sms_reminder}
+
+    def test_reminders_reach_the_stand_ins(self):
+        with NotificationDispatcher(self.senders, channel_rates={}) as dispatcher:
+            results = dispatcher.dispatch([('email', 'pat@example.com', APPOINTMENT), ('sms', '5550001111', APPOINTMENT)])
+        self.assertEqual(results, [True, True])
+        recipients, message = self.smtp_received[0]
+        self.assertEqual(recipients, ['pat@example.com'])
+        body = email.message_from_string(message).get_payload(decode=True).decode()
+        self.assertIn("March 15, 2024 at 02:30 PM with Dr. Smith", body)
+        self.assertEqual(self.sms_received[0]['to'], '5550001111')
+        self.assertIn("with Dr. Smith is on Mar 15, 02:30PM", self.sms_received[0]['message'])
+
+    def test_send_timeout_counts_as_failure(self):
+        self.gateway.delay = 1.0
+        with NotificationDispatcher(self.senders, channel_rates={}) as dispatcher:
+            started = time.monotonic()
+            self.assertEqual(dispatcher.dispatch([('sms', '5550001111', APPOINTMENT)]), [False])
+        self.assertLess(time.monotonic() - started, 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)
@@ -0,0 +1,75 @@
+import unittest
+
+from reminder_scheduler import ReminderSchedule
+
+NOW = 1_700_000_000
+HOUR = 3600
+
+
+class TestReminderSchedule(unittest.TestCase):
+
+    def setUp(self):
+        self.schedule = ReminderSchedule(offsets_minutes=(1440, 120, 15), lookahead_seconds=HOUR, catchup_seconds=600)
+
+    def test_reminders_fire_at_each_offset_and_late_ones_are_skipped(self):
+        self.schedule.schedule(1, NOW + 3 * HOUR, NOW) # 24h reminder is long overdue: not scheduled
+        self.schedule.schedule(2, NOW + 25 * HOUR, NOW)
+        self.assertEqual(self.schedule.next_wake_epoch(), NOW + HOUR)
+        self.assertEqual(self.schedule.pop_due(NOW + HOUR - 1), [])
+        self.assertEqual(self.schedule.pop_due(NOW + HOUR), [(1, NOW + 3 * HOUR, 120), (2, NOW + 25 * HOUR, 1440)])
+        self.assertEqual(len(self.schedule), 2)
+        # The daemon stalled past the catch-up window for appointment 1's 15-minute reminder
+        late = NOW + 3 * HOUR - 15 * 60 + 601
+        self.assertEqual(self.schedule.pop_due(late), [])
+        self.assertEqual(len(self.schedule), 1) # That was appointment 1's last reminder
+        self.assertEqual(self.schedule.schedule(3, NOW, NOW), 0) # Already started
+
+    def test_changes_cancel_reschedule_and_are_idempotent(self):
+        self.schedule.loaded_until = NOW + 26 * HOUR
+        self.schedule.apply_change(1, 'confirmed', NOW + 25 * HOUR, NOW)
+        self.schedule.apply_change(2, 'confirmed', NOW + 25 * HOUR, NOW)
+        self.schedule.apply_change(3, 'confirmed', NOW + 27 * HOUR, NOW) # Beyond the loaded range
+        self.schedule.apply_change(2, 'cancelled_by_patient', NOW + 25 * HOUR, NOW)
+        self.schedule.apply_change(1, 'confirmed', NOW + 26 * HOUR - 1, NOW) # Rescheduled
+        self.schedule.apply_change(1, 'confirmed', NOW + 26 * HOUR - 1, NOW) # Replayed
+        self.assertEqual(self.schedule.pop_due(NOW + 2 * HOUR),
+                         [(1, NOW + 26 * HOUR - 1, 1440)])
+        self.schedule.apply_change(1, 'confirmed', NOW + 26 * HOUR - 1, NOW + 2 * HOUR) # Replayed after sending
+        self.assertEqual(self.schedule.pop_due(NOW + 24 * HOUR), [(1, NOW + 26 * HOUR - 1, 120)])
+
+    def test_rescheduled_away_and_back_fires_once(self):
+        self.schedule.schedule(1, NOW + 5 * HOUR, NOW)
+        self.schedule.schedule(1, NOW + 6 * HOUR, NOW)
+        self.schedule.schedule(1, NOW + 5 * HOUR, NOW)
+        self.assertEqual(self.schedule.pop_due(NOW + 3 * HOUR), [(1, NOW + 5 * HOUR, 120)])
+        self.assertEqual(self.schedule.pop_due(NOW + 5 * HOUR - 15 * 60), [(1, NOW + 5 * HOUR, 15)])
+        self.assertEqual(len(self.schedule), 0)
+
+    def test_requeued_reminders_are_returned_again(self):
+        self.schedule.schedule(1, NOW + 5 * HOUR, NOW)
+        self.schedule.schedule(2, NOW + 6 * HOUR, NOW)
+        self.assertEqual(self.schedule.pop_due(NOW + 3 * HOUR), [(1, NOW + 5 * HOUR, 120)])
+        self.schedule.requeue([(1, NOW + 5 * HOUR, 120)]) # Queueing it failed
+        self.assertEqual(self.schedule.pop_due(NOW + 3 * HOUR + 60), [(1, NOW + 5 * HOUR, 120)])
+        last = self.schedule.pop_due(NOW + 5 * HOUR - 15 * 60)
+        self.assertEqual((last, len(self.schedule)), ([(1, NOW + 5 * HOUR, 15)], 1))
+        self.schedule.requeue(last) # A failed last reminder brings its appointment back
+        self.assertEqual(len(self.schedule), 2)
+        self.assertEqual(self.schedule.pop_due(NOW + 5 * HOUR - 15 * 60), last)
+        # A reminder for a start the appointment no longer has is not put back
+        self.schedule.schedule(2, NOW + 7 * HOUR, NOW + 5 * HOUR)
+        self.schedule.requeue([(2, NOW + 6 * HOUR, 120)])
+        self.assertEqual(self.schedule.pop_due(NOW + 5 * HOUR), [(2, NOW + 7 * HOUR, 120)])
+
+    def test_slices_are_loaded_before_their_first_reminder_is_due(self):
+        self.assertEqual(self.schedule.next_load_range(NOW), (NOW, NOW + 25 * HOUR))
+        self.schedule.loaded_until = NOW + 25 * HOUR
+        self.assertIsNone(self.schedule.next_load_range(NOW + HOUR - 1))
+        self.assertEqual(self.schedule.next_wake_epoch(), NOW + HOUR)
+        self.assertEqual(self.schedule.next_load_range(NOW + HOUR), (NOW + 25 * HOUR, NOW + 26 * HOUR))
+        with self.assertRaises(ValueError):
+            ReminderSchedule(offsets_minutes=())
+
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)
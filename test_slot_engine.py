@@ -0,0 +1,89 @@
+import unittest
+
+from slot_engine import (
+    parse_rrule,
+    expand_occurrences,
+    merge_intervals,
+    subtract_intervals,
+    carve_slots,
+    earliest_slots
+)
+from time_utils import datetime_to_epoch, epoch_to_datetime_string
+
+
+def _epochs(*values):
+    return tuple(datetime_to_epoch(value) for value in values)
+
+
+def _strings(intervals):
+    return [(epoch_to_datetime_string(start), epoch_to_datetime_string(end)) for start, end in intervals]
+
+
+class TestSlotEngine(unittest.TestCase):
+
+    def test_parse_rrule_accepts_supported_subset(self):
+        parsed = parse_rrule("RRULE:FREQ=WEEKLY;BYDAY=FR,MO,WE;UNTIL=20241231T235959Z")
+        self.assertEqual(parsed["freq"], 'WEEKLY')
+        self.assertEqual(parsed["byday"], (0, 2, 4))
+        self.assertEqual(parsed["until"], datetime_to_epoch('2024-12-31 23:59:59'))
+        self.assertEqual(parse_rrule("FREQ=DAILY;UNTIL=20241231")["until"], datetime_to_epoch('2024-12-31 23:59:59'))
+        # Daily on weekdays is the weekly rule on those weekdays
+        self.assertEqual(parse_rrule("FREQ=DAILY;BYDAY=MO,TU")["freq"], 'WEEKLY')
+        for rule in ("FREQ=MONTHLY", "FREQ=WEEKLY;BYDAY=1MO", "FREQ=WEEKLY;BYHOUR=9", "FREQ=DAILY;COUNT=0",
+                     "FREQ=DAILY;COUNT=3;UNTIL=20241231", "FREQ=DAILY;INTERVAL=2;BYDAY=MO", "INTERVAL=2", "",
+                     "FREQ=DAILY;UNTIL=2024-12-31"):
+            with self.assertRaises(ValueError, msg=rule):
+                parse_rrule(rule)
+
+    def test_weekly_expansion_starts_at_dtstart_and_honours_count(self):
+        # 2024-07-03 is a Wednesday; the Monday of that week is before DTSTART and does not occur
+        start, end = _epochs('2024-07-03 09:00:00', '2024-07-03 12:00:00')
+        window = _epochs('2024-07-01 00:00:00', '2024-07-16 00:00:00')
+        occurrences = expand_occurrences(start, end, "FREQ=WEEKLY;BYDAY=MO,WE;COUNT=3", *window)
+        self.assertEqual(_strings(occurrences), [
+            ('2024-07-03 09:00:00', '2024-07-03 12:00:00'),
+            ('2024-07-08 09:00:00', '2024-07-08 12:00:00'),
+            ('2024-07-10 09:00:00', '2024-07-10 12:00:00'),
+        ])
+        # A window far in the future jumps straight to its period and keeps COUNT ordinals right
+        later = _epochs('2024-07-09 00:00:00', '2024-07-11 00:00:00')
+        self.assertEqual(_strings(expand_occurrences(start, end, "FREQ=WEEKLY;BYDAY=MO,WE;COUNT=3", *later)),
+                         [('2024-07-10 09:00:00', '2024-07-10 12:00:00')])
+        self.assertEqual(expand_occurrences(start, end, "FREQ=WEEKLY;BYDAY=MO,WE;COUNT=2", *later), [])
+
+    def test_interval_until_and_overlap_with_window_edges(self):
+        start, end = _epochs('2024-01-01 22:00:00', '2024-01-02 02:00:00')
+        window = _epochs('2025-01-02 01:00:00', '2025-01-06 00:00:00')
+        # Every other day from 2024-01-01 (a leap year) lands on odd days in January 2025; the
+        # occurrence starting on 2025-01-01 still overlaps the window start.
+        self.assertEqual(_strings(expand_occurrences(start, end, "FREQ=DAILY;INTERVAL=2", *window)), [
+            ('2025-01-01 22:00:00', '2025-01-02 02:00:00'),
+            ('2025-01-03 22:00:00', '2025-01-04 02:00:00'),
+            ('2025-01-05 22:00:00', '2025-01-06 02:00:00'),
+        ])
+        self.assertEqual(len(expand_occurrences(start, end, "FREQ=DAILY;INTERVAL=2;UNTIL=20250103T220000", *window)), 2)
+        self.assertEqual(expand_occurrences(start, end, None, *window), [])
+        self.assertEqual(expand_occurrences(start, end, None, start, start + 1), [(start, end)])
+
+    def test_interval_subtraction_and_slot_carving(self):
+        free = merge_intervals([(100, 200), (150, 300), (300, 400), (500, 600)])
+        self.assertEqual(free, [(100, 400), (500, 600)])
+        busy = merge_intervals([(50, 120), (180, 220), (390, 510), (590, 700)])
+        self.assertEqual(subtract_intervals(free, busy), [(120, 180), (220, 390), (510, 590)])
+        self.assertEqual(subtract_intervals(free, []), free)
+        # Slots are aligned to the step from midnight, and not_before is respected
+        self.assertEqual(carve_slots([(125, 400)], 60, 30), [(150, 210), (180, 240), (210, 270), (240, 300),
+                                                              (270, 330), (300, 360), (330, 390)])
+        self.assertEqual(carve_slots([(0, 200)], 100, 100, not_before=1), [(100, 200)])
+
+
+    def test_earliest_slots_merges_calendars_and_stops_at_limit(self):
+        free = {2: [(0, 300), (1000, 1200)], 1: [(100, 400)], 3: []}
+        self.assertEqual(earliest_slots(free, 100, 100, limit=4),
+                         [(0, 100, 2), (100, 200, 1), (100, 200, 2), (200, 300, 1)])
+        self.assertEqual(earliest_slots(free, 100, 100, limit=10, not_before=250, starts_before=1100),
+                         [(300, 400, 1), (1000, 1100, 2)])
+        self.assertEqual(earliest_slots({}, 100, 100, limit=3), [])
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)
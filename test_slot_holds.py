@@ -0,0 +1,49 @@
+import unittest
+
+from slot_holds import SlotHoldRegistry, get_hold_registry, reset_hold_registries
+
+
+class TestSlotHoldRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = SlotHoldRegistry(max_span_seconds=3600)
+        self.registry.add(1, 'a', 10, 1000, 1600, expires=500)
+        self.registry.add(1, 'b', 11, 2000, 2600, expires=900)
+        self.registry.add(2, 'c', 10, 1000, 1600, expires=900)
+
+    def test_find_conflict_matches_overlaps_only(self):
+        self.assertEqual(self.registry.find_conflict(1, 1500, 2100, now=0)[3], 'a')
+        self.assertEqual(self.registry.find_conflict(1, 1600, 2000, now=0), None)  # Touching is not overlapping
+        self.assertEqual(self.registry.find_conflict(1, 0, 1000, now=0), None)
+        self.assertEqual(self.registry.find_conflict(1, 2100, 2200, now=0)[3], 'b')  # Found from a start before the window
+        self.assertEqual(self.registry.find_conflict(3, 0, 10000, now=0), None)
+
+    def test_own_holds_are_not_conflicts(self):
+        self.assertEqual(self.registry.find_conflict(1, 1500, 2100, now=0, patient_id=10)[3], 'b')
+        self.assertEqual(self.registry.find_conflict(1, 1500, 2100, now=0, patient_id=10, hold_id='b'), None)
+
+    def test_expired_and_removed_holds_drop_out(self):
+        self.assertEqual(self.registry.find_conflict(1, 1000, 1100, now=500), None)
+        self.assertEqual(len(self.registry), 2)
+        # Re-adding a hold with a later expiry leaves its old heap entry stale, not live
+        self.registry.add(1, 'b', 11, 2000, 2600, expires=1200)
+        self.assertEqual(self.registry.find_conflict(1, 2000, 2100, now=1000)[3], 'b')
+        self.registry.remove('b')
+        self.registry.remove('missing')
+        self.assertEqual(self.registry.find_conflict(1, 0, 10000, now=1000), None)
+        self.assertEqual(len(self.registry), 0)  # Provider 2's hold expired at 900 too
+
+    def test_registries_are_per_database_file_and_loaded_once(self):
+        loads = []
+        self.addCleanup(reset_hold_registries)
+        registry = get_hold_registry('/tmp/one.db', 3600, loads.append)
+        self.assertIs(get_hold_registry('/tmp/one.db', 3600, loads.append), registry)
+        self.assertIsNot(get_hold_registry('/tmp/two.db', 3600, loads.append), registry)
+        self.assertEqual(len(loads), 2)
+        self.assertIsNone(get_hold_registry('', 3600, loads.append))
+        reset_hold_registries()
+        self.assertIsNot(get_hold_registry('/tmp/one.db', 3600, loads.append), registry)
+
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)
@@ -0,0 +1,79 @@
+import unittest
+import sqlite3
+from datetime import datetime, date
+
+from time_utils import (
+    parse_datetime,
+    parse_date,
+    is_valid_datetime_string,
+    is_valid_date_string,
+    format_datetime,
+    datetime_to_epoch,
+    date_to_epoch,
+    epoch_to_datetime_string,
+    epoch_to_date_string,
+    date_range_to_epoch_bounds,
+    add_epoch_columns,
+    SECONDS_PER_DAY
+)
+
+
+class TestTimeUtils(unittest.TestCase):
+
+    def test_parse_accepts_only_canonical_formats(self):
+        self.assertEqual(parse_datetime('2024-05-01 09:30:00'), datetime(2024, 5, 1, 9, 30))
+        self.assertEqual(parse_date('2024-05-01'), date(2024, 5, 1))
+        for value in ('2024-05-01T09:30:00', '2024-05-01 09:30', '2024-5-1 09:30:00', '2024-02-30 09:30:00',
+                      '2024-05-01 09:30:00.5', None, 20240501):
+            self.assertFalse(is_valid_datetime_string(value), value)
+        for value in ('20240501', '2024-05-1', '2024-13-01', '2024-05-01 00:00:00', None):
+            self.assertFalse(is_valid_date_string(value), value)
+        with self.assertRaises(ValueError):
+            parse_datetime('2024-05-01T09:30:00')
+
+    def test_epochs_match_sqlite_strftime(self):
+        conn = sqlite3.connect(':memory:')
+        try:
+            for value in ('1970-01-01 00:00:00', '2024-02-29 23:59:59', '2038-01-19 03:14:08', '1969-12-31 23:59:59'):
+                sql_epoch = conn.execute("SELECT CAST(STRFTIME('%s', ?) AS INTEGER)", (value,)).fetchone()[0]
+                self.assertEqual(datetime_to_epoch(value), sql_epoch, value)
+                self.assertEqual(epoch_to_datetime_string(sql_epoch), value)
+            sql_epoch = conn.execute("SELECT CAST(STRFTIME('%s', '2024-05-01') AS INTEGER)").fetchone()[0]
+            self.assertEqual(date_to_epoch('2024-05-01'), sql_epoch)
+            self.assertEqual(epoch_to_date_string(sql_epoch + 3600), '2024-05-01')
+        finally:
+            conn.close()
+
+    def test_format_datetime_drops_microseconds(self):
+        self.assertEqual(format_datetime(datetime(2024, 5, 1, 9, 5, 7, 123456)), '2024-05-01 09:05:07')
+        self.assertEqual(datetime_to_epoch(datetime(2024, 5, 1, 9, 5, 7, 999999)), datetime_to_epoch('2024-05-01 09:05:07'))
+
+    def test_date_range_bounds_are_half_open(self):
+        lower, upper = date_range_to_epoch_bounds('2024-05-01', '2024-05-01')
+        self.assertEqual(upper - lower, SECONDS_PER_DAY)
+        self.assertTrue(lower <= datetime_to_epoch('2024-05-01 00:00:00') < upper)
+        self.assertTrue(lower <= datetime_to_epoch('2024-05-01 23:59:59') < upper)
+        self.assertFalse(datetime_to_epoch('2024-05-02 00:00:00') < upper)
+        self.assertEqual(date_range_to_epoch_bounds(None, None), (None, None))
+        self.assertEqual(date_range_to_epoch_bounds('2024-05-01', None), (lower, None))
+        with self.assertRaises(ValueError):
+            date_range_to_epoch_bounds('2024/05/01', None)
+
+    def test_add_epoch_columns_is_idempotent(self):
+        conn = sqlite3.connect(':memory:')
+        try:
+            conn.execute("CREATE TABLE events (event_id INTEGER PRIMARY KEY, happened_at TEXT)")
+            conn.execute("INSERT INTO events (happened_at) VALUES ('2024-05-01 09:30:00')")
+            add_epoch_columns(conn, 'events', {'happened_epoch': 'happened_at'})
+            add_epoch_columns(conn, 'events', {'happened_epoch': 'happened_at'})
+            self.assertEqual(conn.execute("SELECT happened_epoch FROM events").fetchone()[0],
+                             datetime_to_epoch('2024-05-01 09:30:00'))
+            conn.execute("UPDATE events SET happened_at = '2024-05-02 09:30:00'")
+            self.assertEqual(conn.execute("SELECT happened_epoch FROM events").fetchone()[0],
+                             datetime_to_epoch('2024-05-02 09:30:00'))
+        finally:
+            conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main(argv=['first-arg-is-ignored'], exit=False)
@@ -0,0 +1,163 @@
+from datetime import datetime, date, timedelta
+
+# --- Timestamp Conventions ---
+# Every service stores times as TEXT in these two canonical formats. Because the
+# formats are fixed-width and zero-padded, string order equals time order.
+# Alongside the TEXT columns, the schemas expose integer epoch columns (generated
+# from the TEXT with STRFTIME('%s', ...)), which are what range filters and
+# indexes use. STRFTIME treats a naive string as UTC, so the helpers below do the
+# same: an "epoch" here is the naive wall-clock value counted as if it were UTC,
+# which keeps Python-side and SQL-side values directly comparable.
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+DATE_FORMAT = '%Y-%m-%d'
+SECONDS_PER_DAY = 86400
+
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_ORDINAL = _EPOCH.toordinal()
+_ONE_SECOND = timedelta(seconds=1)
+
+
+def parse_datetime(value: str) -> datetime:
+    """
+    Parses a 'YYYY-MM-DD HH:MM:SS' string.
+
+    Equivalent to `datetime.strptime(value, DATETIME_FORMAT)` but several times faster:
+    the separators are checked by position and the C `fromisoformat` parser does the rest.
+
+    Raises:
+        ValueError: If `value` is not a string in exactly that format, or is not a real date/time.
+    """
+    if (not isinstance(value, str) or len(value) != 19 or value[4] != '-' or value[7] != '-'
+            or value[10] != ' ' or value[13] != ':' or value[16] != ':'):
+        raise ValueError(f"Invalid datetime '{value}'. Use YYYY-MM-DD HH:MM:SS.")
+    return datetime.fromisoformat(value)
+
+
+def parse_date(value: str) -> date:
+    """
+    Parses a 'YYYY-MM-DD' string.
+
+    Raises:
+        ValueError: If `value` is not a string in exactly that format, or is not a real date.
+    """
+    if not isinstance(value, str) or len(value) != 10 or value[4] != '-' or value[7] != '-':
+        raise ValueError(f"Invalid date '{value}'. Use YYYY-MM-DD.")
+    return date.fromisoformat(value)
+
+
+def is_valid_datetime_string(value: str) -> bool:
+    """Returns True if `value` is a 'YYYY-MM-DD HH:MM:SS' string."""
+    try:
+        parse_datetime(value)
+        return True
+    except ValueError:
+        return False
+
+
+def is_valid_date_string(value: str) -> bool:
+    """Returns True if `value` is a 'YYYY-MM-DD' string."""
+    try:
+        parse_date(value)
+        return True
+    except ValueError:
+        return False
+
+
+def format_datetime(value: datetime) -> str:
+    """Formats a datetime as 'YYYY-MM-DD HH:MM:SS' (microseconds and tzinfo are dropped)."""
+    return value.replace(tzinfo=None).isoformat(sep=' ', timespec='seconds')
+
+
+def datetime_to_epoch(value: str | datetime) -> int:
+    """
+    Converts a 'YYYY-MM-DD HH:MM:SS' string (or naive datetime) to epoch seconds.
+
+    Matches `CAST(STRFTIME('%s', value) AS INTEGER)` in SQLite.
+
+    Raises:
+        ValueError: If a string is not in the canonical format.
+    """
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    return (value.replace(tzinfo=None, microsecond=0) - _EPOCH) // _ONE_SECOND
+
+
+def date_to_epoch(value: str | date) -> int:
+    """
+    Converts a 'YYYY-MM-DD' string (or date) to the epoch seconds of that day's midnight.
+
+    Raises:
+        ValueError: If a string is not in the canonical format.
+    """
+    if isinstance(value, str):
+        value = parse_date(value)
+    return (value.toordinal() - _EPOCH_ORDINAL) * SECONDS_PER_DAY
+
+
+def epoch_to_datetime_string(epoch: int) -> str:
+    """Converts epoch seconds back to a 'YYYY-MM-DD HH:MM:SS' string."""
+    return format_datetime(_EPOCH + timedelta(seconds=epoch))
+
+
+def epoch_to_date_string(epoch: int) -> str:
+    """Converts epoch seconds to the 'YYYY-MM-DD' string of the day containing it."""
+    return date.fromordinal(_EPOCH_ORDINAL + epoch // SECONDS_PER_DAY).isoformat()
+
+
+def now_datetime_string() -> str:
+    """The current local time as 'YYYY-MM-DD HH:MM:SS'."""
+    return format_datetime(datetime.now())
+
+
+def now_epoch() -> int:
+    """The current local wall-clock time in epoch seconds (see the module conventions above)."""
+    return datetime_to_epoch(datetime.now())
+
+
+def date_range_to_epoch_bounds(start_date: str = None, end_date: str = None) -> tuple[int | None, int | None]:
+    """
+    Turns an inclusive 'YYYY-MM-DD' date range into half-open epoch bounds.
+
+    `start_date` maps to midnight at the start of that day and `end_date` to midnight
+    at the start of the following day, so a filter can be written as
+    `column >= lower AND column < upper` directly on an indexed epoch column,
+    instead of wrapping the column in DATE(...).
+
+    Args:
+        start_date (str, optional): First day included.
+        end_date (str, optional): Last day included.
+
+    Returns:
+        tuple[int | None, int | None]: (lower bound inclusive, upper bound exclusive);
+        a bound is None when the corresponding date is not given.
+
+    Raises:
+        ValueError: If a date is not in 'YYYY-MM-DD' format.
+    """
+    lower = date_to_epoch(start_date) if start_date else None
+    upper = date_to_epoch(end_date) + SECONDS_PER_DAY if end_date else None
+    return lower, upper
+
+
+def add_epoch_columns(conn, table: str, epoch_columns: dict[str, str]):
+    """
+    Adds generated integer epoch columns to `table` where they are missing.
+
+    Each column is `GENERATED ALWAYS AS (CAST(STRFTIME('%s', <source>) AS INTEGER)) VIRTUAL`:
+    SQLite derives it from the canonical TEXT column on read, so writers never set it and
+    it cannot drift, while an index on it stores compact integers that range predicates
+    can seek. Adding VIRTUAL columns is a schema-only change, so this is cheap on
+    existing databases; the caller creates the indexes and commits.
+
+    Args:
+        conn (sqlite3.Connection): An active SQLite3 connection object.
+        table (str): Table to extend.
+        epoch_columns (dict[str, str]): {epoch column name: TEXT column it is derived from}.
+    """
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_xinfo({table})")}
+    for epoch_column, source_column in epoch_columns.items():
+        if epoch_column not in existing:
+            conn.execute(
+                f"ALTER TABLE {table} ADD COLUMN {epoch_column} INTEGER "
+                f"GENERATED ALWAYS AS (CAST(STRFTIME('%s', {source_column}) AS INTEGER)) VIRTUAL"
+            )